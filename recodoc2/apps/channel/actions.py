@@ -3,19 +3,25 @@ import os
 import logging
 import codecs
 import json
-from traceback import print_exc
+from collections import defaultdict
 from django.conf import settings
 from django.db import transaction
+from django.db.models import Max
+from django.contrib.contenttypes.models import ContentType
 
 from docutil.str_util import get_original_title
 from docutil.progress_monitor import CLIProgressMonitor
-from docutil.commands_util import mkdir_safe, dump_model, load_model,\
-    import_clazz
+from docutil.commands_util import mkdir_safe, import_clazz,\
+        print_delete_counts
+from docutil import db_util
 from project.models import Project
 from project.actions import STHREAD_PATH
+from codebase.models import SingleCodeReference, CodeSnippet,\
+        CHANNEL_SOURCE
+from codebase.coverage import invalidate_link_coverage
 from channel.parser import generic_parser
-from channel.models import SupportChannel, SupportChannelStatus,\
-        SupportThread, Message
+from channel.models import SupportChannel, SupportThread, Message
+from channel.toc_store import create_store, open_store
 
 
 logger = logging.getLogger("recodoc.channel.actions")
@@ -34,8 +40,8 @@ def get_channel_path(pname, cname=None, root=False):
 def create_channel_local(pname, cname, syncer, url):
     channel_path = get_channel_path(pname, cname)
     mkdir_safe(channel_path)
-    status = SupportChannelStatus(syncer, url)
-    dump_model(status, pname, STHREAD_PATH, cname)
+    model = create_store(pname, STHREAD_PATH, cname, syncer, url)
+    model.close()
 
 
 def create_channel_db(pname, channel_fullname, channel_dir_name, syncer,
@@ -68,34 +74,28 @@ def list_channels_local(pname):
     return local_channels
 
 
-def clear_channel_elements(pname, cname):
-    model = load_model(pname, STHREAD_PATH, cname)
-    for entry in model.entries:
-        entry.parsed = False
-    dump_model(model, pname, STHREAD_PATH, cname)
+def clear_channel_elements(pname, cname, chunksize=None):
+    model = open_store(pname, STHREAD_PATH, cname)
+    model.reset_parsed()
+    model.close()
 
     channel = SupportChannel.objects.filter(project__dir_name=pname).\
             get(dir_name=cname)
     query = Message.objects.filter(sthread__channel=channel)
     print('Deleting {0} messages'.format(query.count()))
-    for message in query.all():
-        message.code_references.all().delete()
-        message.code_snippets.all().delete()
-        message.delete()
-    SupportThread.objects.filter(channel=channel).delete()
+    # The messages, their code references and snippets are deleted with the
+    # threads.
+    print_delete_counts(db_util.bulk_delete(
+        SupportThread.objects.filter(channel=channel), chunksize))
+    invalidate_link_coverage(source=CHANNEL_SOURCE, resource_pk=channel.pk)
 
 
 def toc_view(pname, cname):
-    model = load_model(pname, STHREAD_PATH, cname)
-    size = len(model.toc_sections)
-    downloaded = sum(
-            (1 for section in model.toc_sections if section.downloaded))
-    last_d = -1
-    for section in model.toc_sections:
-        if section.downloaded:
-            last_d = section.index
-        else:
-            break
+    model = open_store(pname, STHREAD_PATH, cname)
+    size = model.section_count()
+    downloaded = model.section_count(downloaded=True)
+    last_d = model.last_downloaded_section()
+    model.close()
 
     print('Table of Content Status for {0}'.format(cname))
     print('Number of sections: {0}'.format(size))
@@ -104,46 +104,39 @@ def toc_view(pname, cname):
 
 
 def toc_refresh(pname, cname):
-    model = load_model(pname, STHREAD_PATH, cname)
+    model = open_store(pname, STHREAD_PATH, cname)
     try:
         syncer = import_clazz(model.syncer_clazz)()
         syncer.toc_refresh(model)
-        dump_model(model, pname, STHREAD_PATH, cname)
     except Exception:
         logger.exception('Error while refreshing toc')
+    finally:
+        model.close()
 
 
 def toc_download_section(pname, cname, start=None, end=None, force=False):
-    model = load_model(pname, STHREAD_PATH, cname)
+    model = open_store(pname, STHREAD_PATH, cname)
     syncer = import_clazz(model.syncer_clazz)()
-    for section in model.toc_sections:
-        index = section.index
-        if start is not None and start > index:
-            continue
-        elif end is not None and end <= index:
-            continue
-        elif section.downloaded and not force:
+    # Materialized: the sections are updated while they are downloaded.
+    sections = list(model.sections(start, end))
+    for section in sections:
+        if section.downloaded and not force:
             continue
         try:
             syncer.toc_download_section(model, section)
-            dump_model(model, pname, STHREAD_PATH, cname)
 
             print('Downloaded section {0}'.format(section.index))
         except Exception:
             logger.exception('Error while downloading toc section')
+    model.close()
 
 
 def toc_view_entries(pname, cname):
-    model = load_model(pname, STHREAD_PATH, cname)
-    size = len(model.entries)
-    downloaded = sum(
-            (1 for entry in model.entries if entry.downloaded))
-    last_d = -1
-    for entry in model.entries:
-        if entry.downloaded:
-            last_d = entry.index
-        else:
-            break
+    model = open_store(pname, STHREAD_PATH, cname)
+    size = model.entry_count()
+    downloaded = model.entry_count(downloaded=True)
+    last_d = model.last_downloaded_entry()
+    model.close()
 
     print('Table of Content Entries Status for {0}'.format(cname))
     print('Number of entries: {0}'.format(size))
@@ -152,44 +145,43 @@ def toc_view_entries(pname, cname):
 
 
 def toc_download_entries(pname, cname, start=None, end=None, force=False):
-    model = load_model(pname, STHREAD_PATH, cname)
+    model = open_store(pname, STHREAD_PATH, cname)
     channel_path = get_channel_path(pname, cname)
     syncer = import_clazz(model.syncer_clazz)()
-    for entry in model.entries:
-        index = entry.index
-        if start is not None and start > index:
-            continue
-        elif end is not None and end <= index:
-            continue
-        elif entry.downloaded and not force:
-            continue
+    if force:
+        downloaded = None
+    else:
+        downloaded = False
+    for entry in model.entries(start, end, downloaded=downloaded):
         try:
             syncer.download_entry(entry, channel_path)
-            dump_model(model, pname, STHREAD_PATH, cname)
+            model.update_entry(entry)
         except Exception:
             logger.exception('Error while downloading entry')
+    model.close()
 
 
 @transaction.autocommit
 def parse_channel(pname, cname, parse_refs=True):
-    model = load_model(pname, STHREAD_PATH, cname)
+    model = open_store(pname, STHREAD_PATH, cname)
     channel = SupportChannel.objects.filter(project__dir_name=pname).\
             get(dir_name=cname)
     pm = CLIProgressMonitor()
     generic_parser.parse_channel(channel, model, progress_monitor=pm,
             parse_refs=parse_refs)
-    dump_model(model, pname, STHREAD_PATH, cname)
+    model.close()
     return channel
 
 
 @transaction.autocommit
 def debug_channel(pname, cname, parse_refs=True, entry_url=None):
-    model = load_model(pname, STHREAD_PATH, cname)
+    model = open_store(pname, STHREAD_PATH, cname)
     channel = SupportChannel.objects.filter(project__dir_name=pname).\
             get(dir_name=cname)
     pm = CLIProgressMonitor()
     generic_parser.debug_channel(channel, model, progress_monitor=pm,
             parse_refs=parse_refs, entry_url=entry_url)
+    model.close()
     return channel
 
 
@@ -199,24 +191,13 @@ def post_process_channel(pname, cname):
             get(dir_name=cname)
     progress_monitor = CLIProgressMonitor()
 
-    query = Message.objects.filter(sthread__isnull=True)
-    progress_monitor.start('Post Processing', query.count())
-    for message in query.all():
-        post_process_message(channel, message)
-        progress_monitor.work('Post processed a message', 1)
-    progress_monitor.done()
-
-    progress_monitor.start('Post Porcessing Threads', channel.threads.count())
-    for thread in channel.threads.iterator():
-        post_process_thread(channel, thread)
-        progress_monitor.work('Post processed a thread', 1)
-    progress_monitor.done()
-
-    query = Message.objects.filter(sthread__channel=channel)
-    progress_monitor.start('Post Processing References', query.count())
-    for message in query.all():
-        post_process_message_refs(message)
-        progress_monitor.work('Processed references', 1)
+    progress_monitor.start('Post Processing', 3)
+    count = group_orphan_messages(channel)
+    progress_monitor.work('Created {0} threads'.format(count), 1)
+    count = index_thread_messages(channel)
+    progress_monitor.work('Indexed {0} messages'.format(count), 1)
+    count = set_message_refs_context(channel)
+    progress_monitor.work('Processed {0} references'.format(count), 1)
     progress_monitor.done()
 
     return channel
@@ -275,74 +256,163 @@ def show_messageu(url, mindex=None):
     show_message(message.pk)
 
 
-def post_process_message(channel, message):
-    original_title = get_original_title(message.title)
+def get_thread_key(title):
+    return get_original_title(title or '').lower()
 
-    potential_threads = SupportThread.objects.filter(channel=channel).\
-            filter(title__iexact=original_title)
-    count = potential_threads.count()
 
-    if count == 1:
-        potential_threads.all()[0].messages.add(message)
-    elif count > 1:
-        logger.warning("More than one thread for this title: {0}"
-                .format(original_title))
-        potential_threads.all()[0].messages.add(message)
-    else:
-        start_thread(original_title, message, channel)
-
-
-def post_process_thread(channel, thread):
-    messages = thread.messages.order_by('msg_date').all()
-    last_index = -1
-    for i, message in enumerate(messages):
-        message.index = i
-        if i > 0:
-            try:
-                message.title_references.all().delete()
-            except Exception:
-                pass
-        message.save()
-        last_index = i
-    if last_index > -1:
-        thread.first_date = messages[0].msg_date
-        thread.last_date = messages[last_index].msg_date
-    elif thread.last_date is None:
-        logger.error('This thread {0} has no message!'.format(thread.pk))
-        thread.first_date = None
-        thread.last_date = None
+def index_channel_threads(channel):
+    '''Returns a dict {normalized title: thread pk} of the threads of the
+       channel. When many threads share a title, the first one wins.'''
+    thread_index = {}
+    query = SupportThread.objects.filter(channel=channel).\
+            values_list('pk', 'title')
+    for (pk, title) in query.iterator():
+        key = get_thread_key(title)
+        if key in thread_index:
+            logger.warning("More than one thread for this title: {0}"
+                    .format(title))
+        else:
+            thread_index[key] = pk
+    return thread_index
+
+
+def group_orphan_messages(channel):
+    '''Attaches all messages without a thread to an existing thread with
+       the same title or to a new thread. Returns the number of created
+       threads.'''
+    thread_index = index_channel_threads(channel)
+    new_threads = {}
+    thread_messages = defaultdict(list)
+    new_messages = defaultdict(list)
+
+    query = Message.objects.filter(sthread__isnull=True).\
+            values_list('pk', 'title', 'url', 'file_path')
+    for (pk, title, url, file_path) in query.iterator():
+        key = get_thread_key(title)
+        if key in thread_index:
+            thread_messages[thread_index[key]].append(pk)
+        else:
+            if key not in new_threads:
+                new_threads[key] = (get_original_title(title or ''), url,
+                        file_path)
+            new_messages[key].append(pk)
+
+    if len(new_threads) > 0:
+        title_keys = dict((new_threads[key][0], key) for key in new_threads)
+        last_pk = SupportThread.objects.aggregate(last=Max('pk'))['last']
+        if last_pk is None:
+            last_pk = 0
+        order = SupportThread.objects.filter(channel=channel).count()
+        rows = []
+        for i, (title, url, file_path) in enumerate(new_threads.values()):
+            rows.append((title, url, file_path, channel.pk, 1, order + i))
+        db_util.bulk_insert(SupportThread,
+                ('title', 'url', 'file_path', 'channel_id', 'pages',
+                    '_order'),
+                rows)
+
+        query = SupportThread.objects.filter(channel=channel).\
+                filter(pk__gt=last_pk).values_list('pk', 'title')
+        for (pk, title) in query.iterator():
+            thread_messages[pk].extend(new_messages[title_keys[title]])
+
+    message_threads = {}
+    for thread_pk, message_pks in thread_messages.iteritems():
+        for message_pk in message_pks:
+            message_threads[message_pk] = thread_pk
+    db_util.bulk_update_column(Message, 'sthread_id', message_threads)
+
+    return len(new_threads)
+
+
+def index_thread_messages(channel):
+    '''Sets the index of each message according to its date in its thread,
+       and the first/last dates of each thread.'''
+    message_indexes = {}
+    reply_pks = []
+    current_thread = None
+    index = 0
+
+    query = Message.objects.filter(sthread__channel=channel).\
+            order_by('sthread__id', 'msg_date', 'pk').\
+            values_list('pk', 'sthread')
+    for (pk, thread_pk) in query.iterator():
+        if thread_pk != current_thread:
+            current_thread = thread_pk
+            index = 0
+        else:
+            reply_pks.append(pk)
+        message_indexes[pk] = index
+        index += 1
+
+    db_util.bulk_update_column(Message, 'index', message_indexes)
+
+    # Only the first message of a thread keeps its title references.
+    message_type = ContentType.objects.get_for_model(Message)
+    for chunk in db_util.chunks(reply_pks):
+        SingleCodeReference.objects.\
+                filter(title_content_type=message_type).\
+                filter(title_object_id__in=chunk).delete()
+
+    empty = SupportThread.objects.filter(channel=channel).\
+            filter(messages__isnull=True).values_list('pk', flat=True)
+    for thread_pk in empty:
+        logger.error('This thread {0} has no message!'.format(thread_pk))
+
+    thread_table = db_util.get_table(SupportThread)
+    message_table = db_util.get_table(Message)
+    sql = """
+UPDATE {thread} SET
+    {first_date} = (SELECT MIN(m.{msg_date}) FROM {message} m
+                    WHERE m.{sthread} = {thread}.{id}),
+    {last_date} = (SELECT MAX(m.{msg_date}) FROM {message} m
+                   WHERE m.{sthread} = {thread}.{id})
+WHERE {thread}.{channel} = %s AND
+      EXISTS (SELECT 1 FROM {message} m WHERE m.{sthread} = {thread}.{id})
+""".format(thread=thread_table, message=message_table,
+            id=db_util.qn('id'),
+            first_date=db_util.get_column(SupportThread, 'first_date'),
+            last_date=db_util.get_column(SupportThread, 'last_date'),
+            channel=db_util.get_column(SupportThread, 'channel'),
+            msg_date=db_util.get_column(Message, 'msg_date'),
+            sthread=db_util.get_column(Message, 'sthread'))
+    db_util.execute_update(sql, [channel.pk])
+
+    return len(message_indexes)
+
+
+def set_message_refs_context(channel):
+    '''Sets the global context of the references and snippets of all
+       messages to the message thread.'''
+    message_type = ContentType.objects.get_for_model(Message)
+    thread_type = ContentType.objects.get_for_model(SupportThread)
+    message_table = db_util.get_table(Message)
+    sthread = db_util.get_column(Message, 'sthread')
+    count = 0
 
-    try:
-        thread.save()
-    except Exception:
-        print('Error with these messages {0} and {1}, thread {2}'.\
-                format(messages[0].pk, messages[last_index].pk, thread.pk))
-        print_exc()
-
-
-def start_thread(title, support_message, channel):
-    # This is a thread!
-
-    support_thread = SupportThread(
-            title=title,
-            url=support_message.url,
-            file_path=support_message.file_path,
-            channel=channel,
-            pages=1)
-    support_thread.save()
-    support_message.index = 0
-    support_message.save()
-    support_thread.messages.add(support_message)
-
-
-def post_process_message_refs(message):
-    sthread = message.sthread
-    for reference in message.code_references.all():
-        reference.global_context = sthread
-        reference.save()
-    for snippet in message.code_snippets.all():
-        snippet.global_context = sthread
-        snippet.save()
+    for model in (SingleCodeReference, CodeSnippet):
+        table = db_util.get_table(model)
+        local_id = db_util.get_column(model, 'local_object_id')
+        sql = """
+UPDATE {table} SET
+    {global_type} = %s,
+    {global_id} = (SELECT m.{sthread} FROM {message} m
+                   WHERE m.{id} = {table}.{local_id})
+WHERE {table}.{local_type} = %s AND
+      {table}.{local_id} IN (SELECT m.{id} FROM {message} m
+                             INNER JOIN {thread} t ON m.{sthread} = t.{id}
+                             WHERE t.{channel} = %s)
+""".format(table=table, message=message_table, sthread=sthread,
+                id=db_util.qn('id'), local_id=local_id,
+                thread=db_util.get_table(SupportThread),
+                channel=db_util.get_column(SupportThread, 'channel'),
+                global_type=db_util.get_column(model, 'global_content_type'),
+                global_id=db_util.get_column(model, 'global_object_id'),
+                local_type=db_util.get_column(model, 'local_content_type'))
+        count += db_util.execute_update(sql,
+                [thread_type.pk, message_type.pk, channel.pk])
+
+    return count
 
 
 def write_thread_ids(file_path, date_from, date_to=None):
@@ -13,6 +13,9 @@ class Command(NoArgsCommand):
             default='-1', help='Project unix name'),
         make_option('--cname', action='store', dest='cname',
             default='-1', help='Channel name'),
+        make_option('--chunk-size', action='store', dest='chunk_size',
+            type='int', default=None, help='Number of rows deleted per '
+            'transaction (optional, default: one transaction)'),
 
     )
     help = "Clear a channel"
@@ -21,4 +24,5 @@ class Command(NoArgsCommand):
     def handle_noargs(self, **options):
         pname = smart_decode(options.get('pname'))
         cname = smart_decode(options.get('cname'))
-        clear_channel_elements(pname, cname)
+        chunk_size = options.get('chunk_size')
+        clear_channel_elements(pname, cname, chunk_size)
@@ -140,6 +140,7 @@ class Message(SourceElement):
 
 
 ### SYNCER MODEL - NOT PERSISTED ###
+# Kept to migrate the pickled models. See channel.toc_store.
 class SupportChannelStatus(object):
 
     def __init__(self, syncer_clazz, url):
@@ -165,3 +166,5 @@ class TocEntry(object):
         self.downloaded = False
         self.local_paths = []
         self.parsed = False
+        self.seq = None
+        '''Key of the entry in the channel store.'''
@@ -3,6 +3,7 @@ from __future__ import unicode_literals
 import logging
 import os
 import multiprocessing
+from math import ceil
 from traceback import print_exc
 from django.conf import settings
 from docutil.str_util import clean_breaks, get_paragraphs, filter_paragraphs,\
@@ -10,6 +11,7 @@ from docutil.str_util import clean_breaks, get_paragraphs, filter_paragraphs,\
 from docutil.etree_util import get_word_count_text
 from docutil.progress_monitor import NullProgressMonitor
 from docutil.commands_util import chunk_it, import_clazz, download_html_tree
+from docutil.db_util import chunks
 from project.models import Person
 from codebase.actions import get_default_p_classifiers,\
         get_default_kind_dict, get_java_strategies,\
@@ -37,16 +39,18 @@ def sub_process_parse(einput):
         (parser_cls, channel_pk, entry_chunk, parse_refs, lock) = einput
 
         parser = import_clazz(parser_cls)(channel_pk, parse_refs, lock)
+        seqs = []
         for entry_input in entry_chunk:
             if entry_input is not None:
-                (local_paths, url) = entry_input
+                (local_paths, url, seq) = entry_input
                 # Check if downloaded
                 if local_paths is not None and len(local_paths) > 0:
                     parser.parse_entry(local_paths, url)
-        return True
+                seqs.append(seq)
+        return seqs
     except Exception:
         print_exc()
-        return False
+        return None
     finally:
         # Manually close this connection
         connection.close()
@@ -61,10 +65,8 @@ def debug_channel(channel, model, progress_monitor=NullProgressMonitor(),
 
     # Prepare Input
     entries = []
-    for entry in model.entries:
-        if entry.url == entry_url:
-            entries.append((entry.local_paths, entry.url))
-            entry.parsed = True
+    for entry in model.entries(url=entry_url):
+        entries.append((entry.local_paths, entry.url, entry.seq))
     entries_chunks = chunk_it(entries, work_units)
     inputs = []
     for entry_chunk in entries_chunks:
@@ -89,25 +91,30 @@ def debug_channel(channel, model, progress_monitor=NullProgressMonitor(),
     progress_monitor.done()
 
 
+def get_entry_inputs(channel, model, chunk_size, parse_refs, lock):
+    '''Streams the unparsed entries of the channel store as worker inputs.'''
+    entries = ((entry.local_paths, entry.url, entry.seq) for entry in
+            model.entries(parsed=False))
+    for entry_chunk in chunks(entries, chunk_size):
+        yield (channel.parser, channel.pk, entry_chunk, parse_refs, lock)
+
+
 def parse_channel(channel, model, pool_size=DEFAULT_POOL_SIZE,
         progress_monitor=NullProgressMonitor(), parse_refs=True):
+    '''Parses the unparsed entries of the channel store (model). An entry is
+       marked as parsed as soon as its chunk has been processed, so an
+       interrupted parsing can be resumed.'''
     manager = multiprocessing.Manager()
     lock = manager.RLock()
     work_units = pool_size * BUCKET_PER_WORKER
 
     # Prepare Input
-    entries = []
-    for entry in model.entries:
-        if not entry.parsed:
-            entries.append((entry.local_paths, entry.url))
-            entry.parsed = True
-    entries_chunks = chunk_it(entries, work_units)
-    inputs = []
-    for entry_chunk in entries_chunks:
-        inputs.append((channel.parser, channel.pk, entry_chunk, parse_refs,
-            lock))
+    size = model.entry_count(parsed=False)
+    chunk_size = max(1, int(ceil(float(size) / work_units)))
+    chunk_count = int(ceil(float(size) / chunk_size))
+    inputs = get_entry_inputs(channel, model, chunk_size, parse_refs, lock)
 
-    progress_monitor.start('Parsing Channel Entries', len(inputs))
+    progress_monitor.start('Parsing Channel Entries', chunk_count)
 
     progress_monitor.info('Building code words cache')
     get_project_code_words(channel.project)
@@ -118,14 +125,21 @@ def parse_channel(channel, model, pool_size=DEFAULT_POOL_SIZE,
     from django.core.cache import cache
     cache.close()
 
+    # The inputs are consumed by the pool in another thread: the parsed status
+    # is recorded with a distinct connection.
+    status_store = model.__class__(model.path)
+
     progress_monitor.info('Sending {0} chunks to worker pool'
-            .format(len(inputs)))
+            .format(chunk_count))
     pool = multiprocessing.Pool(pool_size)
-    for result in pool.imap_unordered(sub_process_parse, inputs,
+    for seqs in pool.imap_unordered(sub_process_parse, inputs,
             BUCKET_PER_WORKER):
+        if seqs is not None:
+            status_store.set_parsed(seqs)
         progress_monitor.work('Parsed a chunk', 1)
 
     pool.close()
+    status_store.close()
     progress_monitor.done()
 
 
@@ -6,6 +6,14 @@ from project.models import RecoDocError
 from channel.models import TocSection, TocEntry
 
 
+def reset_last_section(model):
+    '''The last section may have received new entries since it was
+       downloaded.'''
+    section = model.last_section()
+    section.downloaded = False
+    model.update_section(section)
+
+
 class MessageSyncer(object):
 
     reverse_entries = True
@@ -14,20 +22,22 @@ class MessageSyncer(object):
         raise RecoDocError('Must be implemented by syncer')
 
     def toc_refresh(self, model):
-        size = len(model.toc_sections)
+        size = model.section_count()
         section_urls = self._get_section_urls(model.url)
         sections_size = len(section_urls)
         if sections_size <= 0:
             return
 
         if size > 0:
-            model.toc_sections[-1].downloaded = False
+            reset_last_section(model)
 
         # We assume that the sections are always returned in the same order!
         index = size
+        sections = []
         for section_url in section_urls[size:]:
-            model.toc_sections.append(TocSection(index, section_url))
+            sections.append(TocSection(index, section_url))
             index += 1
+        model.add_sections(sections)
 
     def _parse_toc_entries(self, page_url, tree):
         raise RecoDocError('Must be implemented by syncer')
@@ -58,10 +68,13 @@ class MessageSyncer(object):
 
         entry_urls = self._sort_section_entries(pages)
         e_index = 1000 * section.index
+        entries = []
         for entry_url in entry_urls:
-            model.entries.append(TocEntry(e_index, entry_url))
+            entries.append(TocEntry(e_index, entry_url))
             e_index += 1
+        model.add_entries(entries)
         section.downloaded = True
+        model.update_section(section)
 
     def download_entry(self, entry, path):
         uid = get_safe_local_id(entry.url)
@@ -83,19 +96,20 @@ class ThreadSyncer(object):
         raise RecoDocError('Must be implemented by syncer')
 
     def toc_refresh(self, model):
-        size = len(model.toc_sections)
+        size = model.section_count()
         page_number = self._get_number_of_pages(model.url)
         if page_number <= 0:
             return
 
         if size > 0:
-            model.toc_sections[-1].downloaded = False
+            reset_last_section(model)
 
         # We assume that the sections are always returned in the same order!
+        sections = []
         for index in xrange(size, page_number):
             section_url = self._get_section_url(model.url, index)
-            model.toc_sections.append(TocSection(index, section_url))
-            index += 1
+            sections.append(TocSection(index, section_url))
+        model.add_sections(sections)
 
     def _parse_toc_entries(self, page_url, tree):
         raise RecoDocError('Must be implemented by syncer')
@@ -109,10 +123,13 @@ class ThreadSyncer(object):
             entry_urls.reverse()
 
         e_index = 1000 * section.index
+        entries = []
         for entry_url in entry_urls:
-            model.entries.append(TocEntry(e_index, entry_url))
+            entries.append(TocEntry(e_index, entry_url))
             e_index += 1
+        model.add_entries(entries)
         section.downloaded = True
+        model.update_section(section)
 
     def _get_next_entry_url(self, url, next_page_id, tree):
         raise RecoDocError('Must be implemented by syncer')
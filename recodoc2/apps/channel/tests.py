@@ -1,24 +1,33 @@
 from __future__ import unicode_literals
 import os
 import logging
+import shutil
+import tempfile
+import cPickle
 import unittest
 from datetime import datetime
 from django.test import TestCase, TransactionTestCase
 from django.conf import settings
 from django.db import transaction
+from django.contrib.contenttypes.models import ContentType
 
-from docutil.commands_util import load_model
+from docutil.commands_util import MODEL_FILE
 from docutil.test_util import clean_test_dir
 from project.models import Project
 from project.actions import create_project_local, create_project_db,\
                             create_release_db, STHREAD_PATH
 from codebase.models import CodeElementKind, SingleCodeReference, CodeSnippet
 from codebase.actions import create_code_element_kinds
-from channel.models import SupportChannel, Message
+from channel.models import SupportChannel, SupportThread, Message,\
+        SupportChannelStatus, TocSection, TocEntry
+from channel.toc_store import open_store, get_store_dir, STORE_FILE,\
+        MIGRATED_SUFFIX
+from channel.parser.generic_parser import get_entry_inputs
 from channel.actions import create_channel_local, create_channel_db,\
         list_channels_db, list_channels_local, get_channel_path, toc_refresh,\
         toc_download_section, toc_download_entries, parse_channel,\
-        post_process_channel
+        post_process_channel, group_orphan_messages, index_thread_messages,\
+        set_message_refs_context
 
 
 class ChannelSetup(TestCase):
@@ -77,35 +86,41 @@ class ChannelSetup(TestCase):
         pname = 'project1'
         cname = 'coreforum'
         toc_refresh(pname, cname)
-        model = load_model(pname, STHREAD_PATH, cname)
+        model = open_store(pname, STHREAD_PATH, cname)
+        toc_sections = list(model.sections())
+        entries = list(model.entries())
         self.assertEqual(
                 'http://mail-archives.apache.org/mod_mbox/hc-httpclient-users/200410.mbox/date',
-                model.toc_sections[0].url)
-        self.assertFalse(model.toc_sections[0].downloaded)
-        self.assertTrue(len(model.toc_sections) >= 79)
+                toc_sections[0].url)
+        self.assertFalse(toc_sections[0].downloaded)
+        self.assertTrue(len(toc_sections) >= 79)
         for i in xrange(0, 79):
-            self.assertEqual(i, model.toc_sections[i].index)
+            self.assertEqual(i, toc_sections[i].index)
 
         toc_download_section(pname, cname, start=0, end=4)
-        model = load_model(pname, STHREAD_PATH, cname)
-        self.assertTrue(model.toc_sections[0].downloaded)
-        self.assertTrue(model.toc_sections[1].downloaded)
-        self.assertTrue(model.toc_sections[2].downloaded)
-        self.assertTrue(model.toc_sections[3].downloaded)
-        self.assertFalse(model.toc_sections[4].downloaded)
-        self.assertEqual(316, len(model.entries))
-        self.assertEqual(0, model.entries[0].index)
-        self.assertFalse(model.entries[0].downloaded)
-        self.assertEqual(1000, model.entries[17].index)
-        self.assertEqual(1001, model.entries[18].index)
-        self.assertTrue(model.entries[18].url.find('xbox.localdomain') > -1)
+        model = open_store(pname, STHREAD_PATH, cname)
+        toc_sections = list(model.sections())
+        entries = list(model.entries())
+        self.assertTrue(toc_sections[0].downloaded)
+        self.assertTrue(toc_sections[1].downloaded)
+        self.assertTrue(toc_sections[2].downloaded)
+        self.assertTrue(toc_sections[3].downloaded)
+        self.assertFalse(toc_sections[4].downloaded)
+        self.assertEqual(316, len(entries))
+        self.assertEqual(0, entries[0].index)
+        self.assertFalse(entries[0].downloaded)
+        self.assertEqual(1000, entries[17].index)
+        self.assertEqual(1001, entries[18].index)
+        self.assertTrue(entries[18].url.find('xbox.localdomain') > -1)
 
         toc_download_entries(pname, cname, 0, 1)
-        model = load_model(pname, STHREAD_PATH, cname)
-        self.assertTrue(model.entries[0].downloaded)
-        self.assertFalse(model.entries[1].downloaded)
+        model = open_store(pname, STHREAD_PATH, cname)
+        toc_sections = list(model.sections())
+        entries = list(model.entries())
+        self.assertTrue(entries[0].downloaded)
+        self.assertFalse(entries[1].downloaded)
         path = os.path.join(settings.PROJECT_FS_ROOT,
-                model.entries[0].local_paths[0])
+                entries[0].local_paths[0])
         self.assertTrue(os.path.exists(path))
 
     #@unittest.skip('Usually works.')
@@ -121,38 +136,44 @@ class ChannelSetup(TestCase):
         pname = 'project1'
         cname = 'coreforum'
         toc_refresh(pname, cname)
-        model = load_model(pname, STHREAD_PATH, cname)
+        model = open_store(pname, STHREAD_PATH, cname)
+        toc_sections = list(model.sections())
+        entries = list(model.entries())
         self.assertEqual(
                 'https://forum.hibernate.org/viewforum.php?f=1&sd=a&start=0',
-                model.toc_sections[0].url)
-        self.assertFalse(model.toc_sections[0].downloaded)
-        self.assertTrue(len(model.toc_sections) > 2349)
+                toc_sections[0].url)
+        self.assertFalse(toc_sections[0].downloaded)
+        self.assertTrue(len(toc_sections) > 2349)
         for i in xrange(0, 2349):
-            self.assertEqual(i, model.toc_sections[i].index)
+            self.assertEqual(i, toc_sections[i].index)
 
         toc_download_section(pname, cname, start=0, end=4)
-        model = load_model(pname, STHREAD_PATH, cname)
-        self.assertTrue(model.toc_sections[0].downloaded)
-        self.assertTrue(model.toc_sections[1].downloaded)
-        self.assertTrue(model.toc_sections[2].downloaded)
-        self.assertTrue(model.toc_sections[3].downloaded)
-        self.assertFalse(model.toc_sections[4].downloaded)
-        self.assertEqual(100, len(model.entries))
-        self.assertEqual(0, model.entries[0].index)
-        self.assertFalse(model.entries[0].downloaded)
-        self.assertEqual(1000, model.entries[25].index)
-        self.assertEqual(1001, model.entries[26].index)
-        self.assertTrue(model.entries[26].url.find('t=59') > -1)
+        model = open_store(pname, STHREAD_PATH, cname)
+        toc_sections = list(model.sections())
+        entries = list(model.entries())
+        self.assertTrue(toc_sections[0].downloaded)
+        self.assertTrue(toc_sections[1].downloaded)
+        self.assertTrue(toc_sections[2].downloaded)
+        self.assertTrue(toc_sections[3].downloaded)
+        self.assertFalse(toc_sections[4].downloaded)
+        self.assertEqual(100, len(entries))
+        self.assertEqual(0, entries[0].index)
+        self.assertFalse(entries[0].downloaded)
+        self.assertEqual(1000, entries[25].index)
+        self.assertEqual(1001, entries[26].index)
+        self.assertTrue(entries[26].url.find('t=59') > -1)
 
         toc_download_entries(pname, cname, 1024, 1025)
-        model = load_model(pname, STHREAD_PATH, cname)
-        self.assertTrue(model.entries[49].downloaded)
-        self.assertFalse(model.entries[50].downloaded)
+        model = open_store(pname, STHREAD_PATH, cname)
+        toc_sections = list(model.sections())
+        entries = list(model.entries())
+        self.assertTrue(entries[49].downloaded)
+        self.assertFalse(entries[50].downloaded)
         path = os.path.join(settings.PROJECT_FS_ROOT,
-                model.entries[49].local_paths[0])
+                entries[49].local_paths[0])
         self.assertTrue(os.path.exists(path))
         path = os.path.join(settings.PROJECT_FS_ROOT,
-                model.entries[49].local_paths[1])
+                entries[49].local_paths[1])
         self.assertTrue(os.path.exists(path))
 
     #@unittest.skip('Usually works.')
@@ -169,39 +190,218 @@ class ChannelSetup(TestCase):
         pname = 'project1'
         cname = 'coreforum'
         toc_refresh(pname, cname)
-        model = load_model(pname, STHREAD_PATH, cname)
+        model = open_store(pname, STHREAD_PATH, cname)
+        toc_sections = list(model.sections())
+        entries = list(model.entries())
         self.assertEqual(
                 'http://www.eclipse.org/forums/index.php/sf/thread/13/1/0/',
-                model.toc_sections[0].url)
-        self.assertFalse(model.toc_sections[0].downloaded)
+                toc_sections[0].url)
+        self.assertFalse(toc_sections[0].downloaded)
 
-        self.assertTrue(len(model.toc_sections) >= 247)
+        self.assertTrue(len(toc_sections) >= 247)
         for i in xrange(0, 247):
-            self.assertEqual(i, model.toc_sections[i].index)
+            self.assertEqual(i, toc_sections[i].index)
 
         toc_download_section(pname, cname, start=0, end=4)
-        model = load_model(pname, STHREAD_PATH, cname)
-        self.assertTrue(model.toc_sections[0].downloaded)
-        self.assertTrue(model.toc_sections[1].downloaded)
-        self.assertTrue(model.toc_sections[2].downloaded)
-        self.assertTrue(model.toc_sections[3].downloaded)
-        self.assertFalse(model.toc_sections[4].downloaded)
-
-        self.assertEqual(160, len(model.entries))
-        self.assertEqual(0, model.entries[0].index)
-        self.assertFalse(model.entries[0].downloaded)
-        self.assertEqual(1000, model.entries[40].index)
-        self.assertEqual(1001, model.entries[41].index)
-        #self.assertTrue(model.entries[26].url.find('t=59') > -1)
+        model = open_store(pname, STHREAD_PATH, cname)
+        toc_sections = list(model.sections())
+        entries = list(model.entries())
+        self.assertTrue(toc_sections[0].downloaded)
+        self.assertTrue(toc_sections[1].downloaded)
+        self.assertTrue(toc_sections[2].downloaded)
+        self.assertTrue(toc_sections[3].downloaded)
+        self.assertFalse(toc_sections[4].downloaded)
+
+        self.assertEqual(160, len(entries))
+        self.assertEqual(0, entries[0].index)
+        self.assertFalse(entries[0].downloaded)
+        self.assertEqual(1000, entries[40].index)
+        self.assertEqual(1001, entries[41].index)
+        #self.assertTrue(entries[26].url.find('t=59') > -1)
 
         toc_download_entries(pname, cname, 1039, 1040)
-        model = load_model(pname, STHREAD_PATH, cname)
-        self.assertTrue(model.entries[79].downloaded)
-        self.assertFalse(model.entries[80].downloaded)
+        model = open_store(pname, STHREAD_PATH, cname)
+        toc_sections = list(model.sections())
+        entries = list(model.entries())
+        self.assertTrue(entries[79].downloaded)
+        self.assertFalse(entries[80].downloaded)
         path = os.path.join(settings.PROJECT_FS_ROOT,
-                model.entries[79].local_paths[0])
+                entries[79].local_paths[0])
         self.assertTrue(os.path.exists(path))
 
+class ChannelPostProcessTest(TestCase):
+    def setUp(self):
+        project = Project.objects.create(name='project1',
+                url='http://www.example.com', dir_name='project1')
+        self.channel = SupportChannel.objects.create(name='forum',
+                dir_name='forum', url='http://www.example.com/forum',
+                project=project)
+        other_channel = SupportChannel.objects.create(name='list',
+                dir_name='list', url='http://www.example.com/list',
+                project=project)
+        self.thread = SupportThread.objects.create(title='Foo bar',
+                channel=self.channel)
+        self.other_thread = SupportThread.objects.create(title='Foo bar',
+                channel=other_channel)
+        self.message_type = ContentType.objects.get_for_model(Message)
+        self.thread_type = ContentType.objects.get_for_model(SupportThread)
+
+        self.m1 = self.add_message('Re: Foo bar', 2)
+        self.m2 = self.add_message('Foo bar', 1, self.thread)
+        self.m3 = self.add_message('New topic', 3)
+        self.m4 = self.add_message('RE: New topic', 4)
+        self.m5 = self.add_message('Foo bar', 1, self.other_thread)
+
+        self.title_refs = [self.add_reference(self.m1, title=True),
+                self.add_reference(self.m2, title=True)]
+        self.refs = [self.add_reference(message) for message in
+                (self.m1, self.m4, self.m5)]
+        self.snippet = CodeSnippet.objects.create(
+                local_content_type=self.message_type,
+                local_object_id=self.m3.pk)
+
+    def add_message(self, title, day, sthread=None):
+        return Message.objects.create(title=title, sthread=sthread,
+                msg_date=datetime(2011, 1, day))
+
+    def add_reference(self, message, title=False):
+        reference = SingleCodeReference(content='Foo',
+                local_content_type=self.message_type,
+                local_object_id=message.pk)
+        if title:
+            reference.title_content_type = self.message_type
+            reference.title_object_id = message.pk
+        reference.save()
+        return reference
+
+    def reload(self, instance):
+        return instance.__class__.objects.get(pk=instance.pk)
+
+    def test_post_process(self):
+        self.assertEqual(1, group_orphan_messages(self.channel))
+        (m1, m2, m3, m4) = [self.reload(message) for message in
+                (self.m1, self.m2, self.m3, self.m4)]
+        new_thread = m3.sthread
+        self.assertEqual(self.thread.pk, m1.sthread_id)
+        self.assertEqual(self.thread.pk, m2.sthread_id)
+        self.assertEqual(self.channel.pk, new_thread.channel_id)
+        self.assertEqual('New topic', new_thread.title)
+        self.assertEqual(new_thread.pk, m4.sthread_id)
+        self.assertEqual(2, SupportThread.objects.
+                filter(channel=self.channel).count())
+
+        self.assertEqual(4, index_thread_messages(self.channel))
+        self.assertEqual([1, 0, 0, 1], [self.reload(message).index for
+            message in (m1, m2, m3, m4)])
+        # The other channel is not processed.
+        self.assertEqual(-1, self.reload(self.m5).index)
+        thread = self.reload(self.thread)
+        self.assertEqual(datetime(2011, 1, 1), thread.first_date)
+        self.assertEqual(datetime(2011, 1, 2), thread.last_date)
+        new_thread = self.reload(new_thread)
+        self.assertEqual(datetime(2011, 1, 3), new_thread.first_date)
+        self.assertEqual(datetime(2011, 1, 4), new_thread.last_date)
+        # Only the first message of a thread keeps its title references.
+        self.assertFalse(SingleCodeReference.objects.
+                filter(pk=self.title_refs[0].pk).exists())
+        self.assertTrue(SingleCodeReference.objects.
+                filter(pk=self.title_refs[1].pk).exists())
+
+        self.assertEqual(4, set_message_refs_context(self.channel))
+        for (reference, thread_pk) in ((self.title_refs[1], self.thread.pk),
+                (self.refs[0], self.thread.pk),
+                (self.refs[1], new_thread.pk),
+                (self.snippet, new_thread.pk)):
+            reference = self.reload(reference)
+            self.assertEqual(self.thread_type.pk,
+                    reference.global_content_type_id)
+            self.assertEqual(thread_pk, reference.global_object_id)
+        reference = self.reload(self.refs[2])
+        self.assertEqual(None, reference.global_content_type_id)
+        self.assertEqual(None, reference.global_object_id)
+
+
+class ChannelStoreTest(TestCase):
+    def setUp(self):
+        self.old_root = settings.PROJECT_FS_ROOT
+        settings.PROJECT_FS_ROOT = tempfile.mkdtemp()
+        self.store_dir = get_store_dir('project1', STHREAD_PATH, 'forum')
+        os.makedirs(self.store_dir)
+
+        model = SupportChannelStatus('foo.syncer', 'http://www.example.com')
+        for index in xrange(3):
+            section = TocSection(index, 'http://www.example.com/s{0}'
+                    .format(index))
+            section.downloaded = index < 2
+            model.toc_sections.append(section)
+        # Entry indexes are not unique.
+        for index in (0, 1, 1, 2, 3):
+            entry = TocEntry(index, 'http://www.example.com/e{0}'
+                    .format(len(model.entries)))
+            entry.downloaded = len(model.entries) < 3
+            if entry.downloaded:
+                entry.local_paths = ['forum/e{0}.html'.format(
+                    len(model.entries))]
+            entry.parsed = len(model.entries) < 2
+            model.entries.append(entry)
+        self.pickle_path = os.path.join(self.store_dir, MODEL_FILE)
+        with open(self.pickle_path, 'wb') as model_file:
+            cPickle.dump(model, model_file, -1)
+
+    def tearDown(self):
+        shutil.rmtree(settings.PROJECT_FS_ROOT)
+        settings.PROJECT_FS_ROOT = self.old_root
+
+    def test_migrate_pickle(self):
+        model = open_store('project1', STHREAD_PATH, 'forum')
+        self.assertFalse(os.path.exists(self.pickle_path))
+        self.assertTrue(os.path.exists(self.pickle_path + MIGRATED_SUFFIX))
+        self.assertTrue(os.path.exists(os.path.join(self.store_dir,
+            STORE_FILE)))
+        self.assertEqual('foo.syncer', model.syncer_clazz)
+        self.assertEqual('http://www.example.com', model.url)
+
+        self.assertEqual([(0, True), (1, True), (2, False)],
+                [(section.index, section.downloaded) for section in
+                    model.sections()])
+        entries = list(model.entries())
+        self.assertEqual([0, 1, 1, 2, 3], [entry.index for entry in entries])
+        self.assertEqual([True, True, True, False, False],
+                [entry.downloaded for entry in entries])
+        self.assertEqual([True, True, False, False, False],
+                [entry.parsed for entry in entries])
+        self.assertEqual(['forum/e2.html'], entries[2].local_paths)
+        self.assertEqual([], entries[3].local_paths)
+        self.assertEqual(5, len(set(entry.seq for entry in entries)))
+        model.close()
+
+        # The store is opened without migrating the pickle again.
+        model = open_store('project1', STHREAD_PATH, 'forum')
+        self.assertEqual(5, model.entry_count())
+        model.close()
+
+    def test_resume(self):
+        model = open_store('project1', STHREAD_PATH, 'forum')
+        self.assertEqual(1, model.last_downloaded_section())
+        self.assertEqual(1, model.last_downloaded_entry())
+        self.assertEqual(['http://www.example.com/e3',
+            'http://www.example.com/e4'], [entry.url for entry in
+                model.entries(downloaded=False)])
+
+        channel = SupportChannel(pk=1, parser='foo.parser')
+        seqs = [seq for (_, _, entry_chunk, _, _) in get_entry_inputs(
+            channel, model, 2, True, None) for (_, _, seq) in entry_chunk]
+        entries = list(model.entries())
+        self.assertEqual([entry.seq for entry in entries[2:]], seqs)
+
+        model.set_parsed(seqs[:1])
+        self.assertEqual(2, model.entry_count(parsed=False))
+        model.reset_parsed()
+        self.assertEqual(5, model.entry_count(parsed=False))
+        self.assertEqual(0, model.entry_count(parsed=True))
+        model.close()
+
+
 class ChannelParserTest(TransactionTestCase):
     @transaction.commit_on_success
     def setUp(self):
@@ -0,0 +1,283 @@
+from __future__ import unicode_literals
+import os
+import json
+import sqlite3
+import cPickle
+import logging
+from django.conf import settings
+from docutil.commands_util import MODEL_FILE
+from channel.models import TocSection, TocEntry
+
+STORE_FILE = 'model.db'
+
+MIGRATED_SUFFIX = '.migrated'
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS status (
+    key TEXT PRIMARY KEY,
+    value TEXT);
+CREATE TABLE IF NOT EXISTS toc_section (
+    idx INTEGER PRIMARY KEY,
+    url TEXT,
+    downloaded INTEGER NOT NULL DEFAULT 0);
+CREATE TABLE IF NOT EXISTS toc_entry (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    idx INTEGER NOT NULL,
+    url TEXT,
+    downloaded INTEGER NOT NULL DEFAULT 0,
+    parsed INTEGER NOT NULL DEFAULT 0,
+    local_paths TEXT);
+CREATE INDEX IF NOT EXISTS toc_entry_idx ON toc_entry (idx);
+CREATE INDEX IF NOT EXISTS toc_entry_downloaded ON toc_entry (downloaded, seq);
+CREATE INDEX IF NOT EXISTS toc_entry_parsed ON toc_entry (parsed, seq);
+'''
+
+ENTRY_COLUMNS = 'seq, idx, url, downloaded, parsed, local_paths'
+
+logger = logging.getLogger("recodoc.channel.toc_store")
+
+
+def get_store_dir(pname, intermediate_path, key):
+    basepath = settings.PROJECT_FS_ROOT
+    return os.path.join(basepath, pname, intermediate_path, key)
+
+
+def create_store(pname, intermediate_path, key, syncer_clazz, url):
+    path = os.path.join(get_store_dir(pname, intermediate_path, key),
+            STORE_FILE)
+    store = ChannelStore(path)
+    store.set_status(syncer_clazz, url)
+    return store
+
+
+def open_store(pname, intermediate_path, key):
+    '''Opens the channel store. A pickled channel model (model.pkl) is
+       migrated to the store the first time it is opened.'''
+    store_dir = get_store_dir(pname, intermediate_path, key)
+    path = os.path.join(store_dir, STORE_FILE)
+    pickle_path = os.path.join(store_dir, MODEL_FILE)
+    if not os.path.exists(path) and os.path.exists(pickle_path):
+        migrate_pickle(pickle_path, path)
+    return ChannelStore(path)
+
+
+def migrate_pickle(pickle_path, path):
+    with open(pickle_path, 'rb') as model_file:
+        model = cPickle.load(model_file)
+    store = ChannelStore(path)
+    store.set_status(model.syncer_clazz, model.url)
+    store.add_sections(model.toc_sections)
+    store.add_entries(model.entries)
+    store.close()
+    os.rename(pickle_path, pickle_path + MIGRATED_SUFFIX)
+    logger.info('Migrated {0} sections and {1} entries from {2}'.format(
+        len(model.toc_sections), len(model.entries), pickle_path))
+
+
+def to_section(row):
+    section = TocSection(row[0], row[1])
+    section.downloaded = bool(row[2])
+    return section
+
+
+def to_entry(row):
+    entry = TocEntry(row[1], row[2])
+    entry.seq = row[0]
+    entry.downloaded = bool(row[3])
+    entry.parsed = bool(row[4])
+    if row[5]:
+        entry.local_paths = json.loads(row[5])
+    return entry
+
+
+class ChannelStore(object):
+    '''Persistent table of contents of a support channel (SQLite). Sections
+       are identified by their index and entries by their insertion sequence
+       (seq) because entry indexes are not guaranteed to be unique.
+
+       Every update is committed immediately so that an interrupted download
+       can resume where it stopped.'''
+
+    def __init__(self, path):
+        self.path = path
+        # The connection is only used by one thread at a time, but the
+        # multiprocessing pool consumes the entry chunks in its own thread.
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.executescript(SCHEMA)
+        self.conn.commit()
+        self.syncer_clazz = self._get_status('syncer_clazz')
+        self.url = self._get_status('url')
+
+    def close(self):
+        self.conn.close()
+
+    def _get_status(self, key):
+        row = self.conn.execute('SELECT value FROM status WHERE key = ?',
+                (key,)).fetchone()
+        if row is None:
+            return None
+        else:
+            return row[0]
+
+    def set_status(self, syncer_clazz, url):
+        self.conn.executemany(
+                'INSERT OR REPLACE INTO status (key, value) VALUES (?, ?)',
+                [('syncer_clazz', syncer_clazz), ('url', url)])
+        self.conn.commit()
+        self.syncer_clazz = syncer_clazz
+        self.url = url
+
+    ### SECTIONS ###
+
+    def section_count(self, downloaded=None):
+        sql = 'SELECT COUNT(*) FROM toc_section'
+        params = []
+        if downloaded is not None:
+            sql += ' WHERE downloaded = ?'
+            params.append(int(downloaded))
+        return self.conn.execute(sql, params).fetchone()[0]
+
+    def sections(self, start=None, end=None):
+        '''Iterates over the sections with start <= index < end.'''
+        (where, params) = self._range_clause(start, end)
+        sql = 'SELECT idx, url, downloaded FROM toc_section {0} ORDER BY idx'\
+                .format(where)
+        for row in self.conn.execute(sql, params):
+            yield to_section(row)
+
+    def last_section(self):
+        row = self.conn.execute('SELECT idx, url, downloaded FROM toc_section '
+                'ORDER BY idx DESC LIMIT 1').fetchone()
+        if row is None:
+            return None
+        else:
+            return to_section(row)
+
+    def last_downloaded_section(self):
+        '''Returns the index of the last section of the initial run of
+           downloaded sections, or -1.'''
+        return self._last_before_missing('toc_section', 'idx')
+
+    def add_sections(self, sections):
+        self.conn.executemany('INSERT OR REPLACE INTO toc_section '
+                '(idx, url, downloaded) VALUES (?, ?, ?)',
+                ((section.index, section.url, int(section.downloaded))
+                    for section in sections))
+        self.conn.commit()
+
+    def update_section(self, section):
+        self.conn.execute('UPDATE toc_section SET downloaded = ? '
+                'WHERE idx = ?', (int(section.downloaded), section.index))
+        self.conn.commit()
+
+    ### ENTRIES ###
+
+    def entry_count(self, downloaded=None, parsed=None):
+        (where, params) = self._status_clause(downloaded, parsed)
+        sql = 'SELECT COUNT(*) FROM toc_entry {0}'.format(where)
+        return self.conn.execute(sql, params).fetchone()[0]
+
+    def entries(self, start=None, end=None, downloaded=None, parsed=None,
+            url=None, chunksize=1000):
+        '''Iterates over the entries with start <= index < end in insertion
+           order. Entries are fetched chunksize rows at a time (keyset on
+           seq) so the store can be updated during the iteration.'''
+        (where, params) = self._range_clause(start, end)
+        (status_where, status_params) = self._status_clause(downloaded,
+                parsed, url)
+        clauses = [clause for clause in (where, status_where) if clause]
+        clauses = [clause[len('WHERE '):] for clause in clauses]
+        clauses.append('seq > ?')
+        params.extend(status_params)
+        sql = 'SELECT {0} FROM toc_entry WHERE {1} ORDER BY seq LIMIT ?'\
+                .format(ENTRY_COLUMNS, ' AND '.join(clauses))
+        last_seq = 0
+        while True:
+            rows = self.conn.execute(sql,
+                    params + [last_seq, chunksize]).fetchall()
+            if not rows:
+                break
+            for row in rows:
+                yield to_entry(row)
+            last_seq = rows[-1][0]
+
+    def last_downloaded_entry(self):
+        '''Returns the index of the last entry of the initial run of
+           downloaded entries, or -1.'''
+        return self._last_before_missing('toc_entry', 'seq')
+
+    def add_entries(self, entries):
+        for entry in entries:
+            cursor = self.conn.execute('INSERT INTO toc_entry '
+                    '(idx, url, downloaded, parsed, local_paths) '
+                    'VALUES (?, ?, ?, ?, ?)',
+                    (entry.index, entry.url, int(entry.downloaded),
+                        int(entry.parsed), json.dumps(entry.local_paths)))
+            entry.seq = cursor.lastrowid
+        self.conn.commit()
+
+    def update_entry(self, entry):
+        self.conn.execute('UPDATE toc_entry SET downloaded = ?, parsed = ?, '
+                'local_paths = ? WHERE seq = ?',
+                (int(entry.downloaded), int(entry.parsed),
+                    json.dumps(entry.local_paths), entry.seq))
+        self.conn.commit()
+
+    def set_parsed(self, seqs, parsed=True):
+        self.conn.executemany('UPDATE toc_entry SET parsed = ? WHERE seq = ?',
+                ((int(parsed), seq) for seq in seqs))
+        self.conn.commit()
+
+    def reset_parsed(self):
+        self.conn.execute('UPDATE toc_entry SET parsed = 0')
+        self.conn.commit()
+
+    ### INTERNAL ###
+
+    def _range_clause(self, start, end):
+        clauses = []
+        params = []
+        if start is not None:
+            clauses.append('idx >= ?')
+            params.append(start)
+        if end is not None:
+            clauses.append('idx < ?')
+            params.append(end)
+        if clauses:
+            return ('WHERE ' + ' AND '.join(clauses), params)
+        else:
+            return ('', params)
+
+    def _status_clause(self, downloaded=None, parsed=None, url=None):
+        clauses = []
+        params = []
+        if downloaded is not None:
+            clauses.append('downloaded = ?')
+            params.append(int(downloaded))
+        if parsed is not None:
+            clauses.append('parsed = ?')
+            params.append(int(parsed))
+        if url is not None:
+            clauses.append('url = ?')
+            params.append(url)
+        if clauses:
+            return ('WHERE ' + ' AND '.join(clauses), params)
+        else:
+            return ('', params)
+
+    def _last_before_missing(self, table, order_column):
+        row = self.conn.execute('SELECT MIN({0}) FROM {1} '
+                'WHERE downloaded = 0'.format(order_column, table)).fetchone()
+        if row[0] is None:
+            sql = 'SELECT idx FROM {0} ORDER BY {1} DESC LIMIT 1'.format(
+                    table, order_column)
+            params = []
+        else:
+            sql = 'SELECT idx FROM {0} WHERE {1} < ? ORDER BY {1} DESC '\
+                    'LIMIT 1'.format(table, order_column)
+            params = [row[0]]
+        row = self.conn.execute(sql, params).fetchone()
+        if row is None:
+            return -1
+        else:
+            return row[0]
@@ -30,14 +30,22 @@ from codeutil.reply_element import REPLY_LANGUAGE, is_reply_lines,\
         is_reply_header, STOP_LANGUAGE, is_rest_reply
 from docutil.str_util import tokenize, find_sentence, find_paragraph, split_pos
 from docutil.cache_util import get_value, get_codebase_key
-from docutil.commands_util import mkdir_safe, import_clazz, download_html_tree
+from docutil.commands_util import mkdir_safe, import_clazz,\
+        download_html_tree, print_delete_counts
+from docutil.db_util import bulk_update_column, bulk_delete
 from docutil.progress_monitor import CLILockProgressMonitor, CLIProgressMonitor
 from docutil import cache_util
 from project.models import ProjectRelease, Project
 from project.actions import CODEBASE_PATH
 from codebase.models import CodeBase, CodeElementKind, CodeElement,\
-        SingleCodeReference, CodeSnippet, CodeElementFilter, ReleaseLinkSet
+        SingleCodeReference, CodeSnippet, CodeElementFilter, ReleaseLinkSet,\
+        ParameterElement, get_method_signature
+from codebase.kinds import get_kind, get_kinds, reset_kinds
+from codebase.overloads import compute_overloads, invalidate_overloads
+from codebase.coverage import invalidate_link_coverage
 from codebase.parser.java_diff import JavaDiffer
+import codebase.linker.telemetry as telemetry
+import codebase.linker.log_writer as log_writer
 
 
 PROJECT_FILE = '.project'
@@ -72,6 +80,11 @@ XML_KINDS_HIERARCHY = {'xml attribute': 'xml element',
 
 ALL_KINDS_HIERARCHIES = dict(JAVA_KINDS_HIERARCHY, **XML_KINDS_HIERARCHY)
 
+DEFAULT_KINDS = ['unknown', 'class', 'annotation', 'method', 'field',
+        'xml element', 'xml attribute', 'xml attribute value', 'xml file',
+        'hbm file', 'ini file', 'conf file', 'properties file', 'log file',
+        'jar file', 'java file', 'python file']
+
 # Constants used by filter
 xtext = etree.XPath("string()")
 
@@ -281,6 +294,8 @@ def create_code_element_kinds():
     for kind in kinds:
         kind.save()
 
+    reset_kinds()
+
 
 @transaction.autocommit
 def parse_code(pname, bname, release, parser_name, opt_input=None):
@@ -299,6 +314,8 @@ def parse_code(pname, bname, release, parser_name, opt_input=None):
     parser_cls = import_clazz(parser_cls_name)
     parser = parser_cls(codebase, project_key, opt_input)
     parser.parse(CLILockProgressMonitor())
+    invalidate_codebase(codebase.pk)
+    compute_overloads(codebase)
 
     return codebase
 
@@ -312,17 +329,28 @@ def parse_snippets(pname, source, parser_name):
     snippet_parser.parse(CLILockProgressMonitor())
 
 
-def clear_snippets(pname, language, source):
+def clear_snippets(pname, language, source, chunksize=None):
     project = Project.objects.get(dir_name=pname)
     to_delete = SingleCodeReference.objects.\
             filter(snippet__language=language).\
             filter(source=source).\
             filter(project=project)
     print('Snippets to delete: %i' % to_delete.count())
-    to_delete.delete()
+    print_delete_counts(bulk_delete(to_delete, chunksize))
+    invalidate_link_coverage(source=source)
+
 
+def invalidate_codebase(codebase_id):
+    '''Discards the per-process caches of a codebase whose code elements
+       changed.'''
+    # The linker filters import this module.
+    from codebase.linker.filters import invalidate_codebase_caches
+    invalidate_overloads(codebase_id)
+    invalidate_codebase_caches(codebase_id)
 
-def clear_code_elements(pname, bname, release, parser_name='-1'):
+
+def clear_code_elements(pname, bname, release, parser_name='-1',
+        chunksize=None):
     prelease = ProjectRelease.objects.filter(project__dir_name=pname).\
             filter(release=release)[0]
     codebase = CodeBase.objects.filter(project_release=prelease).\
@@ -330,7 +358,133 @@ def clear_code_elements(pname, bname, release, parser_name='-1'):
     query = CodeElement.objects.filter(codebase=codebase)
     if parser_name != '-1':
         query = query.filter(parser=parser_name)
-    query.delete()
+    print_delete_counts(bulk_delete(query, chunksize))
+    invalidate_codebase(codebase.pk)
+    compute_overloads(codebase)
+    invalidate_link_coverage(codebase=codebase)
+
+
+def find_package_id(element_id, containers, package_ids, cache):
+    '''Climbs the containers ({element_id: container_id}) of an element
+       until it reaches a package and returns the package id (or None).'''
+    visited = []
+    current_id = containers.get(element_id)
+    package_id = None
+    while current_id is not None and current_id not in visited:
+        if current_id in package_ids:
+            package_id = current_id
+            break
+        elif current_id in cache:
+            package_id = cache[current_id]
+            break
+        visited.append(current_id)
+        current_id = containers.get(current_id)
+
+    cache[element_id] = package_id
+    for visited_id in visited:
+        cache[visited_id] = package_id
+
+    return package_id
+
+
+def get_first_containers(code_elements):
+    '''Returns {element_id: container_id} with the first container
+       (containers.all()[0]) of each code element.'''
+    through = CodeElement.containers.through
+    pairs = through.objects.filter(from_codeelement__in=code_elements).\
+            order_by('pk').\
+            values_list('from_codeelement_id', 'to_codeelement_id')
+    containers = {}
+    for (element_id, container_id) in pairs.iterator():
+        if element_id not in containers:
+            containers[element_id] = container_id
+    return containers
+
+
+def fill_containers(pname, bname, release):
+    '''Fills the container and package columns of the code elements of a
+       codebase parsed before these columns existed.'''
+    prelease = ProjectRelease.objects.filter(project__dir_name=pname).\
+            filter(release=release)[0]
+    codebase = CodeBase.objects.filter(project_release=prelease).\
+            filter(name=bname)[0]
+    code_elements = CodeElement.objects.filter(codebase=codebase)
+
+    progress_monitor = CLIProgressMonitor()
+    progress_monitor.start('Filling containers', 3)
+    containers = get_first_containers(code_elements)
+    package_ids = set(code_elements.filter(kind__kind='package').
+            values_list('pk', flat=True))
+    progress_monitor.work('Loaded {0} containers'.format(len(containers)), 1)
+
+    packages = {}
+    cache = {}
+    for element_id in containers:
+        package_id = find_package_id(element_id, containers, package_ids,
+                cache)
+        if package_id is not None:
+            packages[element_id] = package_id
+
+    # Attributes without containers (e.g., parameters) are in the package of
+    # their attribute container.
+    attributes = code_elements.filter(attcontainer__isnull=False).\
+            values_list('pk', 'attcontainer_id')
+    for (element_id, attcontainer_id) in attributes.iterator():
+        if element_id not in packages and attcontainer_id in packages:
+            packages[element_id] = packages[attcontainer_id]
+    progress_monitor.work('Found {0} packages'.format(len(packages)), 1)
+
+    bulk_update_column(CodeElement, 'container_id', containers)
+    bulk_update_column(CodeElement, 'package_id', packages)
+    invalidate_codebase(codebase.pk)
+    progress_monitor.work('Updated code elements', 1)
+    progress_monitor.done()
+
+
+def fill_signatures(pname, bname, release):
+    '''Fills the signature column of the code elements of a codebase parsed
+       before this column existed.'''
+    prelease = ProjectRelease.objects.filter(project__dir_name=pname).\
+            filter(release=release)[0]
+    codebase = CodeBase.objects.filter(project_release=prelease).\
+            filter(name=bname)[0]
+    code_elements = CodeElement.objects.filter(codebase=codebase)
+
+    progress_monitor = CLIProgressMonitor()
+    progress_monitor.start('Filling signatures', 2)
+
+    count = code_elements.exclude(kind__kind='method').\
+            update(signature=F('fqn'))
+    progress_monitor.work('Updated {0} code elements'.format(count), 1)
+
+    parameter_types = defaultdict(list)
+    parameters = ParameterElement.objects.filter(codebase=codebase).\
+            order_by('attcontainer', 'index').\
+            values_list('attcontainer_id', 'type_simple_name')
+    for (method_id, type_simple_name) in parameters.iterator():
+        parameter_types[method_id].append(type_simple_name)
+
+    signatures = {}
+    methods = code_elements.filter(kind__kind='method').\
+            values_list('pk', 'fqn')
+    for (method_id, fqn) in methods.iterator():
+        signatures[method_id] = get_method_signature(fqn,
+                parameter_types[method_id])
+    count = bulk_update_column(CodeElement, 'signature', signatures)
+    invalidate_codebase(codebase.pk)
+    progress_monitor.work('Updated {0} methods'.format(count), 1)
+    progress_monitor.done()
+
+
+def fill_overloads(pname, bname, release):
+    '''Computes the overloads of a codebase parsed before they were
+       computed at parse time.'''
+    prelease = ProjectRelease.objects.filter(project__dir_name=pname).\
+            filter(release=release)[0]
+    codebase = CodeBase.objects.filter(project_release=prelease).\
+            filter(name=bname)[0]
+    count = compute_overloads(codebase)
+    print('Computed {0} overloads'.format(count))
 
 
 def diff_codebases(pname, bname, release1, release2):
@@ -434,20 +588,39 @@ def link_code(pname, bname, release, linker_name, source, source_release=None,
     start = time.clock()
 
     linker.link_references(progress_monitor, local_object_id)
+    linker.save_telemetry()
+    invalidate_link_coverage(codebase=codebase, source=source)
 
     stop = time.clock()
     progress_monitor.info('Cache Count {0} miss of {1}'
             .format(cache_util.cache_miss, cache_util.cache_total))
+    for (name, hits, misses, size) in cache_util.get_memo_stats():
+        progress_monitor.info('Memo {0}: {1} hits, {2} misses, {3} entries'
+                .format(name, hits, misses, size))
     progress_monitor.info('Time: {0}'.format(stop - start))
 
 
-def clear_links(pname, release, source='-1'):
+def filter_stats(pname, release, linker_name, source, all_runs=False,
+        top=10):
+    '''Reports the hottest and least effective filters of a linker.'''
+    path = telemetry.get_telemetry_path(pname, release, linker_name, source)
+    records = telemetry.read_telemetry(path, not all_runs)
+    entries = telemetry.summarize(records)
+    telemetry.report(entries, top)
+    return entries
+
+
+def clear_links(pname, release, source='-1', chunksize=None):
     prelease = ProjectRelease.objects.filter(project__dir_name=pname).\
             filter(release=release)[0]
     query = ReleaseLinkSet.objects.filter(project_release=prelease)
     if source != '-1':
         query = query.filter(code_reference__source=source)
-    query.delete()
+    print_delete_counts(bulk_delete(query, chunksize))
+    if source != '-1':
+        invalidate_link_coverage(prelease=prelease, source=source)
+    else:
+        invalidate_link_coverage(prelease=prelease)
 
 
 def restore_kinds(pname, release='-1', source='-1'):
@@ -527,15 +700,24 @@ def analyze_post_log(base_dir, project, version, source):
     count = 0
     high_freq = 0
     depth = 0
-    with codecs.open(path, 'r', 'utf-8') as finput:
-        for line in finput:
-            line = line.strip()
-            if line.startswith('Type'):
-                count += 1
-            elif line == 'Rationale: highest_frequency':
+    record_path = log_writer.find_record_path(path)
+    if record_path is not None:
+        for record in log_writer.read_records(record_path):
+            count += 1
+            if record['rationale'] == 'highest_frequency':
                 high_freq += 1
-            elif line == 'Rationale: heuristic_depth':
+            elif record['rationale'] == 'heuristic_depth':
                 depth += 1
+    else:
+        with codecs.open(path, 'r', 'utf-8') as finput:
+            for line in finput:
+                line = line.strip()
+                if line.startswith('Type'):
+                    count += 1
+                elif line == 'Rationale: highest_frequency':
+                    high_freq += 1
+                elif line == 'Rationale: heuristic_depth':
+                    depth += 1
 
     print('Report for post-class')
     print('Count: {0}'.format(count))
@@ -677,7 +859,11 @@ def process_log_files(files):
     skip = False
 
     for f in files:
-        if not os.path.exists(f):
+        record_path = log_writer.find_record_path(f)
+        if record_path is not None:
+            process_log_records(record_path, visited, log_entries)
+            continue
+        elif not os.path.exists(f):
             continue
 
         with codecs.open(f, 'r', 'utf-8') as finput:
@@ -732,6 +918,37 @@ def process_log_files(files):
     return log_entries
 
 
+def process_log_records(path, visited, log_entries):
+    for record in log_writer.read_records(path):
+        ref = unicode(record['ref_pk'])
+        if ref in visited:
+            continue
+        visited.add(ref)
+        entry = LogEntry()
+        entry.origin_size = record['original_size']
+        entry.final_size = record['final_size']
+        entry.from_snippet = record['snippet']
+        entry.custom_filtered = record['custom_filtered']
+        for (name, options, activated, size) in record['filters']:
+            # Same key as in the text log: name followed by the options.
+            entry.filters['{0} {1}'.format(name, options).strip()] =\
+                    (activated, size)
+        entry.temp_types = list(record['originals'])
+        entry.compute_unique_types()
+        log_entries.append(entry)
+
+
+def convert_logs(base_dir):
+    '''Converts the linker record logs of a directory to the text format.'''
+    for filename in sorted(os.listdir(base_dir)):
+        if filename.startswith('linking-') and\
+                (filename.endswith(log_writer.RECORD_EXTENSION) or
+                filename.endswith(log_writer.COMPRESSED_EXTENSION)):
+            text_path = log_writer.convert_log(
+                    os.path.join(base_dir, filename))
+            print('Converted {0} to {1}'.format(filename, text_path))
+
+
 def recommend_single_types(codebase, simple_filters, d):
     single_types = set()
     types = CodeElement.objects.\
@@ -890,27 +1107,8 @@ def get_project_code_words(project):
 
 
 def get_default_kind_dict():
-    kinds = {}
-    kinds['unknown'] = CodeElementKind.objects.get(kind='unknown')
-    kinds['class'] = CodeElementKind.objects.get(kind='class')
-    kinds['annotation'] = CodeElementKind.objects.get(kind='annotation')
-    kinds['method'] = CodeElementKind.objects.get(kind='method')
-    kinds['field'] = CodeElementKind.objects.get(kind='field')
-    kinds['xml element'] = CodeElementKind.objects.get(kind='xml element')
-    kinds['xml attribute'] = CodeElementKind.objects.get(kind='xml attribute')
-    kinds['xml attribute value'] = \
-    CodeElementKind.objects.get(kind='xml attribute value')
-    kinds['xml file'] = CodeElementKind.objects.get(kind='xml file')
-    kinds['hbm file'] = CodeElementKind.objects.get(kind='hbm file')
-    kinds['ini file'] = CodeElementKind.objects.get(kind='ini file')
-    kinds['conf file'] = CodeElementKind.objects.get(kind='conf file')
-    kinds['properties file'] = \
-            CodeElementKind.objects.get(kind='properties file')
-    kinds['log file'] = CodeElementKind.objects.get(kind='log file')
-    kinds['jar file'] = CodeElementKind.objects.get(kind='jar file')
-    kinds['java file'] = CodeElementKind.objects.get(kind='java file')
-    kinds['python file'] = CodeElementKind.objects.get(kind='python file')
-    return kinds
+    kinds = get_kinds()
+    return dict((name, kinds.get(name)) for name in DEFAULT_KINDS)
 
 
 def get_java_strategies():
@@ -1109,7 +1307,7 @@ def get_default_s_classifiers():
 
 
 def restore_original_kind(path, kind_str):
-    kind = CodeElementKind.objects.get(kind=kind_str)
+    kind = get_kind(kind_str)
     with codecs.open(path, 'r', 'utf8') as f:
         for line in f:
             new_line = line.strip()
@@ -0,0 +1,91 @@
+from __future__ import unicode_literals
+import logging
+from codebase.models import CodeElementLink, LinkCoverage
+
+logger = logging.getLogger("recodoc.codebase.coverage")
+
+# {(codebase_id, source, resource_pk): frozenset of covered element ids}
+link_coverages = {}
+
+
+def encode_ids(element_ids):
+    '''Encodes a set of ids as the comma-separated deltas of the sorted
+       ids.'''
+    deltas = []
+    previous = 0
+    for element_id in sorted(element_ids):
+        deltas.append(element_id - previous)
+        previous = element_id
+    return ','.join(str(delta) for delta in deltas)
+
+
+def decode_ids(text):
+    element_ids = []
+    previous = 0
+    if text:
+        for delta in text.split(','):
+            previous += int(delta)
+            element_ids.append(previous)
+    return element_ids
+
+
+def get_linked_ids(codebase_id, source, resource_pk):
+    '''Returns the ids of the code elements of a codebase linked (first link)
+       from the references of a resource.'''
+    return set(CodeElementLink.objects.
+            filter(index=0).
+            filter(code_element__codebase=codebase_id).
+            filter(code_reference__resource_object_id=resource_pk).
+            filter(code_reference__source=source).
+            values_list('code_element_id', flat=True).distinct())
+
+
+def compute_link_coverage(codebase_id, source, resource_pk):
+    '''(Re)computes the LinkCoverage row of a resource and returns the
+       covered ids.'''
+    element_ids = get_linked_ids(codebase_id, source, resource_pk)
+    LinkCoverage.objects.filter(codebase=codebase_id).filter(source=source).\
+            filter(resource_object_id=resource_pk).delete()
+    LinkCoverage.objects.create(codebase_id=codebase_id, source=source,
+            resource_object_id=resource_pk,
+            element_ids=encode_ids(element_ids), size=len(element_ids))
+    logger.info('Computed link coverage of {0} {1}: {2} elements'
+            .format(source, resource_pk, len(element_ids)))
+    return element_ids
+
+
+def get_covered_ids(codebase_id, source, resource_pk):
+    '''Returns the ids of the code elements of a codebase linked from a
+       resource. The ids are read from the LinkCoverage row in one query, or
+       computed and saved if the row is missing.'''
+    key = (codebase_id, source, resource_pk)
+    element_ids = link_coverages.get(key)
+    if element_ids is None:
+        rows = LinkCoverage.objects.filter(codebase=codebase_id).\
+                filter(source=source).\
+                filter(resource_object_id=resource_pk).\
+                values_list('element_ids', flat=True)
+        if len(rows) > 0:
+            element_ids = frozenset(decode_ids(rows[0]))
+        else:
+            element_ids = frozenset(compute_link_coverage(codebase_id, source,
+                resource_pk))
+        link_coverages[key] = element_ids
+    return element_ids
+
+
+def invalidate_link_coverage(codebase=None, prelease=None, source=None,
+        resource_pk=None):
+    '''Deletes the LinkCoverage rows whose links may have changed. None
+       matches any codebase, release, source or resource.'''
+    query = LinkCoverage.objects.all()
+    if codebase is not None:
+        query = query.filter(codebase=codebase)
+    if prelease is not None:
+        query = query.filter(codebase__project_release=prelease)
+    if source is not None:
+        query = query.filter(source=source)
+    if resource_pk is not None:
+        query = query.filter(resource_object_id=resource_pk)
+    query.delete()
+    link_coverages.clear()
@@ -0,0 +1,120 @@
+from __future__ import unicode_literals
+import logging
+from codebase.models import CodeElementKind
+
+# Java kinds
+JAVA_TYPE_KINDS = ('class', 'annotation', 'enumeration')
+
+JAVA_FIELD_KINDS = ('field', 'annotation field', 'enumeration value')
+
+JAVA_MEMBER_KINDS = ('method',) + JAVA_FIELD_KINDS
+
+logger = logging.getLogger("recodoc.codebase.kinds")
+
+registries = {}
+
+
+class KindRegistry(object):
+    '''Immutable map of the code element kinds by name and by pk. The kinds
+       are loaded in one query and shared by all the parsers and linkers of a
+       process.'''
+
+    def __init__(self, kinds):
+        by_name = {}
+        by_pk = {}
+        for kind in kinds:
+            by_name[kind.kind] = kind
+            by_pk[kind.pk] = kind
+        object.__setattr__(self, '_by_name', by_name)
+        object.__setattr__(self, '_by_pk', by_pk)
+        object.__setattr__(self, 'type_pks',
+                frozenset(pk for (pk, kind) in by_pk.iteritems()
+                    if kind.is_type))
+        object.__setattr__(self, 'file_pks',
+                frozenset(pk for (pk, kind) in by_pk.iteritems()
+                    if kind.is_file))
+        # The kinds that support inheritance: the ancestors and descendants
+        # followed by the linkers and the pattern miners.
+        object.__setattr__(self, 'hierarchy_pks', self.type_pks)
+        object.__setattr__(self, 'attribute_pks',
+                frozenset(pk for (pk, kind) in by_pk.iteritems()
+                    if kind.is_attribute))
+        object.__setattr__(self, 'value_pks',
+                frozenset(pk for (pk, kind) in by_pk.iteritems()
+                    if kind.is_value))
+
+    def __setattr__(self, name, value):
+        raise AttributeError('The kind registry is immutable.')
+
+    def get(self, name):
+        '''Returns the kind named name. Raises CodeElementKind.DoesNotExist
+           like CodeElementKind.objects.get(kind=name).'''
+        kind = self._by_name.get(name)
+        if kind is None:
+            raise CodeElementKind.DoesNotExist(
+                    'Unknown code element kind: {0}'.format(name))
+        return kind
+
+    def get_by_pk(self, pk):
+        kind = self._by_pk.get(pk)
+        if kind is None:
+            raise CodeElementKind.DoesNotExist(
+                    'Unknown code element kind pk: {0}'.format(pk))
+        return kind
+
+    def get_pks(self, names):
+        return frozenset(self.get(name).pk for name in names)
+
+    def get_name(self, pk):
+        return self.get_by_pk(pk).kind
+
+    def is_type(self, pk):
+        return pk in self.type_pks
+
+    def is_file(self, pk):
+        return pk in self.file_pks
+
+    def in_hierarchy(self, pk):
+        '''Returns True if the elements of this kind are part of the type
+           hierarchy (parents and children).'''
+        return pk in self.hierarchy_pks
+
+    def is_attribute(self, pk):
+        return pk in self.attribute_pks
+
+    def is_value(self, pk):
+        return pk in self.value_pks
+
+    def names(self):
+        return self._by_name.keys()
+
+    def __contains__(self, name):
+        return name in self._by_name
+
+    def __len__(self):
+        return len(self._by_name)
+
+
+def get_kinds():
+    '''Returns the kind registry of the current process.'''
+    registry = registries.get('default')
+    if registry is None:
+        registry = KindRegistry(CodeElementKind.objects.all())
+        registries['default'] = registry
+        logger.debug('Loaded {0} code element kinds'.format(len(registry)))
+    return registry
+
+
+def get_kind(name):
+    '''Returns the kind named name. If the kind is missing, the registry is
+       reloaded once in case the kind was created after it was loaded.'''
+    registry = get_kinds()
+    if name not in registry:
+        reset_kinds()
+        registry = get_kinds()
+    return registry.get(name)
+
+
+def reset_kinds():
+    '''Discards the registry, e.g., after the kinds have been (re)created.'''
+    registries.clear()
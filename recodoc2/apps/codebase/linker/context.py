@@ -2,6 +2,8 @@ from __future__ import unicode_literals
 import logging
 from django.conf import settings
 import docutil.cache_util as cu
+from codebase.kinds import get_kinds
+from codebase.overloads import get_overload_index, has_signatures
 from codebase.models import CodeElementLink, CodeElement
 
 
@@ -32,8 +34,9 @@ def add_ancestors(code_element, ancestors, pk_set):
     if code_element is None:
         return
 
+    kinds = get_kinds()
     for parent in code_element.parents.all():
-        if parent.kind.is_type and parent.pk not in pk_set:
+        if kinds.in_hierarchy(parent.kind_id) and parent.pk not in pk_set:
             ancestors.append(parent)
             pk_set.add(parent.pk)
             add_ancestors(parent, ancestors, pk_set)
@@ -50,8 +53,9 @@ def add_descendants(code_element, descendants, pk_set):
     if code_element is None:
         return
 
+    kinds = get_kinds()
     for child in code_element.children.all():
-        if child.kind.is_type and child.pk not in pk_set:
+        if kinds.in_hierarchy(child.kind_id) and child.pk not in pk_set:
             descendants.append(child)
             pk_set.add(child.pk)
             add_descendants(child, descendants, pk_set)
@@ -94,19 +98,30 @@ def get_context_return_types_value(context_id, source, filter_func, codebase):
 
     return_types = []
     fqn_set = set()
+    overload_index = None
+    if has_signatures(codebase.pk):
+        overload_index = get_overload_index(codebase.pk)
 
     for link in query.all():
         code_element = link.code_element.methodelement
         return_fqn = code_element.return_fqn
         if return_fqn not in fqn_set:
             fqn_set.add(return_fqn)
-            try:
-                return_element = CodeElement.objects.\
-                        filter(codebase=codebase).\
-                        filter(fqn=return_fqn).all()[0]
-                return_types.append(return_element)
-            except Exception:
-                pass
+            if overload_index is not None:
+                return_ids = overload_index.get_ids(return_fqn)
+                if len(return_ids) > 0:
+                    return_types.append(CodeElement.objects.get(
+                        pk=return_ids[0]))
+            else:
+                # The signatures are missing: building the index would be
+                # more expensive than a query per return type.
+                try:
+                    return_element = CodeElement.objects.\
+                            filter(codebase=codebase).\
+                            filter(fqn=return_fqn).all()[0]
+                    return_types.append(return_element)
+                except Exception:
+                    pass
 
     return return_types
 
@@ -214,8 +229,7 @@ def get_context_id(scode_reference, context_level):
     elif context_level == GLOBAL:
         context_id = scode_reference.global_object_id
     elif context_level == SNIPPET:
-        if scode_reference.snippet is not None:
-            context_id = scode_reference.snippet.pk
+        context_id = scode_reference.snippet_id
 
     if context_id is None:
         context_id = -1
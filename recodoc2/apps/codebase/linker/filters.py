@@ -1,11 +1,16 @@
 from __future__ import unicode_literals
 import logging
+from collections import defaultdict
 from django.conf import settings
+from django.db.models import Count
 import codeutil.java_element as je
 import docutil.str_util as su
+import docutil.simil_util as simil
 import docutil.cache_util as cu
 from docutil.commands_util import simple_decorator
-from codebase.models import CodeElement
+from codebase.kinds import get_kinds
+from codebase.models import CodeElement, ParameterElement,\
+        SingleCodeReference
 import codebase.linker.context as ctx
 from codebase.actions import get_filters
 
@@ -13,6 +18,18 @@ PREFIX_GETCONTAINER = settings.CACHE_MIDDLEWARE_KEY_PREFIX + 'GETCONTAINER'
 
 CUSTOM_FILTERS = {'CustomClassFilter', 'CustomClassMemberFilter'}
 
+SIMILARITY_CACHE_SIZE = 100000
+
+# {codebase_id: {pk: container}}
+codebase_containers = {}
+
+# {codebase_id: {method_id: parameters}}
+codebase_parameters = {}
+
+# {(actual type, formal type): similarity}
+param_similarities = cu.LRUCache(SIMILARITY_CACHE_SIZE,
+        'filters.param_similarities')
+
 
 OBJECT_METHODS = {-1: set(['clone', 'equals', 'finalize', 'getClass',
                            'hashCode', 'notify', 'notifyAll', 'toString',
@@ -82,9 +99,66 @@ def get_container_value(code_element):
         return containers[0]
 
 
+def get_codebase_containers(codebase_id):
+    '''Returns {pk: code element} for all the containers of a codebase.
+       The containers are loaded once per process.'''
+    if codebase_id not in codebase_containers:
+        container_ids = CodeElement.objects.filter(codebase=codebase_id).\
+                filter(container__isnull=False).values('container')
+        codebase_containers[codebase_id] = dict((container.pk, container)
+                for container in CodeElement.objects.select_related('kind').
+                filter(pk__in=container_ids))
+    return codebase_containers[codebase_id]
+
+
+def invalidate_codebase_caches(codebase_id=None):
+    '''Discards the containers and parameters of a codebase whose code
+       elements changed. None matches any codebase.'''
+    for cache in (codebase_containers, codebase_parameters):
+        if codebase_id is None:
+            cache.clear()
+        else:
+            cache.pop(codebase_id, None)
+
+
 def get_container(code_element):
-    return cu.get_value(PREFIX_GETCONTAINER, code_element.pk,
-            get_container_value, [code_element])
+    container_id = code_element.container_id
+    if container_id is None:
+        # The element was parsed before the container column existed.
+        return cu.get_value(PREFIX_GETCONTAINER, code_element.pk,
+                get_container_value, [code_element])
+
+    containers = get_codebase_containers(code_element.codebase_id)
+    if container_id not in containers:
+        containers[container_id] = CodeElement.objects.\
+                select_related('kind').get(pk=container_id)
+    return containers[container_id]
+
+
+def get_codebase_parameters(codebase_id):
+    '''Returns {method_id: ((type_simple_name, type_fqn, package), ...)}
+       for all the methods of a codebase. The parameters are loaded once per
+       process, in one query.'''
+    if codebase_id not in codebase_parameters:
+        parameters = defaultdict(list)
+        parameter_rows = ParameterElement.objects.\
+                filter(codebase=codebase_id).\
+                order_by('attcontainer', 'index').\
+                values_list('attcontainer_id', 'type_simple_name', 'type_fqn')
+        for (method_id, type_simple_name, type_fqn) in\
+                parameter_rows.iterator():
+            parameters[method_id].append((type_simple_name, type_fqn,
+                je.get_package_name(type_fqn, True)))
+        codebase_parameters[codebase_id] = dict((method_id, tuple(params))
+                for (method_id, params) in parameters.iteritems())
+    return codebase_parameters[codebase_id]
+
+
+def get_parameters(method_element):
+    '''Returns the (type_simple_name, type_fqn, package) of the parameters
+       of a method.'''
+    return get_codebase_parameters(method_element.codebase_id).\
+            get(method_element.pk, ())
 
 
 def get_codebase(potentials):
@@ -102,6 +176,31 @@ def is_single_ref(code_reference):
     pass
 
 
+def is_context_dependent(afilter):
+    '''Returns True if the result of the filter depends on the context of the
+       reference and not only on its content.'''
+    return isinstance(afilter, ContextFilter)
+
+
+def get_context_levels(afilters):
+    '''Returns the context levels used by the filters.'''
+    levels = []
+    for afilter in afilters:
+        if is_context_dependent(afilter) and \
+                afilter.context_level not in levels:
+            levels.append(afilter.context_level)
+    return tuple(levels)
+
+
+def get_context_free_size(afilters):
+    '''Returns the number of filters at the head of the chain that do not
+       depend on the context of the reference.'''
+    for index, afilter in enumerate(afilters):
+        if is_context_dependent(afilter):
+            return index
+    return len(afilters)
+
+
 def custom_filtered(filter_results):
     cfiltered = False
 
@@ -118,17 +217,35 @@ def valid_filter(reference, code_filter, check_member):
     valid = not check_member or code_filter.include_member
 
     # Check that snippets are ok
-    valid = valid and (reference.snippet is None or
+    valid = valid and (reference.snippet_id is None or
             code_filter.include_snippet)
 
     # Check that compound references are ok
     valid = valid and (not code_filter.one_ref_only or
-            (reference.parent_reference is None and
-            reference.child_references.count() == 0))
+            (reference.parent_reference_id is None and
+            get_child_count(reference) == 0))
 
     return valid
 
 
+def load_child_counts(references):
+    '''Loads the number of child references of a chunk of references in one
+       query (see queryset_iterator).'''
+    counts = dict(SingleCodeReference.objects.
+            filter(parent_reference__in=[ref.pk for ref in references]).
+            values_list('parent_reference').
+            annotate(Count('pk')))
+    for reference in references:
+        reference.child_count = counts.get(reference.pk, 0)
+
+
+def get_child_count(reference):
+    count = getattr(reference, 'child_count', None)
+    if count is None:
+        count = reference.child_references.count()
+    return count
+
+
 def custom_filter(filter_inst, potentials, scode_reference, simple, fqn,
         check_member=False):
     (simple_filters, fqn_filters) = get_filters(get_codebase(potentials))
@@ -214,14 +331,15 @@ class FQNCaseFilter(object):
 
         result = FilterResult(self, False, potentials)
 
-        if scode_reference.snippet is None and simple != fqn and\
+        if scode_reference.snippet_id is None and simple != fqn and\
                 fqn.find(je.UNKNOWN_PACKAGE) < 0 and\
                 fqn.find(je.SNIPPET_PACKAGE) < 0:
+            kinds = get_kinds()
             new_potentials = []
             for potential in potentials:
                 # We apply the same treatment for types and methods... for
                 # now...
-                if potential.kind.is_type:
+                if kinds.is_type(potential.kind_id):
                     if potential.fqn.lower() == fqn.lower() or\
                             potential.simple_name == simple:
                         new_potentials.append(potential)
@@ -272,7 +390,7 @@ class ObjectMethodsFilter(object):
         if params is not None:
             size = len(params)
 
-        if (scode_reference.snippet is not None or size > 0) and\
+        if (scode_reference.snippet_id is not None or size > 0) and\
                 size in OBJECT_METHODS:
             methods = OBJECT_METHODS[size]
         else:
@@ -323,7 +441,7 @@ class ParameterNumberFilter(object):
         # If this is not a snippet, it might just be a method
         # name without the parameters.
         # In a snippet, the number of parameters is usually right.
-        if size > 0 or scode_reference.snippet is not None:
+        if size > 0 or scode_reference.snippet_id is not None:
             new_potentials = []
             for method_element in potentials:
                 if method_element.parameters_length == size:
@@ -354,20 +472,24 @@ class ParameterTypeFilter(object):
         self.simple_match = simple_match
         self.package_match = package_match
 
-    def _compute_match(self, actual_params, formal_params):
+    def _get_similarity(self, actual, formal):
+        key = (actual, formal)
+        similarity = param_similarities.get(key)
+        if similarity is None:
+            similarity = simil.simil(actual, formal)
+            param_similarities.put(key, similarity)
+        return similarity
+
+    def _compute_match(self, actuals, formal_params):
         matches = 0
-        size = len(actual_params)
+        size = len(actuals)
 
-        if size != formal_params.count():
+        if size != len(formal_params):
             matches = 0
         else:
-            actuals = [je.clean_java_name(actual_param, True, True)[0]
-                    for actual_param in actual_params]
-            formals = [formal_param.type_simple_name
-                    for formal_param in formal_params]
-            for (actual, formal) in zip(actuals, formals):
-                similarity = su.pairwise_simil(actual.lower(),
-                        formal.lower())
+            for (actual, formal_param) in zip(actuals, formal_params):
+                similarity = self._get_similarity(actual,
+                        formal_param[0].lower())
                 if similarity >= self.PARAM_SIMILARITY_THRESHOLD:
                     matches += 1
 
@@ -394,18 +516,15 @@ class ParameterTypeFilter(object):
 
         return matches
 
-    def _compute_package_match(self, actual_params, formal_params):
+    def _compute_package_match(self, actuals, formal_params):
         matches = 0
-        size = len(actual_params)
+        size = len(actuals)
 
-        if size != formal_params.count():
+        if size != len(formal_params):
             matches = 0
         else:
-            actuals = [je.get_package_name(actual_param, True)
-                    for actual_param in actual_params]
-            formals = [je.get_package_name(formal_param.type_fqn, True)
-                    for formal_param in formal_params]
-            for (actual, formal) in zip(actuals, formals):
+            for (actual, formal_param) in zip(actuals, formal_params):
+                formal = formal_param[2]
                 if actual is None or formal is None:
                     continue
                 elif actual == formal:
@@ -418,8 +537,11 @@ class ParameterTypeFilter(object):
     def _get_method_by_param(self, potentials, params, filter_input):
         new_potentials = []
         maximum = 1
+        actuals = [je.clean_java_name(actual_param, True, True)[0].lower()
+                for actual_param in params]
         for method_element in potentials:
-            matches = self._compute_match(params, method_element.parameters())
+            matches = self._compute_match(actuals,
+                    get_parameters(method_element))
             if matches > maximum:
                 new_potentials = [method_element]
                 maximum = matches
@@ -431,9 +553,11 @@ class ParameterTypeFilter(object):
     def _get_method_by_param_package(self, potentials, params, filter_input):
         new_potentials = []
         maximum = 0
+        actuals = [je.get_package_name(actual_param, True)
+                for actual_param in params]
         for method_element in potentials:
-            matches = self._compute_package_match(params,
-                    method_element.parameters())
+            matches = self._compute_package_match(actuals,
+                    get_parameters(method_element))
             if matches > maximum:
                 new_potentials = [method_element]
                 maximum = matches
@@ -658,18 +782,24 @@ class ContextNameSimilarityFilter(object):
         container_simple_lower = container_simple.lower()
         similarities = []
 
-        for potential in potentials:
-            (simple, _) = je.clean_java_name(get_container(potential).fqn)
+        simples = [je.clean_java_name(get_container(potential).fqn)[0]
+                for potential in potentials]
+        psimilarities = simil.simil_array(container_simple_lower,
+                [simple.lower() for simple in simples])
+        pairwise_mask = simil.threshold_mask(psimilarities,
+                self.PAIRWISE_THRESHOLD)
+
+        for (potential, simple, psimilarity, pairwise_match) in\
+                zip(potentials, simples, psimilarities, pairwise_mask):
+            # This is the minimum required by this filter:
+            if not pairwise_match:
+                continue
+
             potential_tokens = [token.lower()
                 for token in su.tokenize(simple)]
-            simple_lower = simple.lower()
             common_token = self._get_common_token_ratio(container_tokens,
                     potential_tokens)
-            psimilarity = su.pairwise_simil(container_simple_lower,
-                    simple_lower)
-
-            # This is the minimum required by this filter:
-            if common_token == 0.0 or psimilarity < self.PAIRWISE_THRESHOLD:
+            if common_token == 0.0:
                 continue
 
             similarity = max(common_token, psimilarity)
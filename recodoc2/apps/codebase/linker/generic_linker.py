@@ -1,16 +1,31 @@
 from __future__ import unicode_literals
+import logging
 import os
-import codecs
 from collections import defaultdict
 from django.conf import settings
+import docutil.cache_util as cu
+from codebase.kinds import get_kind
 from codebase.models import SingleCodeReference, CodeElement, ReleaseLinkSet,\
-        CodeElementLink, CodeElementKind
+        CodeElementLink
+import codebase.linker.context as ctx
+import codebase.linker.filters as filters
+import codebase.linker.telemetry as telemetry
+import codebase.linker.log_writer as log_writer
 
-DEBUG_LOG = defaultdict(list)
+# {reference pk: [log entries]} of the most recent references (DEBUG only).
+DEBUG_LOG = log_writer.DebugLog()
+
+DECISION_CACHE_SIZE = 10000
+
+FILTER_TELEMETRY = getattr(settings, 'FILTER_TELEMETRY', True)
+
+NO_DECISION = 'NO_DECISION'
+
+logger = logging.getLogger("recodoc.codebase.linker.generic_linker")
 
 
 def get_unknown_kind():
-    return CodeElementKind.objects.get(kind='unknown')
+    return get_kind('unknown')
 
 
 def get_any_code_element(simple_name, codebase, exact=True):
@@ -71,13 +86,45 @@ def save_link(scode_reference, code_element, potentials, linker):
                         index=index)
                 link.save()
                 index += 1
+
+    if code_element is not None or (potentials is not None and
+            len(potentials) > 0):
+        linker.link_saved(scode_reference)
     return count
 
 
+class LinkDecision(object):
+    '''Outcome of the linking of a reference: the chosen element, the
+       potentials, and what was logged. It is replayed for the references
+       that share the same decision key.'''
+
+    def __init__(self, code_element, potentials, log):
+        self.code_element = code_element
+        self.potentials = potentials
+        self.log_state = log.get_state()
+        self.log_entry = log.last_entry
+
+    def replay(self, scode_reference, log):
+        log.set_state(self.log_state)
+        if self.log_entry is not None:
+            (log_method, log_args) = self.log_entry
+            getattr(log, log_method)(scode_reference=scode_reference,
+                    **log_args)
+
+        potentials = self.potentials
+        if potentials is not None:
+            potentials = list(potentials)
+        return (self.code_element, potentials)
+
+
 class LinkerLog(object):
+    '''Logs the linking decisions. Records are written as JSON lines by a
+       background thread (see log_writer); log_writer.convert_log produces
+       the original text format.'''
 
     def __init__(self, linker, kind_str):
         self.linker = linker
+        self.kind_str = kind_str
 
         log_dir = os.path.join(settings.PROJECT_FS_ROOT,
                 linker.project.dir_name)
@@ -87,8 +134,11 @@ class LinkerLog(object):
         self.name = 'linking-{0}-{1}-{2}-{3}-{4}.log'.format(kind_str,
                 linker.project.dir_name, self.release, linker.name,
                 linker.source)
-        file_path = os.path.join(log_dir, self.name)
-        self.log_file = codecs.open(file_path, 'a', encoding='utf8')
+        file_path = log_writer.get_record_path(
+                os.path.join(log_dir, self.name))
+        self.writer = log_writer.LogWriter(file_path)
+        self.last_entry = None
+        self.reset_variables()
 
     def reset_variables(self):
         self.custom_filtered = False
@@ -97,215 +147,110 @@ class LinkerLog(object):
         self.one = False
         self.arbitrary = False
 
-    def close(self):
-        self.log_file.close()
+    def get_state(self):
+        return (self.custom_filtered, self.insensitive, self.sensitive,
+                self.one, self.arbitrary)
 
-        pass
-    def log_type(self, simple_name, fqn, scode_reference, code_element,
-            potentials, original_size, fresults, rationale=None):
-        potential_size = 0
-        if potentials is not None:
-            potential_size = len(potentials)
-
-        log_file = self.log_file
-        log_file.write('Type {0} - {1}\n'.format(simple_name, fqn))
-        log_file.write('  Content: {0}\n'.format(scode_reference.content))
-        log_file.write('  Original Size: {0}\n'.format(original_size))
-        log_file.write('  Final Size: {0}\n'.format(potential_size))
-        log_file.write('  URL: {0}\n'.
-                format(scode_reference.local_context.url))
-        log_file.write('  Ref pk: {0}\n'.format(scode_reference.pk))
-        log_file.write('  Local pk: {0}\n'.
-                format(scode_reference.local_object_id))
-
-        log_file.write('  Release: {0}\n'.format(self.release))
-        log_file.write('  Snippet: {0}\n'.
-                format(scode_reference.snippet is not None))
-        log_file.write('  Custom Filtered: {0}\n'.format(self.custom_filtered))
-
-        if rationale is not None:
-            log_file.write('  Rationale: {0}\n'.format(rationale))
-
-        log_file.write('  Filtering\n')
-        log_file.write('    Strategy {0} {1} {2} {3}\n'.format(
-            self.one, self.arbitrary, self.insensitive, self.sensitive))
-        for fresult in fresults:
-            log_file.write('    {0} {1}: {2} - {3}\n'.format(
-                fresult.name, fresult.options, fresult.activated,
-                len(fresult.potentials)))
+    def set_state(self, state):
+        (self.custom_filtered, self.insensitive, self.sensitive, self.one,
+                self.arbitrary) = state
 
+    def close(self):
+        self.writer.close()
+
+    def _get_fields(self, entry, scode_reference, potentials, original_size,
+            fresults):
+        return {'entry': entry,
+                'content': scode_reference.content,
+                'original_size': original_size,
+                'final_size': len(potentials) if potentials is not None
+                    else 0,
+                'ref_pk': scode_reference.pk,
+                'local_ct': scode_reference.local_content_type_id,
+                'local_pk': scode_reference.local_object_id,
+                'release': self.release,
+                'snippet': scode_reference.snippet_id is not None,
+                'custom_filtered': self.custom_filtered,
+                'filters': [(fresult.name, fresult.options, fresult.activated,
+                    len(fresult.potentials)) for fresult in fresults],
+                }
+
+    def _write(self, fields, code_element, potentials, code_elements=None):
+        # The writer thread only receives the fields of the code elements.
         if code_element is not None:
-            log_file.write('  Element: {0}\n'.
-                    format(code_element.human_string()))
-
-        if potentials is not None:
-            for potential in potentials[1:]:
-                log_file.write('  Potential: {0}\n'.
-                        format(potential.human_string()))
-
-        log_file.write('\n\n')
-        self.debug_log_type(simple_name, fqn, scode_reference, code_element,
-                potentials, original_size, fresults, rationale)
+            code_element = log_writer.get_element_key(code_element)
+        self.writer.write((fields, code_element,
+            [log_writer.get_element_key(potential) for potential in
+                potentials or []],
+            [log_writer.get_element_key(original) for original in
+                code_elements or []]))
+
+    def _get_debug_entry(self, fields):
+        debug_entry = {}
+        debug_entry['original size'] = fields['original_size']
+        debug_entry['final size'] = fields['final_size']
+        debug_entry['custom filtered'] = fields['custom_filtered']
+        debug_entry['linker'] = self.linker.name
+        for (name, _, activated, size) in fields['filters']:
+            debug_entry[name] = (activated, size)
+        return debug_entry
 
-    def debug_log_type(self, simple_name, fqn, scode_reference, code_element,
+    def log_type(self, simple_name, fqn, scode_reference, code_element,
             potentials, original_size, fresults, rationale=None):
-        if not settings.DEBUG:
-            return
-
-        potential_size = 0
-        if potentials is not None:
-            potential_size = len(potentials)
-
-        type_log = {}
-        type_log['original size'] = original_size
-        type_log['final size'] = potential_size
-        type_log['rationale'] = rationale
-        type_log['custom filtered'] = self.custom_filtered
-        type_log['linker'] = self.linker.name
-        for fresult in fresults:
-            type_log[fresult.name] = (fresult.activated,
-                    len(fresult.potentials))
-
-        DEBUG_LOG[scode_reference.pk].append(type_log)
+        self.last_entry = ('log_type', {'simple_name': simple_name,
+            'fqn': fqn, 'code_element': code_element,
+            'potentials': potentials, 'original_size': original_size,
+            'fresults': fresults, 'rationale': rationale})
+
+        fields = self._get_fields('type', scode_reference, potentials,
+                original_size, fresults)
+        fields['name'] = simple_name
+        fields['fqn'] = fqn
+        fields['rationale'] = rationale
+        fields['strategy'] = (self.one, self.arbitrary, self.insensitive,
+                self.sensitive)
+        self._write(fields, code_element, potentials)
+
+        if settings.DEBUG:
+            debug_entry = self._get_debug_entry(fields)
+            debug_entry['rationale'] = rationale
+            DEBUG_LOG.append(scode_reference.pk, debug_entry)
 
     def log_method(self, method_info, scode_reference, return_code_element,
             potentials, original_size, fresults, code_elements):
+        self.last_entry = ('log_method', {'method_info': method_info,
+            'return_code_element': return_code_element,
+            'potentials': potentials, 'original_size': original_size,
+            'fresults': fresults, 'code_elements': code_elements})
 
-        potential_size = 0
-        if potentials is not None:
-            potential_size = len(potentials)
-
-        log_file = self.log_file
-        log_file.write('Method {0} - {1}\n'.format(method_info.method_name,
-            method_info.type_params))
-        log_file.write('  Content: {0}\n'.format(scode_reference.content))
-        log_file.write('  Original Size: {0}\n'.format(original_size))
-        log_file.write('  Final Size: {0}\n'.format(potential_size))
-        log_file.write('  URL: {0}\n'.
-                format(scode_reference.local_context.url))
-        log_file.write('  Ref pk: {0}\n'.format(scode_reference.pk))
-        log_file.write('  Local pk: {0}\n'.
-                format(scode_reference.local_object_id))
-
-        log_file.write('  Release: {0}\n'.format(self.release))
-        log_file.write('  Snippet: {0}\n'.
-                format(scode_reference.snippet is not None))
-        log_file.write('  Custom Filtered: {0}\n'.format(self.custom_filtered))
-
-        log_file.write('  Filtering\n')
-        for fresult in fresults:
-            log_file.write('    {0} {1}: {2} - {3}\n'.format(
-                fresult.name, fresult.options, fresult.activated,
-                len(fresult.potentials)))
-
-        if return_code_element is not None:
-            log_file.write('  Element: {0}\n'.
-                    format(return_code_element.human_string()))
-
-        if potentials is not None:
-            for potential in potentials[1:]:
-                log_file.write('  Potential: {0}\n'.
-                        format(potential.human_string()))
-
-        if code_elements is not None:
-            for original in code_elements:
-                log_file.write('  Original: {0}\n'.
-                        format(original.human_string()))
-
-        log_file.write('\n\n')
+        fields = self._get_fields('method', scode_reference, potentials,
+                original_size, fresults)
+        fields['name'] = method_info.method_name
+        fields['type_params'] = '{0}'.format(method_info.type_params)
+        self._write(fields, return_code_element, potentials, code_elements)
 
-        self.debug_log_method(method_info, scode_reference,
-                return_code_element, potentials, original_size, fresults)
-
-    def debug_log_method(self, method_info, scode_reference,
-            return_code_element, potentials, original_size, fresults):
-        if not settings.DEBUG:
-            return
-
-        potential_size = 0
-        if potentials is not None:
-            potential_size = len(potentials)
-
-        method_log = {}
-        method_log['original size'] = original_size
-        method_log['final size'] = potential_size
-        method_log['custom filtered'] = self.custom_filtered
-        method_log['linker'] = self.linker.name
-        for fresult in fresults:
-            method_log[fresult.name] = (fresult.activated,
-                    len(fresult.potentials))
-
-        DEBUG_LOG[scode_reference.pk].append(method_log)
+        if settings.DEBUG:
+            DEBUG_LOG.append(scode_reference.pk,
+                    self._get_debug_entry(fields))
 
     def log_field(self, field_name, fqn_container, scode_reference,
             return_code_element, potentials, original_size, fresults,
             code_elements):
+        self.last_entry = ('log_field', {'field_name': field_name,
+            'fqn_container': fqn_container,
+            'return_code_element': return_code_element,
+            'potentials': potentials, 'original_size': original_size,
+            'fresults': fresults, 'code_elements': code_elements})
 
-        potential_size = 0
-        if potentials is not None:
-            potential_size = len(potentials)
-
-        log_file = self.log_file
-        log_file.write('Field {0}.{1}\n'.format(fqn_container,
-            field_name))
-        log_file.write('  Content: {0}\n'.format(scode_reference.content))
-        log_file.write('  Original Size: {0}\n'.format(original_size))
-        log_file.write('  Final Size: {0}\n'.format(potential_size))
-        log_file.write('  URL: {0}\n'.
-                format(scode_reference.local_context.url))
-        log_file.write('  Ref pk: {0}\n'.format(scode_reference.pk))
-        log_file.write('  Local pk: {0}\n'.
-                format(scode_reference.local_object_id))
-
-        log_file.write('  Release: {0}\n'.format(self.release))
-        log_file.write('  Snippet: {0}\n'.
-                format(scode_reference.snippet is not None))
-        log_file.write('  Custom Filtered: {0}\n'.format(self.custom_filtered))
-
-        log_file.write('  Filtering\n')
-        for fresult in fresults:
-            log_file.write('    {0} {1}: {2} - {3}\n'.format(
-                fresult.name, fresult.options, fresult.activated,
-                len(fresult.potentials)))
-
-        if return_code_element is not None:
-            log_file.write('  Element: {0}\n'.
-                    format(return_code_element.human_string()))
-
-        if potentials is not None:
-            for potential in potentials[1:]:
-                log_file.write('  Potential: {0}\n'.
-                        format(potential.human_string()))
-
-        if code_elements is not None:
-            for original in code_elements:
-                log_file.write('  Original: {0}\n'.
-                        format(original.human_string()))
+        fields = self._get_fields('field', scode_reference, potentials,
+                original_size, fresults)
+        fields['name'] = field_name
+        fields['fqn_container'] = fqn_container
+        self._write(fields, return_code_element, potentials, code_elements)
 
-        log_file.write('\n\n')
-
-        self.debug_log_field(field_name, fqn_container, scode_reference,
-                return_code_element, potentials, original_size, fresults)
-
-    def debug_log_field(self, field_name, fqn_container, scode_reference,
-            return_code_element, potentials, original_size, fresults):
-        if not settings.DEBUG:
-            return
-
-        potential_size = 0
-        if potentials is not None:
-            potential_size = len(potentials)
-
-        field_log = {}
-        field_log['original size'] = original_size
-        field_log['final size'] = potential_size
-        field_log['custom filtered'] = self.custom_filtered
-        field_log['linker'] = self.linker.name
-        for fresult in fresults:
-            field_log[fresult.name] = (fresult.activated,
-                    len(fresult.potentials))
-
-        DEBUG_LOG[scode_reference.pk].append(field_log)
+        if settings.DEBUG:
+            DEBUG_LOG.append(scode_reference.pk,
+                    self._get_debug_entry(fields))
 
 
 class DefaultLinker(object):
@@ -322,6 +267,11 @@ class DefaultLinker(object):
         else:
             self.f_ids = None
             self.f_level = None
+        self._init_decisions()
+        if FILTER_TELEMETRY:
+            self.telemetry = telemetry.FilterTelemetry(self)
+        else:
+            self.telemetry = None
 
     def _get_query(self, kind_hint, local_object_id):
         refs = SingleCodeReference.objects.\
@@ -338,10 +288,139 @@ class DefaultLinker(object):
         return refs
 
     def _reject_reference(self, reference):
+        return self._reject_context(reference.local_object_id,
+                reference.global_object_id)
+
+    def _reject_context(self, local_object_id, global_object_id):
         if self.f_level is None:
             return False
 
         if self.f_level == 'global':
-            return reference.global_object_id not in self.f_ids
+            return global_object_id not in self.f_ids
         elif self.f_level == 'local':
-            return reference.local_object_id not in self.f_ids
+            return local_object_id not in self.f_ids
+
+    def _init_decisions(self):
+        name = getattr(self, 'name', 'linker')
+        self.decisions = cu.LRUCache(DECISION_CACHE_SIZE,
+                '{0}.decisions'.format(name))
+        self.filter_heads = cu.LRUCache(DECISION_CACHE_SIZE,
+                '{0}.filter_heads'.format(name))
+        self.context_generations = defaultdict(int)
+        self.decision_levels = set()
+        self.parent_ids = None
+
+    def _is_single_reference(self, reference):
+        if reference.parent_reference_id is not None:
+            return False
+        if self.parent_ids is None:
+            self.parent_ids = set(SingleCodeReference.objects.
+                    filter(project=self.project).
+                    filter(source=self.source).
+                    filter(parent_reference__isnull=False).
+                    values_list('parent_reference_id', flat=True))
+        return reference.pk not in self.parent_ids
+
+    def _get_decision_key(self, reference, kind_str, context_levels=()):
+        '''Returns the key of a linking decision: two references with the
+           same key are linked to the same elements. The key contains the
+           context of the reference only for the context levels used by
+           context-dependent filters. The context changes (and the decisions
+           are invalidated) each time a link is saved in this context.'''
+        key = [kind_str, reference.content, reference.snippet_id is not None,
+                reference.source, self._is_single_reference(reference)]
+        for context_level in context_levels:
+            context_id = ctx.get_context_id(reference, context_level)
+            key.append((context_level, context_id,
+                self.context_generations[(context_level, context_id)]))
+        return tuple(key)
+
+    def link_saved(self, reference):
+        '''Invalidates the decisions that depend on the contexts of a
+           reference that has just been linked. Only the context levels that
+           are part of a decision key are invalidated: the decisions of a
+           context-free chain stay valid.'''
+        for context_level in self.decision_levels:
+            context_id = ctx.get_context_id(reference, context_level)
+            if context_id != -1:
+                self.context_generations[(context_level, context_id)] += 1
+
+    def _link_reference(self, reference, kind_str, log, link_func,
+            context_levels=()):
+        '''Returns the (code_element, potentials) computed by
+           link_func(reference), or the decision made for an equivalent
+           reference. Returns None if link_func did not try to link the
+           reference.'''
+        self.decision_levels.update(context_levels)
+        key = self._get_decision_key(reference, kind_str, context_levels)
+        decision = self.decisions.get(key)
+        if decision is None:
+            log.last_entry = None
+            result = link_func(reference)
+            if result is None:
+                self.decisions.put(key, NO_DECISION)
+            else:
+                (code_element, potentials) = result
+                self.decisions.put(key, LinkDecision(code_element,
+                    potentials, log))
+        elif decision == NO_DECISION:
+            result = None
+        else:
+            result = decision.replay(reference, log)
+        return result
+
+    def _filter_potentials(self, afilters, head_key, reference, potentials,
+            element_name, log, fqn_container=None, params=None):
+        '''Applies the filters to the potentials and returns (potentials,
+           filter_results). The results of the filters that do not depend on
+           the context (at the head of the chain) are memoized by
+           head_key.'''
+        head_size = filters.get_context_free_size(afilters)
+        head = None
+        start = 0
+        filter_results = []
+        if head_key is not None:
+            head = self.filter_heads.get(head_key)
+        if head is not None:
+            potentials = list(head[0])
+            filter_results = list(head[1])
+            start = head_size
+            if self.telemetry is not None:
+                self.telemetry.record_memoized(log.kind_str, filter_results)
+
+        for index in xrange(start, len(afilters)):
+            if index == head_size and head_key is not None:
+                self.filter_heads.put(head_key,
+                        (list(potentials), list(filter_results)))
+            finput = filters.FilterInput(reference, potentials,
+                    element_name, log, fqn_container, params, filter_results)
+            if self.telemetry is not None:
+                size = len(potentials) if potentials is not None else 0
+                start_time = self.telemetry.start()
+            result = afilters[index].filter(finput)
+            if self.telemetry is not None:
+                self.telemetry.record(log.kind_str, index, result, size,
+                        start_time)
+            potentials = result.potentials
+            filter_results.append(result)
+
+        if head is None and head_key is not None and \
+                head_size == len(afilters):
+            self.filter_heads.put(head_key,
+                    (list(potentials), list(filter_results)))
+
+        return (potentials, filter_results)
+
+    def save_telemetry(self):
+        '''Saves the filter telemetry of this run, if any, and returns the
+           path of the telemetry file.'''
+        if self.telemetry is None:
+            return None
+        else:
+            return self.telemetry.save()
+
+    def print_decision_stats(self):
+        logger.info('Decision cache: {0} hits, {1} misses. Filter cache: {2} '
+                'hits, {3} misses'.format(self.decisions.hits,
+                    self.decisions.misses, self.filter_heads.hits,
+                    self.filter_heads.misses))
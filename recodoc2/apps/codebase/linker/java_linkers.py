@@ -1,17 +1,26 @@
 from __future__ import unicode_literals
+import json
 import logging
+import tempfile
 from collections import defaultdict
 from django.conf import settings
+from django.db.models import Count
 from docutil.progress_monitor import NullProgressMonitor
 from docutil.commands_util import call_gc, queryset_iterator
+from docutil.db_util import chunks, bulk_update_column
 import docutil.str_util as su
+import docutil.simil_util as simil
 import docutil.cache_util as cu
 import codeutil.java_element as je
 import codebase.linker.context as ctx
 import codebase.linker.generic_linker as gl
 import codebase.linker.filters as filters
-from codebase.models import CodeElementKind, ReleaseLinkSet, MethodElement,\
-        MethodInfo, FieldElement
+from codebase.actions import get_first_containers, find_package_id
+from codebase.kinds import get_kind, get_kinds, JAVA_TYPE_KINDS,\
+        JAVA_FIELD_KINDS
+from codebase.models import ReleaseLinkSet, MethodElement, MethodInfo,\
+        FieldElement, SingleCodeReference, CodeElement,\
+        CodeElementLink
 
 ### PPA CONSTANTS ###
 HANDLE_SEPARATOR = ":"
@@ -22,7 +31,6 @@ SNIPPET_TYPE = 'zzzsnippet.ZZZSnippet'
 
 
 ### CACHE PREFIXES ###
-PREFIX_UNKNOWN = settings.CACHE_MIDDLEWARE_KEY_PREFIX + 'UNKNOWN'
 PREFIX_ANNOTATION_LINKER = settings.CACHE_MIDDLEWARE_KEY_PREFIX +\
     'javaannlinker'
 PREFIX_ENUMERATION_LINKER = settings.CACHE_MIDDLEWARE_KEY_PREFIX +\
@@ -37,13 +45,9 @@ PREFIX_ENUM_VAL_LINKER = settings.CACHE_MIDDLEWARE_KEY_PREFIX +\
     'javaenumvallinker'
 PREFIX_FIELD_LINKER = settings.CACHE_MIDDLEWARE_KEY_PREFIX +\
     'javafieldlinker'
-PREFIX_CLASS_POST_LINKER = settings.CACHE_MIDDLEWARE_KEY_PREFIX +\
-    'javaclspostlinker'
 PREFIX_GENERIC_LINKER = settings.CACHE_MIDDLEWARE_KEY_PREFIX +\
     'javagenlinker'
 
-UNKNOWN_KEY = 'UNKNOWN'
-
 
 ### QUERY CONSTANTS FOR FILTERS ###
 SIMPLE = 'SIMPLE'
@@ -55,14 +59,30 @@ IEXACT = 'IEXACT'
 # THRESHOLDS
 FQN_SIMILARITY_THRESHOLD = 0.80
 
+# Number of references loaded at once by the generic linker.
+GENERIC_BATCH_SIZE = getattr(settings, 'GENERIC_LINKER_BATCH_SIZE', 1000)
+
+METHOD_INFO_CACHE_SIZE = 50000
+
+# {(content, in snippet, skip complex search): MethodInfo}
+method_infos = cu.LRUCache(METHOD_INFO_CACHE_SIZE)
+
 
 logger = logging.getLogger("recodoc.codebase.linker")
 
 
+def get_reference_iterator(references, chunksize=1000):
+    '''Iterates over the references to link, with their kind hint and their
+       number of child references loaded once per chunk.'''
+    return queryset_iterator(references, chunksize,
+            select_related=('kind_hint',),
+            chunk_func=filters.load_child_counts)
+
+
 def reclassify_java(code_element, scode_reference):
     reclassified = False
 
-    if scode_reference.snippet is not None or code_element is not None:
+    if scode_reference.snippet_id is not None or code_element is not None:
         # We assume that references from snippet are always correctly
         # classified. References that were linked to a code element
         # do not need to be reclassified.
@@ -70,13 +90,13 @@ def reclassify_java(code_element, scode_reference):
 
     automatic_reclass = set(['method', 'field', 'annotation field',
         'enumeration value', 'annotation', 'enumeration'])
-    unknown_kind = cu.get_value(PREFIX_UNKNOWN, UNKNOWN_KEY,
-            gl.get_unknown_kind, None)
+    unknown_kind = get_kind('unknown')
 
-    if scode_reference.kind_hint.kind in automatic_reclass:
+    if get_kinds().get_name(scode_reference.kind_hint_id) in \
+            automatic_reclass:
         scode_reference.kind_hint = unknown_kind
         reclassified = True
-    elif scode_reference.child_references.count() == 0:
+    elif filters.get_child_count(scode_reference) == 0:
         # This was a single class reference, not mixed with a field or a
         # method (in which case, the field/method will be reclassified if
         # there is a need to). Maybe it was a reference to a method or a
@@ -90,35 +110,70 @@ def reclassify_java(code_element, scode_reference):
     return reclassified
 
 
-def find_package(code_element):
-    while code_element is not None and\
-            code_element.kind.kind != 'package':
-        code_element = code_element.containers.all()[0]
-
-    if code_element is not None:
-        return code_element.fqn
-    else:
-        return None
-
-
-def get_package_freq(local_ctx_id, source, prelease):
-    linksets = ReleaseLinkSet.objects\
-            .filter(code_reference__local_object_id=local_ctx_id)\
-            .filter(code_reference__source=source)\
-            .filter(project_release=prelease).all()
-
-    packages = defaultdict(int)
-
-    for linkset in linksets:
-        if linkset.links.count() == 1:
-            package_name = find_package(linkset.first_link.code_element)
-            if package_name is not None:
-                packages[package_name] += 1
-
-    package_freq = [(k, packages[k]) for k in packages]
-    package_freq.sort(key=lambda v: v[1], reverse=True)
-
-    return package_freq
+def write_spill(spill, reference, simple, fqn):
+    spill.write(json.dumps([reference.pk, simple, fqn]))
+    spill.write(b'\n')
+
+
+class PackageIndex(object):
+    '''Maps code elements to the fqn of their package. The package ids are
+       read from the package column along with the element ids (add). The
+       containers are only loaded and climbed in memory for elements parsed
+       before this column existed.'''
+
+    def __init__(self, prelease):
+        self.prelease = prelease
+        self.packages = dict(CodeElement.objects.
+                filter(codebase__project_release=prelease).
+                filter(kind__kind='package').values_list('pk', 'fqn'))
+        self.element_packages = {}
+        self.containers = None
+        self.cache = {}
+
+    def add(self, element_id, package_id):
+        if package_id is not None:
+            self.element_packages[element_id] = package_id
+
+    def get_package(self, element_id):
+        if element_id in self.packages:
+            return self.packages[element_id]
+
+        package_id = self.element_packages.get(element_id)
+        if package_id is None:
+            if self.containers is None:
+                self.containers = get_first_containers(CodeElement.objects.
+                        filter(codebase__project_release=self.prelease))
+            package_id = find_package_id(element_id, self.containers,
+                    self.packages, self.cache)
+
+        return self.packages.get(package_id)
+
+
+def get_package_freqs(prelease, package_index):
+    '''Returns {(local_object_id, source): [(package, frequency)]} for all the
+       references of a release that are linked to exactly one code element.
+       Packages are sorted by decreasing frequency.'''
+    single_links = ReleaseLinkSet.objects.filter(project_release=prelease).\
+            annotate(link_count=Count('links')).filter(link_count=1).\
+            values_list('code_reference__local_object_id',
+                    'code_reference__source', 'first_link__code_element_id',
+                    'first_link__code_element__package_id')
+
+    packages = defaultdict(lambda: defaultdict(int))
+    for (local_ctx_id, source, element_id, package_id) in\
+            single_links.iterator():
+        package_index.add(element_id, package_id)
+        package_name = package_index.get_package(element_id)
+        if package_name is not None:
+            packages[(local_ctx_id, source)][package_name] += 1
+
+    package_freqs = {}
+    for (key, freqs) in packages.iteritems():
+        package_freq = freqs.items()
+        package_freq.sort(key=lambda v: (-v[1], v[0]))
+        package_freqs[key] = package_freq
+
+    return package_freqs
 
 
 class JavaClassLinker(gl.DefaultLinker):
@@ -128,9 +183,9 @@ class JavaClassLinker(gl.DefaultLinker):
             filtered_ids=None):
         super(JavaClassLinker, self).__init__(project, prelease, codebase,
                 source, srelease, filtered_ids)
-        self.ann_kind = CodeElementKind.objects.get(kind='annotation')
-        self.class_kind = CodeElementKind.objects.get(kind='class')
-        self.enum_kind = CodeElementKind.objects.get(kind='enumeration')
+        self.ann_kind = get_kind('annotation')
+        self.class_kind = get_kind('class')
+        self.enum_kind = get_kind('enumeration')
         self.class_filters = [
                 filters.CustomClassFilter(),
                 filters.FQNCaseFilter(),
@@ -144,8 +199,8 @@ class JavaClassLinker(gl.DefaultLinker):
         acount = ann_refs.count()
         progress_monitor.info('Annotation count: {0}'.format(acount))
         try:
-            self._link_annotations(queryset_iterator(ann_refs), acount,
-                    progress_monitor)
+            self._link_annotations(get_reference_iterator(ann_refs),
+                    acount, progress_monitor)
         except Exception:
             logger.exception('Error while processing annotations.')
         call_gc()
@@ -155,8 +210,8 @@ class JavaClassLinker(gl.DefaultLinker):
         ecount = enum_refs.count()
         progress_monitor.info('Enumeration count: {0}'.format(ecount))
         try:
-            self._link_enumerations(queryset_iterator(enum_refs), ecount,
-                    progress_monitor)
+            self._link_enumerations(get_reference_iterator(enum_refs),
+                    ecount, progress_monitor)
         except Exception:
             logger.exception('Error while processing enumerations.')
         call_gc()
@@ -166,8 +221,8 @@ class JavaClassLinker(gl.DefaultLinker):
         ccount = class_refs.count()
         progress_monitor.info('Class count: {0}'.format(ccount))
         try:
-            self._link_classes(queryset_iterator(class_refs), ccount,
-                    progress_monitor)
+            self._link_classes(get_reference_iterator(class_refs),
+                    ccount, progress_monitor)
         except Exception:
             logger.exception('Error while processing classes.')
         call_gc()
@@ -176,150 +231,181 @@ class JavaClassLinker(gl.DefaultLinker):
         count = 0
         progress_monitor.start('Parsing annotations', acount)
         log = gl.LinkerLog(self, self.ann_kind.kind)
+        try:
+            for scode_reference in ann_refs:
+                #if scode_reference.declaration:
+                    #progress_monitor.work('Skipped declaration', 1)
+                    #continue
+                if self._reject_reference(scode_reference):
+                    progress_monitor.work('Skipped reference', 1)
+                    continue
+
+                result = self._link_reference(scode_reference,
+                        self.ann_kind.kind, log,
+                        lambda reference: self._link_annotation(reference,
+                            log))
+
+                if result is not None:
+                    (code_element, potentials) = result
+                    count += gl.save_link(scode_reference, code_element,
+                            potentials, self)
 
-        for scode_reference in ann_refs:
-            #if scode_reference.declaration:
-                #progress_monitor.work('Skipped declaration', 1)
-                #continue
-            if self._reject_reference(scode_reference):
-                progress_monitor.work('Skipped reference', 1)
-                continue
-
-            (simple, fqn) = je.get_annotation_name(scode_reference.content,
-                    scode_reference.snippet is not None)
+                    if not log.custom_filtered:
+                        reclassify_java(code_element, scode_reference)
 
-            if simple is not None:
-                prefix = '{0}{1}{2}'.format(PREFIX_ANNOTATION_LINKER, EXACT,
-                    cu.get_codebase_key(self.codebase))
-                code_elements = cu.get_value(
-                        prefix,
-                        simple,
-                        gl.get_type_code_elements,
-                        [simple, self.codebase, self.ann_kind])
+                progress_monitor.work('Processed annotation', 1)
+        finally:
+            log.close()
+        progress_monitor.done()
+        print('Associated {0} annotations'.format(count))
 
-                (code_element, potentials) = self.get_code_element(
-                        scode_reference, code_elements, simple, fqn, log)
-                count += gl.save_link(scode_reference, code_element,
-                        potentials, self)
+    def _link_annotation(self, scode_reference, log):
+        (simple, fqn) = je.get_annotation_name(scode_reference.content,
+                scode_reference.snippet_id is not None)
 
-                if not log.custom_filtered:
-                    reclassify_java(code_element, scode_reference)
+        if simple is None:
+            return None
 
-            progress_monitor.work('Processed annotation', 1)
+        prefix = '{0}{1}{2}'.format(PREFIX_ANNOTATION_LINKER, EXACT,
+            cu.get_codebase_key(self.codebase))
+        code_elements = cu.get_value(
+                prefix,
+                simple,
+                gl.get_type_code_elements,
+                [simple, self.codebase, self.ann_kind])
 
-        log.close()
-        progress_monitor.done()
-        print('Associated {0} annotations'.format(count))
+        return self.get_code_element(scode_reference, code_elements, simple,
+                fqn, log)
 
     def _link_enumerations(self, enum_refs, ecount, progress_monitor):
         count = 0
         progress_monitor.start('Parsing enumerations', ecount)
         log = gl.LinkerLog(self, self.enum_kind.kind)
+        try:
+            for scode_reference in enum_refs:
+                #if scode_reference.declaration:
+                    #progress_monitor.work('Skipped declaration', 1)
+                    #continue
+
+                if self._reject_reference(scode_reference):
+                    progress_monitor.work('Skipped reference', 1)
+                    continue
+
+                result = self._link_reference(scode_reference,
+                        self.enum_kind.kind, log,
+                        lambda reference: self._link_enumeration(reference,
+                            log))
+
+                if result is not None:
+                    (code_element, potentials) = result
+                    count += gl.save_link(scode_reference, code_element,
+                            potentials, self)
 
-        for scode_reference in enum_refs:
-            #if scode_reference.declaration:
-                #progress_monitor.work('Skipped declaration', 1)
-                #continue
-
-            if self._reject_reference(scode_reference):
-                progress_monitor.work('Skipped reference', 1)
-                continue
-
-            (simple, fqn) = je.get_class_name(scode_reference.content,
-                    scode_reference.snippet is not None)
+                    if not log.custom_filtered:
+                        reclassify_java(code_element, scode_reference)
 
-            if simple is not None:
-                prefix = '{0}{1}{2}'.format(PREFIX_ENUMERATION_LINKER, EXACT,
-                    cu.get_codebase_key(self.codebase))
-                code_elements = cu.get_value(
-                        prefix,
-                        simple,
-                        gl.get_type_code_elements,
-                        [simple, self.codebase, self.enum_kind])
+                progress_monitor.work('Processed enumeration', 1)
+        finally:
+            log.close()
+        progress_monitor.done()
+        print('Associated {0} enumerations'.format(count))
 
-                (code_element, potentials) = self.get_code_element(
-                        scode_reference, code_elements, simple, fqn, log)
-                count += gl.save_link(scode_reference, code_element,
-                        potentials, self)
+    def _link_enumeration(self, scode_reference, log):
+        (simple, fqn) = je.get_class_name(scode_reference.content,
+                scode_reference.snippet_id is not None)
 
-                if not log.custom_filtered:
-                    reclassify_java(code_element, scode_reference)
+        if simple is None:
+            return None
 
-            progress_monitor.work('Processed enumeration', 1)
+        prefix = '{0}{1}{2}'.format(PREFIX_ENUMERATION_LINKER, EXACT,
+            cu.get_codebase_key(self.codebase))
+        code_elements = cu.get_value(
+                prefix,
+                simple,
+                gl.get_type_code_elements,
+                [simple, self.codebase, self.enum_kind])
 
-        log.close()
-        progress_monitor.done()
-        print('Associated {0} enumerations'.format(count))
+        return self.get_code_element(scode_reference, code_elements, simple,
+                fqn, log)
 
     def _link_classes(self, class_refs, ccount, progress_monitor):
         count = 0
         progress_monitor.start('Parsing classes', ccount)
         log = gl.LinkerLog(self, self.class_kind.kind)
+        try:
+            for scode_reference in class_refs:
+                #if scode_reference.declaration:
+                    #progress_monitor.work('Skipped declaration', 1)
+                    #continue
+
+                if self._reject_reference(scode_reference):
+                    progress_monitor.work('Skipped reference', 1)
+                    continue
+
+                result = self._link_reference(scode_reference,
+                        self.class_kind.kind, log,
+                        lambda reference: self._link_class(reference, log))
+
+                if result is not None:
+                    (code_element, potentials) = result
+                    count += gl.save_link(scode_reference, code_element,
+                            potentials, self)
 
-        for scode_reference in class_refs:
-            #if scode_reference.declaration:
-                #progress_monitor.work('Skipped declaration', 1)
-                #continue
+                    if not log.custom_filtered:
+                        reclassify_java(code_element, scode_reference)
 
-            if self._reject_reference(scode_reference):
-                progress_monitor.work('Skipped reference', 1)
-                continue
+                progress_monitor.work('Processed class', 1)
+        finally:
+            log.close()
+        progress_monitor.done()
+        print('Associated {0} classes'.format(count))
 
-            (simple, fqn) = je.get_class_name(scode_reference.content,
-                    scode_reference.snippet is not None)
-            case_insensitive = scode_reference.snippet == None and\
-                    self.source != 'd'
+    def _link_class(self, scode_reference, log):
+        (simple, fqn) = je.get_class_name(scode_reference.content,
+                scode_reference.snippet_id is not None)
+        case_insensitive = scode_reference.snippet_id is None and\
+                self.source != 'd'
 
-            if case_insensitive:
-                exact = False
-                exact_prefix = IEXACT
-            else:
-                exact = True
-                exact_prefix = EXACT
-
-            if simple is not None:
-                prefix = '{0}{1}{2}'.format(PREFIX_CLASS_LINKER, exact_prefix,
-                    cu.get_codebase_key(self.codebase))
-                code_elements = []
-                code_elements.extend(cu.get_value(
-                        prefix,
-                        simple,
-                        gl.get_type_code_elements,
-                        [simple, self.codebase, self.class_kind, exact]))
-
-                prefix = '{0}{1}{2}'.format(PREFIX_ANNOTATION_LINKER,
-                        exact_prefix, cu.get_codebase_key(self.codebase))
-                code_elements.extend(cu.get_value(
-                        prefix,
-                        simple,
-                        gl.get_type_code_elements,
-                        [simple, self.codebase, self.ann_kind, exact]))
-
-                prefix = '{0}{1}{2}'.format(PREFIX_ENUMERATION_LINKER,
-                        exact_prefix, cu.get_codebase_key(self.codebase))
-                code_elements.extend(cu.get_value(
-                        prefix,
-                        simple,
-                        gl.get_type_code_elements,
-                        [simple, self.codebase, self.enum_kind, exact]))
-
-                (code_element, potentials) = self.get_code_element(
-                        scode_reference, code_elements, simple, fqn, log,
-                        not exact)
-                count += gl.save_link(scode_reference, code_element,
-                        potentials, self)
+        if case_insensitive:
+            exact = False
+            exact_prefix = IEXACT
+        else:
+            exact = True
+            exact_prefix = EXACT
 
-                if not log.custom_filtered:
-                    reclassify_java(code_element, scode_reference)
+        if simple is None:
+            return None
 
-            progress_monitor.work('Processed class', 1)
+        prefix = '{0}{1}{2}'.format(PREFIX_CLASS_LINKER, exact_prefix,
+            cu.get_codebase_key(self.codebase))
+        code_elements = []
+        code_elements.extend(cu.get_value(
+                prefix,
+                simple,
+                gl.get_type_code_elements,
+                [simple, self.codebase, self.class_kind, exact]))
 
-        log.close()
-        progress_monitor.done()
-        print('Associated {0} classes'.format(count))
+        prefix = '{0}{1}{2}'.format(PREFIX_ANNOTATION_LINKER,
+                exact_prefix, cu.get_codebase_key(self.codebase))
+        code_elements.extend(cu.get_value(
+                prefix,
+                simple,
+                gl.get_type_code_elements,
+                [simple, self.codebase, self.ann_kind, exact]))
+
+        prefix = '{0}{1}{2}'.format(PREFIX_ENUMERATION_LINKER,
+                exact_prefix, cu.get_codebase_key(self.codebase))
+        code_elements.extend(cu.get_value(
+                prefix,
+                simple,
+                gl.get_type_code_elements,
+                [simple, self.codebase, self.enum_kind, exact]))
+
+        return self.get_code_element(scode_reference, code_elements, simple,
+                fqn, log, not exact)
 
     def get_code_element(self, scode_reference, code_elements, simple, fqn,
-            log, insensitive=False):
+            log, insensitive=False, head_key=None):
         log.reset_variables()
         return_code_element = None
         potentials = code_elements
@@ -348,10 +434,10 @@ class JavaClassLinker(gl.DefaultLinker):
             elif insensitive:
                 # Do an insensitive comparison on the fqn.
                 fqn_lower = fqn.lower()
-                sims = [su.pairwise_simil(fqn_lower, code_element.fqn.lower())
-                        for code_element in code_elements]
-                max_sim = max(sims)
-                index = sims.index(max_sim)
+                sims = simil.simil_array(fqn_lower,
+                        [code_element.fqn.lower() for code_element in code_elements])
+                index = simil.argmax(sims)
+                max_sim = sims[index]
                 return_code_element = code_elements[index]
                 del(potentials[index])
                 potentials.insert(0, return_code_element)
@@ -360,10 +446,10 @@ class JavaClassLinker(gl.DefaultLinker):
                 log.insensitive = True
             else:
                 # Do a case sensitive comparison on the fqn
-                sims = [su.pairwise_simil(fqn, code_element.fqn)
-                        for code_element in code_elements]
-                max_sim = max(sims)
-                index = sims.index(max_sim)
+                sims = simil.simil_array(fqn,
+                        [code_element.fqn for code_element in code_elements])
+                index = simil.argmax(sims)
+                max_sim = sims[index]
                 return_code_element = code_elements[index]
                 del(potentials[index])
                 potentials.insert(0, return_code_element)
@@ -371,13 +457,9 @@ class JavaClassLinker(gl.DefaultLinker):
                     potentials = [return_code_element]
                 log.sensitive = True
 
-        filter_results = []
-        for afilter in self.class_filters:
-            finput = filters.FilterInput(scode_reference, potentials,
-                    fqn, log, None, None, filter_results)
-            result = afilter.filter(finput)
-            potentials = result.potentials
-            filter_results.append(result)
+        (potentials, filter_results) = self._filter_potentials(
+                self.class_filters, head_key, scode_reference, potentials, fqn,
+                log)
 
         potentials_size = len(potentials)
         if potentials_size > 0:
@@ -406,96 +488,159 @@ class JavaPostClassLinker(gl.DefaultLinker):
             local_object_id=None):
 
         # Get link to filter.
-        linksets = ReleaseLinkSet.objects\
-                .filter(project_release=self.prelease)\
-                .filter(first_link__code_element__kind__is_type=True)
-
-        count = linksets.count()
-        progress_monitor.start('Post-Processing Classes', count)
-        log = gl.LinkerLog(self, 'type')
-
-        for linkset in queryset_iterator(linksets):
-            log.reset_variables()
-            scode_reference = linkset.code_reference
-
-            if self._reject_reference(scode_reference):
+        linksets = self._get_linksets()
+        package_index = PackageIndex(self.prelease)
+        links = self._get_links(package_index)
+        package_freqs = get_package_freqs(self.prelease, package_index)
+
+        progress_monitor.start('Post-Processing Classes', len(linksets))
+
+        # [(linkset_pk, code_element_id, potential ids, rationale)]
+        results = []
+        first_elements = {}
+        first_rationales = defaultdict(list)
+        deleted_links = []
+
+        for linkset_pk in sorted(linksets):
+            (reference_id, local_ctx_id, global_ctx_id, source) =\
+                    linksets[linkset_pk]
+            if self._reject_context(local_ctx_id, global_ctx_id):
                 progress_monitor.work('Skipped reference', 1)
                 continue
 
-            lcount = linkset.links.count()
-            if lcount <= 1:
-                log.log_type('', '', scode_reference,
-                        linkset.first_link.code_element,
-                        [linkset.first_link], lcount, [], 'onlyone')
+            # [(index, link_pk, code_element_id, is_first)]
+            linkset_links = sorted(links[linkset_pk])
+            element_ids = [link[2] for link in linkset_links]
+            first_link = [link for link in linkset_links if link[3]][0]
+            if len(linkset_links) <= 1:
+                results.append((linkset_pk, first_link[2], [first_link[2]],
+                    'onlyone'))
                 progress_monitor.work('Skipped a linkset.', 1)
                 continue
 
-            local_ctx_id = scode_reference.local_object_id
-            source = scode_reference.source
-            prefix = '{0}{1}{2}'.format(PREFIX_CLASS_POST_LINKER,
-                cu.get_codebase_key(self.codebase), source)
-            package_freq = cu.get_value(
-                    prefix,
-                    local_ctx_id,
-                    get_package_freq,
-                    [local_ctx_id, source, self.prelease])
+            package_freq = package_freqs.get((local_ctx_id, source), [])
 
             # Find package with highest frequency
-            code_element = self._find_package_by_freq(linkset, package_freq)
+            code_element_id = self._find_package_by_freq(element_ids,
+                    package_freq, package_index)
             rationale = 'highest_frequency'
 
             # Heuristic
-            if code_element is None:
-                code_element = self._find_package_by_depth(linkset)
+            if code_element_id is None:
+                code_element_id = self._find_package_by_depth(element_ids,
+                        package_index)
                 rationale = 'heuristic_depth'
 
             # Update links
-            if code_element is not None:
-                linkset.first_link.code_element = code_element
-                linkset.first_link.linker_name = self.name
-                linkset.first_link.rationale = rationale
-                linkset.first_link.save()
-                for link in linkset.links.all()[1:]:
-                    link.delete()
-                log.log_type('', '', scode_reference,
-                        linkset.first_link.code_element,
-                        [linkset.first_link], lcount, [], rationale)
+            if code_element_id is not None:
+                first_elements[first_link[1]] = code_element_id
+                first_rationales[rationale].append(first_link[1])
+                deleted_links.extend(link[1] for link in linkset_links
+                        if link[1] != first_link[1])
+                results.append((linkset_pk, code_element_id,
+                    [code_element_id], rationale))
                 progress_monitor.info('FOUND Best Package {0} because {1}'
-                        .format(code_element.fqn, rationale))
+                        .format(package_index.get_package(code_element_id),
+                            rationale))
             else:
-                potentials =\
-                    [link.code_element for link in linkset.links.all()]
-                log.log_type('', '', scode_reference,
-                        linkset.first_link.code_element,
-                        potentials, lcount, 'nomatch')
+                results.append((linkset_pk, first_link[2], element_ids,
+                    'nomatch'))
 
             progress_monitor.work('Processed a linkset.', 1)
 
         progress_monitor.done()
 
-    def _find_package_by_depth(self, linkset):
+        self._update_links(first_elements, first_rationales, deleted_links)
+        self._log_results(results, linksets, links)
+
+    def _get_linksets(self):
+        '''Returns {linkset_pk: (reference_pk, local_object_id,
+           global_object_id, source)} for the linksets whose first link is a
+           type.'''
+        linksets = ReleaseLinkSet.objects\
+                .filter(project_release=self.prelease)\
+                .filter(first_link__code_element__kind__is_type=True)\
+                .values_list('pk', 'code_reference_id',
+                        'code_reference__local_object_id',
+                        'code_reference__global_object_id',
+                        'code_reference__source')
+        return dict((row[0], row[1:]) for row in linksets.iterator())
+
+    def _get_links(self, package_index):
+        '''Returns {linkset_pk: [(index, link_pk, code_element_id,
+           is_first)]} in one query.'''
+        links = defaultdict(list)
+        link_rows = CodeElementLink.objects\
+                .filter(release_link_set__project_release=self.prelease)\
+                .filter(release_link_set__first_link__code_element__kind__is_type=True)\
+                .values_list('release_link_set_id', 'index', 'pk',
+                        'code_element_id', 'first_link_id',
+                        'code_element__package_id')
+        for (linkset_pk, index, link_pk, element_id, first_pk, package_id)\
+                in link_rows.iterator():
+            package_index.add(element_id, package_id)
+            links[linkset_pk].append((index, link_pk, element_id,
+                first_pk == linkset_pk))
+        return links
+
+    def _update_links(self, first_elements, first_rationales, deleted_links):
+        bulk_update_column(CodeElementLink, 'code_element_id', first_elements)
+        for (rationale, link_pks) in first_rationales.iteritems():
+            for chunk in chunks(link_pks):
+                CodeElementLink.objects.filter(pk__in=chunk).update(
+                        linker_name=self.name, rationale=rationale)
+        # QuerySet.delete also removes the objects pointing to the links.
+        for chunk in chunks(deleted_links):
+            CodeElementLink.objects.filter(pk__in=chunk).delete()
+
+    def _log_results(self, results, linksets, links):
+        log = gl.LinkerLog(self, 'type')
+        try:
+            for chunk in chunks(results):
+                reference_ids = [linksets[result[0]][0] for result in chunk]
+                references = SingleCodeReference.objects.in_bulk(reference_ids)
+                element_ids = set()
+                for result in chunk:
+                    element_ids.add(result[1])
+                    element_ids.update(result[2])
+                elements = CodeElement.objects.select_related('kind').\
+                        in_bulk(list(element_ids))
+
+                for (linkset_pk, element_id, potential_ids, rationale) in \
+                        chunk:
+                    log.reset_variables()
+                    scode_reference = references[linksets[linkset_pk][0]]
+                    potentials = [elements[pk] for pk in potential_ids]
+                    log.log_type('', '', scode_reference, elements[element_id],
+                            potentials, len(links[linkset_pk]), [], rationale)
+        finally:
+            log.close()
+
+    def _find_package_by_depth(self, element_ids, package_index):
         best_depth = -1
         best_package_name = ''
         best_element = None
 
-        for link in linkset.links.all():
-            package = find_package(link.code_element)
+        for element_id in element_ids:
+            package = package_index.get_package(element_id)
             if package is not None:
                 depth = len(package.split('.'))
                 if best_depth == -1 or depth < best_depth:
                     best_depth = depth
                     best_package_name = package
-                    best_element = link.code_element
+                    best_element = element_id
                 elif depth == best_depth:
                     # Same depth, alphanumeric comparison
                     if package < best_package_name:
                         best_package_name = package
-                        best_element = link.code_element
+                        best_element = element_id
 
         return best_element
 
-    def _find_package_by_freq(self, linkset, package_freq):
-        package_names = [p[0] for p in package_freq]
+    def _find_package_by_freq(self, element_ids, package_freq,
+            package_index):
+        package_names = dict((p[0], index) for (index, p) in
+                enumerate(package_freq))
         size = len(package_freq)
         # Best Index = index of package with highest frequency.
         # List of packages is sorted by decreasing frequency.
@@ -503,38 +648,36 @@ class JavaPostClassLinker(gl.DefaultLinker):
         best_index = size
         best_element = None
 
-        for link in linkset.links.all():
-            package = find_package(link.code_element)
-            if package is not None:
-                try:
-                    index = package_names.index(package)
-                    if index < best_index:
-                        if index == size - 1 or best_index == size:
-                            best_index = index
-                            best_element = link.code_element
-                        # Otherwise, frequency is equivalent and it's not good!
-                        elif package_freq[index][1] >\
-                                package_freq[best_index][1]:
-                            best_index = index
-                            best_element = link.code_element
-                        # Compare depth!
-                        else:
-                            depth_best =\
-                                len(package_names[best_index].split('.'))
-                            depth_index =\
-                                len(package_names[index].split('.'))
-
-                            # At equal frequency, compare depth
-                            if depth_best < depth_index:
-                                continue
-                            elif depth_index < depth_best:
-                                best_index = index
-                                best_element = link.code_element
-                            else:
-                                best_index = size
-                                best_element = None
-                except Exception:
-                    pass
+        for element_id in element_ids:
+            package = package_index.get_package(element_id)
+            if package is None or package not in package_names:
+                continue
+            index = package_names[package]
+            if index < best_index:
+                if index == size - 1 or best_index == size:
+                    best_index = index
+                    best_element = element_id
+                # Otherwise, frequency is equivalent and it's not good!
+                elif package_freq[index][1] >\
+                        package_freq[best_index][1]:
+                    best_index = index
+                    best_element = element_id
+                # Compare depth!
+                else:
+                    depth_best =\
+                        len(package_freq[best_index][0].split('.'))
+                    depth_index =\
+                        len(package_freq[index][0].split('.'))
+
+                    # At equal frequency, compare depth
+                    if depth_best < depth_index:
+                        continue
+                    elif depth_index < depth_best:
+                        best_index = index
+                        best_element = element_id
+                    else:
+                        best_index = size
+                        best_element = None
 
         return best_element
 
@@ -546,7 +689,7 @@ class JavaMethodLinker(gl.DefaultLinker):
             filtered_ids=None):
         super(JavaMethodLinker, self).__init__(project, prelease, codebase,
                 source, srelease, filtered_ids)
-        self.method_kind = CodeElementKind.objects.get(kind='method')
+        self.method_kind = get_kind('method')
         self.method_filters = [
                 filters.ObjectMethodsFilter(),
                 filters.ExceptionFilter(),
@@ -573,6 +716,7 @@ class JavaMethodLinker(gl.DefaultLinker):
                 filters.AbstractTypeFilter(),
                 filters.StrictFilter(),
                 ]
+        self.context_levels = filters.get_context_levels(self.method_filters)
 
     def link_references(self, progress_monitor=NullProgressMonitor(),
             local_object_id=None):
@@ -594,28 +738,37 @@ class JavaMethodLinker(gl.DefaultLinker):
         count = 0
         progress_monitor.start('Parsing methods', mcount)
         log = gl.LinkerLog(self, self.method_kind.kind)
+        try:
+            for scode_reference in method_refs:
+                if self._reject_reference(scode_reference):
+                    progress_monitor.work('Skipped reference', 1)
+                    continue
+                (code_element, potentials) = self._link_reference(
+                        scode_reference, self.method_kind.kind, log,
+                        lambda reference: self._link_method(reference, log),
+                        self.context_levels)
+                count += gl.save_link(scode_reference, code_element,
+                        potentials, self)
 
-        for scode_reference in method_refs:
-            if self._reject_reference(scode_reference):
-                progress_monitor.work('Skipped reference', 1)
-                continue
-            method_info = self._get_method_info(scode_reference)
-            code_elements = self._get_method_elements(method_info)
-
-            (code_element, potentials) = self.get_code_element(
-                    scode_reference, code_elements, method_info, log)
-            count += gl.save_link(scode_reference, code_element, potentials,
-                    self)
-
-            if not log.custom_filtered:
-                reclassify_java(code_element, scode_reference)
-
-            progress_monitor.work('Processed method', 1)
+                if not log.custom_filtered:
+                    reclassify_java(code_element, scode_reference)
 
-        log.close()
+                progress_monitor.work('Processed method', 1)
+        finally:
+            log.close()
         progress_monitor.done()
+        self.print_decision_stats()
         print('Associated {0} methods'.format(count))
 
+    def _link_method(self, scode_reference, log):
+        method_info = self._get_method_info(scode_reference)
+        code_elements = self._get_method_elements(method_info)
+        head_key = self._get_decision_key(scode_reference,
+                self.method_kind.kind)
+
+        return self.get_code_element(scode_reference, code_elements,
+                method_info, log, head_key)
+
     def _get_method_elements(self, method_info):
             prefix = '{0}{1}'.format(PREFIX_METHOD_LINKER,
                 cu.get_codebase_key(self.codebase))
@@ -630,14 +783,22 @@ class JavaMethodLinker(gl.DefaultLinker):
             return code_elements
 
     def _get_method_info(self, scode_reference, skip_complex_search=False):
+        key = (scode_reference.content, scode_reference.snippet_id is not None,
+                skip_complex_search)
+        method_info = method_infos.get(key)
+        if method_info is None:
+            method_info = self._parse_method_info(*key)
+            method_infos.put(key, method_info)
+        return method_info
+
+    def _parse_method_info(self, content, in_snippet, skip_complex_search):
         method_name = fqn_container = nb_params = type_params = None
 
-        if scode_reference.snippet != None:
-            parts = scode_reference.content.split(HANDLE_SEPARATOR)
+        if in_snippet:
+            parts = content.split(HANDLE_SEPARATOR)
             (method_name, fqn_container, nb_params, type_params) = \
                     self._get_method_info_snippet(parts)
         else:
-            content = scode_reference.content
             match1 = je.CALL_CHAIN_RE.search(content)
             match2 = je.METHOD_DECLARATION_RE.search(content)
             match3 = je.METHOD_SIGNATURE_RE.search(content)
@@ -744,7 +905,7 @@ class JavaMethodLinker(gl.DefaultLinker):
         return (nb_params, type_params)
 
     def get_code_element(self, scode_reference, code_elements, method_info,
-            log):
+            log, head_key=None):
         log.reset_variables()
         return_code_element = None
         if code_elements is None:
@@ -757,18 +918,13 @@ class JavaMethodLinker(gl.DefaultLinker):
         #for code_element in code_elements:
             #print(code_element.fqn)
 
-        filter_results = []
-
         method_name = method_info.method_name
         params = method_info.type_params
         fqn_container = method_info.fqn_container
 
-        for afilter in self.method_filters:
-            finput = filters.FilterInput(scode_reference, potentials,
-                    method_name, log, fqn_container, params, filter_results)
-            result = afilter.filter(finput)
-            potentials = result.potentials
-            filter_results.append(result)
+        (potentials, filter_results) = self._filter_potentials(
+                self.method_filters, head_key, scode_reference, potentials,
+                method_name, log, fqn_container, params)
 
         log.custom_filtered = filters.custom_filtered(filter_results)
 
@@ -792,11 +948,9 @@ class JavaFieldLinker(gl.DefaultLinker):
             filtered_ids=None):
         super(JavaFieldLinker, self).__init__(project, prelease, codebase,
                 source, srelease, filtered_ids)
-        self.field_kind = CodeElementKind.objects.get(kind='field')
-        self.ann_field_kind =\
-            CodeElementKind.objects.get(kind='annotation field')
-        self.enum_value_kind =\
-            CodeElementKind.objects.get(kind='enumeration value')
+        self.field_kind = get_kind('field')
+        self.ann_field_kind = get_kind('annotation field')
+        self.enum_value_kind = get_kind('enumeration value')
         self.field_filters = [
                 filters.ExceptionFilter(),
                 filters.FQNCaseFilter(),
@@ -819,6 +973,7 @@ class JavaFieldLinker(gl.DefaultLinker):
                 filters.AbstractTypeFilter(),
                 filters.StrictFilter(),
                 ]
+        self.context_levels = filters.get_context_levels(self.field_filters)
 
     def link_references(self, progress_monitor=NullProgressMonitor(),
             local_object_id=None):
@@ -828,8 +983,8 @@ class JavaFieldLinker(gl.DefaultLinker):
         acount = ann_refs.count()
         progress_monitor.info('Annotation Field count: {0}'.format(acount))
         try:
-            self._link_ann_fields(queryset_iterator(ann_refs), acount,
-                    progress_monitor)
+            self._link_ann_fields(get_reference_iterator(ann_refs),
+                    acount, progress_monitor)
         except Exception:
             logger.exception('Error while processing annotation fields')
         call_gc()
@@ -839,8 +994,8 @@ class JavaFieldLinker(gl.DefaultLinker):
         ecount = enum_refs.count()
         progress_monitor.info('Enumeration Value count: {0}'.format(ecount))
         try:
-            self._link_enum_values(queryset_iterator(enum_refs), ecount,
-                    progress_monitor)
+            self._link_enum_values(get_reference_iterator(enum_refs),
+                    ecount, progress_monitor)
         except Exception:
             logger.exception('Error while processing enumeration values')
         call_gc()
@@ -850,8 +1005,8 @@ class JavaFieldLinker(gl.DefaultLinker):
         fcount = field_refs.count()
         progress_monitor.info('Field count: {0}'.format(fcount))
         try:
-            self._link_fields(queryset_iterator(field_refs), fcount,
-                    progress_monitor)
+            self._link_fields(get_reference_iterator(field_refs),
+                    fcount, progress_monitor)
         except Exception:
             logger.exception('Error while processing fields')
         call_gc()
@@ -860,27 +1015,25 @@ class JavaFieldLinker(gl.DefaultLinker):
         count = 0
         progress_monitor.start('Parsing annotation fields', acount)
         log = gl.LinkerLog(self, self.ann_field_kind.kind)
+        try:
+            for scode_reference in ann_refs:
+                if self._reject_reference(scode_reference):
+                    progress_monitor.work('Skipped reference', 1)
+                    continue
+                (code_element, potentials) = self._link_reference(
+                        scode_reference, self.ann_field_kind.kind, log,
+                        lambda reference: self._link_field(reference, log,
+                            self.ann_field_kind, PREFIX_ANN_FIELD_LINKER),
+                        self.context_levels)
+                count += gl.save_link(scode_reference, code_element,
+                        potentials, self)
 
-        for scode_reference in ann_refs:
-            if self._reject_reference(scode_reference):
-                progress_monitor.work('Skipped reference', 1)
-                continue
-            (field_name, fqn_container) = self._get_field_name(scode_reference)
-            code_elements = self._get_field_elements(field_name,
-                    PREFIX_ANN_FIELD_LINKER, self.ann_field_kind)
-
-            (code_element, potentials) = self.get_code_element(
-                    scode_reference, code_elements, field_name, fqn_container,
-                    log)
-            count += gl.save_link(scode_reference, code_element, potentials,
-                    self)
-
-            if not log.custom_filtered:
-                reclassify_java(code_element, scode_reference)
-
-            progress_monitor.work('Processed ann field', 1)
+                if not log.custom_filtered:
+                    reclassify_java(code_element, scode_reference)
 
-        log.close()
+                progress_monitor.work('Processed ann field', 1)
+        finally:
+            log.close()
         progress_monitor.done()
         print('Associated {0} ann fields'.format(count))
 
@@ -888,27 +1041,25 @@ class JavaFieldLinker(gl.DefaultLinker):
         count = 0
         progress_monitor.start('Parsing enumeration values', ecount)
         log = gl.LinkerLog(self, self.enum_value_kind.kind)
+        try:
+            for scode_reference in enum_refs:
+                if self._reject_reference(scode_reference):
+                    progress_monitor.work('Skipped reference', 1)
+                    continue
+                (code_element, potentials) = self._link_reference(
+                        scode_reference, self.enum_value_kind.kind, log,
+                        lambda reference: self._link_field(reference, log,
+                            self.enum_value_kind, PREFIX_ENUM_VAL_LINKER),
+                        self.context_levels)
+                count += gl.save_link(scode_reference, code_element,
+                        potentials, self)
 
-        for scode_reference in enum_refs:
-            if self._reject_reference(scode_reference):
-                progress_monitor.work('Skipped reference', 1)
-                continue
-            (field_name, fqn_container) = self._get_field_name(scode_reference)
-            code_elements = self._get_field_elements(field_name,
-                    PREFIX_ENUM_VAL_LINKER, self.enum_value_kind)
-
-            (code_element, potentials) = self.get_code_element(
-                    scode_reference, code_elements, field_name, fqn_container,
-                    log)
-            count += gl.save_link(scode_reference, code_element, potentials,
-                    self)
-
-            if not log.custom_filtered:
-                reclassify_java(code_element, scode_reference)
-
-            progress_monitor.work('Processed enum value', 1)
+                if not log.custom_filtered:
+                    reclassify_java(code_element, scode_reference)
 
-        log.close()
+                progress_monitor.work('Processed enum value', 1)
+        finally:
+            log.close()
         progress_monitor.done()
         print('Associated {0} enum values'.format(count))
 
@@ -916,12 +1067,33 @@ class JavaFieldLinker(gl.DefaultLinker):
         count = 0
         progress_monitor.start('Parsing fields', acount)
         log = gl.LinkerLog(self, self.field_kind.kind)
+        try:
+            for scode_reference in field_refs:
+                if self._reject_reference(scode_reference):
+                    progress_monitor.work('Skipped reference', 1)
+                    continue
+                (code_element, potentials) = self._link_reference(
+                        scode_reference, self.field_kind.kind, log,
+                        lambda reference: self._link_field(reference, log),
+                        self.context_levels)
+                count += gl.save_link(scode_reference, code_element,
+                        potentials, self)
 
-        for scode_reference in field_refs:
-            if self._reject_reference(scode_reference):
-                progress_monitor.work('Skipped reference', 1)
-                continue
-            (field_name, fqn_container) = self._get_field_name(scode_reference)
+                if not log.custom_filtered:
+                    reclassify_java(code_element, scode_reference)
+
+                progress_monitor.work('Processed field', 1)
+        finally:
+            log.close()
+        progress_monitor.done()
+        self.print_decision_stats()
+        print('Associated {0} fields'.format(count))
+
+    def _link_field(self, scode_reference, log, kind=None, prefix=None):
+        '''Links a field reference to the elements of kind or, if kind is
+           None, to the elements of all field kinds.'''
+        (field_name, fqn_container) = self._get_field_name(scode_reference)
+        if kind is None:
             code_elements = []
             code_elements.extend(self._get_field_elements(field_name,
                     PREFIX_FIELD_LINKER, self.field_kind))
@@ -929,26 +1101,18 @@ class JavaFieldLinker(gl.DefaultLinker):
                     PREFIX_ENUM_VAL_LINKER, self.enum_value_kind))
             code_elements.extend(self._get_field_elements(field_name,
                     PREFIX_ANN_FIELD_LINKER, self.ann_field_kind))
+            kind = self.field_kind
+        else:
+            code_elements = self._get_field_elements(field_name, prefix, kind)
+        head_key = self._get_decision_key(scode_reference, kind.kind)
 
-            (code_element, potentials) = self.get_code_element(
-                    scode_reference, code_elements, field_name, fqn_container,
-                    log)
-            count += gl.save_link(scode_reference, code_element, potentials,
-                    self)
-
-            if not log.custom_filtered:
-                reclassify_java(code_element, scode_reference)
-
-            progress_monitor.work('Processed field', 1)
-
-        log.close()
-        progress_monitor.done()
-        print('Associated {0} fields'.format(count))
+        return self.get_code_element(scode_reference, code_elements,
+                field_name, fqn_container, log, head_key)
 
     def _get_field_name(self, scode_reference):
         field_name = fqn_container = None
 
-        if scode_reference.snippet != None:
+        if scode_reference.snippet_id is not None:
             parts = scode_reference.content.split(HANDLE_SEPARATOR)
             (field_name, fqn_container) = \
                     self._get_field_name_from_snippet(parts)
@@ -988,7 +1152,7 @@ class JavaFieldLinker(gl.DefaultLinker):
         return code_elements
 
     def get_code_element(self, scode_reference, code_elements, field_name,
-            fqn_container, log):
+            fqn_container, log, head_key=None):
         log.reset_variables()
         return_code_element = None
         if code_elements is None:
@@ -1001,14 +1165,9 @@ class JavaFieldLinker(gl.DefaultLinker):
         #for code_element in code_elements:
             #print(code_element.fqn)
 
-        filter_results = []
-
-        for afilter in self.field_filters:
-            finput = filters.FilterInput(scode_reference, potentials,
-                    field_name, log, fqn_container, None, filter_results)
-            result = afilter.filter(finput)
-            potentials = result.potentials
-            filter_results.append(result)
+        (potentials, filter_results) = self._filter_potentials(
+                self.field_filters, head_key, scode_reference, potentials,
+                field_name, log, fqn_container)
 
         log.custom_filtered = filters.custom_filtered(filter_results)
 
@@ -1029,25 +1188,24 @@ class JavaFieldLinker(gl.DefaultLinker):
 class JavaGenericLinker(gl.DefaultLinker):
     name = 'javageneric'
 
+    batch_size = GENERIC_BATCH_SIZE
+
     def __init__(self, project, prelease, codebase, source, srelease=None,
             filtered_ids=None):
         super(JavaGenericLinker, self).__init__(project, prelease, codebase,
                 source, srelease, filtered_ids)
-        self.unknown_kind = CodeElementKind.objects.get(kind='unknown')
-        self.ann_kind = CodeElementKind.objects.get(kind='annotation')
-        self.class_kind = CodeElementKind.objects.get(kind='class')
-        self.enum_kind = CodeElementKind.objects.get(kind='enumeration')
-        self.method_kind = CodeElementKind.objects.get(kind='method')
-        self.field_kind = CodeElementKind.objects.get(kind='field')
-        self.ann_field_kind =\
-            CodeElementKind.objects.get(kind='annotation field')
-        self.enum_value_kind =\
-            CodeElementKind.objects.get(kind='enumeration value')
-
-        self.class_kinds = set([self.class_kind, self.enum_kind,
-            self.ann_kind])
-        self.field_kinds = set([self.field_kind, self.ann_field_kind,
-            self.enum_value_kind])
+        self.unknown_kind = get_kind('unknown')
+        self.ann_kind = get_kind('annotation')
+        self.class_kind = get_kind('class')
+        self.enum_kind = get_kind('enumeration')
+        self.method_kind = get_kind('method')
+        self.field_kind = get_kind('field')
+        self.ann_field_kind = get_kind('annotation field')
+        self.enum_value_kind = get_kind('enumeration value')
+
+        kinds = get_kinds()
+        self.class_kind_pks = kinds.get_pks(JAVA_TYPE_KINDS)
+        self.field_kind_pks = kinds.get_pks(JAVA_FIELD_KINDS)
 
         self.class_linker = JavaClassLinker(project, prelease, codebase,
                 source, srelease)
@@ -1062,67 +1220,195 @@ class JavaGenericLinker(gl.DefaultLinker):
         ucount = unknown_refs.count()
         progress_monitor.info('Unknown reference count: {0}'.format(ucount))
         try:
-            self._link_all_references(queryset_iterator(unknown_refs), ucount,
-                    progress_monitor)
+            self._link_all_references(
+                    get_reference_iterator(unknown_refs, self.batch_size),
+                    ucount, progress_monitor)
         except Exception:
             logger.exception('Error while processing unknown references.')
         call_gc()
 
     def _link_all_references(self, unknown_refs, ucount, progress_monitor):
-        skipped = 0
-        class_tuples = []
+        '''Links the unknown references in three passes (classes, methods,
+           fields): a reference goes to the next pass if it was not linked
+           in the previous one. Each pass sees all the links saved by the
+           previous pass. Only the references of the current batch are kept
+           in memory: the references left for the next pass are spilled to a
+           temporary file as (pk, simple, fqn).'''
+        method_spill = tempfile.TemporaryFile()
+        field_spill = tempfile.TemporaryFile()
+        try:
+            (count, skipped, mcount) = self._link_class_references(
+                    unknown_refs, ucount, method_spill, progress_monitor)
+            (mlinked, fcount) = self._link_method_references(method_spill,
+                    mcount, field_spill, progress_monitor)
+            count += mlinked
+            count += self._link_field_references(field_spill, fcount,
+                    progress_monitor)
+        finally:
+            method_spill.close()
+            field_spill.close()
 
-        progress_monitor.start('Parsing all unknown refs', ucount)
-        for reference in unknown_refs:
+        progress_monitor.info('Associated {0} elements, Skipped {1} elements'
+                .format(count, skipped))
 
-            if self._reject_reference(reference):
-                progress_monitor.work('Rejected reference.', 1)
-                continue
+    def _get_classified_elements(self, reference, simple):
+        prefix = '{0}{1}'.format(PREFIX_GENERIC_LINKER,
+            cu.get_codebase_key(self.codebase))
+        if reference.source == 'd' or reference.snippet_id is not None:
+            exact = True
+            prefix += EXACT
+        else:
+            exact = False
+            prefix += IEXACT
+        code_elements = cu.get_value(
+                prefix,
+                simple,
+                gl.get_any_code_element,
+                [simple, self.codebase, exact])
+
+        return self._classify_code_elements(code_elements)
+
+    def _read_spill(self, spill):
+        '''Yields batches of (reference, simple, fqn) from a spill file.'''
+        spill.flush()
+        spill.seek(0)
+        for lines in chunks(spill, self.batch_size):
+            rows = [json.loads(line) for line in lines]
+            references = SingleCodeReference.objects.in_bulk(
+                    [row[0] for row in rows])
+            yield [(references[pk], simple, fqn) for (pk, simple, fqn) in rows
+                    if pk in references]
+
+    def _link_class_references(self, unknown_refs, ucount, method_spill,
+            progress_monitor):
+        count = skipped = spilled = 0
+
+        progress_monitor.start('Processing classes', ucount)
+        log = gl.LinkerLog(self, 'generic-' + self.class_kind.kind)
+        try:
+            for reference in unknown_refs:
+
+                if self._reject_reference(reference):
+                    progress_monitor.work('Rejected reference.', 1)
+                    continue
+
+                content = su.safe_strip(reference.content)
+                if content is None or content == '':
+                    progress_monitor.work('Empty {0}'.format(reference.pk), 1)
+                    skipped += 1
+                    continue
+
+                (simple, fqn) = je.clean_java_name(je.get_clean_name(content))
+                (class_elements, method_elements, field_elements) = \
+                        self._get_classified_elements(reference, simple)
+                code_element = None
+                if len(class_elements) > 0:
+                    head_key = self._get_decision_key(reference,
+                            'generic-' + self.class_kind.kind)
+                    (code_element, potentials) = \
+                            self.class_linker.get_code_element(reference,
+                                    class_elements, simple, fqn, log, True,
+                                    head_key)
+                    if code_element is not None:
+                        count += gl.save_link(reference, code_element,
+                                potentials, self)
+
+                if code_element is None and (len(method_elements) > 0 or
+                        len(field_elements) > 0):
+                    write_spill(method_spill, reference, simple, fqn)
+                    spilled += 1
+                progress_monitor.work('Processed a class', 1)
+
+            progress_monitor.done()
+        finally:
+            log.close()
+        progress_monitor.info('Processed classes')
 
-            content = su.safe_strip(reference.content)
-            if content is None or content == '':
-                progress_monitor.work('Empty {0}'.format(reference.pk), 1)
-                skipped += 1
-                continue
+        return (count, skipped, spilled)
 
-            (simple, fqn) = je.clean_java_name(je.get_clean_name(content))
-            prefix = '{0}{1}'.format(PREFIX_GENERIC_LINKER,
-                cu.get_codebase_key(self.codebase))
-            if reference.source == 'd' or reference.snippet is not None:
-                exact = True
-                prefix += EXACT
-            else:
-                exact = False
-                prefix += IEXACT
-            code_elements = cu.get_value(
-                    prefix,
-                    simple,
-                    gl.get_any_code_element,
-                    [simple, self.codebase, exact])
+    def _link_method_references(self, method_spill, mcount, field_spill,
+            progress_monitor):
+        count = spilled = 0
 
-            classified_elements = self._classify_code_elements(code_elements)
-            class_tuples.append((reference, simple, fqn) + classified_elements)
-            progress_monitor.work('Classified reference', 1)
-        progress_monitor.done()
+        progress_monitor.info('Processing {0} methods'.format(mcount))
+        progress_monitor.start('Processing methods', mcount)
+        log = gl.LinkerLog(self, 'generic-' + self.method_kind.kind)
+        try:
+            for batch in self._read_spill(method_spill):
+                for (reference, simple, fqn) in batch:
+                    (_, method_elements, field_elements) = \
+                            self._get_classified_elements(reference, simple)
+                    code_element = None
+                    if len(method_elements) > 0:
+                        fqn_container = je.get_package_name(fqn)
+                        if fqn_container == simple:
+                            fqn_container = None
+                        method_info = MethodInfo(simple, fqn_container, None,
+                                None)
+                        head_key = self._get_decision_key(reference,
+                                'generic-' + self.method_kind.kind)
+                        (code_element, potentials) =\
+                                self.method_linker.get_code_element(reference,
+                                        method_elements, method_info, log,
+                                        head_key)
+                        if code_element is not None:
+                            count += gl.save_link(reference, code_element,
+                                    potentials, self)
+
+                    if code_element is None and len(field_elements) > 0:
+                        write_spill(field_spill, reference, simple, fqn)
+                        spilled += 1
+                    progress_monitor.work('Processed method', 1)
+
+            progress_monitor.done()
+        finally:
+            log.close()
+        progress_monitor.info('Processed methods')
 
-        progress_monitor.info('Classified all refs. Processing now')
-        count = self._process_tuples(class_tuples, progress_monitor)
+        return (count, spilled)
 
-        progress_monitor.info('Associated {0} elements, Skipped {1} elements'
-                .format(count, skipped))
-        progress_monitor.done()
+    def _link_field_references(self, field_spill, fcount, progress_monitor):
+        count = 0
+
+        progress_monitor.info('Processing {0} fields'.format(fcount))
+        progress_monitor.start('Processing fields', fcount)
+        log = gl.LinkerLog(self, 'generic-' + self.field_kind.kind)
+        try:
+            for batch in self._read_spill(field_spill):
+                for (reference, simple, fqn) in batch:
+                    (_, _, field_elements) = \
+                            self._get_classified_elements(reference, simple)
+                    fqn_container = je.get_package_name(fqn)
+                    if fqn_container == simple:
+                        fqn_container = None
+                    head_key = self._get_decision_key(reference,
+                            'generic-' + self.field_kind.kind)
+                    (code_element, potentials) =\
+                            self.field_linker.get_code_element(reference,
+                                    field_elements, simple, fqn_container, log,
+                                    head_key)
+                    if code_element is not None:
+                        count += gl.save_link(reference, code_element,
+                                potentials, self)
+                    progress_monitor.work('Processing fields', 1)
+            progress_monitor.done()
+        finally:
+            log.close()
+        progress_monitor.info('Processed fields')
+
+        return count
 
     def _classify_code_elements(self, code_elements):
         class_code_elements = []
         method_code_elements = []
         field_code_elements = []
         for element in code_elements:
-            kind = element.kind
-            if kind in self.class_kinds:
+            kind_id = element.kind_id
+            if kind_id in self.class_kind_pks:
                 class_code_elements.append(element)
-            elif kind == self.method_kind:
+            elif kind_id == self.method_kind.pk:
                 method_code_elements.append(element)
-            elif kind in self.field_kinds:
+            elif kind_id in self.field_kind_pks:
                 field_code_elements.append(element)
 
         # Debug
@@ -1130,83 +1416,3 @@ class JavaGenericLinker(gl.DefaultLinker):
                 #len(field_code_elements))
 
         return (class_code_elements, method_code_elements, field_code_elements)
-
-    def _process_tuples(self, class_tuples, progress_monitor):
-        method_tuples = []
-        field_tuples = []
-        count = 0
-
-        progress_monitor.info('Processing {0} classes'
-                .format(len(class_tuples)))
-        progress_monitor.start('Processing classes', len(class_tuples))
-        log = gl.LinkerLog(self, 'generic-' + self.class_kind.kind)
-        for (reference, simple, fqn, class_elements, method_elements,
-                field_elements) in class_tuples:
-            if len(class_elements) > 0:
-                (code_element, potentials) = \
-                        self.class_linker.get_code_element(reference,
-                                class_elements, simple, fqn, log, True)
-                if code_element is not None:
-                    count += gl.save_link(reference, code_element,
-                            potentials, self)
-                else:
-                    method_tuples.append((reference, simple, fqn,
-                        method_elements, field_elements))
-            else:
-                method_tuples.append((reference, simple, fqn,
-                    method_elements, field_elements))
-            progress_monitor.work('Processed a class', 1)
-
-        progress_monitor.done()
-        log.close()
-        progress_monitor.info('Processed classes')
-
-        progress_monitor.info('Processing {0} methods'
-                .format(len(method_tuples)))
-        progress_monitor.start('Processing methods', len(method_tuples))
-        log = gl.LinkerLog(self, 'generic-' + self.method_kind.kind)
-        for (reference, simple, fqn, method_elements,
-                field_elements) in method_tuples:
-            if len(method_elements) > 0:
-                fqn_container = je.get_package_name(fqn)
-                if fqn_container == simple:
-                    fqn_container = None
-                method_info = MethodInfo(simple, fqn_container, None, None)
-                (code_element, potentials) =\
-                        self.method_linker.get_code_element(reference,
-                                method_elements, method_info, log)
-                if code_element is not None:
-                    count += gl.save_link(reference, code_element,
-                            potentials, self)
-                else:
-                    field_tuples.append((reference, simple, fqn,
-                        field_elements))
-            else:
-                field_tuples.append((reference, simple, fqn, field_elements))
-            progress_monitor.work('Processed method', 1)
-
-        progress_monitor.done()
-        log.close()
-        progress_monitor.info('Processed methods')
-
-        progress_monitor.info('Processing {0} fields'
-                .format(len(field_tuples)))
-        progress_monitor.start('Processing fields', len(field_tuples))
-        log = gl.LinkerLog(self, 'generic-' + self.field_kind.kind)
-        for (reference, simple, fqn, field_elements) in field_tuples:
-            if len(field_elements) > 0:
-                fqn_container = je.get_package_name(fqn)
-                if fqn_container == simple:
-                    fqn_container = None
-                (code_element, potentials) =\
-                        self.field_linker.get_code_element(reference,
-                                field_elements, simple, fqn_container, log)
-                if code_element is not None:
-                    count += gl.save_link(reference, code_element,
-                            potentials, self)
-            progress_monitor.work('Processing fields', 1)
-        progress_monitor.done()
-        log.close()
-        progress_monitor.info('Processed fields')
-
-        return count
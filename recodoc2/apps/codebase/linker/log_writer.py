@@ -0,0 +1,262 @@
+from __future__ import unicode_literals
+import os
+import json
+import gzip
+import codecs
+import logging
+from collections import OrderedDict
+from threading import Thread
+from Queue import Queue
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+
+LOG_QUEUE_SIZE = getattr(settings, 'LINKER_LOG_QUEUE_SIZE', 10000)
+
+LOG_COMPRESS = getattr(settings, 'LINKER_LOG_COMPRESS', False)
+
+DEBUG_LOG_SIZE = getattr(settings, 'LINKER_DEBUG_LOG_SIZE', 10000)
+
+# Number of records written at once by the writer thread.
+WRITE_BATCH = 500
+
+RECORD_EXTENSION = '.jsonl'
+
+COMPRESSED_EXTENSION = '.jsonl.gz'
+
+TEXT_EXTENSION = '.log'
+
+logger = logging.getLogger("recodoc.codebase.linker.log_writer")
+
+
+def get_record_path(text_path, compress=None):
+    '''Returns the path of the record log corresponding to a text log
+       (linking-*.log).'''
+    if compress is None:
+        compress = LOG_COMPRESS
+    base = text_path
+    if base.endswith(TEXT_EXTENSION):
+        base = base[:-len(TEXT_EXTENSION)]
+    if compress:
+        return base + COMPRESSED_EXTENSION
+    else:
+        return base + RECORD_EXTENSION
+
+
+def find_record_path(text_path):
+    '''Returns the path of the existing record log (compressed or not) of a
+       text log or None.'''
+    for compress in (False, True):
+        path = get_record_path(text_path, compress)
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def open_record_file(path, mode):
+    if path.endswith('.gz'):
+        return gzip.open(path, mode)
+    else:
+        return open(path, mode)
+
+
+def get_element_key(code_element):
+    '''Returns (pk, fqn, signature) of a code element. The linkers extract
+       these fields before queuing an entry, so the writer thread never
+       uses the ORM.'''
+    return (code_element.pk, code_element.fqn, code_element.signature)
+
+
+def get_element_string(element_key):
+    '''Returns the human string of a code element (pk, fqn, signature). The
+       fqn is used for the elements parsed before the signature column
+       existed.'''
+    (_, fqn, signature) = element_key
+    if signature is None:
+        return fqn
+    else:
+        return signature
+
+
+def get_record(entry):
+    '''Returns the record (dict) of a log entry: (fields, code element,
+       potentials, original code elements), where each code element is
+       described by (pk, fqn, signature) (see get_element_key).'''
+    (fields, code_element, potentials, code_elements) = entry
+    record = dict(fields)
+    if code_element is not None:
+        code_element = get_element_string(code_element)
+    record['element'] = code_element
+    record['potentials'] = [get_element_string(potential)
+            for potential in potentials]
+    record['originals'] = [get_element_string(original)
+            for original in code_elements]
+    return record
+
+
+def encode_entry(entry):
+    return (json.dumps(get_record(entry)) + '\n').encode('utf8')
+
+
+class LogWriter(Thread):
+    '''Formats log entries (see get_record) and writes them as JSON lines
+       from a background thread. Entries are handed over through a bounded
+       queue: a producer waits if the writer falls behind by more than
+       queue_size entries. The first error is raised again by close(). The
+       thread is a daemon: the producer must call close() (in a finally
+       block) or the queued entries are lost.'''
+
+    def __init__(self, path, queue_size=LOG_QUEUE_SIZE):
+        Thread.__init__(self)
+        self.daemon = True
+        self.path = path
+        self.queue = Queue(queue_size)
+        self.log_file = open_record_file(path, 'ab')
+        self.error = None
+        self.dropped = 0
+        self.start()
+
+    def write(self, entry):
+        self.queue.put(entry)
+
+    def run(self):
+        done = False
+        while not done:
+            entries = [self.queue.get()]
+            while len(entries) < WRITE_BATCH and not self.queue.empty():
+                entries.append(self.queue.get())
+            if entries[-1] is None:
+                entries.pop()
+                done = True
+            self._write(entries)
+
+    def _write(self, entries):
+        try:
+            self.log_file.write(b''.join(encode_entry(entry)
+                for entry in entries))
+        except Exception:
+            # Retry the entries one by one so that only the faulty ones are
+            # lost.
+            for entry in entries:
+                try:
+                    self.log_file.write(encode_entry(entry))
+                except Exception as error:
+                    logger.exception('Error while writing the linker log {0}'
+                            .format(self.path))
+                    self.dropped += 1
+                    if self.error is None:
+                        self.error = error
+
+    def close(self):
+        self.queue.put(None)
+        self.join()
+        self.log_file.close()
+        if self.error is not None:
+            logger.error('{0} records were not written to {1}'
+                    .format(self.dropped, self.path))
+            raise self.error
+
+
+class DebugLog(object):
+    '''Bounded map of {reference pk: [log entries]}. When more than size
+       references are logged, the oldest references are dropped. Missing
+       references have no entry ([]).'''
+
+    def __init__(self, size=DEBUG_LOG_SIZE):
+        self.size = size
+        self.entries = OrderedDict()
+
+    def append(self, pk, entry):
+        if pk in self.entries:
+            self.entries[pk].append(entry)
+        else:
+            self.entries[pk] = [entry]
+            if len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+
+    def __getitem__(self, pk):
+        return self.entries.get(pk, [])
+
+    def __contains__(self, pk):
+        return pk in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+
+def read_records(path):
+    '''Iterates over the records of a record log.'''
+    with open_record_file(path, 'rb') as log_file:
+        for line in log_file:
+            line = line.strip()
+            if line:
+                yield json.loads(line.decode('utf8'))
+
+
+def get_url(record, urls):
+    key = (record['local_ct'], record['local_pk'])
+    if key not in urls:
+        url = None
+        try:
+            content_type = ContentType.objects.get_for_id(key[0])
+            url = content_type.get_object_for_this_type(pk=key[1]).url
+        except Exception:
+            pass
+        urls[key] = url
+    return urls[key]
+
+
+def format_record(record, url):
+    '''Returns the text (original linker log format) of a record.'''
+    entry = record['entry']
+    lines = []
+    if entry == 'type':
+        lines.append('Type {0} - {1}'.format(record['name'], record['fqn']))
+    elif entry == 'method':
+        lines.append('Method {0} - {1}'.format(record['name'],
+            record['type_params']))
+    else:
+        lines.append('Field {0}.{1}'.format(record['fqn_container'],
+            record['name']))
+    lines.append('  Content: {0}'.format(record['content']))
+    lines.append('  Original Size: {0}'.format(record['original_size']))
+    lines.append('  Final Size: {0}'.format(record['final_size']))
+    lines.append('  URL: {0}'.format(url))
+    lines.append('  Ref pk: {0}'.format(record['ref_pk']))
+    lines.append('  Local pk: {0}'.format(record['local_pk']))
+    lines.append('  Release: {0}'.format(record['release']))
+    lines.append('  Snippet: {0}'.format(record['snippet']))
+    lines.append('  Custom Filtered: {0}'.format(record['custom_filtered']))
+    if record.get('rationale') is not None:
+        lines.append('  Rationale: {0}'.format(record['rationale']))
+    lines.append('  Filtering')
+    if entry == 'type':
+        lines.append('    Strategy {0} {1} {2} {3}'.format(
+            *record['strategy']))
+    for (name, options, activated, size) in record['filters']:
+        lines.append('    {0} {1}: {2} - {3}'.format(name, options,
+            activated, size))
+    if record['element'] is not None:
+        lines.append('  Element: {0}'.format(record['element']))
+    for potential in record['potentials'][1:]:
+        lines.append('  Potential: {0}'.format(potential))
+    for original in record.get('originals', []):
+        lines.append('  Original: {0}'.format(original))
+    return '\n'.join(lines) + '\n\n\n'
+
+
+def convert_log(path, text_path=None):
+    '''Converts a record log to the text format and returns the path of the
+       text log.'''
+    if text_path is None:
+        if path.endswith(COMPRESSED_EXTENSION):
+            text_path = path[:-len(COMPRESSED_EXTENSION)] + TEXT_EXTENSION
+        else:
+            text_path = path[:-len(RECORD_EXTENSION)] + TEXT_EXTENSION
+    urls = {}
+    with codecs.open(text_path, 'w', encoding='utf8') as text_file:
+        for record in read_records(path):
+            text_file.write(format_record(record, get_url(record, urls)))
+    return text_path
@@ -0,0 +1,177 @@
+from __future__ import unicode_literals
+import os
+import json
+import time
+import logging
+import itertools
+from collections import OrderedDict
+from django.conf import settings
+
+TELEMETRY_FIELDS = ['run', 'release', 'linker', 'source', 'kind', 'position',
+        'filter', 'calls', 'memoized', 'activations', 'candidates_in',
+        'candidates_out', 'wall', 'cpu']
+
+logger = logging.getLogger("recodoc.codebase.linker.telemetry")
+
+# Distinguishes the runs started in the same second by the same process.
+RUN_SEQUENCE = itertools.count()
+
+
+def get_run_id():
+    return '{0}-{1}-{2}'.format(time.strftime('%Y-%m-%dT%H:%M:%S'),
+            os.getpid(), next(RUN_SEQUENCE))
+
+
+def get_telemetry_path(pname, release, linker_name, source):
+    return os.path.join(settings.PROJECT_FS_ROOT, pname,
+            'telemetry-{0}-{1}-{2}.jsonl'.format(release, linker_name,
+                source))
+
+
+class FilterStats(object):
+
+    def __init__(self):
+        self.calls = 0
+        self.memoized = 0
+        self.activations = 0
+        self.candidates_in = 0
+        self.candidates_out = 0
+        self.wall = 0.0
+        self.cpu = 0.0
+
+
+class FilterTelemetry(object):
+    '''Records, for each filter of each filter chain of a linker, the number
+       of calls and activations, the number of candidates before and after the
+       filter, and the cumulative wall and CPU time. The filters whose result
+       was memoized are counted separately (memoized) and are not part of
+       the other statistics.'''
+
+    def __init__(self, linker):
+        self.linker = linker
+        self.run = get_run_id()
+        # {(kind, position, filter name): FilterStats}
+        self.stats = OrderedDict()
+
+    def start(self):
+        return (time.time(), time.clock())
+
+    def _get_stats(self, kind, position, name):
+        key = (kind, position, name)
+        stats = self.stats.get(key)
+        if stats is None:
+            stats = self.stats[key] = FilterStats()
+        return stats
+
+    def record(self, kind, position, result, size_in, start):
+        (wall_start, cpu_start) = start
+        stats = self._get_stats(kind, position, result.name)
+        stats.calls += 1
+        if result.activated:
+            stats.activations += 1
+        stats.candidates_in += size_in
+        if result.potentials is not None:
+            stats.candidates_out += len(result.potentials)
+        stats.wall += time.time() - wall_start
+        stats.cpu += time.clock() - cpu_start
+
+    def record_memoized(self, kind, filter_results):
+        '''Records the filters at the head of a chain whose results were
+           reused instead of being computed.'''
+        for (position, result) in enumerate(filter_results):
+            self._get_stats(kind, position, result.name).memoized += 1
+
+    def get_release(self):
+        if self.linker.prelease is None:
+            return None
+        else:
+            return self.linker.prelease.release
+
+    def get_records(self):
+        linker = self.linker
+        release = self.get_release()
+        records = []
+        for ((kind, position, name), stats) in self.stats.iteritems():
+            records.append(OrderedDict([('run', self.run),
+                ('release', release), ('linker', linker.name),
+                ('source', linker.source), ('kind', kind),
+                ('position', position), ('filter', name),
+                ('calls', stats.calls), ('memoized', stats.memoized),
+                ('activations', stats.activations),
+                ('candidates_in', stats.candidates_in),
+                ('candidates_out', stats.candidates_out),
+                ('wall', stats.wall), ('cpu', stats.cpu)]))
+        return records
+
+    def save(self):
+        '''Appends the records of this run to the telemetry file of the
+           linker and returns its path.'''
+        if len(self.stats) == 0:
+            return None
+        linker = self.linker
+        path = get_telemetry_path(linker.project.dir_name,
+                self.get_release(), linker.name, linker.source)
+        with open(path, 'a') as telemetry_file:
+            for record in self.get_records():
+                telemetry_file.write(json.dumps(record) + '\n')
+        logger.info('Saved filter telemetry to {0}'.format(path))
+        return path
+
+
+def read_telemetry(path, last_run=True):
+    '''Returns the records of a telemetry file. If last_run is True, only the
+       records of the most recent run (the last one appended) are
+       returned.'''
+    records = []
+    with open(path) as telemetry_file:
+        for line in telemetry_file:
+            line = line.strip()
+            if line:
+                records.append(json.loads(line))
+    if last_run and len(records) > 0:
+        run = records[-1]['run']
+        records = [record for record in records if record['run'] == run]
+    return records
+
+
+def summarize(records):
+    '''Aggregates the records by (kind, position, filter) and computes the
+       activation ratio and the fraction of candidates removed by each
+       filter.'''
+    summary = OrderedDict()
+    for record in records:
+        key = (record['kind'], record['position'], record['filter'])
+        if key not in summary:
+            summary[key] = dict((field, 0) for field in TELEMETRY_FIELDS[7:])
+            summary[key].update(kind=key[0], position=key[1], filter=key[2])
+        for field in TELEMETRY_FIELDS[7:]:
+            # Files written before memoized was recorded do not have it.
+            summary[key][field] += record.get(field, 0)
+
+    entries = summary.values()
+    for entry in entries:
+        calls = entry['calls']
+        candidates_in = entry['candidates_in']
+        entry['activation_ratio'] = float(entry['activations']) / calls \
+                if calls > 0 else 0.0
+        entry['reduction'] = \
+                float(candidates_in - entry['candidates_out']) / \
+                candidates_in if candidates_in > 0 else 0.0
+    return entries
+
+
+def report(entries, top=10):
+    '''Prints the hottest filters (by CPU time) and the least effective ones
+       (by activation ratio).'''
+    line = '  {kind:<20} {position:>3} {filter:<45} calls={calls:<8} '\
+            'memo={memoized:<8} act={activation_ratio:.3f} '\
+            'red={reduction:.3f} wall={wall:.2f}s cpu={cpu:.2f}s'
+
+    print('Hottest filters:')
+    for entry in sorted(entries, key=lambda e: e['cpu'], reverse=True)[:top]:
+        print(line.format(**entry))
+
+    print('Least effective filters:')
+    for entry in sorted(entries,
+            key=lambda e: (e['activation_ratio'], -e['cpu']))[:top]:
+        print(line.format(**entry))
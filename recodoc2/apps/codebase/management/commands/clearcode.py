@@ -18,6 +18,9 @@ class Command(NoArgsCommand):
         make_option('--parser', action='store', dest='parser',
             default='-1', help='Parser used to create the code elements '
             '(optional)'),
+        make_option('--chunk-size', action='store', dest='chunk_size',
+            type='int', default=None, help='Number of rows deleted per '
+            'transaction (optional, default: one transaction)'),
 
     )
     help = "Clear a codebase"
@@ -28,4 +31,5 @@ class Command(NoArgsCommand):
         bname = smart_decode(options.get('bname'))
         release = smart_decode(options.get('release'))
         parser = smart_decode(options.get('parser'))
-        clear_code_elements(pname, bname, release, parser)
+        chunk_size = options.get('chunk_size')
+        clear_code_elements(pname, bname, release, parser, chunk_size)
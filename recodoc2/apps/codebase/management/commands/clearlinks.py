@@ -15,6 +15,9 @@ class Command(NoArgsCommand):
             default='-1', help='Project Release'),
         make_option('--source', action='store', dest='source',
             default='-1', help='Source of code references (optional)'),
+        make_option('--chunk-size', action='store', dest='chunk_size',
+            type='int', default=None, help='Number of rows deleted per '
+            'transaction (optional, default: one transaction)'),
 
     )
     help = "Clear links"
@@ -24,4 +27,5 @@ class Command(NoArgsCommand):
         pname = smart_decode(options.get('pname'))
         release = smart_decode(options.get('release'))
         source = smart_decode(options.get('source'))
-        clear_links(pname, release, source)
+        chunk_size = options.get('chunk_size')
+        clear_links(pname, release, source, chunk_size)
@@ -15,6 +15,9 @@ class Command(NoArgsCommand):
             default='j', help='Language of the snippets to delete.'),
         make_option('--source', action='store', dest='source',
             default='d', help='Source of snippets (s or d)'),
+        make_option('--chunk-size', action='store', dest='chunk_size',
+            type='int', default=None, help='Number of rows deleted per '
+            'transaction (optional, default: one transaction)'),
 
     )
     help = "Delete single references parsed from snippets"
@@ -24,4 +27,5 @@ class Command(NoArgsCommand):
         pname = smart_decode(options.get('pname'))
         language = smart_decode(options.get('language'))
         source = smart_decode(options.get('source'))
-        clear_snippets(pname, language, source)
+        chunk_size = options.get('chunk_size')
+        clear_snippets(pname, language, source, chunk_size)
@@ -0,0 +1,22 @@
+from __future__ import unicode_literals
+import os
+from optparse import make_option
+from django.conf import settings
+from django.core.management.base import NoArgsCommand
+
+from docutil.commands_util import recocommand
+from docutil.str_util import smart_decode
+from codebase.actions import convert_logs
+
+
+class Command(NoArgsCommand):
+    option_list = NoArgsCommand.option_list + (
+        make_option('--pname', action='store', dest='pname',
+            default='-1', help='Project unix name'),
+    )
+    help = "Convert the linker logs of a project to the text format"
+
+    @recocommand
+    def handle_noargs(self, **options):
+        pname = smart_decode(options.get('pname'))
+        convert_logs(os.path.join(settings.PROJECT_FS_ROOT, pname))
@@ -0,0 +1,26 @@
+from __future__ import unicode_literals
+from optparse import make_option
+from django.core.management.base import NoArgsCommand
+
+from docutil.commands_util import recocommand
+from docutil.str_util import smart_decode
+from codebase.actions import fill_overloads
+
+
+class Command(NoArgsCommand):
+    option_list = NoArgsCommand.option_list + (
+        make_option('--pname', action='store', dest='pname',
+            default='-1', help='Project unix name'),
+        make_option('--bname', action='store', dest='bname',
+            default='-1', help='Code Base name'),
+        make_option('--release', action='store', dest='release',
+            default='-1', help='Project Release'),
+    )
+    help = "Compute the overloads of an existing code base"
+
+    @recocommand
+    def handle_noargs(self, **options):
+        pname = smart_decode(options.get('pname'))
+        bname = smart_decode(options.get('bname'))
+        release = smart_decode(options.get('release'))
+        fill_overloads(pname, bname, release)
@@ -0,0 +1,35 @@
+from __future__ import unicode_literals
+from optparse import make_option
+from django.core.management.base import NoArgsCommand
+
+from docutil.commands_util import recocommand
+from docutil.str_util import smart_decode
+from codebase.actions import filter_stats
+
+
+class Command(NoArgsCommand):
+    option_list = NoArgsCommand.option_list + (
+        make_option('--pname', action='store', dest='pname',
+            default='-1', help='Project unix name'),
+        make_option('--release', action='store', dest='release',
+            default='-1', help='Project Release'),
+        make_option('--linker', action='store', dest='linker',
+            default='-1', help='Linker name'),
+        make_option('--source', action='store', dest='source',
+            default='-1', help='Source of code references'),
+        make_option('--all', action='store_true', dest='all',
+            default=False, help='Aggregate all runs (default: last run)'),
+        make_option('--top', action='store', dest='top',
+            default='10', help='Number of filters to report'),
+    )
+    help = "Report the hottest and least effective filters of a linker"
+
+    @recocommand
+    def handle_noargs(self, **options):
+        pname = smart_decode(options.get('pname'))
+        release = smart_decode(options.get('release'))
+        linker = smart_decode(options.get('linker'))
+        source = smart_decode(options.get('source'))
+        all_runs = options.get('all', False)
+        top = int(options.get('top'))
+        filter_stats(pname, release, linker, source, all_runs, top)
@@ -105,6 +105,13 @@ class CodeElementFilter(models.Model):
         return self.fqn
 
 
+def get_method_signature(fqn, parameter_types):
+    '''Returns the human readable signature of a method, e.g.,
+       p.Foo.bar(int, String, ).'''
+    return fqn + '(' + ''.join(parameter_type + ', '
+            for parameter_type in parameter_types) + ')'
+
+
 class CodeElement(models.Model):
     '''A code element.'''
 
@@ -137,6 +144,22 @@ class CodeElement(models.Model):
             symmetrical=False)
     '''List of containers (e.g., when an element contains members)'''
 
+    container = models.ForeignKey('self', related_name='primary_containees',
+            null=True, blank=True)
+    '''First container (containers.all()[0]). Denormalized so that the
+       linkers can find the container of an element without a query.'''
+
+    signature = models.CharField(max_length=2000, null=True, blank=True,
+            db_index=True)
+    '''Human readable signature (see human_string), e.g., the fqn and the
+       parameter types of a method. Computed by the parsers so that code
+       elements can be displayed and compared without a query.'''
+
+    package = models.ForeignKey('self', related_name='package_elements',
+            null=True, blank=True)
+    '''Package that transitively contains the element. Null for packages
+       and for elements that are not in a package.'''
+
     type_containers = models.ManyToManyField('self',
             related_name='type_containees', symmetrical=False)
     '''List of type containers (e.g., when an element contains another
@@ -167,6 +190,9 @@ class CodeElement(models.Model):
         return ParameterElement.objects.filter(attcontainer=self).all()
 
     def human_string(self):
+        if self.signature is not None:
+            return self.signature
+
         human_string = self.fqn
         if self.kind is None:
             return human_string
@@ -184,11 +210,9 @@ class CodeElement(models.Model):
         if self.kind.kind == 'method':
             #clazz = self.containers.all()[0].simple_name
             #count = self.attributes.count()
-            human_string = self.fqn + '('
-            for attribute in self.attributes.all():
-                human_string += attribute.parameterelement.type_simple_name \
-                        + ', '
-            human_string += ')'
+            human_string = get_method_signature(self.fqn,
+                    [attribute.parameterelement.type_simple_name
+                        for attribute in self.attributes.all()])
         #if self.kind.kind in \
                 #{'field', 'enumeration value', 'annotation field'}:
             #human_string = self.fieldelement.type_simple_name
@@ -268,6 +292,33 @@ class MethodFamily(CodeElement):
     '''att.'''
 
 
+class CodeElementOverload(models.Model):
+    '''A code element of a codebase keyed by its fully qualified name, kind
+       and signature: the materialized overload index (see
+       codebase.overloads). Computed when the codebase is parsed.'''
+
+    codebase = models.ForeignKey(CodeBase, related_name='overloads')
+    '''att.'''
+
+    fqn = models.CharField(max_length=500, null=True, blank=True,
+            db_index=True)
+    '''att.'''
+
+    kind = models.ForeignKey(CodeElementKind, null=True, blank=True)
+    '''att.'''
+
+    code_element = models.ForeignKey(CodeElement,
+            related_name='overload_keys')
+    '''att.'''
+
+    signature = models.CharField(max_length=2000, null=True, blank=True)
+    '''Human readable signature of the code element (see
+       CodeElement.human_string)'''
+
+    def __unicode__(self):
+        return self.signature
+
+
 ### CODE-LIKE TERMS ###
 
 class CodeSnippet(SourceElement):
@@ -600,6 +651,36 @@ class CodeElementLink(models.Model):
         ordering = ['index']
 
 
+class LinkCoverage(models.Model):
+    '''Code elements of a codebase that are linked (first link) from the
+       references of a resource. Computed on demand and deleted when the
+       links of the resource change.'''
+
+    codebase = models.ForeignKey(CodeBase, related_name='link_coverages')
+    '''att.'''
+
+    source = models.CharField(max_length=1, choices=SOURCE_TYPE,
+            default='d')
+    '''Type of resource (doc or channel)'''
+
+    resource_object_id = models.PositiveIntegerField()
+    '''att.'''
+
+    element_ids = models.TextField(blank=True, default='')
+    '''Sorted ids of the covered elements, encoded as comma-separated
+       deltas.'''
+
+    size = models.IntegerField(default=0)
+    '''Number of covered elements.'''
+
+    def __unicode__(self):
+        return '{0} - {1} {2} ({3})'.format(self.codebase, self.source,
+                self.resource_object_id, self.size)
+
+    class Meta:
+        unique_together = (('codebase', 'source', 'resource_object_id'),)
+
+
 ### Transient Classes ###
 
 class MethodInfo(object):
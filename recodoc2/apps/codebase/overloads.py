@@ -0,0 +1,182 @@
+from __future__ import unicode_literals
+import logging
+from collections import OrderedDict, defaultdict
+from django.db.models import Count
+from docutil.db_util import chunks, bulk_insert, bulk_delete
+from codebase.kinds import get_kind
+from codebase.models import CodeElement, CodeElementOverload,\
+        ParameterElement, get_method_signature
+
+logger = logging.getLogger("recodoc.codebase.overloads")
+
+# {codebase_id: OverloadIndex}
+codebase_overloads = {}
+
+# {codebase_id: True if the signatures of all the elements are filled}
+codebase_signatures = {}
+
+
+def get_method_signatures(method_fqns):
+    '''Returns {pk: signature} of the methods {pk: fqn}. The parameters are
+       loaded in one query per chunk of methods.'''
+    parameter_types = defaultdict(list)
+    for chunk in chunks(method_fqns.keys()):
+        parameters = ParameterElement.objects.filter(attcontainer__in=chunk).\
+                order_by('attcontainer', 'index').\
+                values_list('attcontainer_id', 'type_simple_name')
+        for (method_id, type_simple_name) in parameters:
+            parameter_types[method_id].append(type_simple_name)
+    return dict((pk, get_method_signature(fqn, parameter_types[pk]))
+            for (pk, fqn) in method_fqns.iteritems())
+
+
+def get_element_keys(code_elements):
+    '''Returns {pk: (fqn, kind_id, signature)} for the code elements. The
+       signatures of the methods parsed before the signature column existed
+       are computed from their parameters (see get_method_signatures).'''
+    method_kind_id = get_kind('method').pk
+    keys = OrderedDict()
+    method_fqns = {}
+    rows = code_elements.values_list('pk', 'fqn', 'kind_id', 'signature')
+    for (pk, fqn, kind_id, signature) in rows.iterator():
+        if signature is None:
+            if kind_id == method_kind_id:
+                method_fqns[pk] = fqn
+            else:
+                signature = fqn
+        keys[pk] = (fqn, kind_id, signature)
+
+    if len(method_fqns) > 0:
+        for (pk, signature) in \
+                get_method_signatures(method_fqns).iteritems():
+            (fqn, kind_id, _) = keys[pk]
+            keys[pk] = (fqn, kind_id, signature)
+    return keys
+
+
+class OverloadIndex(object):
+    '''Index of the code elements of a codebase by (fqn, kind) and by
+       (fqn, kind, signature). Elements are kept in the default order of the
+       code elements (index).'''
+
+    def __init__(self, keys):
+        # {fqn: [(pk, kind_id, signature)]}
+        self.fqns = defaultdict(list)
+        # {(fqn, kind_id, signature): pk}
+        self.signatures = {}
+        for (pk, (fqn, kind_id, signature)) in keys.iteritems():
+            self.fqns[fqn].append((pk, kind_id, signature))
+            self.signatures.setdefault((fqn, kind_id, signature), pk)
+
+    def _get_elements(self, fqn, kind_id):
+        elements = self.fqns.get(fqn, [])
+        if kind_id is None:
+            return elements
+        else:
+            return [element for element in elements if element[1] == kind_id]
+
+    def get_ids(self, fqn, kind_id=None):
+        '''Returns the ids of the elements named fqn (of kind_id if it is not
+           None).'''
+        return [pk for (pk, _, _) in self._get_elements(fqn, kind_id)]
+
+    def get_signatures(self, fqn, kind_id):
+        return [signature for (_, _, signature) in
+                self._get_elements(fqn, kind_id)]
+
+    def count(self, fqn, kind_id=None):
+        return len(self._get_elements(fqn, kind_id))
+
+    def find(self, fqn, kind_id, signature):
+        '''Returns the id of the element with this fqn, kind and signature or
+           None.'''
+        return self.signatures.get((fqn, kind_id, signature))
+
+
+def get_overload_keys(codebase_id):
+    '''Returns {pk: (fqn, kind_id, signature)} of the code elements of a
+       codebase from the CodeElementOverload rows, or None if the overloads
+       of the codebase were not computed.'''
+    rows = CodeElementOverload.objects.filter(codebase=codebase_id).\
+            order_by('pk').values_list('code_element_id', 'fqn', 'kind_id',
+                    'signature')
+    keys = OrderedDict((pk, (fqn, kind_id, signature)) for (pk, fqn,
+        kind_id, signature) in rows.iterator())
+    if len(keys) == 0:
+        return None
+    else:
+        return keys
+
+
+def get_overload_index(codebase_id):
+    '''Returns the overload index of a codebase. The index is loaded from
+       the CodeElementOverload rows (or built from the code elements if
+       they were not computed) and kept until invalidate_overloads is called
+       for the codebase.'''
+    index = codebase_overloads.get(codebase_id)
+    if index is None:
+        keys = get_overload_keys(codebase_id)
+        if keys is None:
+            keys = get_element_keys(
+                    CodeElement.objects.filter(codebase=codebase_id))
+        index = OverloadIndex(keys)
+        codebase_overloads[codebase_id] = index
+    return index
+
+
+def has_signatures(codebase_id):
+    '''Returns True if the signature column of all the code elements of a
+       codebase is filled (i.e., the codebase was parsed or backfilled after
+       the column existed).'''
+    filled = codebase_signatures.get(codebase_id)
+    if filled is None:
+        filled = not CodeElement.objects.filter(codebase=codebase_id).\
+                filter(signature__isnull=True).exists()
+        codebase_signatures[codebase_id] = filled
+    return filled
+
+
+def invalidate_overloads(codebase_id=None):
+    '''Discards the overload index and the signature flag of a codebase
+       whose code elements changed. None matches any codebase.'''
+    if codebase_id is None:
+        codebase_overloads.clear()
+        codebase_signatures.clear()
+    else:
+        codebase_overloads.pop(codebase_id, None)
+        codebase_signatures.pop(codebase_id, None)
+
+
+def compute_overloads(codebase):
+    '''(Re)computes the CodeElementOverload rows of a codebase: one row per
+       code element, in the default order of the code elements.'''
+    bulk_delete(CodeElementOverload.objects.filter(codebase=codebase))
+    keys = get_element_keys(CodeElement.objects.filter(codebase=codebase))
+    count = bulk_insert(CodeElementOverload,
+            ['codebase_id', 'code_element_id', 'fqn', 'kind_id',
+                'signature'],
+            ((codebase.pk, pk, fqn, kind_id, signature) for (pk, (fqn,
+                kind_id, signature)) in keys.iteritems()))
+    invalidate_overloads(codebase.pk)
+    logger.info('Computed {0} overloads for {1}'.format(count, codebase))
+    return count
+
+
+def get_overload_counts(codebase, fqns):
+    '''Returns {fqn: number of code elements named fqn (all kinds)} for the
+       fqns found in the codebase.'''
+    counts = defaultdict(int)
+    if not CodeElementOverload.objects.filter(codebase=codebase).exists():
+        # Codebase parsed before the overloads were computed.
+        index = get_overload_index(codebase.pk)
+        for fqn in fqns:
+            counts[fqn] = index.count(fqn)
+        return counts
+
+    for chunk in chunks(list(set(fqns))):
+        rows = CodeElementOverload.objects.filter(codebase=codebase).\
+                filter(fqn__in=chunk).values('fqn').\
+                annotate(count=Count('pk')).order_by()
+        for row in rows:
+            counts[row['fqn']] += row['count']
+    return counts
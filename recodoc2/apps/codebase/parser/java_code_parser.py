@@ -8,8 +8,9 @@ from traceback import print_exc
 from django.db import connection
 from py4j.java_gateway import JavaGateway
 from py4j.protocol import Py4JJavaError
-from codebase.models import CodeElementKind, CodeElement, MethodElement,\
-        ParameterElement, FieldElement
+from codebase.kinds import get_kind
+from codebase.models import CodeElement, MethodElement, ParameterElement,\
+        FieldElement, get_method_signature
 from docutil.progress_monitor import NullProgressMonitor
 from codeutil.java_element import clean_java_name
 
@@ -18,6 +19,15 @@ PARSER_WORKER = 4
 HIERARCHY_WORKER = 2
 
 
+def get_package_id(container_code_element):
+    '''Returns the package of a type declared in container_code_element
+       (a package or an enclosing type).'''
+    if container_code_element.package_id is not None:
+        return container_code_element.package_id
+    else:
+        return container_code_element.pk
+
+
 class HierarchyWorker(Thread):
     '''Worker that adds parents to code elements.'''
 
@@ -85,17 +95,14 @@ class CUWorker(Thread):
         self.gateway = gateway
         self.progress_monitor = progress_monitor
 
-        self.class_kind = CodeElementKind.objects.get(kind='class')
-        self.annotation_kind = CodeElementKind.objects.get(kind='annotation')
-        self.enumeration_kind = CodeElementKind.objects.get(kind='enumeration')
-        self.field_kind = CodeElementKind.objects.get(kind='field')
-        self.method_kind = CodeElementKind.objects.get(kind='method')
-        self.method_parameter_kind = CodeElementKind.objects.get(
-                kind='method parameter')
-        self.annotation_field_kind = CodeElementKind.objects.get(
-                kind='annotation field')
-        self.enumeration_value_kind = CodeElementKind.objects.get(
-                kind='enumeration value')
+        self.class_kind = get_kind('class')
+        self.annotation_kind = get_kind('annotation')
+        self.enumeration_kind = get_kind('enumeration')
+        self.field_kind = get_kind('field')
+        self.method_kind = get_kind('method')
+        self.method_parameter_kind = get_kind('method parameter')
+        self.annotation_field_kind = get_kind('annotation field')
+        self.enumeration_value_kind = get_kind('enumeration value')
 
         self.ASTParser = self.gateway.jvm.org.eclipse.jdt.core.dom.ASTParser
         self.JLS3 = self.gateway.jvm.org.eclipse.jdt.core.dom.AST.JLS3
@@ -159,6 +166,7 @@ class CUWorker(Thread):
         type_code_element = CodeElement(codebase=self.codebase,
                 simple_name=simple_name,
                 fqn=fqn,
+                signature=fqn,
                 eclipse_handle=java_element.getHandleIdentifier(),
                 parser=JAVA_PARSER,
                 deprecated=deprecated,
@@ -171,6 +179,8 @@ class CUWorker(Thread):
             type_code_element.kind = self.enumeration_kind
         else:
             type_code_element.kind = self.class_kind
+        type_code_element.container = container_code_element
+        type_code_element.package_id = get_package_id(container_code_element)
         type_code_element.save()
         type_code_element.containers.add(container_code_element)
 
@@ -231,6 +241,8 @@ class CUWorker(Thread):
         except Py4JJavaError:
             parameter_names = ["arg" for param in parameters]
         params_length = len(parameters)
+        parameter_types = [clean_java_name(parameter.getQualifiedName())
+                for parameter in parameters]
         (return_simple_name, return_fqn) = clean_java_name(
                 method_binding.getReturnType().getQualifiedName())
         deprecated = method_binding.isDeprecated()
@@ -243,6 +255,8 @@ class CUWorker(Thread):
         method_code_element = MethodElement(codebase=self.codebase,
                 kind=self.method_kind, simple_name=simple_name,
                 fqn=fqn,
+                signature=get_method_signature(fqn,
+                    [parameter_type[0] for parameter_type in parameter_types]),
                 parameters_length=params_length,
                 eclipse_handle=java_element.getHandleIdentifier(),
                 return_simple_name=return_simple_name,
@@ -252,13 +266,13 @@ class CUWorker(Thread):
                 abstract=abstract)
 
         # method container
+        method_code_element.container = container_code_element
+        method_code_element.package_id = container_code_element.package_id
         method_code_element.save()
         method_code_element.containers.add(container_code_element)
 
         # parse parameters
-        for i, parameter in enumerate(parameters):
-            (type_simple_name, type_fqn) = clean_java_name(
-                    parameter.getQualifiedName())
+        for i, (type_simple_name, type_fqn) in enumerate(parameter_types):
 
             parameter_name = parameter_names[i]
             if parameter_name.startswith('arg'):
@@ -270,10 +284,12 @@ class CUWorker(Thread):
                     kind=self.method_parameter_kind,
                     simple_name=simple_name,
                     fqn=fqn,
+                    signature=fqn,
                     type_simple_name=type_simple_name,
                     type_fqn=type_fqn,
                     index=i,
                     attcontainer=method_code_element,
+                    package_id=method_code_element.package_id,
                     parser=JAVA_PARSER)
             parameter_code_element.save()
 
@@ -300,10 +316,13 @@ class CUWorker(Thread):
                     kind=self.field_kind,
                     simple_name=simple_name,
                     fqn=fqn,
+                    signature=fqn,
                     eclipse_handle=java_element.getHandleIdentifier(),
                     type_simple_name=type_simple_name,
                     type_fqn=type_fqn,
                     parser=JAVA_PARSER)
+            field_code_element.container = container_code_element
+            field_code_element.package_id = container_code_element.package_id
             field_code_element.save()
             field_code_element.containers.add(container_code_element)
 
@@ -321,10 +340,13 @@ class CUWorker(Thread):
                     kind=self.enumeration_value_kind,
                     simple_name=simple_name,
                     fqn=fqn,
+                    signature=fqn,
                     eclipse_handle=java_element.getHandleIdentifier(),
                     type_simple_name=type_simple_name,
                     type_fqn=type_fqn,
                     parser=JAVA_PARSER)
+            field_code_element.container = container_code_element
+            field_code_element.package_id = container_code_element.package_id
             field_code_element.save()
             field_code_element.containers.add(container_code_element)
 
@@ -342,11 +364,14 @@ class CUWorker(Thread):
                     kind=self.annotation_field_kind,
                     simple_name=simple_name,
                     fqn=fqn,
+                    signature=fqn,
                     eclipse_handle=java_element.getHandleIdentifier(),
                     type_simple_name=type_simple_name,
                     type_fqn=type_fqn,
                     attcontainer=container_code_element,
                     parser=JAVA_PARSER)
+            field_code_element.container = container_code_element
+            field_code_element.package_id = container_code_element.package_id
             field_code_element.save()
             field_code_element.containers.add(container_code_element)
 
@@ -373,7 +398,7 @@ class JavaParser(object):
         self.codebase = codebase
         self.queue = Queue()
 
-        self.package_kind = CodeElementKind.objects.get(kind='package')
+        self.package_kind = get_kind('package')
 
         if opt_input is None or opt_input.strip() == '' or opt_input == '-1':
             self.proot_name = None
@@ -421,6 +446,7 @@ class JavaParser(object):
                     continue
                 package_code_element = CodeElement(codebase=self.codebase,
                         simple_name=package_name, fqn=package_name,
+                        signature=package_name,
                         eclipse_handle=package.getHandleIdentifier(),
                         kind=self.package_kind, parser=JAVA_PARSER)
                 package_code_element.save()
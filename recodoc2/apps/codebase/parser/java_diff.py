@@ -1,193 +1,224 @@
 from __future__ import unicode_literals
-
+from collections import defaultdict
+from django.db import transaction
+from docutil.db_util import bulk_insert
+from codebase.kinds import get_kinds
 from codebase.models import CodeBaseDiff, CodeElement
+from codebase.overloads import get_method_signatures
+
+# (kind, removed field, added field) of the members compared in each type.
+MEMBER_DIFFS = (
+    ('method', 'removed_methods', 'added_methods'),
+    ('field', 'removed_fields', 'added_fields'),
+    ('enumeration value', 'removed_enum_values', 'added_enum_values'),
+    ('annotation field', 'removed_ann_fields', 'added_ann_fields'),
+)
+
+# (kind, size field) of the elements counted in each codebase.
+SIZE_FIELDS = (
+    ('package', 'packages_size'),
+    ('method', 'methods_size'),
+    ('field', 'fields_size'),
+    ('enumeration value', 'enum_values_size'),
+    ('annotation field', 'ann_fields_size'),
+)
+
+
+class CodeBaseSignatures(object):
+    '''Packages, types and members of a codebase loaded with one projection
+       query per kind. Each element is described by (kind id, fqn,
+       signature, deprecated), where signature is the human string of the
+       element.'''
+
+    def __init__(self, codebase):
+        kinds = get_kinds()
+        self.package_kind_id = kinds.get('package').pk
+        self.method_kind_id = kinds.get('method').pk
+        self.type_kind_ids = kinds.type_pks
+        self.member_kind_ids = kinds.get_pks(kind for (kind, _, _) in
+                MEMBER_DIFFS)
+        # {pk: (kind_id, fqn, signature, deprecated)}
+        self.elements = {}
+        # {kind_id: [pk]}
+        self.by_kind = defaultdict(list)
+
+        # {pk: fqn} of the methods parsed before the signature column
+        # existed.
+        method_fqns = {}
+        kind_ids = set([self.package_kind_id]) | self.type_kind_ids | \
+                self.member_kind_ids
+        for kind_id in kind_ids:
+            rows = CodeElement.objects.filter(codebase=codebase).\
+                    filter(kind=kind_id).\
+                    values_list('pk', 'fqn', 'signature', 'deprecated')
+            for (pk, fqn, signature, deprecated) in rows.iterator():
+                if signature is None:
+                    if kind_id == self.method_kind_id:
+                        method_fqns[pk] = fqn
+                    else:
+                        signature = fqn
+                self.elements[pk] = (kind_id, fqn, signature, deprecated)
+                self.by_kind[kind_id].append(pk)
+
+        if len(method_fqns) > 0:
+            for (pk, signature) in \
+                    get_method_signatures(method_fqns).iteritems():
+                (kind_id, fqn, _, deprecated) = self.elements[pk]
+                self.elements[pk] = (kind_id, fqn, signature, deprecated)
+
+        # {pk: [container pk]}
+        self.containers = defaultdict(list)
+        through = CodeElement.containers.through
+        pairs = through.objects.\
+                filter(from_codeelement__codebase=codebase).\
+                values_list('from_codeelement_id', 'to_codeelement_id')
+        for (element_id, container_id) in pairs.iterator():
+            self.containers[element_id].append(container_id)
+
+    def count(self, kind_ids, deprecated=False):
+        return sum(1 for kind_id in kind_ids for pk in self.by_kind[kind_id]
+                if not deprecated or self.elements[pk][3])
+
+    def is_deprecated(self, pk):
+        return self.elements[pk][3]
+
+    def get_packages(self):
+        '''Returns {fqn: pk} of the packages.'''
+        return dict((self.elements[pk][1], pk) for pk in
+                self.by_kind[self.package_kind_id])
+
+    def get_types(self, package_ids):
+        '''Returns {fqn: pk} of the types declared in the packages.'''
+        types = {}
+        for kind_id in self.type_kind_ids:
+            for pk in self.by_kind[kind_id]:
+                if any(container_id in package_ids for container_id in
+                        self.containers.get(pk, [])):
+                    types[self.elements[pk][1]] = pk
+        return types
+
+    def get_members(self, kind_id, type_ids, deprecated=False):
+        '''Returns {(kind id, type fqn, signature): pk} of the members of the
+           types.'''
+        members = {}
+        for pk in self.by_kind[kind_id]:
+            (_, _, signature, is_deprecated) = self.elements[pk]
+            if deprecated and not is_deprecated:
+                continue
+            for container_id in self.containers.get(pk, []):
+                if container_id in type_ids:
+                    type_fqn = self.elements[container_id][1]
+                    members[(kind_id, type_fqn, signature)] = pk
+        return members
+
+
+def diff_keys(from_keys, to_keys):
+    '''Returns (removed pks, added pks) of two {key: pk} maps.'''
+    removed = set(from_keys[key] for key in
+            set(from_keys).difference(to_keys))
+    added = set(to_keys[key] for key in set(to_keys).difference(from_keys))
+    return (removed, added)
 
 
 class JavaDiffer(object):
 
     def diff(self, fcodebase, tcodebase):
+        from_signatures = CodeBaseSignatures(fcodebase)
+        to_signatures = CodeBaseSignatures(tcodebase)
+
         cdiff = CodeBaseDiff()
         cdiff.codebase_from = fcodebase
         cdiff.codebase_to = tcodebase
-        cdiff.save()
-        fpackages = CodeElement.objects.filter(codebase=fcodebase,
-                kind__kind='package')
-        tpackages = CodeElement.objects.filter(codebase=tcodebase,
-                kind__kind='package')
-
-        self._diff_count(cdiff)
-        self._diff_packages(cdiff, fpackages, tpackages)
+        self._diff_count(cdiff, from_signatures, to_signatures)
 
-        cdiff.save()
+        # {m2m field name: set of element pks}
+        self.changes = defaultdict(set)
+        self._diff_packages(from_signatures, to_signatures)
+        self._save(cdiff)
         return cdiff
 
-    def _diff_count(self, cdiff):
-        cdiff.packages_size_from = \
-            cdiff.codebase_from.code_elements.filter(kind__kind='package')\
-            .count()
-        cdiff.packages_size_to = \
-            cdiff.codebase_to.code_elements.filter(kind__kind='package')\
-            .count()
-
-        cdiff.types_size_from = \
-            cdiff.codebase_from.code_elements.filter(kind__is_type=True)\
-            .count()
-        cdiff.types_size_to = \
-            cdiff.codebase_to.code_elements.filter(kind__is_type=True).count()
-
-        cdiff.methods_size_from = \
-            cdiff.codebase_from.code_elements.filter(kind__kind='method')\
-            .count()
-        cdiff.methods_size_to = \
-            cdiff.codebase_to.code_elements.filter(kind__kind='method').count()
-
-        cdiff.fields_size_from = \
-            cdiff.codebase_from.code_elements.filter(kind__kind='field')\
-            .count()
-        cdiff.fields_size_to = \
-            cdiff.codebase_to.code_elements.filter(kind__kind='field').count()
-
-        cdiff.enum_values_size_from = \
-            cdiff.codebase_from.code_elements.filter(
-                    kind__kind='enumeration value').count()
-        cdiff.enum_values_size_to = \
-            cdiff.codebase_to.code_elements.filter(
-                    kind__kind='enumeration value').count()
-
-        cdiff.ann_fields_size_from = \
-            cdiff.codebase_from.code_elements.filter(
-                    kind__kind='annotation field').count()
-        cdiff.ann_fields_size_to = \
-            cdiff.codebase_to.code_elements.filter(
-                    kind__kind='annotation field').count()
-
-        cdiff.dep_methods_size_from = \
-            cdiff.codebase_from.code_elements.filter(
-                    kind__kind='method').filter(deprecated=True).count()
-        cdiff.dep_methods_size_to = \
-            cdiff.codebase_to.code_elements.filter(
-                    kind__kind='method').filter(deprecated=True).count()
-
-        cdiff.dep_types_size_from = \
-            cdiff.codebase_from.code_elements.filter(
-                    kind__is_type=True).filter(deprecated=True).count()
-        cdiff.dep_types_size_to = \
-            cdiff.codebase_to.code_elements.filter(
-                    kind__is_type=True).filter(deprecated=True).count()
-
+    def _diff_count(self, cdiff, from_signatures, to_signatures):
+        kinds = get_kinds()
+        for (suffix, signatures) in (('from', from_signatures),
+                ('to', to_signatures)):
+            for (kind, field) in SIZE_FIELDS:
+                setattr(cdiff, '{0}_{1}'.format(field, suffix),
+                        signatures.count([kinds.get(kind).pk]))
+            setattr(cdiff, 'types_size_{0}'.format(suffix),
+                    signatures.count(signatures.type_kind_ids))
+            setattr(cdiff, 'dep_methods_size_{0}'.format(suffix),
+                    signatures.count([signatures.method_kind_id], True))
+            setattr(cdiff, 'dep_types_size_{0}'.format(suffix),
+                    signatures.count(signatures.type_kind_ids, True))
+
+    def _diff_packages(self, from_signatures, to_signatures):
+        from_packages = from_signatures.get_packages()
+        to_packages = to_signatures.get_packages()
+        (removed, added) = diff_keys(from_packages, to_packages)
+        self.changes['removed_packages'].update(removed)
+        self.changes['added_packages'].update(added)
+
+        common = set(from_packages).intersection(to_packages)
+        from_types = from_signatures.get_types(
+                set(from_packages[fqn] for fqn in common))
+        to_types = to_signatures.get_types(
+                set(to_packages[fqn] for fqn in common))
+        self._diff_types(from_signatures, to_signatures, from_types,
+                to_types)
+
+    def _diff_types(self, from_signatures, to_signatures, from_types,
+            to_types):
+        (removed, added) = diff_keys(from_types, to_types)
+        self.changes['removed_types'].update(removed)
+        self.changes['added_types'].update(added)
+        # BIG VERSION BUMP!
+        self.changes['removed_deprecated_types'].update(pk for pk in removed
+                if from_signatures.is_deprecated(pk))
+        # STRANGE!
+        self.changes['added_deprecated_types'].update(pk for pk in added
+                if to_signatures.is_deprecated(pk))
+
+        common = set(from_types).intersection(to_types)
+        for fqn in common:
+            from_type = from_types[fqn]
+            to_type = to_types[fqn]
+            from_deprecated = from_signatures.is_deprecated(from_type)
+            to_deprecated = to_signatures.is_deprecated(to_type)
+            if from_deprecated and not to_deprecated:
+                # STRANGE!
+                self.changes['removed_deprecated_types'].add(from_type)
+            elif not from_deprecated and to_deprecated:
+                # NORMAL CASE!
+                self.changes['added_deprecated_types'].add(to_type)
+
+        self._diff_members(from_signatures, to_signatures,
+                set(from_types[fqn] for fqn in common),
+                set(to_types[fqn] for fqn in common))
+
+    def _diff_members(self, from_signatures, to_signatures, from_type_ids,
+            to_type_ids):
+        kinds = get_kinds()
+        for (kind, removed_field, added_field) in MEMBER_DIFFS:
+            kind_id = kinds.get(kind).pk
+            (removed, added) = diff_keys(
+                    from_signatures.get_members(kind_id, from_type_ids),
+                    to_signatures.get_members(kind_id, to_type_ids))
+            self.changes[removed_field].update(removed)
+            self.changes[added_field].update(added)
+
+        method_kind_id = from_signatures.method_kind_id
+        (removed, added) = diff_keys(
+                from_signatures.get_members(method_kind_id, from_type_ids,
+                    True),
+                to_signatures.get_members(method_kind_id, to_type_ids, True))
+        self.changes['removed_deprecated_methods'].update(removed)
+        self.changes['added_deprecated_methods'].update(added)
+
+    @transaction.commit_on_success
+    def _save(self, cdiff):
+        '''Saves the diff and inserts the rows of its m2m fields in bulk.'''
         cdiff.save()
-
-    def _diff_packages(self, cdiff, fpackages, tpackages):
-        from_fqns = dict((fpackage.fqn, fpackage) for fpackage in
-                fpackages.all())
-        to_fqns = dict((tpackage.fqn, tpackage) for tpackage in
-                tpackages.all())
-        from_types = []
-        to_types = []
-
-        for from_fqn in from_fqns:
-            if from_fqn not in to_fqns:
-                from_package = from_fqns[from_fqn]
-                cdiff.removed_packages.add(from_package)
-            else:
-                from_package = from_fqns[from_fqn]
-                from_types.extend(from_package.containees.
-                        filter(kind__is_type=True).all())
-
-                to_package = to_fqns[from_fqn]
-                to_types.extend(to_package.containees.
-                        filter(kind__is_type=True).all())
-
-        for to_fqn in to_fqns:
-            if to_fqn not in from_fqns:
-                to_package = to_fqns[to_fqn]
-                cdiff.added_packages.add(to_fqns[to_fqn])
-
-        self._diff_types(cdiff, from_types, to_types)
-
-    def _diff_types(self, cdiff, ftypes, ttypes):
-        from_fqns = dict((ftype.fqn, ftype) for ftype in
-                ftypes)
-        to_fqns = dict((ttype.fqn, ttype) for ttype in
-                ttypes)
-        types = []
-
-        for from_fqn in from_fqns:
-            if from_fqn not in to_fqns:
-                from_type = from_fqns[from_fqn]
-                cdiff.removed_types.add(from_type)
-                if from_type.deprecated:
-                    # BIG VERSION BUMP!
-                    cdiff.removed_deprecated_types.add(from_type)
-            else:
-                from_type = from_fqns[from_fqn]
-                to_type = to_fqns[from_fqn]
-                types.append((from_type, to_type))
-                if from_type.deprecated and not to_type.deprecated:
-                    # STRANGE!
-                    cdiff.removed_deprecated_types.add(from_type)
-                elif not from_type.deprecated and to_type.deprecated:
-                    # NORMAL CASE!
-                    cdiff.added_deprecated_types.add(to_type)
-
-        for to_fqn in to_fqns:
-            if to_fqn not in from_fqns:
-                to_type = to_fqns[to_fqn]
-                cdiff.added_types.add(to_type)
-                if to_type.deprecated:
-                    # STRANGE!
-                    cdiff.added_deprecated_types.add(to_type)
-
-        for (ftype, ttype) in types:
-            self._diff_type(cdiff, ftype, ttype)
-
-    def _diff_type(self, cdiff, ftype, ttype):
-        from_fqns = dict((method.human_string(), method) for method in
-                ftype.containees.filter(kind__kind='method').all())
-        to_fqns = dict((method.human_string(), method) for method in
-                ttype.containees.filter(kind__kind='method').all())
-        self._diff_type_members(cdiff, from_fqns, to_fqns,
-                cdiff.removed_methods, cdiff.added_methods)
-
-        from_fqns = dict((method.human_string(), method) for method in
-                ftype.containees.filter(kind__kind='method')\
-                        .filter(deprecated=True).all())
-        to_fqns = dict((method.human_string(), method) for method in
-                ttype.containees.filter(kind__kind='method')\
-                        .filter(deprecated=True).all())
-        self._diff_type_members(cdiff, from_fqns, to_fqns,
-                cdiff.removed_deprecated_methods,
-                cdiff.added_deprecated_methods)
-
-        from_fqns = dict((method.human_string(), method) for method in
-                ftype.containees.filter(kind__kind='field').all())
-        to_fqns = dict((method.human_string(), method) for method in
-                ttype.containees.filter(kind__kind='field').all())
-        self._diff_type_members(cdiff, from_fqns, to_fqns,
-                cdiff.removed_fields, cdiff.added_fields)
-
-        from_fqns = dict((method.human_string(), method) for method in
-                ftype.containees.filter(kind__kind='enumeration value').all())
-        to_fqns = dict((method.human_string(), method) for method in
-                ttype.containees.filter(kind__kind='enumeration value').all())
-        self._diff_type_members(cdiff, from_fqns, to_fqns,
-                cdiff.removed_enum_values, cdiff.added_enum_values)
-
-        from_fqns = dict((method.human_string(), method) for method in
-                ftype.containees.filter(kind__kind='annotation field').all())
-        to_fqns = dict((method.human_string(), method) for method in
-                ttype.containees.filter(kind__kind='annotation field').all())
-        self._diff_type_members(cdiff, from_fqns, to_fqns,
-                cdiff.removed_ann_fields, cdiff.added_ann_fields)
-
-    def _diff_type_members(self, cdiff, from_fqns, to_fqns, removed, added,
-            func=None):
-        for from_fqn in from_fqns:
-            if from_fqn not in to_fqns:
-                from_type = from_fqns[from_fqn]
-                removed.add(from_type)
-
-        for to_fqn in to_fqns:
-            if to_fqn not in from_fqns:
-                to_type = to_fqns[to_fqn]
-                added.add(to_type)
+        for (field, element_ids) in self.changes.iteritems():
+            through = getattr(CodeBaseDiff, field).through
+            bulk_insert(through, ['codebasediff_id', 'codeelement_id'],
+                    ((cdiff.pk, element_id) for element_id in element_ids))
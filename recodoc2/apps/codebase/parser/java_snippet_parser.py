@@ -2,7 +2,8 @@ from __future__ import unicode_literals
 import logging
 import gc
 from py4j.java_gateway import JavaGateway
-from codebase.models import CodeElementKind, CodeSnippet, SingleCodeReference
+from codebase.kinds import get_kind
+from codebase.models import CodeSnippet, SingleCodeReference
 from codeutil.java_element import is_cu_body, is_class_body, clean_intro, \
     clean_dots, clean_comments
 from docutil.progress_monitor import NullProgressMonitor
@@ -34,12 +35,12 @@ class JavaSnippetParser(object):
         self.gateway = JavaGateway(start_callback_server=False)
         self.PPACoreUtil = \
                 self.gateway.jvm.ca.mcgill.cs.swevo.ppa.util.PPACoreUtil
-        self.class_kind = CodeElementKind.objects.get(kind='class')
-        self.unknown_kind = CodeElementKind.objects.get(kind='unknown')
-        self.method_kind = CodeElementKind.objects.get(kind='method')
-        self.field_kind = CodeElementKind.objects.get(kind='field')
-        self.enumeration_kind = CodeElementKind.objects.get(kind='enumeration')
-        self.annotation_kind = CodeElementKind.objects.get(kind='annotation')
+        self.class_kind = get_kind('class')
+        self.unknown_kind = get_kind('unknown')
+        self.method_kind = get_kind('method')
+        self.field_kind = get_kind('field')
+        self.enumeration_kind = get_kind('enumeration')
+        self.annotation_kind = get_kind('annotation')
 
     def parse(self, progress_monitor=NullProgressMonitor()):
         options = self.gateway.jvm.ca.mcgill.cs.swevo.ppa.PPAOptions()
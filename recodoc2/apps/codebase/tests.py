@@ -3,7 +3,10 @@ import logging
 import os
 import time
 import shutil
+import json
+import tempfile
 import unittest
+from collections import OrderedDict, defaultdict
 from django.test import TestCase, TransactionTestCase
 from django.conf import settings
 from django.db import transaction
@@ -11,14 +14,24 @@ from py4j.java_gateway import JavaGateway
 from docutil.commands_util import get_encoding
 from docutil.test_util import clean_test_dir
 from codebase.models import CodeBase, CodeElementKind, CodeElement,\
-                            MethodElement, CodeSnippet
+                            MethodElement, CodeSnippet, ParameterElement
 from codebase.actions import start_eclipse, stop_eclipse, check_eclipse,\
                              create_code_db, create_code_local, list_code_db,\
                              list_code_local, link_eclipse, get_codebase_path,\
                              create_code_element_kinds, parse_code,\
                              clear_code_elements, get_project_code_words,\
                              diff_codebases, parse_snippets 
-from project.models import Project
+from codebase.kinds import get_kinds
+from codebase.overloads import OverloadIndex, compute_overloads,\
+        get_element_keys, get_overload_keys, get_overload_counts,\
+        get_overload_index
+from codebase.parser.java_diff import JavaDiffer, MEMBER_DIFFS, diff_keys
+from codebase.coverage import encode_ids, decode_ids
+from codebase.linker.filters import FilterResult
+import codebase.linker.generic_linker as gl
+import codebase.linker.telemetry as telemetry
+import codebase.linker.log_writer as log_writer
+from project.models import Project, ProjectRelease
 from project.actions import create_project_local, create_project_db,\
                             create_release_db
 from docutil.cache_util import clear_cache
@@ -33,6 +46,442 @@ class EclipseTest(TestCase):
         stop_eclipse()
 
 
+class OverloadIndexTest(TestCase):
+
+    def testOverloadIndex(self):
+        keys = OrderedDict([
+            (3, ('p.A.m', 1, 'p.A.m(int)')),
+            (1, ('p.A.m', 1, 'p.A.m()')),
+            (2, ('p.A.m', 2, 'p.A.m')),
+            (4, ('p.A', 3, 'p.A'))])
+        index = OverloadIndex(keys)
+        self.assertEqual([3, 1, 2], index.get_ids('p.A.m'))
+        self.assertEqual([3, 1], index.get_ids('p.A.m', 1))
+        self.assertEqual(3, index.count('p.A.m'))
+        self.assertEqual(0, index.count('p.B'))
+        self.assertEqual(1, index.find('p.A.m', 1, 'p.A.m()'))
+        self.assertEqual(None, index.find('p.A.m', 2, 'p.A.m()'))
+
+    def testComputeOverloads(self):
+        create_code_element_kinds()
+        kinds = get_kinds()
+        project = Project.objects.create(name='project1',
+                url='http://www.example.com', dir_name='project1')
+        codebase = CodeBase.objects.create(name='core',
+                project_release=ProjectRelease.objects.create(
+                    project=project, release='1.0'))
+        self.assertEqual(None, get_overload_keys(codebase.pk))
+        CodeElement.objects.create(codebase=codebase, fqn='p.A',
+                kind=kinds.get('class'), signature='p.A')
+        methods = [CodeElement.objects.create(codebase=codebase,
+            fqn='p.A.m', kind=kinds.get('method'), signature=signature)
+            for signature in ('p.A.m()', 'p.A.m(int, )')]
+
+        self.assertEqual(3, compute_overloads(codebase))
+        keys = get_overload_keys(codebase.pk)
+        self.assertEqual(dict(get_element_keys(
+            CodeElement.objects.filter(codebase=codebase))), dict(keys))
+        self.assertEqual({'p.A': 1, 'p.A.m': 2},
+                dict(get_overload_counts(codebase, ['p.A', 'p.A.m'])))
+        index = get_overload_index(codebase.pk)
+        self.assertEqual(set(keys), set(index.get_ids('p.A') +
+                index.get_ids('p.A.m')))
+        self.assertEqual(methods[1].pk, index.find('p.A.m',
+            kinds.get('method').pk, 'p.A.m(int, )'))
+
+        # The index is reloaded after the overloads are recomputed.
+        compute_overloads(codebase)
+        self.assertFalse(index is get_overload_index(codebase.pk))
+
+
+class LinkCoverageTest(TestCase):
+
+    def testEncodeIds(self):
+        self.assertEqual('3,2,10', encode_ids(set([15, 3, 5])))
+        self.assertEqual([3, 5, 15], decode_ids('3,2,10'))
+        self.assertEqual('', encode_ids([]))
+        self.assertEqual([], decode_ids(''))
+
+
+class KeepFilter(object):
+
+    def filter(self, filter_input):
+        return FilterResult(self, False, filter_input.potentials)
+
+
+class FirstFilter(object):
+
+    def filter(self, filter_input):
+        return FilterResult(self, True, filter_input.potentials[:1])
+
+
+class TelemetryLog(object):
+    kind_str = 'method'
+
+
+class FilterTelemetryTest(TestCase):
+
+    def setUp(self):
+        self.old_telemetry = gl.FILTER_TELEMETRY
+        gl.FILTER_TELEMETRY = True
+        self.linker = gl.DefaultLinker(None, None, None, 'd')
+        self.linker.name = 'test'
+
+    def tearDown(self):
+        gl.FILTER_TELEMETRY = self.old_telemetry
+
+    def testFilterTelemetry(self):
+        afilters = [KeepFilter(), FirstFilter(), KeepFilter()]
+        log = TelemetryLog()
+        for potentials in ([1, 2, 3], [4, 5], [6]):
+            (result, _) = self.linker._filter_potentials(afilters, None,
+                    None, potentials, 'm', log)
+            self.assertEqual(potentials[:1], result)
+
+        stats = self.linker.telemetry.stats
+        self.assertEqual([('method', 0, 'KeepFilter'),
+            ('method', 1, 'FirstFilter'), ('method', 2, 'KeepFilter')],
+            stats.keys())
+        first = stats[('method', 1, 'FirstFilter')]
+        self.assertEqual(3, first.calls)
+        self.assertEqual(3, first.activations)
+        self.assertEqual(6, first.candidates_in)
+        self.assertEqual(3, first.candidates_out)
+        last = stats[('method', 2, 'KeepFilter')]
+        self.assertEqual(0, last.activations)
+        self.assertEqual(3, last.candidates_in)
+
+        (handle, path) = tempfile.mkstemp()
+        try:
+            with os.fdopen(handle, 'w') as telemetry_file:
+                for record in self.linker.telemetry.get_records():
+                    telemetry_file.write(json.dumps(record) + '\n')
+            entries = telemetry.summarize(telemetry.read_telemetry(path))
+        finally:
+            os.remove(path)
+        self.assertEqual(3, len(entries))
+        self.assertEqual('FirstFilter', entries[1]['filter'])
+        self.assertEqual(1.0, entries[1]['activation_ratio'])
+        self.assertEqual(0.5, entries[1]['reduction'])
+        self.assertEqual(0.0, entries[0]['activation_ratio'])
+
+    def testMemoizedFilters(self):
+        afilters = [FirstFilter(), KeepFilter()]
+        log = TelemetryLog()
+        for potentials in ([1, 2, 3], [1, 2, 3], [1, 2, 3]):
+            (result, _) = self.linker._filter_potentials(afilters, 'key',
+                    None, potentials, 'm', log)
+            self.assertEqual([1], result)
+
+        stats = self.linker.telemetry.stats
+        first = stats[('method', 0, 'FirstFilter')]
+        self.assertEqual(1, first.calls)
+        self.assertEqual(2, first.memoized)
+        self.assertEqual(3, first.candidates_in)
+        self.assertEqual(2, stats[('method', 1, 'KeepFilter')].memoized)
+        record = self.linker.telemetry.get_records()[0]
+        self.assertEqual(2, record['memoized'])
+
+    def testSaveWithoutRelease(self):
+        class TelemetryProject(object):
+            dir_name = 'telemetry'
+
+        self.linker.project = TelemetryProject()
+        self.linker._filter_potentials([FirstFilter()], None, None, [1, 2],
+                'm', TelemetryLog())
+        old_root = settings.PROJECT_FS_ROOT
+        settings.PROJECT_FS_ROOT = tempfile.mkdtemp()
+        try:
+            os.mkdir(os.path.join(settings.PROJECT_FS_ROOT, 'telemetry'))
+            path = self.linker.save_telemetry()
+            records = telemetry.read_telemetry(path)
+        finally:
+            shutil.rmtree(settings.PROJECT_FS_ROOT)
+            settings.PROJECT_FS_ROOT = old_root
+        self.assertEqual(1, len(records))
+        self.assertEqual(None, records[0]['release'])
+
+    def testLastRun(self):
+        runs = [telemetry.FilterTelemetry(self.linker).run for _ in
+                xrange(3)]
+        self.assertEqual(3, len(set(runs)))
+
+        (handle, path) = tempfile.mkstemp()
+        try:
+            with os.fdopen(handle, 'w') as telemetry_file:
+                for run in runs:
+                    telemetry_file.write(json.dumps({'run': run}) + '\n')
+            records = telemetry.read_telemetry(path)
+        finally:
+            os.remove(path)
+        self.assertEqual([{'run': runs[2]}], records)
+
+
+class LoggedElement(object):
+
+    def __init__(self, pk, fqn, signature):
+        self.pk = pk
+        self.fqn = fqn
+        self.signature = signature
+
+
+LOG_FIELDS = {'entry': 'field', 'name': 'bar', 'fqn_container': 'p.Foo',
+        'content': 'Foo.bar', 'original_size': 3, 'final_size': 2,
+        'ref_pk': 10, 'local_ct': -1, 'local_pk': 20, 'release': '1.0',
+        'snippet': False, 'custom_filtered': True,
+        'filters': [('ObjectMethodsFilter', '', False, 3),
+            ('FieldContainerFilter', 'strict', True, 2)]}
+
+
+class LogWriterTest(TestCase):
+
+    def setUp(self):
+        self.log_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.log_dir, 'linking-field.jsonl')
+
+    def tearDown(self):
+        shutil.rmtree(self.log_dir)
+
+    def testDebugLog(self):
+        debug_log = log_writer.DebugLog(2)
+        debug_log.append(1, 'a')
+        debug_log.append(1, 'b')
+        debug_log.append(2, 'c')
+        debug_log.append(3, 'd')
+        self.assertFalse(1 in debug_log)
+        self.assertEqual([], debug_log[1])
+        self.assertEqual(['c'], debug_log[2])
+        self.assertEqual(2, len(debug_log))
+        debug_log.clear()
+        self.assertEqual(0, len(debug_log))
+
+    def testFormatRecord(self):
+        self.assertEqual((1, 'p.Foo.bar', None), log_writer.get_element_key(
+            LoggedElement(1, 'p.Foo.bar', None)))
+        record = log_writer.get_record((LOG_FIELDS,
+            (1, 'p.Foo.bar', 'p.Foo.bar'), [(1, 'p.Foo.bar', 'p.Foo.bar'),
+                (2, 'q.Foo.bar', None)], [(3, 'r.Foo.bar', 'r.Foo.bar')]))
+        text = log_writer.format_record(record, 'http://foo/bar.html')
+        self.assertTrue(text.startswith('Field p.Foo.bar\n'))
+        self.assertTrue('  URL: http://foo/bar.html\n' in text)
+        self.assertTrue('    FieldContainerFilter strict: True - 2\n' in
+                text)
+        self.assertTrue('  Element: p.Foo.bar\n' in text)
+        self.assertTrue('  Potential: q.Foo.bar\n' in text)
+        self.assertFalse('  Potential: p.Foo.bar\n' in text)
+        self.assertTrue('  Original: r.Foo.bar\n' in text)
+
+    def testConvertLog(self):
+        writer = log_writer.LogWriter(self.path)
+        writer.write((LOG_FIELDS, (1, 'p.Foo.bar', 'p.Foo.bar'), [], []))
+        writer.write((LOG_FIELDS, None, [], []))
+        writer.close()
+
+        records = list(log_writer.read_records(self.path))
+        self.assertEqual(2, len(records))
+        self.assertEqual('p.Foo.bar', records[0]['element'])
+        self.assertEqual(None, records[1]['element'])
+
+        text_path = log_writer.convert_log(self.path)
+        self.assertEqual(os.path.join(self.log_dir, 'linking-field.log'),
+                text_path)
+        with open(text_path) as text_file:
+            text = text_file.read()
+        self.assertEqual(2, text.count('Field p.Foo.bar\n'))
+        self.assertEqual(1, text.count('  Element: p.Foo.bar\n'))
+
+    def testWriteError(self):
+        writer = log_writer.LogWriter(self.path)
+        writer.write((LOG_FIELDS, (1, 'p.Foo.bar', 'p.Foo.bar'), [], []))
+        # The signature cannot be encoded in JSON.
+        writer.write((LOG_FIELDS, (2, 'p.Foo.baz', object()), [], []))
+        writer.write((LOG_FIELDS, None, [(3, 'q.Foo.bar', None)], []))
+        self.assertRaises(TypeError, writer.close)
+        self.assertEqual(1, writer.dropped)
+
+        records = list(log_writer.read_records(self.path))
+        self.assertEqual(2, len(records))
+        self.assertEqual(['q.Foo.bar'], records[1]['potentials'])
+
+
+def get_old_members(code_type, kind, deprecated):
+    members = code_type.containees.filter(kind__kind=kind)
+    if deprecated:
+        members = members.filter(deprecated=True)
+    return dict((member.human_string(), member) for member in members)
+
+
+def get_old_diff(fcodebase, tcodebase):
+    '''Returns {m2m field name: set of pks} computed like the former
+       JavaDiffer: one query per package and type, members compared by
+       human_string().'''
+    changes = defaultdict(set)
+
+    def diff(from_fqns, to_fqns, removed, added):
+        changes[removed].update(element.pk for (fqn, element) in
+                from_fqns.iteritems() if fqn not in to_fqns)
+        changes[added].update(element.pk for (fqn, element) in
+                to_fqns.iteritems() if fqn not in from_fqns)
+
+    fpackages = dict((package.fqn, package) for package in
+            CodeElement.objects.filter(codebase=fcodebase,
+                kind__kind='package'))
+    tpackages = dict((package.fqn, package) for package in
+            CodeElement.objects.filter(codebase=tcodebase,
+                kind__kind='package'))
+    diff(fpackages, tpackages, 'removed_packages', 'added_packages')
+
+    ftypes = {}
+    ttypes = {}
+    for fqn in set(fpackages).intersection(tpackages):
+        ftypes.update((code_type.fqn, code_type) for code_type in
+                fpackages[fqn].containees.filter(kind__is_type=True))
+        ttypes.update((code_type.fqn, code_type) for code_type in
+                tpackages[fqn].containees.filter(kind__is_type=True))
+    diff(ftypes, ttypes, 'removed_types', 'added_types')
+    changes['removed_deprecated_types'].update(code_type.pk for (fqn,
+        code_type) in ftypes.iteritems() if code_type.deprecated and
+        (fqn not in ttypes or not ttypes[fqn].deprecated))
+    changes['added_deprecated_types'].update(code_type.pk for (fqn,
+        code_type) in ttypes.iteritems() if code_type.deprecated and
+        (fqn not in ftypes or not ftypes[fqn].deprecated))
+
+    member_diffs = [(kind, removed, added, False) for (kind, removed, added)
+            in MEMBER_DIFFS]
+    member_diffs.append(('method', 'removed_deprecated_methods',
+        'added_deprecated_methods', True))
+    for fqn in set(ftypes).intersection(ttypes):
+        for (kind, removed, added, deprecated) in member_diffs:
+            diff(get_old_members(ftypes[fqn], kind, deprecated),
+                 get_old_members(ttypes[fqn], kind, deprecated),
+                 removed, added)
+    return changes
+
+
+class JavaDiffTest(TestCase):
+
+    def setUp(self):
+        create_code_element_kinds()
+        project = Project.objects.create(name='project1',
+                url='http://www.example.com', dir_name='project1')
+        self.fcodebase = CodeBase.objects.create(name='core',
+                project_release=ProjectRelease.objects.create(
+                    project=project, release='3.0'))
+        self.tcodebase = CodeBase.objects.create(name='core',
+                project_release=ProjectRelease.objects.create(
+                    project=project, release='3.1'))
+        self.elements = {}
+
+        for codebase in (self.fcodebase, self.tcodebase):
+            self.add(codebase, 'package', 'p1')
+            self.add(codebase, 'class', 'p1.A', 'p1')
+            self.add(codebase, 'field', 'p1.A.f1', 'p1.A')
+            self.add(codebase, 'enumeration value', 'p1.A.V1', 'p1.A')
+            self.add_method(codebase, 'p1.A.foo', 'p1.A', ['int'])
+
+        fcodebase = self.fcodebase
+        self.add(fcodebase, 'package', 'p2')
+        self.add(fcodebase, 'class', 'p2.X', 'p2')
+        self.add(fcodebase, 'class', 'p1.B', 'p1', deprecated=True)
+        self.add(fcodebase, 'enumeration', 'p1.C', 'p1')
+        self.add_method(fcodebase, 'p1.A.bar', 'p1.A', signature='bar()',
+                deprecated=True)
+        self.add_method(fcodebase, 'p1.A.baz', 'p1.A', signature='baz()')
+
+        tcodebase = self.tcodebase
+        self.add(tcodebase, 'package', 'p3')
+        self.add(tcodebase, 'class', 'p3.Y', 'p3')
+        self.add(tcodebase, 'enumeration', 'p1.C', 'p1', deprecated=True)
+        self.add(tcodebase, 'annotation', 'p1.D', 'p1', deprecated=True)
+        self.add(tcodebase, 'field', 'p1.A.f2', 'p1.A')
+        self.add(tcodebase, 'annotation field', 'p1.D.value', 'p1.D')
+        self.add_method(tcodebase, 'p1.A.bar', 'p1.A', signature='bar()')
+        self.add_method(tcodebase, 'p1.A.foo', 'p1.A', ['String'])
+        self.add_method(tcodebase, 'p1.A.qux', 'p1.A', signature='qux()',
+                deprecated=True)
+
+    def add(self, codebase, kind, fqn, container=None, deprecated=False,
+            signature=None):
+        element = CodeElement.objects.create(codebase=codebase,
+                kind=get_kinds().get(kind), fqn=fqn,
+                simple_name=fqn.split('.')[-1], deprecated=deprecated,
+                signature=signature)
+        if container is not None:
+            element.containers.add(self.elements[(codebase.pk, container)])
+        self.elements[(codebase.pk, fqn)] = element
+        return element
+
+    def add_method(self, codebase, fqn, container, parameter_types=(),
+            signature=None, deprecated=False):
+        '''Adds a method. Without a signature, the method is keyed by the
+           human string of its parameters like the methods parsed before
+           the signature column existed.'''
+        method = self.add(codebase, 'method', fqn, container, deprecated,
+                signature)
+        for (index, type_name) in enumerate(parameter_types):
+            ParameterElement.objects.create(codebase=codebase,
+                    kind=get_kinds().get('method parameter'),
+                    fqn=type_name, simple_name=type_name,
+                    attcontainer=method, index=index,
+                    type_simple_name=type_name, type_fqn=type_name)
+        return method
+
+    def get_pks(self, codebase, *fqns):
+        return set(self.elements[(codebase.pk, fqn)].pk for fqn in fqns)
+
+    def testDiffKeys(self):
+        self.assertEqual((set([1]), set([3])),
+                diff_keys({'a': 1, 'b': 2}, {'b': 4, 'c': 3}))
+        self.assertEqual((set(), set()), diff_keys({}, {}))
+
+    def testDiffCodebases(self):
+        cdiff = JavaDiffer().diff(self.fcodebase, self.tcodebase)
+        old = get_old_diff(self.fcodebase, self.tcodebase)
+        fields = set(old)
+        fields.update(field for diff in MEMBER_DIFFS for field in diff[1:])
+        for field in fields:
+            self.assertEqual(old[field],
+                    set(getattr(cdiff, field).values_list('pk', flat=True)),
+                    field)
+
+        (fcodebase, tcodebase) = (self.fcodebase, self.tcodebase)
+        self.assertEqual(self.get_pks(fcodebase, 'p2'),
+                old['removed_packages'])
+        self.assertEqual(self.get_pks(tcodebase, 'p3'), old['added_packages'])
+        self.assertEqual(self.get_pks(fcodebase, 'p1.B'), old['removed_types'])
+        self.assertEqual(self.get_pks(tcodebase, 'p1.D'), old['added_types'])
+        self.assertEqual(self.get_pks(fcodebase, 'p1.B'),
+                old['removed_deprecated_types'])
+        self.assertEqual(self.get_pks(tcodebase, 'p1.C', 'p1.D'),
+                old['added_deprecated_types'])
+        self.assertEqual(self.get_pks(fcodebase, 'p1.A.baz'),
+                old['removed_methods'])
+        self.assertEqual(2, len(old['added_methods']))
+        self.assertEqual(self.get_pks(fcodebase, 'p1.A.bar'),
+                old['removed_deprecated_methods'])
+        self.assertEqual(self.get_pks(tcodebase, 'p1.A.qux'),
+                old['added_deprecated_methods'])
+        self.assertEqual(self.get_pks(tcodebase, 'p1.A.f2'),
+                old['added_fields'])
+
+        self.assertEqual((2, 2), (cdiff.packages_size_from,
+            cdiff.packages_size_to))
+        self.assertEqual((4, 4), (cdiff.types_size_from,
+            cdiff.types_size_to))
+        self.assertEqual((3, 4), (cdiff.methods_size_from,
+            cdiff.methods_size_to))
+        self.assertEqual((1, 2), (cdiff.fields_size_from,
+            cdiff.fields_size_to))
+        self.assertEqual((1, 1), (cdiff.enum_values_size_from,
+            cdiff.enum_values_size_to))
+        self.assertEqual((0, 1), (cdiff.ann_fields_size_from,
+            cdiff.ann_fields_size_to))
+        self.assertEqual((1, 1), (cdiff.dep_methods_size_from,
+            cdiff.dep_methods_size_to))
+        self.assertEqual((1, 2), (cdiff.dep_types_size_from,
+            cdiff.dep_types_size_to))
+
+
 class CodeSetup(TestCase):
 
     @classmethod
@@ -88,6 +537,27 @@ class CodeSetup(TestCase):
         kind_count = CodeElementKind.objects.all().count()
         self.assertEqual(30, kind_count)
 
+    def testKindRegistry(self):
+        create_code_element_kinds()
+        kinds = get_kinds()
+        self.assertEqual(30, len(kinds))
+        class_kind = CodeElementKind.objects.get(kind='class')
+        self.assertEqual(class_kind.pk, kinds.get('class').pk)
+        self.assertEqual('class', kinds.get_name(class_kind.pk))
+        self.assertTrue(kinds.is_type(class_kind.pk))
+        self.assertFalse(kinds.is_type(kinds.get('method').pk))
+        self.assertTrue(kinds.is_file(kinds.get('jar file').pk))
+        self.assertTrue(kinds.in_hierarchy(kinds.get('annotation').pk))
+        self.assertTrue(kinds.in_hierarchy(kinds.get('enumeration').pk))
+        self.assertFalse(kinds.in_hierarchy(kinds.get('method').pk))
+        self.assertFalse(kinds.in_hierarchy(kinds.get('package').pk))
+        self.assertEqual(kinds.type_pks, kinds.hierarchy_pks)
+        self.assertTrue(kinds.is_attribute(
+            kinds.get('method parameter').pk))
+        self.assertTrue(kinds.is_value(kinds.get('property value').pk))
+        self.assertRaises(CodeElementKind.DoesNotExist, kinds.get, 'foo')
+        self.assertRaises(AttributeError, setattr, kinds, 'type_pks', None)
+
     def testLinkEclipseProject(self):
         create_code_local('project1', 'core', '3.0')
         to_path = get_codebase_path('project1', 'core', '3.0')
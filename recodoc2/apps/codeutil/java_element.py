@@ -3,6 +3,7 @@ import re
 import logging
 from codeutil.parser import create_match
 import docutil.str_util as su
+from docutil.cache_util import memoize
 
 
 logger = logging.getLogger("recodoc.codeutil.java")
@@ -45,6 +46,7 @@ def is_field_ref(name):
     return len(matches) > 0 and len(matches.pop()) > 1
 
 
+@memoize()
 def clean_java_name(name, remove_snippet=False, remove_unknown=False):
     """Given a name, returns a tuple containing the simple name and the fully
     qualified name. Removes all array or generic artifacts.
@@ -82,6 +84,7 @@ def clean_java_name(name, remove_snippet=False, remove_unknown=False):
     return (clean_name_simple, clean_name_fqn)
 
 
+@memoize()
 def get_annotation_name(name, is_handle):
     pass
     simple = fqn = None
@@ -96,6 +99,7 @@ def get_annotation_name(name, is_handle):
     return (su.safe_strip(simple), su.safe_strip(fqn))
 
 
+@memoize()
 def get_class_name(name, is_handle, skip_fancy_search=False):
     simple = fqn = None
     if is_handle:
@@ -126,6 +130,7 @@ def get_class_name(name, is_handle, skip_fancy_search=False):
     return (simple.strip(), fqn.strip())
 
 
+@memoize()
 def get_package_name(name, no_default=False):
     package = name
     dot_index = package.rfind('.')
@@ -136,6 +141,7 @@ def get_package_name(name, no_default=False):
     return package
 
 
+@memoize()
 def get_clean_name(content):
     '''Strips unfriendly characters like parentheses, apostrophes, quotes,
        etc. Gets the FQN first if there is one. Otherwise, try to find the
@@ -5,11 +5,13 @@ from django.conf import settings
 from django.db import transaction
 
 from docutil.progress_monitor import CLIProgressMonitor
+from docutil.db_util import bulk_delete
 from docutil.commands_util import mkdir_safe, dump_model, load_model,\
-    import_clazz
+    import_clazz, print_delete_counts
 from project.models import ProjectRelease
 from project.actions import DOC_PATH
-from codebase.models import CodeBase, CodeBaseDiff
+from codebase.models import CodeBase, CodeBaseDiff, DOCUMENT_SOURCE
+from codebase.coverage import invalidate_link_coverage
 from recommender.models import CodePattern, CodePatternCoverage
 from recommender.parser.pattern_coverage import compute_coverage
 from doc.models import DocumentStatus, Document, Page, Section, DocDiff
@@ -72,18 +74,19 @@ def sync_doc(pname, dname, release):
     dump_model(model, pname, DOC_PATH, doc_key)
 
 
-def clear_doc_elements(pname, dname, release):
+def clear_doc_elements(pname, dname, release, chunksize=None):
     prelease = ProjectRelease.objects.filter(project__dir_name=pname).\
             filter(release=release)[0]
     document = Document.objects.filter(project_release=prelease).\
             filter(title=dname)[0]
     query = Section.objects.filter(page__document=document)
     print('Deleting %i sections' % query.count())
-    for section in query.all():
-        section.code_references.all().delete()
-        section.code_snippets.all().delete()
-        section.delete()
-    Page.objects.filter(document=document).delete()
+    # The sections, their code references and snippets are deleted with the
+    # pages.
+    print_delete_counts(bulk_delete(
+        Page.objects.filter(document=document), chunksize))
+    invalidate_link_coverage(source=DOCUMENT_SOURCE,
+            resource_pk=document.pk)
 
 
 @transaction.autocommit
@@ -167,19 +170,21 @@ def clear_pattern_coverage(pname, bname, release, dname, srelease):
     query.delete()
 
 
-def remove_page(pname, dname, release, url_regex):
+def remove_page(pname, dname, release, url_regex, chunksize=None):
     prelease = ProjectRelease.objects.filter(project__dir_name=pname).\
             filter(release=release)[0]
     document = Document.objects.filter(project_release=prelease).\
             filter(title=dname)[0]
     pattern = re.compile(url_regex)
     to_delete = []
-    for page in document.pages.all():
-        if pattern.search(page.url):
-            to_delete.append(page)
-    for page in to_delete:
-        print('Page {0} deleted'.format(page.url))
-        page.delete()
+    for (pk, url) in document.pages.values_list('pk', 'url'):
+        if pattern.search(url):
+            to_delete.append(pk)
+            print('Page {0} deleted'.format(url))
+    print_delete_counts(bulk_delete(Page.objects.filter(pk__in=to_delete),
+        chunksize))
+    invalidate_link_coverage(source=DOCUMENT_SOURCE,
+            resource_pk=document.pk)
 
     print('{0} pages deleted'.format(len(to_delete)))
 
@@ -14,6 +14,9 @@ class Command(NoArgsCommand):
             default='-1', help='Document name'),
         make_option('--release', action='store', dest='release',
             default='-1', help='Project Release'),
+        make_option('--chunk-size', action='store', dest='chunk_size',
+            type='int', default=None, help='Number of rows deleted per '
+            'transaction (optional, default: one transaction)'),
     )
     help = "Clear document model"
 
@@ -22,4 +25,5 @@ class Command(NoArgsCommand):
         pname = smart_decode(options.get('pname'))
         dname = smart_decode(options.get('dname'))
         release = smart_decode(options.get('release'))
-        clear_doc_elements(pname, dname, release)
+        chunk_size = options.get('chunk_size')
+        clear_doc_elements(pname, dname, release, chunk_size)
@@ -16,6 +16,9 @@ class Command(NoArgsCommand):
             default='-1', help='Project Release'),
         make_option('--regex', action='store', dest='regex',
             default='-1', help='Regex pattern matched against the page url'),
+        make_option('--chunk-size', action='store', dest='chunk_size',
+            type='int', default=None, help='Number of rows deleted per '
+            'transaction (optional, default: one transaction)'),
     )
     help = "Remove pages from a document"
 
@@ -25,4 +28,5 @@ class Command(NoArgsCommand):
         dname = smart_decode(options.get('dname'))
         release = smart_decode(options.get('release'))
         regex = smart_decode(options.get('regex'))
-        remove_page(pname, dname, release, regex)
+        chunk_size = options.get('chunk_size')
+        remove_page(pname, dname, release, regex, chunk_size)
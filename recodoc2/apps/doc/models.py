@@ -119,6 +119,14 @@ class Section(SourceElement):
             related_name='children')
     '''att.'''
 
+    content_hash = models.CharField(max_length=40, blank=True, null=True,
+            db_index=True)
+    '''SHA-1 of the text of the section (see simil_util.get_content_hash)'''
+
+    minhash = models.TextField(blank=True, null=True)
+    '''MinHash signature of the text of the section, used to find near
+       duplicate sections (see simil_util.get_minhash)'''
+
     title_references = generic.GenericRelation(SingleCodeReference,
             content_type_field="title_content_type",
             object_id_field="title_object_id",
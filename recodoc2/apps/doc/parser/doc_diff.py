@@ -1,13 +1,24 @@
 from __future__ import unicode_literals
-from difflib import SequenceMatcher
+from collections import defaultdict
+from difflib import SequenceMatcher, get_close_matches
+from docutil.simil_util import get_content_hash, get_minhash,\
+        decode_minhash, get_lsh_bands
 from doc.models import SectionMatcher, DocDiff, Section, PageMatcher,\
         SectionChanger, LinkChange
+from codebase.models import CodeElementLink
 
 
 ABS_THRESHOLD = 2.0
 RELATIVE_THRESHOLD = 1.0
 RATIO_THRESHOLD = 0.85
 DEFAULT_DISTANCES = ((0.90, 0.75), (0.80, 0.50), (0.70, 0.25))
+# Confidence of the sections matched by content hash (sum of the factors of
+# the section matchers).
+UNCHANGED_CONFIDENCE = 21.0
+# Number of sections with a similar title added to the candidates. Below the
+# lowest distance threshold, TitleMatcher gives no confidence.
+FUZZY_TITLE_SIZE = 3
+FUZZY_TITLE_RATIO = DEFAULT_DISTANCES[-1][0]
 
 
 def get_null_matches(from_elem, to_elems, factor):
@@ -212,6 +223,81 @@ class SectionPageMatcher(object):
         return mresult
 
 
+class SectionIndex(object):
+    '''Index of the sections of a document by content hash, number, title
+       and LSH band of their MinHash signature. The signature of the sections
+       parsed before signatures were saved is computed from their text.
+
+       A section whose number, title and content all changed is not a
+       candidate, even if its children, parent and page would have matched:
+       the matchers are only run on the candidates.'''
+
+    def __init__(self, sections):
+        self.sections = sections
+        self.positions = {}
+        self.hashes = defaultdict(list)
+        self.numbers = defaultdict(list)
+        self.titles = defaultdict(list)
+        self.bands = defaultdict(list)
+        for (position, section) in enumerate(sections):
+            self.positions[section.pk] = position
+            content_hash = get_section_hash(section)
+            if content_hash is not None:
+                self.hashes[content_hash].append(section)
+            number = (section.number or '').strip()
+            if number != '':
+                self.numbers[number].append(section)
+            self.titles[(section.title or '').strip()].append(section)
+            for band in get_section_bands(section):
+                self.bands[band].append(section)
+
+    def get_unique(self, content_hash):
+        '''Returns the only section with this content hash or None.'''
+        sections = self.hashes.get(content_hash, [])
+        if len(sections) == 1:
+            return sections[0]
+        else:
+            return None
+
+    def get_candidates(self, section):
+        '''Returns the sections that have the same number as section, a
+           similar title (see FUZZY_TITLE_RATIO) or that share a LSH band
+           with it, in document order.'''
+        candidates = {}
+        number = (section.number or '').strip()
+        if number != '':
+            for candidate in self.numbers.get(number, []):
+                candidates[candidate.pk] = candidate
+        title = (section.title or '').strip()
+        for candidate in self.titles.get(title, []):
+            candidates[candidate.pk] = candidate
+        for similar_title in get_close_matches(title, self.titles,
+                FUZZY_TITLE_SIZE, FUZZY_TITLE_RATIO):
+            for candidate in self.titles[similar_title]:
+                candidates[candidate.pk] = candidate
+        for band in get_section_bands(section):
+            for candidate in self.bands.get(band, []):
+                candidates[candidate.pk] = candidate
+        return sorted(candidates.values(),
+                key=lambda candidate: self.positions[candidate.pk])
+
+
+def get_section_hash(section):
+    if section.content_hash is None and section.text_content:
+        section.content_hash = get_content_hash(section.text_content)
+    return section.content_hash
+
+
+def get_section_bands(section):
+    signature = decode_minhash(section.minhash)
+    if signature is None and section.text_content:
+        signature = get_minhash(section.text_content)
+    if signature is None:
+        return []
+    else:
+        return get_lsh_bands(signature)
+
+
 class DocDiffer(object):
 
     def diff_docs(self, document_from, document_to):
@@ -259,13 +345,31 @@ class DocDiffer(object):
         print('Finished matching pages')
 
     def match_sections(self, ddiff):
+        '''Matches the sections with a unique identical content hash
+           (unchanged sections), then runs the matchers on the candidates of
+           the other sections (same number, similar title or near duplicate
+           content).'''
         section_froms = list(Section.objects
-                .filter(page__document=ddiff.document_from).all())
+                .filter(page__document=ddiff.document_from)
+                .select_related('page', 'parent').all())
         section_tos = list(Section.objects
-                .filter(page__document=ddiff.document_to).all())
+                .filter(page__document=ddiff.document_to)
+                .select_related('page', 'parent').all())
+        from_hashes = defaultdict(int)
+        for section_from in section_froms:
+            from_hashes[get_section_hash(section_from)] += 1
+        to_index = SectionIndex(section_tos)
         matched_tos = set()
         for section_from in section_froms:
-            best_match = self._match_section(section_from, section_tos)
+            best_match = None
+            content_hash = get_section_hash(section_from)
+            if content_hash is not None and from_hashes[content_hash] == 1:
+                section_to = to_index.get_unique(content_hash)
+                if section_to is not None:
+                    best_match = (section_to, UNCHANGED_CONFIDENCE)
+            if best_match is None:
+                best_match = self._match_section(section_from,
+                        to_index.get_candidates(section_from))
             if best_match is not None:
                 (section_to, confidence) = best_match
                 s_matcher = SectionMatcher(
@@ -318,6 +422,8 @@ class DocDiffer(object):
         return best_match
 
     def _match_section(self, section_from, section_tos):
+        if len(section_tos) == 0:
+            return None
         match_results = []
         match_results.append(
                 SectionNumberMatcher().match(section_from, section_tos))
@@ -330,6 +436,10 @@ class DocDiffer(object):
         match_results.append(
                 SectionPageMatcher().match(section_from, section_tos))
         best_match = get_best_match(match_results)
+        # With fewer candidates, a single candidate must still be a good
+        # match.
+        if best_match is not None and best_match[1] <= ABS_THRESHOLD:
+            best_match = None
         return best_match
 
 
@@ -379,47 +489,43 @@ class DocLinkerDiffer(object):
         links = []
         for single_ref in section.code_references.all():
             link = self._get_link(single_ref,
-                    single_ref.project_release)
+                    single_ref.project_release_id)
             if link is not None:
                 links.append(link)
         return links
 
     def _diff_links(self, links_from, links_to, added_links, removed_links):
+        links_by_key = defaultdict(list)
+        for link_to in links_to:
+            links_by_key[link_to.diff_key].append(link_to)
+
+        matched = set()
         for link_from in links_from:
-            link_to = self._pop_link(link_from, links_to)
+            link_to = self._pop_link(link_from, links_by_key)
             # This means the link was removed!
             if link_to is None:
                 link_change = LinkChange(diff=self.docdiff,
                         link_from=link_from, from_matched_section=True)
                 link_change.save()
                 removed_links.append(link_change)
+            else:
+                matched.add(link_to.pk)
 
         # Remaining links were added!
         for link_to in links_to:
+            if link_to.pk in matched:
+                continue
             link_change = LinkChange(diff=self.docdiff,
                     link_to=link_to, from_matched_section=True)
             link_change.save()
             added_links.append(link_change)
 
-
-    def _pop_link(self, link_to_find, links):
-        index = -1
-        link = None
-        human_string = link_to_find.code_element.human_string()
-        is_snippet = link_to_find.code_reference.snippet is not None
-        
-        for i, temp_link in enumerate(links):
-            temp_human = temp_link.code_element.human_string()     
-            temp_snippet = temp_link.code_reference.snippet is not None
-            if human_string == temp_human and is_snippet == temp_snippet:
-                index = i
-                link = temp_link
-                break
-
-        if index > -1:
-            del links[index]
-
-        return link
+    def _pop_link(self, link_to_find, links_by_key):
+        links = links_by_key.get(link_to_find.diff_key)
+        if links:
+            return links.pop(0)
+        else:
+            return None
 
     def _add_removed_links(self, section, removed_links):
         for link in self._get_links(section):
@@ -443,12 +549,17 @@ class DocLinkerDiffer(object):
                 link_change.save()
                 added_links.append(link_change)
 
-    def _get_link(self, code_reference, project_release):
+    def _get_link(self, code_reference, project_release_id):
         link = None
         try:
-            release_links = code_reference.release_links.\
-                get(project_release=project_release)
-            link = release_links.first_link
+            link = CodeElementLink.objects.select_related('code_element').\
+                    get(first_link__code_reference=code_reference,
+                        first_link__project_release=project_release_id)
+            link.code_reference = code_reference
+            # Links are matched on the signature of their code element and
+            # on the kind of reference (snippet or not).
+            link.diff_key = (link.code_element.human_string(),
+                    code_reference.snippet_id is not None)
         except Exception:
             pass
         return link
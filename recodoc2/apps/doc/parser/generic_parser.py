@@ -7,12 +7,14 @@ from lxml import etree
 from django.db import transaction
 from django.conf import settings
 from docutil.str_util import clean_breaks, normalize
+from docutil.simil_util import get_content_hash, get_minhash, encode_minhash
 from docutil.etree_util import clean_tree, get_word_count, XPathList,\
         SingleXPath, get_word_count_text, get_text_context, get_sentence,\
         get_complex_text
 from docutil.url_util import get_relative_url, get_path
 from docutil.commands_util import chunk_it, import_clazz, get_encoding
 from docutil.progress_monitor import NullProgressMonitor
+from docutil.page_store import read_page
 from codebase.models import DOCUMENT_SOURCE
 from codebase.actions import get_project_code_words, get_default_kind_dict,\
         parse_single_code_references, get_java_strategies,\
@@ -202,9 +204,7 @@ class GenericParser(object):
 
     def get_page_etree(self, page):
         page_path = os.path.join(settings.PROJECT_FS_ROOT, page.file_path)
-        page_file = open(page_path)
-        content = page_file.read()
-        page_file.close()
+        content = read_page(page_path)
         encoding = get_encoding(content)
         parser = etree.HTMLParser(remove_comments=True, encoding=encoding)
         tree = etree.fromstring(content, parser).getroottree()
@@ -299,7 +299,9 @@ class GenericParser(object):
                 file_path=page.file_path,
                 url=page.url,
                 number=number,
-                word_count=word_count)
+                word_count=word_count,
+                content_hash=get_content_hash(text),
+                minhash=encode_minhash(get_minhash(text)))
 
         if settings.SAVE_SECTION_TEXT:
             section.text_content = text
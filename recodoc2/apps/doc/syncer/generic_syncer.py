@@ -1,12 +1,12 @@
 from __future__ import unicode_literals
 import os
-import urllib2
 import urlparse
 import logging
 from lxml import etree
 from docutil.url_util import get_local_url, get_url_without_hash,\
         ensure_path_exists, get_path_from_url, get_sanitized_url
-from docutil.commands_util import get_encoding, download_file
+from docutil.commands_util import get_encoding, download_file,\
+        get_file_from
 from doc.models import DocumentPage, DocumentLink
 from traceback import print_exc
 
@@ -79,7 +79,7 @@ class GenericSyncer(object):
         self.logger.info("Processing page: " + url)
         local_url = self.make_copy(get_url_without_hash(url))
 
-        local_page = urllib2.urlopen(local_url)
+        local_page = get_file_from(local_url)
         content = local_page.read()
         local_page.close()
         parser = etree.HTMLParser(encoding=get_encoding(content))
@@ -11,13 +11,14 @@ from docutil.commands_util import load_model
 from docutil.test_util import clean_test_dir
 from codebase.models import CodeElementKind, SingleCodeReference, CodeSnippet
 from codebase.actions import create_code_element_kinds
-from project.models import Project
+from project.models import Project, ProjectRelease
 from project.actions import create_project_local, create_project_db,\
                             create_release_db, DOC_PATH
 from doc.actions import create_doc_local, get_doc_path, list_doc_local,\
                             create_doc_db, list_doc_db, sync_doc,\
                             clear_doc_elements, parse_doc, diff_doc
-from doc.models import Document, Page, Section
+from doc.models import Document, Page, Section, DocDiff
+from doc.parser.doc_diff import DocDiffer, UNCHANGED_CONFIDENCE
 
 
 class DocSetup(TestCase):
@@ -288,6 +289,101 @@ class DocSetup(TestCase):
                 section_match.confidence))
 
 
+TEXT_A = 'An instance of Configuration represents the entire set of '\
+        'mappings of the application types to a SQL database. It is used to '\
+        'build an immutable session factory.'
+
+TEXT_B = 'When all mappings have been parsed by the Configuration, the '\
+        'application must obtain a factory for Session instances. This '\
+        'factory is intended to be shared by all application threads.'
+
+
+class DocDifferTest(TestCase):
+
+    def setUp(self):
+        project = Project.objects.create(name='project1',
+                url='http://www.example.com', dir_name='project1')
+        (doc1, doc2) = [Document.objects.create(title='manual',
+            project_release=ProjectRelease.objects.create(project=project,
+                release=release)) for release in ('3.0', '3.1')]
+        self.ddiff = DocDiff.objects.create(document_from=doc1,
+                document_to=doc2)
+        page1 = Page.objects.create(document=doc1,
+                title='Chapter 3. Configuration')
+        page2 = Page.objects.create(document=doc2,
+                title='Chapter 3. Configuration')
+
+        self.sections = {}
+        self.add(page1, '3.1', 'Programmatic configuration', TEXT_A)
+        self.add(page1, '3.2', 'Obtaining a SessionFactory', TEXT_B)
+        self.add(page1, '3.2.1', 'Factory options',
+                'The options of a factory.', '3.2')
+        self.add(page1, '3.2.2', 'Multiple factories',
+                'Several factories can be built.', '3.2')
+        self.add(page1, '3.3', 'JDBC connections', 'It is advisable to '
+                'have the session factory create and pool JDBC connections '
+                'for you.')
+        self.add(page1, '3.4', 'Optional properties', 'There are a number '
+                'of other properties that control the behavior.')
+
+        # Unchanged content, new number and title.
+        self.add(page2, '3.5', 'Building the mappings', TEXT_A)
+        # Near duplicate content, new number and title, same children.
+        self.add(page2, '3.1', 'Creating the factory',
+                TEXT_B.replace('application threads',
+                    'threads of the application'))
+        self.add(page2, '3.1.1', 'Factory options',
+                'The options of a factory.', '3.1')
+        self.add(page2, '3.1.2', 'Multiple factories',
+                'Several factories can be built.', '3.1')
+        # Renamed section with new content and number.
+        self.add(page2, '3.2', 'JDBC connection', 'Connections are obtained '
+                'from a pool the first time that you need to access the '
+                'database.')
+        self.add(page2, '3.3', 'SQL dialects', 'A dialect can be configured '
+                'to use the SQL variant of a database.')
+
+    def add(self, page, number, title, text, parent=None):
+        if parent is not None:
+            parent = self.sections[(page.pk, parent)]
+        section = Section.objects.create(page=page, number=number,
+                title='{0}. {1}'.format(number, title), text_content=text,
+                parent=parent)
+        self.sections[(page.pk, number)] = section
+        return section
+
+    def get_title(self, section):
+        return section.title.split(' ', 1)[1]
+
+    def test_match_sections(self):
+        DocDiffer().match_sections(self.ddiff)
+        matches = dict((self.get_title(matcher.section_from),
+            (self.get_title(matcher.section_to), matcher.confidence))
+            for matcher in self.ddiff.section_matches.all())
+
+        self.assertEqual(5, len(matches))
+        # Content hash
+        self.assertEqual(('Building the mappings', UNCHANGED_CONFIDENCE),
+                matches['Programmatic configuration'])
+        self.assertEqual(('Factory options', UNCHANGED_CONFIDENCE),
+                matches['Factory options'])
+        self.assertEqual(('Multiple factories', UNCHANGED_CONFIDENCE),
+                matches['Multiple factories'])
+        # LSH band (the section has a different number and title)
+        (title, confidence) = matches['Obtaining a SessionFactory']
+        self.assertEqual('Creating the factory', title)
+        self.assertTrue(confidence < UNCHANGED_CONFIDENCE)
+        # Similar title
+        (title, confidence) = matches['JDBC connections']
+        self.assertEqual('JDBC connection', title)
+        self.assertTrue(confidence < UNCHANGED_CONFIDENCE)
+
+        self.assertEqual(['Optional properties'], [self.get_title(section)
+            for section in self.ddiff.removed_sections.all()])
+        self.assertEqual(['SQL dialects'], [self.get_title(section)
+            for section in self.ddiff.added_sections.all()])
+
+
 class DocParserTest(TransactionTestCase):
     @transaction.commit_on_success
     def setUp(self):
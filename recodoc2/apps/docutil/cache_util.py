@@ -1,5 +1,9 @@
 from __future__ import unicode_literals
+import os
 import hashlib
+from collections import OrderedDict
+from functools import wraps
+from threading import Lock
 from traceback import print_exc
 from django.core.cache import cache
 from docutil.str_util import smart_decode, normalize
@@ -9,6 +13,13 @@ DEFAULT_EXPIRATION_TIME = 3600
 
 cache_total = cache_miss = 0
 
+MEMO_SIZE = 50000
+
+# {function name: LRUCache} of the memoized functions.
+memo_caches = OrderedDict()
+
+MISSING = object()
+
 
 def reset_cache_stats():
     global cache_total
@@ -64,3 +75,90 @@ def get_codebase_key(codebase):
             codebase.project_release.project.name,
             codebase.project_release.release,
             codebase.name])
+
+
+class LRUCache(object):
+    '''Bounded map that discards the least recently used entries and counts
+       hits and misses. The cache can be used by several threads. A forked
+       worker keeps the entries of its parent, but gets its own lock and
+       statistics. A named cache is reported by get_memo_stats.'''
+
+    def __init__(self, size=MEMO_SIZE, name=None):
+        self.size = size
+        self.entries = OrderedDict()
+        self._reset_process()
+        if name is not None:
+            memo_caches[name] = self
+
+    def _reset_process(self):
+        self.pid = os.getpid()
+        self.lock = Lock()
+        self.hits = self.misses = 0
+
+    def _check_process(self):
+        if self.pid != os.getpid():
+            self._reset_process()
+
+    def get(self, key, default=None):
+        self._check_process()
+        with self.lock:
+            value = self.entries.pop(key, MISSING)
+            if value is MISSING:
+                self.misses += 1
+                return default
+            self.entries[key] = value
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        self._check_process()
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = value
+            if len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        self._check_process()
+        with self.lock:
+            self.entries.clear()
+            self.hits = self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+
+def memoize(size=MEMO_SIZE):
+    '''Memoizes a pure function in a bounded LRU cache. The arguments must be
+       hashable. The returned values are shared and must not be modified.'''
+    def decorator(function):
+        memo = LRUCache(size, '{0}.{1}'.format(function.__module__,
+            function.__name__))
+
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if kwargs:
+                key = (args, tuple(sorted(kwargs.iteritems())))
+            else:
+                key = args
+            value = memo.get(key, MISSING)
+            if value is MISSING:
+                value = function(*args, **kwargs)
+                memo.put(key, value)
+            return value
+
+        wrapper.memo = memo
+        return wrapper
+    return decorator
+
+
+def get_memo_stats():
+    '''Returns [(name, hits, misses, size)] for the memoized functions and
+       the named caches.'''
+    return [(name, memo.hits, memo.misses, len(memo))
+            for (name, memo) in memo_caches.iteritems()]
+
+
+def clear_memos():
+    for memo in memo_caches.itervalues():
+        memo.clear()
@@ -6,18 +6,19 @@ import random
 import urlparse
 import urllib2
 import logging
-import shutil
-import codecs
 import gc
-from traceback import print_exc
 import chardet
 from itertools import izip_longest
-from django.db import transaction
+from threading import Thread
+from Queue import Queue
+from StringIO import StringIO
+from django.db import transaction, connections
 from django.conf import settings
 from django.contrib.contenttypes.models import ContentType
 
 from project.models import RecoDocError
 from docutil.url_util import get_sanitized_url, is_local
+from docutil import page_store
 from docutil.etree_util import get_html_tree
 
 USER_AGENTS = ["Mozilla/5.0 (X11; U; Linux i686; ru; rv:1.9.3a5pre) Gecko/20100526 Firefox/3.7a5pre",
@@ -34,6 +35,9 @@ REFERERS = ["http://www.google.com", "http://www.yahoo.com", "http://www.bing.co
 MAX_DOWNLOAD_RETRY = 2
 MODEL_FILE = 'model.pkl'
 
+# Call the garbage collector every n chunks in queryset_iterator.
+QUERYSET_GC_INTERVAL = getattr(settings, 'QUERYSET_GC_INTERVAL', 1)
+
 logger = logging.getLogger("recodoc.docutil.commands_util")
 
 
@@ -47,35 +51,60 @@ def call_gc():
             format(unreach, len(gc.garbage), gen0, gen1, gen2))
 
 
-def queryset_iterator_plus(queryset, extra_object, chunksize=1000):
-    '''
-    Iterate over a Django Queryset ordered by the primary key
+def queryset_iterator_plus(queryset, extra_object, chunksize=1000, **kwargs):
+    '''Same as queryset_iterator, but yields (row, extra_object).'''
+    for row in queryset_iterator(queryset, chunksize, **kwargs):
+        yield (row, extra_object)
 
-    This method loads a maximum of chunksize (default: 1000) rows in it's
-    memory at the same time while django normally would load all rows in it's
-    memory. Using the iterator() method only causes it to not preload all the
-    classes.
 
-    Note that the implementation of the iterator does not support ordered
-    query sets.
-    '''
-    try:
-        pk = 0
-        last_pk = queryset.order_by('-pk')[0].pk
-        queryset = queryset.order_by('pk')
-        while pk < last_pk:
-            for row in queryset.filter(pk__gt=pk)[:chunksize]:
-                pk = row.pk
-                yield (row, extra_object)
-            gc.collect()
-    except IndexError:
-        return
-    except Exception:
-        print_exc()
-        return
+class ChunkFetcher(Thread):
+    '''Fetches the chunks of a queryset_iterator in a background thread, on
+       its own database connection. The thread only sees committed rows.'''
+
+    def __init__(self, queryset, chunksize):
+        Thread.__init__(self)
+        self.daemon = True
+        self.queryset = queryset
+        self.chunksize = chunksize
+        self.requests = Queue()
+        self.results = Queue()
+        self.start()
+
+    def fetch(self, pk):
+        self.requests.put(pk)
+
+    def get(self):
+        (chunk, error) = self.results.get()
+        if error is not None:
+            raise error
+        return chunk
+
+    def run(self):
+        try:
+            while True:
+                pk = self.requests.get()
+                if pk is None:
+                    break
+                try:
+                    self.results.put((_get_chunk(self.queryset, pk,
+                        self.chunksize), None))
+                except Exception as error:
+                    self.results.put((None, error))
+        finally:
+            connections[self.queryset.db].close()
 
+    def close(self):
+        self.requests.put(None)
+        self.join()
 
-def queryset_iterator(queryset, chunksize=1000):
+
+def _get_chunk(queryset, pk, chunksize):
+    return list(queryset.filter(pk__gt=pk)[:chunksize])
+
+
+def queryset_iterator(queryset, chunksize=1000, fields=None,
+        select_related=None, chunk_func=None, gc_interval=None,
+        prefetch=False):
     '''
     Iterate over a Django Queryset ordered by the primary key
 
@@ -84,23 +113,59 @@ def queryset_iterator(queryset, chunksize=1000):
     memory. Using the iterator() method only causes it to not preload all the
     classes.
 
+    Each chunk is fetched with a single keyset query (pk > last pk). fields
+    restricts the loaded columns (only()) and select_related is a list of
+    relations to load with the rows. chunk_func, if provided, is called with
+    each chunk (a list of rows) before the rows are yielded (e.g., to load
+    related counts in one query). The garbage collector is called every
+    gc_interval chunks (QUERYSET_GC_INTERVAL by default, 0: never).
+
+    If prefetch is True, the next chunk is fetched in a background thread
+    while the current chunk is processed. The background thread uses its own
+    connection, so it does not see the rows modified by the current
+    uncommitted transaction. The errors raised while fetching a chunk,
+    including in the background thread, are raised to the caller.
+
     Note that the implementation of the iterator does not support ordered
     query sets.
     '''
+    if gc_interval is None:
+        gc_interval = QUERYSET_GC_INTERVAL
+    if fields is not None:
+        queryset = queryset.only(*fields)
+    if select_related is not None:
+        queryset = queryset.select_related(*select_related)
+    queryset = queryset.order_by('pk')
+
+    fetcher = None
     try:
-        pk = 0
-        last_pk = queryset.order_by('-pk')[0].pk
-        queryset = queryset.order_by('pk')
-        while pk < last_pk:
-            for row in queryset.filter(pk__gt=pk)[:chunksize]:
-                pk = row.pk
+        if prefetch:
+            fetcher = ChunkFetcher(queryset, chunksize)
+            fetcher.fetch(0)
+            chunk = fetcher.get()
+        else:
+            chunk = _get_chunk(queryset, 0, chunksize)
+        chunk_index = 0
+        while len(chunk) > 0:
+            last = len(chunk) < chunksize
+            if fetcher is not None and not last:
+                fetcher.fetch(chunk[-1].pk)
+            if chunk_func is not None:
+                chunk_func(chunk)
+            for row in chunk:
                 yield row
-            gc.collect()
-    except IndexError:
-        return
-    except Exception:
-        print_exc()
-        return
+            chunk_index += 1
+            if gc_interval > 0 and chunk_index % gc_interval == 0:
+                gc.collect()
+            if last:
+                break
+            elif fetcher is not None:
+                chunk = fetcher.get()
+            else:
+                chunk = _get_chunk(queryset, chunk[-1].pk, chunksize)
+    finally:
+        if fetcher is not None:
+            fetcher.close()
 
 
 def simple_decorator(decorator):
@@ -127,6 +192,13 @@ def simple_decorator(decorator):
     return new_decorator
 
 
+def print_delete_counts(counts):
+    '''Prints the number of rows deleted from each table (see
+       db_util.bulk_delete).'''
+    for (table, count) in counts.iteritems():
+        print('Deleted {0} rows from {1}'.format(count, table))
+
+
 def mkdir_safe(path):
     '''Creates a directory if it does not already exist'''
     if not os.path.exists(path):
@@ -181,6 +253,11 @@ def dump_model(model, pname, intermediate_path, key):
 
 
 def get_file_from(url):
+    if is_local(url):
+        path = urlparse.urlparse(url).path
+        if page_store.in_store(path):
+            return StringIO(page_store.read_page(path))
+
     trial = 0
     file_from = None
     while trial < MAX_DOWNLOAD_RETRY:
@@ -305,9 +382,7 @@ def download_file(file_from_path, file_to_path, force=False, binary=False,
         real_browser=False):
     url = get_sanitized_url(file_from_path)
 
-    if os.path.exists(file_to_path) and \
-       os.path.getsize(file_to_path) > 0 and \
-       not force:
+    if page_store.page_exists(file_to_path) and not force:
         logger.info('Skipped downloading {0} because it already exists in '
                 '{1}'.format(url, file_to_path))
         return
@@ -317,24 +392,14 @@ def download_file(file_from_path, file_to_path, force=False, binary=False,
         else:
             file_from = get_file_from_real_browser(url)
 
-        if binary:
-            file_to = open(file_to_path, 'wb')
-        else:
-            file_to = codecs.open(file_to_path, 'w', encoding='utf8')
-
         logger.info('Downloading {0} to {1} in mode binary? {2}'.format(url,
             file_to_path, binary))
+        content = file_from.read()
+        file_from.close()
         if not binary:
-            content = file_from.read()
             encoding = get_encoding(content)
             content = unicode(content, encoding)
-            file_to.write(content)
-            file_from.close()
-            file_to.close()
-        else:
-            shutil.copyfileobj(file_from, file_to)
-            file_from.close()
-            file_to.close()
+        page_store.write_page(file_to_path, content)
     except Exception:
         logger.info('Error while downloading a file: {0}'.format(
             url))
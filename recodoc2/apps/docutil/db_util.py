@@ -0,0 +1,224 @@
+from __future__ import unicode_literals
+import itertools
+from collections import OrderedDict
+from django.db import connection, transaction
+from django.contrib.contenttypes import generic
+from django.contrib.contenttypes.models import ContentType
+
+DEFAULT_CHUNK_SIZE = 1000
+
+# Replaced by the query selecting the ids of the deleted rows.
+ROOT_IDS = '__root_ids__'
+
+cursor_ids = itertools.count()
+
+
+def qn(name):
+    return connection.ops.quote_name(name)
+
+
+def chunks(seq, chunksize=DEFAULT_CHUNK_SIZE):
+    '''Yields successive lists of at most chunksize elements from seq.'''
+    chunk = []
+    for element in seq:
+        chunk.append(element)
+        if len(chunk) >= chunksize:
+            yield chunk
+            chunk = []
+    if len(chunk) > 0:
+        yield chunk
+
+
+def get_table(model):
+    return qn(model._meta.db_table)
+
+
+def get_column(model, field_name):
+    return qn(model._meta.get_field(field_name).column)
+
+
+def bulk_insert(model, columns, rows, chunksize=DEFAULT_CHUNK_SIZE):
+    '''Inserts rows (sequences of values ordered like columns) with one
+       executemany per chunk. save() and signals are bypassed, so the caller
+       must provide every non-null column (including _order for models using
+       order_with_respect_to). Returns the number of inserted rows.'''
+    sql = 'INSERT INTO {0} ({1}) VALUES ({2})'.format(
+            get_table(model),
+            ', '.join(qn(column) for column in columns),
+            ', '.join(['%s'] * len(columns)))
+    cursor = connection.cursor()
+    count = 0
+    for chunk in chunks(rows, chunksize):
+        cursor.executemany(sql, chunk)
+        count += len(chunk)
+    transaction.commit_unless_managed()
+    return count
+
+
+def reserve_pks(model, count):
+    '''Returns count new primary keys drawn from the sequence of the model
+       table (PostgreSQL), so that rows can be bulk inserted with their pk
+       and referenced by other bulk inserted rows.'''
+    if count == 0:
+        return []
+    cursor = connection.cursor()
+    cursor.execute('SELECT nextval(pg_get_serial_sequence(%s, %s)) FROM '
+            'generate_series(1, %s)',
+            [model._meta.db_table, model._meta.pk.column, count])
+    return [row[0] for row in cursor.fetchall()]
+
+
+def bulk_update_column(model, column, values, chunksize=DEFAULT_CHUNK_SIZE):
+    '''Sets column to a different value for each row with one UPDATE ... CASE
+       statement per chunk. values is a dict {pk: value}. Returns the number
+       of updated rows.'''
+    table = get_table(model)
+    pk_column = qn(model._meta.pk.column)
+    cursor = connection.cursor()
+    count = 0
+    for chunk in chunks(values.items(), chunksize):
+        sql = 'UPDATE {0} SET {1} = CASE {2} {3} END WHERE {2} IN ({4})'\
+                .format(table, qn(column), pk_column,
+                        ' '.join(['WHEN %s THEN %s'] * len(chunk)),
+                        ', '.join(['%s'] * len(chunk)))
+        params = []
+        for (pk, value) in chunk:
+            params.append(pk)
+            params.append(value)
+        params.extend(pk for (pk, _) in chunk)
+        cursor.execute(sql, params)
+        count += cursor.rowcount
+    transaction.commit_unless_managed()
+    return count
+
+
+def execute_update(sql, params=None):
+    '''Executes a data-modifying statement and returns the number of affected
+       rows.'''
+    cursor = connection.cursor()
+    cursor.execute(sql, params)
+    count = cursor.rowcount
+    transaction.commit_unless_managed()
+    return count
+
+
+def stream_rows(sql, params=None, chunksize=DEFAULT_CHUNK_SIZE):
+    '''Iterates over the rows of a query with a server-side (named) cursor
+       (PostgreSQL): only chunksize rows are fetched at a time, so the result
+       is never loaded at once. Several streams can be consumed together.'''
+    # Make sure that the connection is opened.
+    connection.cursor()
+    cursor = connection.connection.cursor(
+            name='stream_{0}'.format(next(cursor_ids)))
+    try:
+        cursor.execute(sql, params)
+        while True:
+            rows = cursor.fetchmany(chunksize)
+            if len(rows) == 0:
+                break
+            for row in rows:
+                yield row
+    finally:
+        cursor.close()
+
+
+def get_delete_statements(model, ids_sql=ROOT_IDS, path=()):
+    '''Returns the statements [(model, sql)] that delete the rows of model
+       whose pk is in ids_sql and, before them, the rows that depend on these
+       rows (reverse foreign keys, m2m rows and generic relations),
+       recursively, like Django's cascade. Each level selects its rows with
+       a subquery, so the statements must be executed in order.
+
+       Unlike Django 1.3, which deletes them, the rows outside the set that
+       reference a row of the set through a nullable self foreign key (e.g.,
+       the children of a section or the parameters of a method) are kept
+       and their reference is set to NULL. Non-nullable self foreign keys and
+       foreign keys to a model already on the path are not followed: the
+       rows that use them must be in the set. The foreign keys are checked
+       at the end of the transaction (DEFERRABLE INITIALLY DEFERRED on
+       PostgreSQL).'''
+    statements = []
+    path = path + (model,)
+    table = get_table(model)
+    pk_column = qn(model._meta.pk.column)
+
+    for field in model._meta.many_to_many:
+        if isinstance(field, generic.GenericRelation):
+            related_model = field.rel.to
+            content_type = ContentType.objects.get_for_model(model)
+            sub_sql = 'SELECT {0} FROM {1} WHERE {2} = {3} AND {4} IN ({5})'\
+                    .format(qn(related_model._meta.pk.column),
+                        get_table(related_model),
+                        get_column(related_model,
+                            field.content_type_field_name),
+                        int(content_type.pk),
+                        get_column(related_model, field.object_id_field_name),
+                        ids_sql)
+            statements.extend(get_delete_statements(related_model, sub_sql,
+                path))
+
+    for related in model._meta.get_all_related_objects(local_only=True,
+            include_hidden=True):
+        related_model = related.model
+        column = qn(related.field.column)
+        if related_model is model:
+            if related.field.null:
+                statements.append((model, 'UPDATE {0} SET {1} = NULL WHERE '
+                    '{1} IN ({2}) AND {3} NOT IN ({2})'.format(table, column,
+                        ids_sql, pk_column)))
+        elif related_model not in path:
+            sub_sql = 'SELECT {0} FROM {1} WHERE {2} IN ({3})'.format(
+                    qn(related_model._meta.pk.column),
+                    get_table(related_model), column, ids_sql)
+            statements.extend(get_delete_statements(related_model, sub_sql,
+                path))
+
+    # Multi-table inheritance: the parent rows share the pk of the rows.
+    parent_statements = []
+    for parent_model in model._meta.parents:
+        if parent_model not in path:
+            parent_statements.extend(get_delete_statements(parent_model,
+                ids_sql, path))
+
+    delete_statement = (model, 'DELETE FROM {0} WHERE {1} IN ({2})'.format(
+        table, pk_column, ids_sql))
+    if ids_sql == ROOT_IDS:
+        # The root ids are a list of pks: the parent rows are deleted after
+        # the rows, like Django does.
+        statements.append(delete_statement)
+        statements.extend(parent_statements)
+    else:
+        # ids_sql selects the pks from the table of the model, so the parent
+        # rows must be deleted while the rows still exist.
+        statements.extend(parent_statements)
+        statements.append(delete_statement)
+    return statements
+
+
+@transaction.commit_on_success
+def _execute_deletes(statements, ids_sql, params, counts):
+    cursor = connection.cursor()
+    for (model, sql) in statements:
+        cursor.execute(sql.replace(ROOT_IDS, ids_sql),
+                list(params) * sql.count(ROOT_IDS))
+        if sql.startswith('DELETE'):
+            table = model._meta.db_table
+            counts[table] = counts.get(table, 0) + cursor.rowcount
+
+
+def bulk_delete(queryset, chunksize=None):
+    '''Deletes the rows of a queryset and the rows that depend on them with
+       one set-based statement per table (see get_delete_statements) in one
+       transaction, or in one transaction per chunk of chunksize rows to keep
+       the locks short. The pks of the queryset are fetched first, so the
+       statements never evaluate the queryset on tables they already
+       changed. Returns {table: number of deleted rows}.'''
+    statements = get_delete_statements(queryset.model)
+    counts = OrderedDict()
+    pks = list(queryset.values_list('pk', flat=True).order_by('pk'))
+    if chunksize is None:
+        chunksize = max(len(pks), 1)
+    for chunk in chunks(pks, chunksize):
+        _execute_deletes(statements, ', '.join(['%s'] * len(chunk)),
+                chunk, counts)
+    return counts
@@ -0,0 +1,33 @@
+from __future__ import unicode_literals
+import os
+from django.conf import settings
+from django.core.management.base import NoArgsCommand
+from optparse import make_option
+from docutil.commands_util import recocommand
+from docutil.progress_monitor import CLIProgressMonitor
+from docutil.str_util import smart_decode
+from docutil.page_store import pack_pages, get_store
+
+
+class Command(NoArgsCommand):
+    option_list = NoArgsCommand.option_list + (
+        make_option('--path', action='store', dest='path',
+            default='', help='Path relative to PROJECT_FS_ROOT'),
+        make_option('--codec', action='store', dest='codec',
+            default='zlib', help='Compression: zlib or lzma'),
+        make_option('--remove', action='store_true', dest='remove',
+            default=False, help='Remove the packed files'),
+    )
+    help = "Move downloaded pages to the compressed page store"
+
+    @recocommand
+    def handle_noargs(self, **options):
+        path = smart_decode(options.get('path'))
+        codec = smart_decode(options.get('codec'))
+        remove = options.get('remove', False)
+        count = pack_pages(os.path.join(settings.PROJECT_FS_ROOT, path),
+                codec, remove, CLIProgressMonitor())
+        (pages, blobs, size, blob_size) = get_store().stats()
+        print('Packed {0} files'.format(count))
+        print('Page store: {0} pages ({1} bytes), {2} blobs ({3} bytes)'
+                .format(pages, size, blobs, blob_size))
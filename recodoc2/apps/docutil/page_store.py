@@ -0,0 +1,196 @@
+from __future__ import unicode_literals
+import os
+import zlib
+import sqlite3
+import hashlib
+import logging
+from django.conf import settings
+from docutil.url_util import get_relative_url
+from docutil.progress_monitor import NullProgressMonitor
+
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+
+STORE_DIR = '.pages'
+MANIFEST_FILE = 'manifest.db'
+
+COMPRESSORS = {'zlib': (lambda content: zlib.compress(content, 6),
+                        zlib.decompress)}
+if lzma is not None:
+    COMPRESSORS['lzma'] = (lzma.compress, lzma.decompress)
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS page (
+    path TEXT PRIMARY KEY,
+    digest TEXT NOT NULL,
+    codec TEXT NOT NULL,
+    size INTEGER NOT NULL);
+CREATE INDEX IF NOT EXISTS page_digest ON page (digest);
+'''
+
+logger = logging.getLogger("recodoc.docutil.page_store")
+
+stores = {}
+
+
+def get_codec():
+    '''Returns the compression of the page store ('zlib' or 'lzma') or None
+       if pages are stored as plain files.'''
+    return getattr(settings, 'PAGE_STORE', None)
+
+
+def get_store():
+    '''Returns the page store of the current process. Worker processes each
+       open their own manifest connection.'''
+    key = (os.getpid(), settings.PROJECT_FS_ROOT)
+    if key not in stores:
+        stores[key] = PageStore(settings.PROJECT_FS_ROOT)
+    return stores[key]
+
+
+def in_store(path):
+    '''Returns True if the page located at path (absolute or relative to
+       PROJECT_FS_ROOT) has been stored in the page store.'''
+    codec = get_codec()
+    if codec is None and not os.path.exists(get_manifest_path()):
+        return False
+    return get_store().contains(path)
+
+
+def page_exists(path):
+    return in_store(path) or \
+        (os.path.exists(path) and os.path.getsize(path) > 0)
+
+
+def read_page(path):
+    '''Returns the raw content of the page located at path. The page store is
+       looked up first, then the file system.'''
+    if in_store(path):
+        return get_store().get(path)
+    else:
+        with open(path, 'rb') as page_file:
+            return page_file.read()
+
+
+def write_page(path, content):
+    '''Writes the page in the page store if it is enabled. Otherwise, the page
+       is written to path. content is a str or a unicode string (utf8).'''
+    if isinstance(content, unicode):
+        content = content.encode('utf8')
+    codec = get_codec()
+    if codec is None:
+        with open(path, 'wb') as page_file:
+            page_file.write(content)
+    else:
+        get_store().put(path, content, codec)
+
+
+def get_manifest_path(root=None):
+    if root is None:
+        root = settings.PROJECT_FS_ROOT
+    return os.path.join(root, STORE_DIR, MANIFEST_FILE)
+
+
+class PageStore(object):
+    '''Content-addressed store of compressed pages. Blobs are named after the
+       sha1 of their uncompressed content, so identical pages (e.g., across
+       releases of a document) are stored once. The manifest maps the local
+       path of a page (relative to root) to its blob.'''
+
+    def __init__(self, root):
+        self.root = root
+        self.blob_root = os.path.join(root, STORE_DIR)
+        if not os.path.exists(self.blob_root):
+            os.makedirs(self.blob_root)
+        self.conn = sqlite3.connect(get_manifest_path(root), timeout=60)
+        self.conn.executescript(SCHEMA)
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    def get_key(self, path):
+        return get_relative_url(path, self.root)
+
+    def get_blob_path(self, digest, codec):
+        return os.path.join(self.blob_root, digest[:2],
+                '{0}.{1}'.format(digest, codec))
+
+    def contains(self, path):
+        row = self.conn.execute('SELECT 1 FROM page WHERE path = ?',
+                (self.get_key(path),)).fetchone()
+        return row is not None
+
+    def get(self, path):
+        row = self.conn.execute('SELECT digest, codec FROM page WHERE '
+                'path = ?', (self.get_key(path),)).fetchone()
+        if row is None:
+            return None
+        (digest, codec) = row
+        with open(self.get_blob_path(digest, codec), 'rb') as blob_file:
+            return COMPRESSORS[codec][1](blob_file.read())
+
+    def put(self, path, content, codec='zlib'):
+        digest = hashlib.sha1(content).hexdigest()
+        blob_path = self.get_blob_path(digest, codec)
+        if not os.path.exists(blob_path):
+            blob_dir = os.path.dirname(blob_path)
+            if not os.path.exists(blob_dir):
+                os.makedirs(blob_dir)
+            # Write then rename so that a reader never sees a partial blob.
+            temp_path = '{0}.{1}.tmp'.format(blob_path, os.getpid())
+            with open(temp_path, 'wb') as blob_file:
+                blob_file.write(COMPRESSORS[codec][0](content))
+            os.rename(temp_path, blob_path)
+        self.conn.execute('INSERT OR REPLACE INTO page (path, digest, codec, '
+                'size) VALUES (?, ?, ?, ?)',
+                (self.get_key(path), digest, codec, len(content)))
+        self.conn.commit()
+        return digest
+
+    def pack(self, path, codec='zlib', remove=False):
+        '''Moves an existing file into the store.'''
+        with open(path, 'rb') as page_file:
+            content = page_file.read()
+        digest = self.put(path, content, codec)
+        if remove:
+            os.remove(path)
+        return digest
+
+    def stats(self):
+        '''Returns (number of pages, number of blobs, uncompressed size of the
+           pages, uncompressed size of the blobs).'''
+        (pages, size) = self.conn.execute('SELECT COUNT(*), '
+                'COALESCE(SUM(size), 0) FROM page').fetchone()
+        (blobs, blob_size) = self.conn.execute('SELECT COUNT(*), '
+                'COALESCE(SUM(size), 0) FROM (SELECT digest, MAX(size) AS '
+                'size FROM page GROUP BY digest) AS blob').fetchone()
+        return (pages, blobs, size, blob_size)
+
+
+def pack_pages(path, codec='zlib', remove=False,
+        progress_monitor=NullProgressMonitor()):
+    '''Moves all the files under path (e.g., a document or a channel directory)
+       into the page store.'''
+    file_paths = []
+    for (dirpath, dirnames, filenames) in os.walk(path):
+        if STORE_DIR in dirnames:
+            dirnames.remove(STORE_DIR)
+        for filename in filenames:
+            if filename.endswith('.pkl') or filename.endswith('.db'):
+                # Models are not pages.
+                continue
+            file_paths.append(os.path.join(dirpath, filename))
+
+    store = get_store()
+    progress_monitor.start('Packing pages', len(file_paths))
+    for file_path in file_paths:
+        store.pack(file_path, codec, remove)
+        progress_monitor.work(file_path, 1)
+    progress_monitor.done()
+    return len(file_paths)
@@ -0,0 +1,196 @@
+from __future__ import unicode_literals
+import hashlib
+import random
+import zlib
+from itertools import chain
+import docutil.cache_util as cu
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+PROFILE_CACHE_SIZE = 100000
+
+# Below this number of candidates, the pure-Python version is faster.
+NUMPY_MIN_SIZE = 16
+
+MINHASH_SIZE = 64
+
+# 16 bands of 4 rows: sections whose shingles have a Jaccard similarity of
+# 0.5 share at least one band with a probability of 0.64 (more than 0.99
+# for 0.8).
+MINHASH_BANDS = 16
+
+SHINGLE_SIZE = 3
+
+MERSENNE_PRIME = (1 << 61) - 1
+
+MAX_HASH = (1 << 32) - 1
+
+# The permutations are generated with a fixed seed so that the signatures
+# computed (and saved) by different processes can be compared.
+_random = random.Random(42)
+MINHASH_PERMUTATIONS = [(_random.randint(1, MERSENNE_PRIME - 1),
+    _random.randint(0, MERSENNE_PRIME - 1)) for _ in xrange(MINHASH_SIZE)]
+
+# {string: bigram profile}
+profiles = cu.LRUCache(PROFILE_CACHE_SIZE, 'simil_util.profiles')
+
+
+def get_profile(s):
+    '''Returns the bigram profile of s: the sorted codes of its distinct
+       uppercase bigrams. Profiles are cached by string.'''
+    profile = profiles.get(s)
+    if profile is None:
+        upper = s.upper().strip()
+        codes = set((ord(upper[i]) << 21) | ord(upper[i + 1])
+                for i in xrange(len(upper) - 1))
+        profile = tuple(sorted(codes))
+        profiles.put(s, profile)
+    return profile
+
+
+def _dice(intersection, union):
+    if union == 0:
+        return 0.0
+    else:
+        return (intersection * 2.0) / float(union)
+
+
+def simil(s1, s2):
+    '''Same as str_util.pairwise_simil (Dice coefficient of the bigrams),
+       with cached profiles.'''
+    if s1 == s2:
+        return 1.0
+
+    if len(s1) == 1 or len(s2) == 1:
+        return 0.0
+
+    profile1 = get_profile(s1)
+    profile2 = set(get_profile(s2))
+    intersection = sum(1 for code in profile1 if code in profile2)
+    return _dice(intersection, len(profile1) + len(profile2))
+
+
+def _simil_python(query, query_profile, candidates, candidate_profiles):
+    query_set = set(query_profile)
+    query_size = len(query_profile)
+    scores = []
+    for profile in candidate_profiles:
+        intersection = sum(1 for code in profile if code in query_set)
+        scores.append(_dice(intersection, query_size + len(profile)))
+    return scores
+
+
+def _simil_numpy(query, query_profile, candidates, candidate_profiles):
+    lengths = numpy.array([len(profile) for profile in candidate_profiles],
+            dtype=numpy.int64)
+    codes = numpy.fromiter(chain.from_iterable(candidate_profiles),
+            dtype=numpy.int64, count=int(lengths.sum()))
+    hits = numpy.in1d(codes, numpy.array(query_profile, dtype=numpy.int64))
+    hit_sums = numpy.concatenate(([0], numpy.cumsum(hits)))
+    ends = numpy.cumsum(lengths)
+    intersections = hit_sums[ends] - hit_sums[ends - lengths]
+    unions = lengths + len(query_profile)
+    return numpy.where(unions > 0,
+            (intersections * 2.0) / numpy.maximum(unions, 1), 0.0)
+
+
+def simil_array(query, candidates, use_numpy=None):
+    '''Returns the similarity (see simil) between query and each candidate.
+       The result is a NumPy array if NumPy is used, a list otherwise.'''
+    if use_numpy is None:
+        use_numpy = numpy is not None and len(candidates) >= NUMPY_MIN_SIZE
+
+    query_profile = get_profile(query)
+    candidate_profiles = [get_profile(candidate) for candidate in candidates]
+    if use_numpy:
+        scores = _simil_numpy(query, query_profile, candidates,
+                candidate_profiles)
+    else:
+        scores = _simil_python(query, query_profile, candidates,
+                candidate_profiles)
+
+    single = len(query) == 1
+    for index, candidate in enumerate(candidates):
+        if candidate == query:
+            scores[index] = 1.0
+        elif single or len(candidate) == 1:
+            scores[index] = 0.0
+
+    return scores
+
+
+def argmax(scores):
+    '''Returns the index of the first highest score or -1 if there is no
+       score.'''
+    if len(scores) == 0:
+        return -1
+    elif numpy is not None and isinstance(scores, numpy.ndarray):
+        return int(numpy.argmax(scores))
+    else:
+        return scores.index(max(scores))
+
+
+def threshold_mask(scores, threshold):
+    '''Returns a mask that is True for the scores >= threshold.'''
+    if numpy is not None and isinstance(scores, numpy.ndarray):
+        return scores >= threshold
+    else:
+        return [score >= threshold for score in scores]
+
+
+def get_content_hash(text):
+    '''Returns the SHA-1 of text with normalized white spaces, or None if
+       text is empty.'''
+    words = text.split() if text is not None else []
+    if len(words) == 0:
+        return None
+    return hashlib.sha1(' '.join(words).encode('utf8')).hexdigest()
+
+
+def get_shingles(text, size=SHINGLE_SIZE):
+    '''Returns the 32-bit hashes of the distinct word shingles of text.'''
+    words = text.lower().split() if text is not None else []
+    if 0 < len(words) < size:
+        size = len(words)
+    return set(zlib.crc32(' '.join(words[i:i + size]).encode('utf8')) &
+            MAX_HASH for i in xrange(len(words) - size + 1))
+
+
+def get_minhash(text):
+    '''Returns the MinHash signature (list of MINHASH_SIZE integers) of the
+       shingles of text, or None if text is empty.'''
+    shingles = get_shingles(text)
+    if len(shingles) == 0:
+        return None
+    return [min(((a * shingle + b) % MERSENNE_PRIME) & MAX_HASH
+        for shingle in shingles) for (a, b) in MINHASH_PERMUTATIONS]
+
+
+def encode_minhash(signature):
+    if signature is None:
+        return None
+    return ','.join(str(value) for value in signature)
+
+
+def decode_minhash(text):
+    if not text:
+        return None
+    return [int(value) for value in text.split(',')]
+
+
+def minhash_simil(signature1, signature2):
+    '''Estimates the Jaccard similarity of two MinHash signatures.'''
+    same = sum(1 for (value1, value2) in zip(signature1, signature2)
+            if value1 == value2)
+    return float(same) / len(signature1)
+
+
+def get_lsh_bands(signature, bands=MINHASH_BANDS):
+    '''Returns the (band index, band values) keys of a signature: two
+       signatures that share a key are candidate near duplicates.'''
+    rows = len(signature) // bands
+    return [(band, tuple(signature[band * rows:(band + 1) * rows]))
+            for band in xrange(bands)]
@@ -1,13 +1,25 @@
 from __future__ import unicode_literals
 import os
+import shutil
+import tempfile
 from lxml import etree
-from django.test import TestCase
+from django.test import TestCase, TransactionTestCase
+from django.db import DatabaseError
+from django.db.models.deletion import Collector
+from django.contrib.contenttypes.models import ContentType
 from django.conf import settings
 import docutil.url_util as uu
 import docutil.commands_util as cc
 import docutil.str_util as su
+import docutil.simil_util as simil
 import docutil.cache_util as cu
 import docutil.etree_util as eu
+import docutil.page_store as ps
+import docutil.db_util as du
+from project.models import Project, ProjectRelease
+from codebase.models import CodeBase, CodeElement, MethodElement,\
+        ParameterElement, SingleCodeReference, CodeSnippet, CodeElementLink
+from doc.models import Document, Page, Section, DocDiff, SectionMatcher
 
 
 page_test = '''
@@ -159,6 +171,226 @@ class CommandsUtilTest(TestCase):
         file_from.close()
 
 
+class QuerysetIteratorTest(TransactionTestCase):
+    def setUp(self):
+        for i in xrange(4):
+            Project.objects.create(name='project{0}'.format(i),
+                    url='http://www.example.com/{0}'.format(i),
+                    dir_name='project{0}'.format(i))
+        self.names = ['project{0}'.format(i) for i in xrange(4)]
+
+    def test_empty(self):
+        query = Project.objects.filter(name='missing')
+        self.assertEqual([], list(cc.queryset_iterator(query)))
+        self.assertEqual([], list(cc.queryset_iterator(query,
+            prefetch=True)))
+
+    def test_exact_multiple(self):
+        for prefetch in (False, True):
+            chunks = []
+            projects = list(cc.queryset_iterator(Project.objects.all(), 2,
+                chunk_func=lambda chunk: chunks.append(len(chunk)),
+                prefetch=prefetch))
+            self.assertEqual(self.names,
+                    [project.name for project in projects])
+            self.assertEqual([2, 2], chunks)
+
+    def test_chunk_func(self):
+        chunks = []
+
+        def chunk_func(chunk):
+            chunks.append([project.name for project in chunk])
+
+        projects = cc.queryset_iterator(Project.objects.all(), 3,
+                fields=['name'], chunk_func=chunk_func, gc_interval=0)
+        self.assertEqual(self.names, [project.name for project in projects])
+        self.assertEqual([self.names[:3], self.names[3:]], chunks)
+
+    def test_prefetch_error(self):
+        query = Project.objects.extra(where=['1 / 0 = 1'])
+        self.assertRaises(DatabaseError, list, cc.queryset_iterator(query,
+            2, prefetch=True))
+
+
+class ImportTest(TestCase):
+    '''Imports the parser and action modules that depend on the helpers of
+       commands_util.'''
+
+    modules = ['channel.parser.generic_parser', 'doc.parser.generic_parser',
+        'recommender.parser.pattern_coverage', 'recommender.actions',
+        'doc.actions', 'channel.actions', 'codebase.actions']
+
+    def test_imports(self):
+        for module in self.modules:
+            __import__(module)
+        self.assertEqual([[1, 3], [2, 4]],
+                [list(chunk) for chunk in cc.chunk_it([1, 2, 3, 4], 2)])
+        self.assertEqual(3, cc.size([1, 2, 3]))
+
+
+class BulkDeleteTest(TestCase):
+
+    def setUp(self):
+        project = Project.objects.create(name='project1',
+                url='http://www.example.com', dir_name='project1')
+        release = ProjectRelease.objects.create(project=project,
+                release='1.0')
+        self.codebase = CodeBase.objects.create(name='core',
+                project_release=release)
+        self.element = CodeElement.objects.create(codebase=self.codebase,
+                fqn='p.Foo')
+        document = Document.objects.create(title='doc',
+                project_release=release)
+        self.page1 = Page.objects.create(document=document, title='page1')
+        self.page2 = Page.objects.create(document=document, title='page2')
+        self.section_type = ContentType.objects.get_for_model(Section)
+        self.page_type = ContentType.objects.get_for_model(Page)
+
+    def add_section(self, page, parent=None):
+        section = Section.objects.create(page=page, parent=parent)
+        reference = SingleCodeReference.objects.create(
+                local_content_type=self.section_type,
+                local_object_id=section.pk,
+                global_content_type=self.page_type, global_object_id=page.pk)
+        CodeElementLink.objects.create(code_reference=reference,
+                code_element=self.element, rationale='test',
+                linker_name='test')
+        return section
+
+    def get_collected(self, queryset):
+        '''Returns {model: pks} of the rows that Django would delete.'''
+        collector = Collector(using=queryset.db)
+        collector.collect(queryset)
+        return dict((model, set(instance.pk for instance in instances))
+                for (model, instances) in collector.data.iteritems())
+
+    def check_delete(self, queryset):
+        '''Deletes the rows with bulk_delete and checks that the rows
+           collected by Django have been deleted, and only them.'''
+        collected = self.get_collected(queryset)
+        models = dict((model._meta.db_table, model) for (model, _) in
+                du.get_delete_statements(queryset.model))
+        for model in collected:
+            self.assertTrue(model._meta.db_table in models)
+
+        counts = du.bulk_delete(queryset)
+        for (model, pks) in collected.iteritems():
+            table = model._meta.db_table
+            self.assertEqual(len(pks), counts.get(table, 0), table)
+            self.assertFalse(model.objects.filter(pk__in=pks).exists())
+        tables = set(model._meta.db_table for model in collected)
+        for (table, count) in counts.iteritems():
+            if count > 0 and table not in tables:
+                # Django deletes the m2m rows in batches.
+                self.assertTrue(models[table]._meta.auto_created, table)
+        return collected
+
+    def test_delete_page(self):
+        section1 = self.add_section(self.page1)
+        section2 = self.add_section(self.page1, section1)
+        section3 = self.add_section(self.page2)
+        SingleCodeReference.objects.create(
+                title_content_type=self.section_type,
+                title_object_id=section2.pk)
+        snippet = CodeSnippet.objects.create(
+                local_content_type=self.section_type,
+                local_object_id=section1.pk,
+                global_content_type=self.page_type,
+                global_object_id=self.page1.pk)
+        reference = SingleCodeReference.objects.create(snippet=snippet)
+        CodeElementLink.objects.create(code_reference=reference,
+                code_element=self.element, rationale='test',
+                linker_name='test')
+        SectionMatcher.objects.create(section_from=section1,
+                section_to=section3)
+        diff = DocDiff.objects.create()
+        diff.removed_pages.add(self.page1)
+
+        collected = self.check_delete(Page.objects.filter(pk=self.page1.pk))
+        self.assertEqual(set([section1.pk, section2.pk]),
+                collected[Section])
+        self.assertEqual(4, len(collected[SingleCodeReference]))
+        self.assertEqual(3, len(collected[CodeElementLink]))
+        self.assertEqual(0, diff.removed_pages.count())
+        self.assertEqual([section3.pk],
+                list(Section.objects.values_list('pk', flat=True)))
+        self.assertEqual(1, SingleCodeReference.objects.count())
+        self.assertEqual(1, CodeElementLink.objects.count())
+        self.assertEqual(1, CodeElement.objects.count())
+
+    def test_delete_code_elements(self):
+        clazz = CodeElement.objects.create(codebase=self.codebase,
+                fqn='p.Bar')
+        clazz.containers.add(self.element)
+        clazz.parents.add(self.element)
+        method1 = MethodElement.objects.create(codebase=self.codebase,
+                fqn='p.Bar.baz')
+        method1.containers.add(clazz)
+        method2 = MethodElement.objects.create(codebase=self.codebase,
+                fqn='p.Bar.baz')
+        method2.containers.add(clazz)
+        method1.overloads.add(method2)
+        ParameterElement.objects.create(codebase=self.codebase, fqn='int',
+                attcontainer=method1, type_simple_name='int')
+        reference = SingleCodeReference.objects.create()
+        CodeElementLink.objects.create(code_reference=reference,
+                code_element=method1, rationale='test', linker_name='test')
+
+        collected = self.check_delete(
+                CodeElement.objects.filter(codebase=self.codebase))
+        self.assertEqual(5, len(collected[CodeElement]))
+        self.assertEqual(set([method1.pk, method2.pk]),
+                collected[MethodElement])
+        self.assertEqual(1, len(collected[ParameterElement]))
+        self.assertEqual(0, CodeElement.objects.count())
+        self.assertEqual(0, CodeElementLink.objects.count())
+        self.assertEqual(1, SingleCodeReference.objects.count())
+
+    def test_delete_child_model(self):
+        clazz = CodeElement.objects.create(codebase=self.codebase,
+                fqn='p.Bar')
+        methods = []
+        for fqn in ('p.Bar.baz', 'p.Foo.baz'):
+            method = MethodElement.objects.create(codebase=self.codebase,
+                    fqn=fqn)
+            method.containers.add(clazz)
+            methods.append(method.pk)
+        MethodElement.objects.get(pk=methods[0]).overloads.add(methods[1])
+        reference = SingleCodeReference.objects.create()
+        CodeElementLink.objects.create(code_reference=reference,
+                code_element_id=methods[0], rationale='test',
+                linker_name='test')
+
+        # The queryset filters on the parent table (codebase).
+        collected = self.check_delete(
+                MethodElement.objects.filter(codebase=self.codebase))
+        self.assertEqual(set(methods), collected[MethodElement])
+        self.assertEqual(set(methods), collected[CodeElement])
+        self.assertEqual(0, MethodElement.objects.count())
+        self.assertEqual(set([self.element.pk, clazz.pk]),
+                set(CodeElement.objects.values_list('pk', flat=True)))
+        self.assertEqual(0, CodeElementLink.objects.count())
+
+    def test_self_reference(self):
+        section1 = self.add_section(self.page1)
+        section2 = self.add_section(self.page1, section1)
+        section3 = self.add_section(self.page1, section2)
+        queryset = Section.objects.filter(pk=section1.pk)
+
+        # Django deletes the children of the section, recursively.
+        self.assertEqual(set([section1.pk, section2.pk, section3.pk]),
+                self.get_collected(queryset)[Section])
+
+        # bulk_delete sets the parent of the first child to NULL.
+        counts = du.bulk_delete(queryset)
+        self.assertEqual(1, counts[Section._meta.db_table])
+        self.assertEqual(1, counts[SingleCodeReference._meta.db_table])
+        self.assertEqual(None, Section.objects.get(pk=section2.pk).parent_id)
+        self.assertEqual(section2.pk,
+                Section.objects.get(pk=section3.pk).parent_id)
+        self.assertEqual(2, SingleCodeReference.objects.count())
+
+
 class UrlUtilTest(TestCase):
     def test_check_url(self):
         self.assertTrue(uu.check_url('www.infobart.com', '/'))
@@ -255,6 +487,57 @@ class StrUtilTest(TestCase):
         self.assertEqual('Hello world', su.find_sentence(p2, 0, len('Hello')))
 
 
+class SimilUtilTest(TestCase):
+    strings = ['Foo', 'foo', 'FooBar', 'BarFoo', 'Session', 'SessionImpl',
+            'org.hibernate.Session', 'org.hibernate.SessionFactory', 'F',
+            'o', 'HttpClient', 'HttpClientParams', 'httpclient']
+
+    def test_simil(self):
+        for s1 in self.strings:
+            for s2 in self.strings:
+                self.assertEqual(su.pairwise_simil(s1, s2),
+                        simil.simil(s1, s2))
+
+    def test_simil_array(self):
+        for s1 in self.strings:
+            expected = [su.pairwise_simil(s1, s2) for s2 in self.strings]
+            python_scores = simil.simil_array(s1, self.strings, False)
+            self.assertEqual(expected, list(python_scores))
+            if simil.numpy is not None:
+                numpy_scores = simil.simil_array(s1, self.strings, True)
+                self.assertEqual(expected, list(numpy_scores))
+
+    def test_argmax(self):
+        scores = simil.simil_array('SessionImp', self.strings)
+        self.assertEqual(5, simil.argmax(scores))
+        self.assertEqual(-1, simil.argmax([]))
+        mask = simil.threshold_mask(scores, 0.8)
+        self.assertEqual([4, 5],
+                [i for (i, match) in enumerate(mask) if match])
+
+    def test_minhash(self):
+        text1 = 'The Session interface is the main runtime interface ' \
+                'between a Java application and Hibernate.'
+        text2 = 'The  Session interface is the main runtime interface\n' \
+                'between a Java application and Hibernate!'
+        self.assertEqual(simil.get_content_hash(text1),
+                simil.get_content_hash(' ' + text1 + '\n'))
+        self.assertNotEqual(simil.get_content_hash(text1),
+                simil.get_content_hash(text2))
+        self.assertEqual(None, simil.get_content_hash('  '))
+
+        signature1 = simil.get_minhash(text1)
+        signature2 = simil.get_minhash(text2)
+        self.assertEqual(simil.MINHASH_SIZE, len(signature1))
+        self.assertEqual(signature1,
+                simil.decode_minhash(simil.encode_minhash(signature1)))
+        self.assertEqual(1.0, simil.minhash_simil(signature1, signature1))
+        self.assertTrue(simil.minhash_simil(signature1, signature2) > 0.5)
+        self.assertTrue(set(simil.get_lsh_bands(signature1)) &
+                set(simil.get_lsh_bands(signature2)))
+        self.assertEqual(None, simil.get_minhash(''))
+
+
 def func1():
     return 3
 
@@ -314,3 +597,69 @@ class CacheUtilTest(TestCase):
             'p', 'k2', func2, [1, 5]))
         self.assertEqual(4, cu.cache_miss)
         self.assertEqual(6, cu.cache_total)
+
+    def test_lru_cache(self):
+        lru = cu.LRUCache(2)
+        lru.put('a', 1)
+        lru.put('b', 2)
+        self.assertEqual(1, lru.get('a'))
+        lru.put('c', 3)
+        self.assertEqual(None, lru.get('b'))
+        self.assertEqual(1, lru.get('a'))
+        self.assertEqual(3, lru.get('c'))
+        self.assertEqual(2, len(lru))
+        self.assertEqual(3, lru.hits)
+        self.assertEqual(1, lru.misses)
+
+    def test_named_lru_cache(self):
+        lru = cu.LRUCache(2, 'test.lru')
+        lru.put('a', 1)
+        lru.get('a')
+        lru.get('b')
+        self.assertTrue(('test.lru', 1, 1, 1) in cu.get_memo_stats())
+
+    def test_memoize(self):
+        calls = []
+
+        @cu.memoize(10)
+        def add(arg1, arg2=0):
+            calls.append(arg1)
+            return arg1 + arg2
+
+        self.assertEqual(3, add(1, 2))
+        self.assertEqual(3, add(1, 2))
+        self.assertEqual(4, add(1, arg2=3))
+        self.assertEqual(2, len(calls))
+        self.assertEqual(1, add.memo.hits)
+
+
+class PageStoreTest(TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.store = ps.PageStore(self.root)
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.root)
+
+    def test_put_get(self):
+        path = os.path.join(self.root, 'doc1', 'page.html')
+        self.assertFalse(self.store.contains(path))
+        self.store.put(path, page_test.encode('utf8'))
+        self.assertTrue(self.store.contains(path))
+        self.assertTrue(self.store.contains('doc1/page.html'))
+        self.assertEqual(page_test.encode('utf8'), self.store.get(path))
+
+    def test_dedup(self):
+        content = page_test.encode('utf8')
+        digest1 = self.store.put(os.path.join(self.root, 'doc1', 'p.html'),
+                content)
+        digest2 = self.store.put(os.path.join(self.root, 'doc2', 'p.html'),
+                content)
+        self.store.put(os.path.join(self.root, 'doc2', 'p2.html'), b'other')
+        self.assertEqual(digest1, digest2)
+        (pages, blobs, size, blob_size) = self.store.stats()
+        self.assertEqual(3, pages)
+        self.assertEqual(2, blobs)
+        self.assertEqual(2 * len(content) + 5, size)
+        self.assertEqual(len(content) + 5, blob_size)
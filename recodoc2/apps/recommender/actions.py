@@ -1,113 +1,55 @@
 from __future__ import unicode_literals
-from django.db import connection
+from collections import defaultdict
 from django.contrib.contenttypes.models import ContentType
 from docutil.progress_monitor import CLIProgressMonitor
-from docutil.commands_util import get_content_type, dictfetchall
+from docutil.commands_util import get_content_type
 from docutil.str_util import normalize
+from docutil.db_util import bulk_insert, chunks, stream_rows
 from project.models import ProjectRelease
 from codebase.models import CodeBase, CodeElementLink, CodeElement
+from codebase.actions import get_first_containers
+from codebase.overloads import get_element_keys, get_overload_index
 from recommender.models import CodePattern, CodePatternCoverage,\
         DocumentationPattern,\
         CoverageDiff, SuperAddRecommendation, RemoveRecommendation,\
         HighLink, CodeLink
 import recommender.parser.pattern_coverage as pcoverage
-
-
-SRC_SNIPPET_QUERY = 'AND code1.snippet_id is NULL'
-
-DST_SNIPPET_QUERY = 'AND code2.snippet_id is NULL'
-
-SUB_QUERIES="""
-WITH scts AS (
-    SELECT code1.local_object_id as section_id,
-           link1.code_element_id as section_code_id
-    FROM codebase_singlecodereference as code1, 
-         codebase_codeelementlink as link1, 
-         codebase_codeelement as ce1
-    WHERE link1.index=0 AND link1.code_reference_id = code1.id AND
-          link1.code_element_id = ce1.id AND
-          ce1.codebase_id = {codebase_id} AND
-          code1.resource_object_id={src_resource_id} AND
-          code1.{src_type_type}_content_type_id={src_content_type}
-          {src_snippet_query}
-    GROUP BY code1.{src_type_type}_object_id, link1.code_element_id
-    ),
-
-    msgs AS (
-    SELECT code2.local_object_id as msg_id, 
-           link2.code_element_id as msg_code_id
-    FROM codebase_singlecodereference as code2, 
-         codebase_codeelementlink as link2, 
-         codebase_codeelement as ce2
-    WHERE link2.index=0 AND link2.code_reference_id = code2.id AND
-          link2.code_element_id = ce2.id AND
-          ce2.codebase_id = {codebase_id} AND
-          code2.resource_object_id={dst_resource_id} AND
-          code2.{dst_type_type}_content_type_id={dst_content_type}
-          {dst_snippet_query}
-    GROUP BY code2.{src_type_type}_object_id, link2.code_element_id
-    ),
-
-    common AS (
-    SELECT scts.section_id AS section_id,
-           msgs.msg_id AS msg_id,
-           scts.section_code_id as code_id
-    FROM scts, msgs
-    WHERE scts.section_code_id = msgs.msg_code_id
-    ),
-
-    common_size AS (
-    SELECT scts.section_id AS section_id,
-           msgs.msg_id AS msg_id,
-           COUNT(scts.section_code_id) as size
-    FROM scts, msgs
-    WHERE scts.section_code_id = msgs.msg_code_id
-    GROUP BY scts.section_id, msgs.msg_id
-    ),
-    
-    main AS (
-    SELECT common.section_id as section_id,
-           common.msg_id as msg_id,
-           common.code_id as code_id,
-           common_size.size as size
-    FROM common, common_size
-    WHERE common.section_id = common_size.section_id AND
-          common.msg_id = common_size.msg_id
-    ORDER BY section_id, msg_id, code_id
-    )
+import recommender.parser.pattern_miner as pminer
+
+
+REMOVE_RECOMMENDATION_COLUMNS = ['code_element_from_id', 'code_element_to_id',
+        'deprecated_element_id', 'codebase_from_id', 'codebase_to_id',
+        'resource_content_type_id', 'resource_object_id', 'source']
+
+SNIPPET_QUERY = 'AND code.snippet_id is NULL'
+
+LINK_GROUPS_QUERY = """
+SELECT link.code_element_id,
+       array_agg(DISTINCT code.{type_type}_object_id)
+FROM codebase_singlecodereference as code,
+     codebase_codeelementlink as link,
+     codebase_codeelement as ce
+WHERE link.index=0 AND link.code_reference_id = code.id AND
+      link.code_element_id = ce.id AND
+      ce.codebase_id = %s AND
+      code.resource_object_id = %s AND
+      code.{type_type}_content_type_id = %s
+      {snippet_query}
+GROUP BY link.code_element_id
+ORDER BY link.code_element_id
 """
 
-MAIN_QUERY="""
-SELECT section_id, msg_id, code_id, size
-FROM main
-WHERE size > {size}
-ORDER BY msg_id, section_id, code_id
-"""
-
-
 
-
-def compute_patterns(pname, bname, release):
+def compute_patterns(pname, bname, release,
+        pool_size=pminer.DEFAULT_POOL_SIZE):
     prelease = ProjectRelease.objects.filter(project__dir_name=pname).\
             filter(release=release)[0]
     codebase = CodeBase.objects.filter(project_release=prelease).\
             filter(name=bname)[0]
-    code_elements = codebase.code_elements.all()
 
     progress_monitor = CLIProgressMonitor(min_step=1.0)
 
-    dpatterns = pcoverage.compute_declaration_pattern(code_elements, True,
-            progress_monitor)
-    (hpatterns1, hpatternsd) = pcoverage.\
-            compute_hierarchy_pattern(code_elements, True, progress_monitor)
-
-    pcoverage.compute_no_abstract_pattern(dpatterns, progress_monitor)
-    pcoverage.compute_no_abstract_pattern(hpatterns1, progress_monitor)
-    pcoverage.compute_no_abstract_pattern(hpatternsd, progress_monitor)
-
-    pcoverage.compute_token_pattern_second(dpatterns, progress_monitor)
-
-    pcoverage.compute_token_pattern(code_elements, True, progress_monitor)
+    pminer.compute_patterns(codebase, pool_size, progress_monitor)
 
 
 def clear_patterns(pname, bname, release):
@@ -240,30 +182,9 @@ def find_high_level_links_msg(pname, bname, release, pk_resource_src,
                 model="page").pk
         src_type_type = dst_type_type = 'global'
 
-    if no_snippet:
-        src_snippet = SRC_SNIPPET_QUERY
-        dst_snippet = DST_SNIPPET_QUERY
-    else:
-        src_snippet = ''
-        dst_snippet = ''
-
-    params = {
-        'codebase_id': codebase.pk,
-        'src_resource_id': pk_resource_src,
-        'src_type_type': src_type_type,
-        'src_content_type': src_type,
-        'dst_resource_id': pk_resource_dst,
-        'dst_type_type': dst_type_type,
-        'dst_content_type': dst_type,
-        'src_snippet_query': src_snippet,
-        'dst_snippet_query': dst_snippet,
-    }
-    sub_query = SUB_QUERIES.format(**params)
-    main = sub_query + MAIN_QUERY.format(size=size)
-
-    cursor = connection.cursor()
-    cursor.execute(main)
-    result = dictfetchall(cursor)
+    result = get_high_level_links(codebase, pk_resource_src, src_type,
+            src_type_type, pk_resource_dst, dst_type, dst_type_type,
+            no_snippet, size)
 
     (msg_index, section_index, code_index) = index_high_level_links(result,
             src_type, dst_type)
@@ -307,7 +228,8 @@ def compute_addition_reco(pname, bname, release1, release2, source,
             filter(coverage_from__pattern__codebase=codebase1).\
             filter(coverage_to__resource_object_id=resource_pk).\
             filter(coverage_to__source=source).\
-            filter(coverage_to__pattern__codebase=codebase2).all()
+            filter(coverage_to__pattern__codebase=codebase2).\
+            select_related('coverage_from', 'coverage_to')
 
     progress_monitor = CLIProgressMonitor(min_step=1.0)
     recs = pcoverage.compute_coverage_recommendation(coverage_diffs,
@@ -346,52 +268,44 @@ def compute_remove_reco(pname, bname, release1, release2, source, resource_pk,
     codebase2 = CodeBase.objects.filter(project_release=prelease2).\
             filter(name=bname)[0]
 
-    recs = []
-    query = codebase1.code_elements.all()
+    content_type_id = get_content_type(source).pk
     progress_monitor = CLIProgressMonitor(min_step=1.0)
-    progress_monitor.start('Processing code elements', query.count())
-
-    for code_element in query:
-        if not code_element_linked(code_element, source, resource_pk):
-            progress_monitor.work('Skipped code element', 1)
-            continue
-
-        (equivalent, exact) = find_equivalent(code_element, codebase2)
-        rec = RemoveRecommendation(code_element_from=code_element,
-                code_element_to=equivalent, codebase_from=codebase1,
-                codebase_to=codebase2,
-                resource_content_type=get_content_type(source),
-                resource_object_id=resource_pk,
-                source=source)
-
-        if equivalent is None:
-            rec.save()
-            recs.append(rec)
-        elif not exact:
-            deprecated = find_deprecated(equivalent)
-            if deprecated:
-                rec.deprecated_element = deprecated
-                # If not keep all, ensure that the element was not already
-                # deprecated
-                if keep_all or not find_deprecated(code_element):
-                    rec.save()
-                    recs.append(rec)
-            else:
-                rec.save()
-                recs.append(rec)
-        else:
-            deprecated = find_deprecated(equivalent)
+    progress_monitor.start('Loading code elements', 3)
+    linked_ids = get_code_element_links_query(codebase1, source,
+            resource_pk).values('code_element_id')
+    keys1 = get_element_keys(codebase1.code_elements.filter(pk__in=linked_ids))
+    progress_monitor.work('Loaded linked code elements', 1)
+    index2 = get_overload_index(codebase2.pk)
+    progress_monitor.work('Loaded new code elements', 1)
+    find1 = DeprecatedFinder(codebase1)
+    find2 = DeprecatedFinder(codebase2)
+    progress_monitor.work('Loaded containers', 1)
+    progress_monitor.done()
+
+    rows = []
+    progress_monitor.start('Processing code elements', len(keys1))
+    for (pk, key) in keys1.iteritems():
+        # Only exact equivalents (same fqn, kind and signature) are matched
+        # (see find_equivalent).
+        equivalent = index2.find(*key)
+        deprecated = None
+        if equivalent is not None:
+            deprecated = find2.find(equivalent)
             # If not keep all, ensure that the element was not already
             # deprecated
-            if deprecated and (keep_all or not find_deprecated(code_element)):
-                rec.deprecated_element = deprecated
-                rec.save()
-                recs.append(rec)
-
+            if deprecated is None or not (keep_all or
+                    find1.find(pk) is None):
+                progress_monitor.work('Processed code element', 1)
+                continue
+        rows.append((pk, equivalent, deprecated, codebase1.pk, codebase2.pk,
+            content_type_id, resource_pk, source))
         progress_monitor.work('Processed code element', 1)
-
     progress_monitor.done()
 
+    bulk_insert(RemoveRecommendation, REMOVE_RECOMMENDATION_COLUMNS, rows)
+
+    recs = [RemoveRecommendation(**dict(zip(REMOVE_RECOMMENDATION_COLUMNS,
+        row))) for row in rows]
     report_remove_recs(recs)
 
 
@@ -449,6 +363,16 @@ def code_element_linked(code_element, source, resource_pk):
     return get_code_element_links(code_element, source, resource_pk).exists()
 
 
+def get_code_element_links_query(codebase, source, resource_pk):
+    '''Returns the first links of the references of a resource to the code
+       elements of a codebase.'''
+    return CodeElementLink.objects.\
+            filter(code_element__codebase=codebase).\
+            filter(code_reference__source=source).\
+            filter(code_reference__resource_object_id=resource_pk).\
+            filter(index=0)
+
+
 def get_code_element_links(code_element, source, resource_pk):
     return  CodeElementLink.objects.filter(code_element=code_element).\
             filter(code_reference__source=source).\
@@ -457,24 +381,46 @@ def get_code_element_links(code_element, source, resource_pk):
 
 
 def find_equivalent(code_element, codebase):
-    count = 0
-    return_code_element = None
-    exact = False
-    human_string = code_element.human_string()
-    code_elements = codebase.code_elements.filter(fqn=code_element.fqn).\
-            filter(kind=code_element.kind).all()
-
-    for temp in code_elements:
-        count += 1
-        if human_string == temp.human_string():
-            return_code_element = temp
-            exact = True
-            break
-
-    if code_element is None and count > 0:
-        return_code_element = code_elements[0]
-
-    return (return_code_element, exact)
+    '''Returns (the element of codebase with the same fqn, kind and
+       signature as code_element or None, True if found).'''
+    pk = get_overload_index(codebase.pk).find(code_element.fqn,
+            code_element.kind_id, code_element.human_string())
+    if pk is None:
+        return (None, False)
+    else:
+        return (CodeElement.objects.get(pk=pk), True)
+
+
+class DeprecatedFinder(object):
+    '''Same as find_deprecated, but on element ids, with the first container
+       of each code element of a codebase loaded at once.'''
+
+    def __init__(self, codebase):
+        code_elements = codebase.code_elements.all()
+        self.containers = get_first_containers(code_elements)
+        self.deprecated_ids = set(code_elements.filter(deprecated=True).
+                values_list('pk', flat=True))
+        self.cache = {}
+
+    def find(self, element_id):
+        '''Returns the id of the element or of its closest deprecated
+           container or None.'''
+        visited = []
+        deprecated = None
+        while element_id is not None:
+            if element_id in self.cache:
+                deprecated = self.cache[element_id]
+                break
+            visited.append(element_id)
+            if element_id in self.deprecated_ids:
+                deprecated = element_id
+                break
+            element_id = self.containers.get(element_id)
+            if element_id in visited:
+                break
+        for visited_id in visited:
+            self.cache[visited_id] = deprecated
+        return deprecated
 
 
 def find_deprecated(code_element):
@@ -490,12 +436,106 @@ def find_deprecated(code_element):
             return None
 
 
+def get_high_level_links(codebase, src_resource_pk, src_type, src_type_type,
+        dst_resource_pk, dst_type, dst_type_type, no_snippet, size):
+    '''Returns the code elements shared by the (section, message) pairs
+       that have more than size common code elements, as a list of
+       {section_id, msg_id, code_id, size} ordered by message, section and
+       code element.'''
+    # First pass: count the common code elements of each (section,
+    # message) pair. Only the pairs above the threshold are kept.
+    counts = defaultdict(int)
+    for (_, section_ids, msg_ids) in get_common_links(codebase,
+            src_resource_pk, src_type, src_type_type, dst_resource_pk,
+            dst_type, dst_type_type, no_snippet):
+        for section_id in section_ids:
+            for msg_id in msg_ids:
+                counts[(section_id, msg_id)] += 1
+    pairs = set(pair for (pair, pair_size) in counts.iteritems()
+            if pair_size > size)
+    del counts
+
+    # Second pass: collect the common code elements of the kept pairs.
+    codes = defaultdict(list)
+    for (code_id, section_ids, msg_ids) in get_common_links(codebase,
+            src_resource_pk, src_type, src_type_type, dst_resource_pk,
+            dst_type, dst_type_type, no_snippet):
+        for section_id in section_ids:
+            for msg_id in msg_ids:
+                if (section_id, msg_id) in pairs:
+                    codes[(section_id, msg_id)].append(code_id)
+
+    result = []
+    for (section_id, msg_id) in sorted(codes, key=lambda pair: pair[::-1]):
+        code_ids = codes[(section_id, msg_id)]
+        for code_id in code_ids:
+            result.append({'section_id': section_id, 'msg_id': msg_id,
+                'code_id': code_id, 'size': len(code_ids)})
+
+    return result
+
+
+def get_link_groups(codebase, resource_pk, content_type, type_type,
+        no_snippet):
+    '''Streams (code element id, [object ids]) ordered by code element id:
+       the (local or global) objects of a resource that are linked to each
+       code element of the codebase.'''
+    if no_snippet:
+        snippet_query = SNIPPET_QUERY
+    else:
+        snippet_query = ''
+    sql = LINK_GROUPS_QUERY.format(type_type=type_type,
+            snippet_query=snippet_query)
+    return stream_rows(sql, [codebase.pk, resource_pk, content_type])
+
+
+def get_common_links(codebase, src_resource_pk, src_type, src_type_type,
+        dst_resource_pk, dst_type, dst_type_type, no_snippet):
+    '''Streams (code element id, [source object ids], [destination object
+       ids]) for the code elements linked from both resources. The two link
+       groups are merged on the code element id.'''
+    src_groups = get_link_groups(codebase, src_resource_pk, src_type,
+            src_type_type, no_snippet)
+    dst_groups = get_link_groups(codebase, dst_resource_pk, dst_type,
+            dst_type_type, no_snippet)
+    src = next(src_groups, None)
+    dst = next(dst_groups, None)
+    while src is not None and dst is not None:
+        if src[0] < dst[0]:
+            src = next(src_groups, None)
+        elif src[0] > dst[0]:
+            dst = next(dst_groups, None)
+        else:
+            yield (src[0], src[1], dst[1])
+            src = next(src_groups, None)
+            dst = next(dst_groups, None)
+
+
+def load_objects(model, ids, *related):
+    '''Returns {pk: object} for the ids, loaded in chunks with in_bulk.'''
+    objects = {}
+    queryset = model.objects.all()
+    if len(related) > 0:
+        queryset = queryset.select_related(*related)
+    for chunk in chunks(ids):
+        objects.update(queryset.in_bulk(chunk))
+    return objects
+
+
 def index_high_level_links(result, section_type_id, msg_type_id):
     msgs_index = {}
     sections_index = {}
     code_index = {}
-    msg_type = ContentType.objects.get(pk=msg_type_id)
-    section_type = ContentType.objects.get(pk=section_type_id)
+    msg_model = ContentType.objects.get(pk=msg_type_id).model_class()
+    section_model = ContentType.objects.get(pk=section_type_id).\
+            model_class()
+
+    messages = load_objects(msg_model,
+            set(int(line['msg_id']) for line in result))
+    sections = load_objects(section_model,
+            set(int(line['section_id']) for line in result))
+    codes = load_objects(CodeElement,
+            set(int(line['code_id']) for line in result))
 
     for line in result:
         msg_id = int(line['msg_id'])
@@ -505,17 +545,17 @@ def index_high_level_links(result, section_type_id, msg_type_id):
         if msg_id in msgs_index:
             message = msgs_index[msg_id][0]
         else:
-            message = msg_type.get_object_for_this_type(pk=msg_id)
+            message = messages[msg_id]
             msgs_index[msg_id] = (message, {})
         if section_id in sections_index:
             section = sections_index[section_id][0]
         else:
-            section = section_type.get_object_for_this_type(pk=section_id)
+            section = sections[section_id]
             sections_index[section_id] = (section, {})
         if code_id in code_index:
             code = code_index[code_id][0]
         else:
-            code = CodeElement.objects.get(pk=code_id)
+            code = codes[code_id]
             code_index[code_id] = (code, CodeLink(code))
 
         msg_links = msgs_index[msg_id][1]
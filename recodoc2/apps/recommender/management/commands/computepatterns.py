@@ -15,6 +15,9 @@ class Command(NoArgsCommand):
             default='-1', help='Code Base name'),
         make_option('--release', action='store', dest='release',
             default='-1', help='Project Release'),
+        make_option('--processes', action='store', dest='processes',
+            type='int', default=4,
+            help='Number of processes mining the patterns'),
     )
     help = "Compute code patterns."
 
@@ -23,4 +26,4 @@ class Command(NoArgsCommand):
         pname = smart_decode(options.get('pname'))
         bname = smart_decode(options.get('bname'))
         release = smart_decode(options.get('release'))
-        compute_patterns(pname, bname, release)
+        compute_patterns(pname, bname, release, options.get('processes'))
@@ -2,10 +2,13 @@ from __future__ import unicode_literals
 from collections import defaultdict
 import codebase.models as cmodel
 import recommender.models as rmodel
-import codebase.linker.context as ctx
-from docutil.progress_monitor import NullProgressMonitor, CLIProgressMonitor
-from docutil.str_util import tokenize
+from codebase.kinds import get_kind
+from codebase.overloads import get_element_keys, get_overload_counts
+from codebase.coverage import get_covered_ids
+from docutil.progress_monitor import NullProgressMonitor
 from docutil.commands_util import size
+from docutil.db_util import chunks, bulk_insert, bulk_update_column,\
+        reserve_pks
 
 
 SUPER_REC_THRESHOLD = 0.4
@@ -19,253 +22,6 @@ VALID_COVERAGE_THRESHOLD = 0.5
 DOC_PATTERN_LOCATION_THRESHOLD = 0.75
 
 
-def create_pattern(head, codebase, criterion, first_criterion):
-    pattern = rmodel.CodePattern(head=head)
-    if first_criterion:
-        pattern.criterion1 = criterion
-    else:
-        pattern.criterion2 = criterion
-    pattern.codebase = codebase
-    pattern.save()
-
-    return pattern
-
-
-def compute_declaration_pattern(code_elements, first_criterion=True,
-        progress_monitor=NullProgressMonitor()):
-    '''Go through all code element and insert it in a pattern represented by
-       its container.
-    '''
-    patterns = {}
-
-    progress_monitor.start('Comp. Declaration patterns', size(code_elements))
-
-    for code_element in code_elements:
-        kind_pk = code_element.kind.pk
-        for container in code_element.containers.all():
-            pk = container.pk
-            key = '{0}-{1}'.format(pk, kind_pk)
-            if key not in patterns:
-                patterns[key] = create_pattern(container, container.codebase,
-                        rmodel.DECLARATION, first_criterion)
-                patterns[key].kind = code_element.kind
-                patterns[key].save()
-            patterns[key].extension.add(code_element)
-
-        progress_monitor.work('Code Element processed', 1)
-
-    progress_monitor.done()
-
-    return patterns
-
-
-def compute_ancestors(code_element, ancestors):
-    for parent in code_element.parents.all():
-        if parent.pk not in ancestors:
-            ancestors[parent.pk] = parent
-            compute_ancestors(parent, ancestors)
-
-
-def compute_hierarchy_pattern(code_elements, first_criterion=True,
-        progress_monitor=NullProgressMonitor()):
-    '''Go through all code elements and insert it in a pattern represented by
-       its direct container. Then, insert it in a pattern represented by any of
-       its ancestor.
-    '''
-    patterns1 = {}
-    patternsd = {}
-
-    progress_monitor.start('Comp. Hierarchy Patterns', size(code_elements))
-
-    for code_element in code_elements:
-        # Hierarchy 1
-        for parent in code_element.parents.all():
-            pk = parent.pk
-            if pk not in patterns1:
-                patterns1[pk] = create_pattern(parent, parent.codebase,
-                        rmodel.HIERARCHY, first_criterion)
-            patterns1[pk].extension.add(code_element)
-
-        # Hierarchy D
-        ancestors_list = ctx.get_ancestors_value(code_element)
-        ancestors = {ancestor.pk: ancestor for ancestor in ancestors_list}
-
-        for ancestor_pk in ancestors:
-            if ancestor_pk not in patternsd:
-                patternsd[ancestor_pk] = create_pattern(
-                        ancestors[ancestor_pk],
-                        code_element.codebase,
-                        rmodel.HIERARCHY_D,
-                        first_criterion)
-            patternsd[ancestor_pk].extension.add(code_element)
-
-        progress_monitor.work('Code Element processed', 1)
-
-    progress_monitor.done()
-
-    return (patterns1, patternsd)
-
-
-def compute_no_abstract_pattern(patterns,
-        progress_monitor=NullProgressMonitor()):
-    '''Go through all patterns. If a proper subset of the patterns is non
-       abstract, create a new pattern, with non-abstract as a second criteria.
-    '''
-
-    new_patterns = {}
-    progress_monitor.start('Comp. No Abstract patterns', len(patterns))
-
-    for head_pk in patterns:
-        pattern = patterns[head_pk]
-        code_elements = pattern.extension.all()
-        new_extension = [code_element for code_element in code_elements if
-                not code_element.abstract]
-        new_size = len(new_extension)
-        if new_size > 0 and new_size < pattern.extension.count():
-            new_pattern = create_pattern(pattern.head, pattern.codebase,
-                    rmodel.NO_ABSTRACT, False)
-            new_pattern.criterion1 = pattern.criterion1
-            new_pattern.save()
-            new_pattern.extension.add(*new_extension)
-            new_patterns[new_pattern.pk] = new_pattern
-        progress_monitor.work('pattern processed', 1)
-
-    progress_monitor.done()
-
-    return new_patterns
-
-
-def compute_token_pattern_second(patterns,
-        progress_monitor=NullProgressMonitor()):
-    '''For each pattern, compute sub patterns based on token.'''
-
-    progress_monitor.start('Computing token for a set of patterns',
-            len(patterns))
-    token_patterns = {}
-
-    for head_pk in patterns:
-        pattern = patterns[head_pk]
-        code_elements = pattern.extension.all()
-        sub_patterns = compute_token_pattern(code_elements, False,
-                CLIProgressMonitor())
-        for key in sub_patterns:
-            sub_pattern = sub_patterns[key]
-            sub_pattern.head = pattern.head
-            sub_pattern.criterion1 = pattern.criterion1
-            sub_pattern.save()
-            token_patterns[sub_pattern.pk] = sub_pattern
-        progress_monitor.work('pattern processed.', 1)
-
-    progress_monitor.done()
-
-    return token_patterns
-
-
-def compute_tokens(code_elements):
-    '''Compute a set of all tokens contained in the provided code elements.'''
-    tokens = set()
-    for code_element in code_elements.all():
-        temp = [token.lower().strip() for token in
-                tokenize(code_element.simple_name)]
-        tokens.update(temp)
-    return tokens
-
-
-def compute_token_pattern(code_elements, first_criterion=True,
-        progress_monitor=NullProgressMonitor()):
-    '''For each token, go through all code elements and create three patterns:
-       code elements that start with a token, elements that end with a token,
-       and elements that have the token in the middle. This is exclusive.
-    '''
-    patterns = {}
-    if size(code_elements) == 0:
-        return patterns
-
-    codebase = code_elements.all()[0].codebase
-    tokens = compute_tokens(code_elements)
-    progress_monitor.start('Processing {0} token for code elements'
-            .format(len(tokens)), len(tokens))
-
-    progress_monitor.info('Computing code element names')
-    ctokens = []
-    for code_element in code_elements.all():
-        name = code_element.simple_name.lower().strip()
-        element_tokens = [token.lower().strip() for token in
-                tokenize(code_element.simple_name)]
-        ctokens.append((name, code_element, element_tokens))
-    progress_monitor.info('Computed code element names')
-
-    for token in tokens:
-        start = defaultdict(list)
-        end = defaultdict(list)
-        middle = defaultdict(list)
-
-        if first_criterion:
-            # Here, we want to avoid mixing classes with methods and fields!
-            addt = lambda d, e: d[e.kind.pk].append(e)
-        else:
-            # Here, we already know that they are part of the same pattern, so
-            # they don't mix.
-            addt = lambda d, e: d[0].append(e)
-
-        for (name, code_element, element_tokens) in ctokens:
-
-            if token not in element_tokens:
-                continue
-            elif name.startswith(token):
-                addt(start, code_element)
-            elif name.endswith(token):
-                addt(end, code_element)
-            elif name.find(token) > -1:
-                addt(middle, code_element)
-
-        #print('Debugging {0}: {1} {2} {3}'.format(token, len(start), len(end),
-            #len(middle)))
-
-        for start_extension in start.values():
-            if len(start_extension) > 1:
-                pattern = create_pattern(None, codebase, rmodel.TOKEN,
-                        first_criterion)
-                pattern.token = token
-                pattern.token_pos = rmodel.PREFIX
-                pattern.save()
-                pattern.extension.add(*start_extension)
-                patterns[pattern.pk] = pattern
-                if first_criterion:
-                    pattern.kind = start_extension[0].kind
-                    pattern.save()
-
-        for end_extension in end.values():
-            if len(end_extension) > 1:
-                pattern = create_pattern(None, codebase, rmodel.TOKEN,
-                        first_criterion)
-                pattern.token = token
-                pattern.token_pos = rmodel.SUFFIX
-                pattern.save()
-                pattern.extension.add(*end_extension)
-                patterns[pattern.pk] = pattern
-                if first_criterion:
-                    pattern.kind = end_extension[0].kind
-                    pattern.save()
-
-        for mid_extension in middle.values():
-            if len(mid_extension) > 1:
-                pattern = create_pattern(None, codebase, rmodel.TOKEN,
-                        first_criterion)
-                pattern.token = token
-                pattern.token_pos = rmodel.MIDDLE
-                pattern.save()
-                pattern.extension.add(*mid_extension)
-                patterns[pattern.pk] = pattern
-                if first_criterion:
-                    pattern.kind = mid_extension[0].kind
-                    pattern.save()
-
-        progress_monitor.work('Processed a token')
-    progress_monitor.done()
-    return patterns
-
-
 def compute_coverage(patterns, source, resource,
         progress_monitor=NullProgressMonitor):
     '''For each pattern, compute coverage (linked elements / total elements).
@@ -273,17 +29,17 @@ def compute_coverage(patterns, source, resource,
 
     progress_monitor.start('Computing Coverage', size(patterns))
 
-    for pattern in patterns.all():
-        total = pattern.extension.count()
-        count = 0
-        pk = resource.pk
-        for member in pattern.extension.all():
-            if cmodel.CodeElementLink.objects.\
-                    filter(code_element=member).\
-                    filter(index=0).\
-                    filter(code_reference__resource_object_id=pk).\
-                    filter(code_reference__source=source).exists():
-                count += 1
+    patterns = list(patterns.all())
+    extensions = get_extensions([pattern.pk for pattern in patterns])
+    covered_ids = {}
+    for pattern in patterns:
+        if pattern.codebase_id not in covered_ids:
+            covered_ids[pattern.codebase_id] = get_covered_ids(
+                    pattern.codebase_id, source, resource.pk)
+        extension = extensions[pattern.pk]
+        total = len(extension)
+        count = sum(1 for element_id in extension
+                if element_id in covered_ids[pattern.codebase_id])
         if total > 0:
             coverage = float(count) / float(total)
         else:
@@ -457,7 +213,9 @@ def compute_pattern_index(codebase, progress_monitor):
     progress_monitor.start('Computing pattern index for codebase {0}'
             .format(codebase), patterns.count())
 
-    for pattern in patterns.all():
+    # The heads are loaded with the patterns and the signature of the heads
+    # is used by pattern.equiv.
+    for pattern in patterns.select_related('head').all():
         if pattern.head is not None:
             heads[pattern.head.human_string()].append(pattern)
         else:
@@ -513,11 +271,13 @@ def compute_coverage_diff(pattern_diffs, source, resource_pk, progress_monitor):
 
     progress_monitor.start('Computing coverage diff', len(pattern_diffs))
 
+    coverages = get_coverages([pattern_id for pattern_diff in pattern_diffs
+        for pattern_id in (pattern_diff.pattern_from_id,
+            pattern_diff.pattern_to_id)], source, resource_pk)
+
     for pattern_diff in pattern_diffs:
-        coverage_from = pattern_diff.pattern_from.get_coverage(source,
-                resource_pk)
-        coverage_to = pattern_diff.pattern_to.get_coverage(source,
-                resource_pk)
+        coverage_from = coverages.get(pattern_diff.pattern_from_id)
+        coverage_to = coverages.get(pattern_diff.pattern_to_id)
         if coverage_from is None or coverage_to is None:
             progress_monitor.info('ERROR! One coverage is none: {0} {1}'
                     .format(pattern_diff.pattern_from.pk,
@@ -539,6 +299,20 @@ def compute_coverage_diff(pattern_diffs, source, resource_pk, progress_monitor):
     return coverage_diffs
 
 
+def get_coverages(pattern_ids, source, resource_pk):
+    '''Returns {pattern id: coverage} with the coverage of each pattern for a
+       resource, loaded in chunks.'''
+    coverages = {}
+    for chunk in chunks(list(set(pattern_ids))):
+        query = rmodel.CodePatternCoverage.objects.filter(pattern__in=chunk).\
+                filter(source=source).\
+                filter(resource_object_id=resource_pk).\
+                select_related('pattern')
+        for coverage in query:
+            coverages.setdefault(coverage.pattern_id, coverage)
+    return coverages
+
+
 def report_diff(pattern_diffs, coverage_diffs, report_title):
     top = 25
     print()
@@ -607,15 +381,23 @@ def compute_coverage_recommendation(coverage_diffs,
        For each such coverage diff, create a recommendation.
     '''
 
+    coverage_diffs = list(coverage_diffs)
+    classifier = MemberClassifier([coverage for coverage_diff in
+        coverage_diffs for coverage in (coverage_diff.coverage_from,
+            coverage_diff.coverage_to)])
+
     recommendations = []
-    diffs_len = size(coverage_diffs)
+    new_members = []
+    old_members = []
+    diffs_len = len(coverage_diffs)
     progress_monitor.start('Processing {0} diffs'.format(diffs_len),
             diffs_len)
 
     for coverage_diff in coverage_diffs:
         (covered_mem_from, uncovered_mem_from) =\
-            get_members(coverage_diff.coverage_from)
-        (_, uncovered_mem_to) = get_members(coverage_diff.coverage_to)
+            classifier.get_members(coverage_diff.coverage_from)
+        (_, uncovered_mem_to) = \
+            classifier.get_members(coverage_diff.coverage_to)
 
         members_to_doc = []
         for member_key in uncovered_mem_to:
@@ -626,87 +408,219 @@ def compute_coverage_recommendation(coverage_diffs,
         if len(members_to_doc) > 0:
             recommendation = rmodel.AddRecommendation(
                     coverage_diff=coverage_diff)
-            recommendation.save()
-            recommendation.new_members.add(*members_to_doc)
-            recommendation.old_members.add(*covered_mem_from.values())
             recommendations.append(recommendation)
+            new_members.append(members_to_doc)
+            old_members.append(covered_mem_from.values())
 
         progress_monitor.work('Processed diff', 1)
 
     progress_monitor.done()
 
+    save_recommendations(recommendations, new_members, old_members)
+
     return recommendations
 
 
+def save_recommendations(recommendations, new_members, old_members):
+    '''Inserts the recommendations and their new and old members (lists of
+       element ids) in bulk.'''
+    pks = reserve_pks(rmodel.AddRecommendation, len(recommendations))
+    for (pk, recommendation) in zip(pks, recommendations):
+        recommendation.pk = pk
+    bulk_insert(rmodel.AddRecommendation, ['id', 'coverage_diff_id'],
+            [(rec.pk, rec.coverage_diff_id) for rec in recommendations])
+
+    for (members, field) in ((new_members, 'new_members'),
+            (old_members, 'old_members')):
+        through = getattr(rmodel.AddRecommendation, field).through
+        rows = [(rec.pk, element_id) for (rec, element_ids) in
+                zip(recommendations, members) for element_id in element_ids]
+        bulk_insert(through, ['addrecommendation_id', 'codeelement_id'],
+                rows)
+
+
+def get_extensions(pattern_ids):
+    '''Returns {pattern id: [element ids]} with the extension of each
+       pattern.'''
+    through = rmodel.CodePattern.extension.through
+    extensions = defaultdict(list)
+    for chunk in chunks(list(pattern_ids)):
+        pairs = through.objects.filter(codepattern__in=chunk).order_by('pk').\
+                values_list('codepattern_id', 'codeelement_id')
+        for (pattern_id, element_id) in pairs.iterator():
+            extensions[pattern_id].append(element_id)
+    return extensions
+
+
+class MemberClassifier(object):
+    '''Classifies the extension members of pattern coverages as covered
+       (linked from the resource of the coverage) or uncovered. The
+       extensions, the human strings of the members and the covered ids of
+       each resource are loaded once.'''
+
+    def __init__(self, pattern_coverages):
+        pattern_ids = set(coverage.pattern_id for coverage in
+                pattern_coverages)
+        self.extensions = get_extensions(pattern_ids)
+        self.codebase_ids = {}
+        for chunk in chunks(list(pattern_ids)):
+            self.codebase_ids.update(rmodel.CodePattern.objects.
+                    filter(pk__in=chunk).values_list('pk', 'codebase_id'))
+        element_ids = set()
+        for element_list in self.extensions.itervalues():
+            element_ids.update(element_list)
+        self.human_strings = {}
+        for chunk in chunks(list(element_ids)):
+            keys = get_element_keys(
+                    cmodel.CodeElement.objects.filter(pk__in=chunk))
+            for (element_id, (_, _, human_string)) in keys.iteritems():
+                self.human_strings[element_id] = human_string
+
+    def get_members(self, pattern_coverage):
+        '''Returns ({human string: element id} of the covered members,
+           {human string: element id} of the uncovered members).'''
+        covered_ids = get_covered_ids(
+                self.codebase_ids[pattern_coverage.pattern_id],
+                pattern_coverage.source, pattern_coverage.resource_object_id)
+        covered_members = {}
+        uncovered_members = {}
+        for element_id in self.extensions[pattern_coverage.pattern_id]:
+            human_string = self.human_strings[element_id]
+            if element_id in covered_ids:
+                covered_members[human_string] = element_id
+            else:
+                uncovered_members[human_string] = element_id
+        return (covered_members, uncovered_members)
+
+
 def get_members(pattern_coverage):
-    pattern = pattern_coverage.pattern
-    pk = pattern_coverage.resource_object_id
-    source = pattern_coverage.source
-    covered_members = {}
-    uncovered_members = {}
-
-    for member in pattern.extension.all():
-        if cmodel.CodeElementLink.objects.\
-                filter(code_element=member).\
-                filter(index=0).\
-                filter(code_reference__resource_object_id=pk).\
-                filter(code_reference__source=source).exists():
-            covered_members[member.human_string()] = member
-        else:
-            uncovered_members[member.human_string()] = member
+    return MemberClassifier([pattern_coverage]).get_members(pattern_coverage)
+
+
+class SubsetIndex(object):
+    '''Finds the sets that are subsets of a query set without comparing the
+       query with every set: each set is posted under its rarest member, so
+       only the sets whose rarest member is in the query are checked.'''
+
+    def __init__(self, sets):
+        self.sets = sets
+        self.postings = defaultdict(list)
+        self.empty = []
+        freqs = defaultdict(int)
+        for members in sets.itervalues():
+            for member in members:
+                freqs[member] += 1
+        for (key, members) in sets.iteritems():
+            if len(members) == 0:
+                self.empty.append(key)
+            else:
+                rarest = min(members, key=lambda member: (freqs[member],
+                    member))
+                self.postings[rarest].append(key)
+
+    def subsets(self, query):
+        keys = list(self.empty)
+        for member in query:
+            for key in self.postings.get(member, ()):
+                if self.sets[key] <= query:
+                    keys.append(key)
+        return keys
+
+
+def get_new_member_sets(recommendations):
+    '''Returns ({rec pk: number of new members}, {rec pk: frozenset}). The
+       new members are represented by integers: members with the same human
+       string have the same integer.'''
+    through = rmodel.AddRecommendation.new_members.through
+    members = defaultdict(list)
+    for chunk in chunks([rec.pk for rec in recommendations]):
+        pairs = through.objects.filter(addrecommendation__in=chunk).\
+                values_list('addrecommendation_id', 'codeelement_id')
+        for (rec_id, element_id) in pairs.iterator():
+            members[rec_id].append(element_id)
+
+    element_ids = set()
+    for element_list in members.itervalues():
+        element_ids.update(element_list)
+    member_ids = {}
+    element_member_ids = {}
+    for chunk in chunks(list(element_ids)):
+        keys = get_element_keys(
+                cmodel.CodeElement.objects.filter(pk__in=chunk))
+        for (element_id, (_, _, human_string)) in keys.iteritems():
+            element_member_ids[element_id] = member_ids.setdefault(
+                    human_string, len(member_ids))
+
+    counts = {}
+    member_sets = {}
+    for rec in recommendations:
+        element_list = members[rec.pk]
+        counts[rec.pk] = len(element_list)
+        member_sets[rec.pk] = frozenset(element_member_ids[element_id]
+                for element_id in element_list)
+    return (counts, member_sets)
+
+
+def get_super_groups(rec_pks, member_sets):
+    '''Groups the recommendations (rec_pks sorted by decreasing number of
+       new members). Each recommendation that is not in a group yet starts a
+       group with the following recommendations whose members are a subset
+       of its members. Returns ([(initial rec pk, [rec pks of the group])],
+       {rec pk: initial rec pk of the last group that includes it}).'''
+    positions = dict((rec_pk, i) for (i, rec_pk) in enumerate(rec_pks))
+    subset_index = SubsetIndex(member_sets)
+    processed_recs = set()
+    groups = []
+    rec_groups = {}
+
+    for (i, rec_pk) in enumerate(rec_pks):
+        if rec_pk in processed_recs:
+            continue
+        processed_recs.add(rec_pk)
+        group_pks = [rec_pk]
+        for temp_pk in subset_index.subsets(member_sets[rec_pk]):
+            if positions[temp_pk] > i:
+                group_pks.append(temp_pk)
+                processed_recs.add(temp_pk)
+        for temp_pk in group_pks:
+            rec_groups[temp_pk] = rec_pk
+        groups.append((rec_pk, group_pks))
 
-    return (covered_members, uncovered_members)
+    return (groups, rec_groups)
 
 
 def compute_super_recommendations(recommendations,
         progress_monitor=NullProgressMonitor()):
     '''Combine similar recommendations together.
-       Recommendations are combined if there isn't more than 20% difference and
-       one is a proper subset of the other.
+       Recommendations are combined if one is a subset of the other.
     '''
 
-    recommendations.sort(key=lambda r: r.new_members.count(), reverse=True)
-    processed_recs = set()
+    (counts, member_sets) = get_new_member_sets(recommendations)
+    recommendations.sort(key=lambda r: counts[r.pk], reverse=True)
+    recs = dict((rec.pk, rec) for rec in recommendations)
+    (groups, rec_groups) = get_super_groups([rec.pk for rec in
+        recommendations], member_sets)
     super_recs = []
+    # {initial rec pk: super rec}
+    group_super_recs = {}
 
-    reclen = len(recommendations)
-    progress_monitor.start('Processing {0} recommendations'.format(reclen),
-            reclen)
-
-    for i, rec in enumerate(recommendations):
-        if rec.pk in processed_recs:
-            progress_monitor.work('Skipped rec', 1)
-            continue
+    reclen = len(groups)
+    progress_monitor.start('Processing {0} super recommendations'.
+            format(reclen), reclen)
 
-        current_best_cov = rec.coverage_diff.coverage_from.coverage
-        processed_recs.add(rec.pk)
+    for (rec_pk, group_pks) in groups:
+        rec = recs[rec_pk]
         super_rec = rmodel.SuperAddRecommendation(initial_rec=rec,
                 codebase_from=rec.coverage_diff.coverage_from.pattern.codebase,
                 codebase_to=rec.coverage_diff.coverage_to.pattern.codebase,
                 resource=rec.coverage_diff.coverage_from.resource,
                 source=rec.coverage_diff.coverage_from.source)
-        super_rec.save()
-        super_rec.recommendations.add(rec)
         super_recs.append(super_rec)
-        new_members = list(rec.new_members.all())
-        #count = float(len(new_members))
-
-        for temprec in recommendations[i + 1:]:
-            coverage_from = temprec.coverage_diff.coverage_from.coverage
-            #if (1.0 - (temprec.new_members.count() / count)) > \
-                    #SUPER_REC_THRESHOLD:
-                #if coverage_from > current_best_cov:
-                    #break
-            if proper_subset(list(temprec.new_members.all()), new_members):
-                if coverage_from > current_best_cov:
-                    current_best_cov = coverage_from
-                super_rec.recommendations.add(temprec)
-                processed_recs.add(temprec.pk)
-
-        super_rec.best_rec =\
-            get_best_rec(list(super_rec.recommendations.all()))
+        group_super_recs[rec_pk] = super_rec
+
+        group = [recs[group_pk] for group_pk in sorted(group_pks)]
+        super_rec.best_rec = get_best_rec(group)
         check_overloading(super_rec)
-        super_rec.save()
 
         progress_monitor.work('Processed rec', 1)
 
@@ -717,20 +631,26 @@ def compute_super_recommendations(recommendations,
         super_rec.index = i
         super_rec.save()
 
+    bulk_update_column(rmodel.AddRecommendation, 'super_rec_id',
+            dict((rec_pk, group_super_recs[group_pk].pk) for (rec_pk,
+                group_pk) in rec_groups.iteritems()))
+
     return super_recs
 
 
 def check_overloading(super_rec):
     '''We don't want to recommend a new method that is an overloaded version of
        an already covered method.'''
+    method_kind = get_kind('method')
+    members = list(super_rec.best_rec.new_members.values_list('fqn',
+        'kind_id'))
+    total = len(members)
+    counts = get_overload_counts(super_rec.codebase_to,
+            [fqn for (fqn, kind_id) in members
+                if kind_id == method_kind.pk])
     overloaded = 0
-    total = 0
-    for member in super_rec.best_rec.new_members.all():
-        total += 1
-        codebase = member.codebase
-        if member.kind.kind != 'method':
-            continue
-        if codebase.code_elements.filter(fqn=member.fqn).count() > 1:
+    for (fqn, kind_id) in members:
+        if kind_id == method_kind.pk and counts[fqn] > 1:
             overloaded += 1
     if float(overloaded) / float(total) > OVERLOADED_THRESHOLD:
         super_rec.overloaded = True
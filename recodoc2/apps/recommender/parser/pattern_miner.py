@@ -0,0 +1,332 @@
+from __future__ import unicode_literals
+import logging
+from collections import defaultdict, OrderedDict
+from multiprocessing.pool import Pool
+from django.db import connection, transaction
+from django.core.cache import cache
+import codebase.models as cmodel
+import recommender.models as rmodel
+from codebase.kinds import get_kinds
+from docutil.db_util import bulk_insert, reserve_pks
+from docutil.progress_monitor import NullProgressMonitor
+from docutil.str_util import tokenize
+
+DEFAULT_POOL_SIZE = 4
+
+PATTERN_COLUMNS = ['id', 'head_id', 'codebase_id', 'criterion1',
+        'criterion2', 'token', 'token_pos', 'kind_id']
+
+logger = logging.getLogger("recodoc.recommender.parser.pattern_miner")
+
+# Structure of the codebase being mined. Set before the worker pool is
+# created so that the workers share it (read-only) through fork.
+structure = None
+
+
+class MinedPattern(object):
+    '''A pattern found by a miner, before it is saved. The extension is a list
+       of element ids without duplicate. codebase_id is the codebase of the
+       head for the declaration and direct hierarchy patterns, and None
+       (the mined codebase) for the other patterns.'''
+
+    __slots__ = ('head_id', 'criterion1', 'criterion2', 'token', 'token_pos',
+            'kind_id', 'codebase_id', 'extension')
+
+    def __init__(self, head_id, criterion1, criterion2=rmodel.UNUSED,
+            token=None, token_pos=rmodel.MIDDLE, kind_id=None,
+            codebase_id=None):
+        self.head_id = head_id
+        self.criterion1 = criterion1
+        self.criterion2 = criterion2
+        self.token = token
+        self.token_pos = token_pos
+        self.kind_id = kind_id
+        self.codebase_id = codebase_id
+        self.extension = []
+
+    def __getstate__(self):
+        return [getattr(self, name) for name in self.__slots__]
+
+    def __setstate__(self, state):
+        for (name, value) in zip(self.__slots__, state):
+            setattr(self, name, value)
+
+
+class CodebaseStructure(object):
+    '''Elements, containers and parents of a codebase, loaded once. The
+       containers and parents may belong to another codebase.'''
+
+    def __init__(self, codebase):
+        code_elements = codebase.code_elements.all()
+        # {pk: (kind_id, simple_name, abstract)} in the default order.
+        self.elements = OrderedDict()
+        rows = code_elements.values_list('pk', 'kind_id', 'simple_name',
+                'abstract')
+        for (pk, kind_id, simple_name, abstract) in rows.iterator():
+            self.elements[pk] = (kind_id, simple_name, abstract)
+        # Kind and codebase of each related element, which may be outside
+        # the codebase.
+        self.kinds = dict((pk, element[0]) for (pk, element) in
+                self.elements.iteritems())
+        self.codebase_ids = dict((pk, codebase.pk) for pk in self.elements)
+        self.containers = self._get_relation(cmodel.CodeElement.containers,
+                code_elements)
+        self.parents = self._get_relation(cmodel.CodeElement.parents,
+                code_elements)
+        self.hierarchy_pks = get_kinds().hierarchy_pks
+        self.codebase_id = codebase.pk
+
+    def _get_relation(self, relation, code_elements):
+        through = relation.through
+        pairs = through.objects.filter(from_codeelement__in=code_elements).\
+                order_by('pk').\
+                values_list('from_codeelement_id', 'to_codeelement_id',
+                        'to_codeelement__kind_id',
+                        'to_codeelement__codebase_id')
+        related = defaultdict(list)
+        for (element_id, related_id, kind_id, codebase_id) in \
+                pairs.iterator():
+            related[element_id].append(related_id)
+            self.kinds[related_id] = kind_id
+            self.codebase_ids[related_id] = codebase_id
+        return related
+
+    def get_ancestors(self, element_id):
+        '''Same as context.get_ancestors_value: the parents in the type
+           hierarchy, recursively.'''
+        ancestors = []
+        visited = set()
+        stack = [element_id]
+        while len(stack) > 0:
+            for parent_id in self.parents.get(stack.pop(), []):
+                if parent_id not in visited and \
+                        self.kinds.get(parent_id) in self.hierarchy_pks:
+                    visited.add(parent_id)
+                    ancestors.append(parent_id)
+                    stack.append(parent_id)
+        return ancestors
+
+
+def mine_declaration(structure):
+    '''Groups the elements by container and kind: {(container id, kind id):
+       pattern}.'''
+    patterns = OrderedDict()
+    for (element_id, (kind_id, _, _)) in structure.elements.iteritems():
+        for container_id in structure.containers.get(element_id, []):
+            key = (container_id, kind_id)
+            if key not in patterns:
+                patterns[key] = MinedPattern(container_id,
+                        rmodel.DECLARATION, kind_id=kind_id,
+                        codebase_id=structure.codebase_ids[container_id])
+            patterns[key].extension.append(element_id)
+    return patterns.values()
+
+
+def mine_hierarchy(structure):
+    '''Groups the elements by direct parent and by ancestor: (direct parent
+       patterns, ancestor patterns).'''
+    patterns1 = OrderedDict()
+    patternsd = OrderedDict()
+    for element_id in structure.elements:
+        # The through rows are unique, so an element is added once.
+        for parent_id in structure.parents.get(element_id, []):
+            if parent_id not in patterns1:
+                patterns1[parent_id] = MinedPattern(parent_id,
+                        rmodel.HIERARCHY,
+                        codebase_id=structure.codebase_ids[parent_id])
+            patterns1[parent_id].extension.append(element_id)
+
+        for ancestor_id in structure.get_ancestors(element_id):
+            if ancestor_id not in patternsd:
+                patternsd[ancestor_id] = MinedPattern(ancestor_id,
+                        rmodel.HIERARCHY_D)
+            patternsd[ancestor_id].extension.append(element_id)
+    return (patterns1.values(), patternsd.values())
+
+
+def mine_no_abstract(structure, patterns):
+    '''Returns the patterns of the non abstract elements of the patterns that
+       contain abstract and non abstract elements.'''
+    new_patterns = []
+    for pattern in patterns:
+        new_extension = [element_id for element_id in pattern.extension
+                if not structure.elements[element_id][2]]
+        new_size = len(new_extension)
+        if new_size > 0 and new_size < len(pattern.extension):
+            new_pattern = MinedPattern(pattern.head_id, pattern.criterion1,
+                    rmodel.NO_ABSTRACT, codebase_id=pattern.codebase_id)
+            new_pattern.extension = new_extension
+            new_patterns.append(new_pattern)
+    return new_patterns
+
+
+def get_tokens(simple_name):
+    return [token.lower().strip() for token in tokenize(simple_name)]
+
+
+def mine_token(structure, element_ids, first_criterion=True,
+        shard=0, shards=1):
+    '''For each token of the shard, groups the elements whose name starts
+       with, ends with or contains the token (exclusively). Tokens are
+       assigned to shards by hash.'''
+    ctokens = []
+    tokens = set()
+    for element_id in element_ids:
+        (kind_id, simple_name, _) = structure.elements[element_id]
+        element_tokens = get_tokens(simple_name)
+        tokens.update(element_tokens)
+        ctokens.append((simple_name.lower().strip(), element_id, kind_id,
+            element_tokens))
+
+    patterns = []
+    for token in tokens:
+        if hash(token) % shards != shard:
+            continue
+        positions = {rmodel.PREFIX: defaultdict(list),
+                rmodel.SUFFIX: defaultdict(list),
+                rmodel.MIDDLE: defaultdict(list)}
+        for (name, element_id, kind_id, element_tokens) in ctokens:
+            # Here, we want to avoid mixing classes with methods and fields!
+            # With a second criterion, the elements are already part of the
+            # same pattern.
+            key = kind_id if first_criterion else 0
+            if token not in element_tokens:
+                continue
+            elif name.startswith(token):
+                positions[rmodel.PREFIX][key].append(element_id)
+            elif name.endswith(token):
+                positions[rmodel.SUFFIX][key].append(element_id)
+            elif name.find(token) > -1:
+                positions[rmodel.MIDDLE][key].append(element_id)
+
+        for (token_pos, extensions) in positions.iteritems():
+            for (key, extension) in extensions.iteritems():
+                if len(extension) > 1:
+                    if first_criterion:
+                        pattern = MinedPattern(None, rmodel.TOKEN,
+                                token=token, token_pos=token_pos,
+                                kind_id=key)
+                    else:
+                        pattern = MinedPattern(None, None, rmodel.TOKEN,
+                                token=token, token_pos=token_pos)
+                    pattern.extension = extension
+                    patterns.append(pattern)
+    return patterns
+
+
+def mine_token_second(structure, patterns, shard=0, shards=1):
+    '''Computes the token sub patterns of the patterns of the shard.'''
+    token_patterns = []
+    for (i, pattern) in enumerate(patterns):
+        if i % shards != shard:
+            continue
+        for sub_pattern in mine_token(structure, pattern.extension, False):
+            sub_pattern.head_id = pattern.head_id
+            sub_pattern.criterion1 = pattern.criterion1
+            token_patterns.append(sub_pattern)
+    return token_patterns
+
+
+def mine(task):
+    '''Runs one mining task on the shared structure and returns the mined
+       patterns.'''
+    (name, shard, shards) = task
+    if name == 'declaration':
+        dpatterns = mine_declaration(structure)
+        return dpatterns + mine_no_abstract(structure, dpatterns)
+    elif name == 'hierarchy':
+        (hpatterns1, hpatternsd) = mine_hierarchy(structure)
+        return hpatterns1 + hpatternsd + \
+                mine_no_abstract(structure, hpatterns1) + \
+                mine_no_abstract(structure, hpatternsd)
+    elif name == 'token':
+        return mine_token(structure, structure.elements.keys(), True, shard,
+                shards)
+    elif name == 'token_second':
+        return mine_token_second(structure, mine_declaration(structure),
+                shard, shards)
+    else:
+        return []
+
+
+def get_tasks(pool_size):
+    tasks = [('declaration', 0, 1), ('hierarchy', 0, 1)]
+    for shard in xrange(pool_size):
+        tasks.append(('token', shard, pool_size))
+        tasks.append(('token_second', shard, pool_size))
+    return tasks
+
+
+@transaction.commit_on_success
+def save_patterns(codebase_id, patterns):
+    '''Inserts the patterns and their extension in bulk, in one
+       transaction. The patterns without codebase are saved in
+       codebase_id.'''
+    pks = reserve_pks(rmodel.CodePattern, len(patterns))
+    bulk_insert(rmodel.CodePattern, PATTERN_COLUMNS,
+            ((pk, pattern.head_id, pattern.codebase_id or codebase_id,
+                pattern.criterion1, pattern.criterion2, pattern.token,
+                pattern.token_pos, pattern.kind_id)
+                for (pk, pattern) in zip(pks, patterns)))
+    through = rmodel.CodePattern.extension.through
+    bulk_insert(through, ['codepattern_id', 'codeelement_id'],
+            ((pk, element_id) for (pk, pattern) in zip(pks, patterns)
+                for element_id in pattern.extension))
+    return len(patterns)
+
+
+def mine_patterns(codebase_structure, pool_size=DEFAULT_POOL_SIZE,
+        progress_monitor=NullProgressMonitor()):
+    '''Runs the miners on a codebase structure in a pool of pool_size
+       processes (in this process if pool_size is 1) and returns the mined
+       patterns.'''
+    global structure
+
+    patterns = []
+    structure = codebase_structure
+    try:
+        if pool_size > 1:
+            pool = Pool(pool_size)
+            try:
+                for result in pool.imap_unordered(mine, get_tasks(pool_size),
+                        1):
+                    patterns.extend(result)
+                    progress_monitor.work('Mined {0} patterns'
+                            .format(len(result)), 1)
+            finally:
+                # All the results have been received, or a worker failed.
+                pool.terminate()
+                pool.join()
+        else:
+            for task in get_tasks(pool_size):
+                result = mine(task)
+                patterns.extend(result)
+                progress_monitor.work('Mined {0} patterns'
+                        .format(len(result)), 1)
+    finally:
+        structure = None
+    return patterns
+
+
+def compute_patterns(codebase, pool_size=DEFAULT_POOL_SIZE,
+        progress_monitor=NullProgressMonitor()):
+    '''Computes the declaration, hierarchy, no abstract and token patterns of
+       a codebase. The structure of the codebase is loaded once and the
+       miners run in a pool of processes (see mine_patterns). The patterns
+       are saved at the end.'''
+    progress_monitor.start('Computing patterns', len(get_tasks(pool_size)) +
+            2)
+    codebase_structure = CodebaseStructure(codebase)
+    progress_monitor.work('Loaded {0} code elements'
+            .format(len(codebase_structure.elements)), 1)
+
+    if pool_size > 1:
+        # Close connection to allow the new processes to create their own.
+        connection.close()
+        cache.close()
+    patterns = mine_patterns(codebase_structure, pool_size, progress_monitor)
+
+    count = save_patterns(codebase.pk, patterns)
+    progress_monitor.work('Saved {0} patterns'.format(count), 1)
+    progress_monitor.done()
+    return count
@@ -1,16 +1,596 @@
+from __future__ import unicode_literals
+import random
+from collections import OrderedDict
+from django.contrib.contenttypes.models import ContentType
+from django.db import connection
+from django.test import TestCase
+from docutil.commands_util import dictfetchall
+from project.models import Project, ProjectRelease
+from codebase.models import CodeBase, CodeElement, CodeElementLink,\
+        SingleCodeReference, CodeSnippet
+from codebase.actions import create_code_element_kinds
+from codebase.kinds import get_kinds
+import recommender.actions as ractions
+import recommender.models as rmodel
+import recommender.parser.pattern_miner as pm
+import recommender.parser.pattern_coverage as pcoverage
+
+# Message level query of the former find_high_level_links_msg.
+OLD_SUB_QUERIES = """
+WITH scts AS (
+    SELECT code1.local_object_id as section_id,
+           link1.code_element_id as section_code_id
+    FROM codebase_singlecodereference as code1,
+         codebase_codeelementlink as link1,
+         codebase_codeelement as ce1
+    WHERE link1.index=0 AND link1.code_reference_id = code1.id AND
+          link1.code_element_id = ce1.id AND
+          ce1.codebase_id = {codebase_id} AND
+          code1.resource_object_id={src_resource_id} AND
+          code1.{src_type_type}_content_type_id={src_content_type}
+          {src_snippet_query}
+    GROUP BY code1.{src_type_type}_object_id, link1.code_element_id
+    ),
+
+    msgs AS (
+    SELECT code2.local_object_id as msg_id,
+           link2.code_element_id as msg_code_id
+    FROM codebase_singlecodereference as code2,
+         codebase_codeelementlink as link2,
+         codebase_codeelement as ce2
+    WHERE link2.index=0 AND link2.code_reference_id = code2.id AND
+          link2.code_element_id = ce2.id AND
+          ce2.codebase_id = {codebase_id} AND
+          code2.resource_object_id={dst_resource_id} AND
+          code2.{dst_type_type}_content_type_id={dst_content_type}
+          {dst_snippet_query}
+    GROUP BY code2.{src_type_type}_object_id, link2.code_element_id
+    ),
+
+    common AS (
+    SELECT scts.section_id AS section_id,
+           msgs.msg_id AS msg_id,
+           scts.section_code_id as code_id
+    FROM scts, msgs
+    WHERE scts.section_code_id = msgs.msg_code_id
+    ),
+
+    common_size AS (
+    SELECT scts.section_id AS section_id,
+           msgs.msg_id AS msg_id,
+           COUNT(scts.section_code_id) as size
+    FROM scts, msgs
+    WHERE scts.section_code_id = msgs.msg_code_id
+    GROUP BY scts.section_id, msgs.msg_id
+    ),
+
+    main AS (
+    SELECT common.section_id as section_id,
+           common.msg_id as msg_id,
+           common.code_id as code_id,
+           common_size.size as size
+    FROM common, common_size
+    WHERE common.section_id = common_size.section_id AND
+          common.msg_id = common_size.msg_id
+    ORDER BY section_id, msg_id, code_id
+    )
 """
-This file demonstrates writing tests using the unittest module. These will pass
-when you run "manage.py test".
 
-Replace this with more appropriate tests for your application.
+OLD_MAIN_QUERY = """
+SELECT section_id, msg_id, code_id, size
+FROM main
+WHERE size > {size}
+ORDER BY msg_id, section_id, code_id
 """
 
-from django.test import TestCase
+PACKAGE = 1
+
+CLASS = 2
+
+METHOD = 5
+
+
+def get_structure():
+    '''Returns the structure of a small codebase (5) with a package (1),
+       three classes and four methods. The root class (99) belongs to
+       another codebase (7).'''
+    structure = pm.CodebaseStructure.__new__(pm.CodebaseStructure)
+    structure.elements = OrderedDict([
+        (10, (CLASS, 'FooBar', False)),
+        (11, (CLASS, 'AbstractFoo', True)),
+        (12, (CLASS, 'BarFoo', False)),
+        (20, (METHOD, 'getFoo', False)),
+        (21, (METHOD, 'getBar', False)),
+        (22, (METHOD, 'setFoo', False)),
+        (23, (METHOD, 'getFooBar', True))])
+    structure.kinds = dict((pk, element[0]) for (pk, element) in
+            structure.elements.iteritems())
+    structure.kinds.update({1: PACKAGE, 99: CLASS})
+    structure.codebase_ids = dict((pk, 5) for pk in structure.kinds)
+    structure.codebase_ids[99] = 7
+    structure.containers = {10: [1], 11: [1], 12: [1], 20: [10], 21: [10],
+            22: [10], 23: [10]}
+    structure.parents = {10: [11], 11: [99], 12: [10]}
+    structure.hierarchy_pks = frozenset([CLASS])
+    structure.codebase_id = 5
+    return structure
+
+
+def get_key(pattern):
+    return (pattern.head_id, pattern.criterion1, pattern.criterion2,
+            pattern.token, pattern.token_pos, pattern.kind_id,
+            pattern.codebase_id, tuple(sorted(pattern.extension)))
+
+
+class PatternMinerTest(TestCase):
+
+    def test_parallel_mining(self):
+        sequential = sorted(get_key(pattern) for pattern in
+                pm.mine_patterns(get_structure(), 1))
+        parallel = sorted(get_key(pattern) for pattern in
+                pm.mine_patterns(get_structure(), 3))
+        self.assertEqual(sequential, parallel)
+        self.assertEqual(len(sequential), len(set(sequential)))
+
+        self.assertTrue((10, rmodel.DECLARATION, rmodel.UNUSED, None,
+            rmodel.MIDDLE, METHOD, 5, (20, 21, 22, 23)) in sequential)
+        self.assertTrue((10, rmodel.DECLARATION, rmodel.NO_ABSTRACT, None,
+            rmodel.MIDDLE, None, 5, (20, 21, 22)) in sequential)
+        self.assertTrue((99, rmodel.HIERARCHY, rmodel.UNUSED, None,
+            rmodel.MIDDLE, None, 7, (11,)) in sequential)
+        self.assertTrue((99, rmodel.HIERARCHY_D, rmodel.UNUSED, None,
+            rmodel.MIDDLE, None, None, (10, 11, 12)) in sequential)
+        self.assertTrue((None, rmodel.TOKEN, rmodel.UNUSED, 'foo',
+            rmodel.SUFFIX, CLASS, None, (11, 12)) in sequential)
+        self.assertTrue((10, rmodel.DECLARATION, rmodel.TOKEN, 'get',
+            rmodel.PREFIX, None, None, (20, 21, 23)) in sequential)
+
+
+class HighLevelLinksTest(TestCase):
+
+    def setUp(self):
+        project = Project.objects.create(name='project1',
+                url='http://www.example.com', dir_name='project1')
+        release = ProjectRelease.objects.create(project=project,
+                release='1.0')
+        self.codebase = CodeBase.objects.create(name='core',
+                project_release=release)
+        other = CodeBase.objects.create(name='other',
+                project_release=release)
+        self.elements = [CodeElement.objects.create(codebase=self.codebase,
+            fqn='p.Foo{0}'.format(i)) for i in xrange(4)]
+        other_element = CodeElement.objects.create(codebase=other,
+                fqn='p.Bar')
+        self.snippet = CodeSnippet.objects.create(project=project)
+
+        self.section_type = ContentType.objects.get(app_label='doc',
+                model='section').pk
+        self.page_type = ContentType.objects.get(app_label='doc',
+                model='page').pk
+        self.msg_type = ContentType.objects.get(app_label='channel',
+                model='message').pk
+        self.thread_type = ContentType.objects.get(app_label='channel',
+                model='supportthread').pk
+        (e0, e1, e2, e3) = self.elements
+
+        # Sections 100 and 101 are in page 10, section 102 in page 11.
+        self.add_section(100, 10, e0)
+        self.add_section(100, 10, e0)
+        self.add_section(100, 10, e1)
+        self.add_section(100, 10, e2)
+        self.add_section(100, 10, e3, index=1)
+        self.add_section(101, 10, e0)
+        self.add_section(101, 10, e3, snippet=True)
+        self.add_section(102, 11, other_element)
+
+        # Messages 200 and 201 are in thread 20, message 202 in thread 21.
+        self.add_message(200, 20, e0)
+        self.add_message(200, 20, e1)
+        self.add_message(200, 20, e2, snippet=True)
+        self.add_message(201, 20, e0)
+        self.add_message(201, 20, e3)
+        self.add_message(202, 21, e1)
+        self.add_message(203, 22, e0, resource_pk=3)
+
+    def add_reference(self, element, resource_pk, local_type, local_pk,
+            global_type, global_pk, snippet, index):
+        reference = SingleCodeReference.objects.create(
+                resource_object_id=resource_pk,
+                local_content_type_id=local_type, local_object_id=local_pk,
+                global_content_type_id=global_type,
+                global_object_id=global_pk,
+                snippet=self.snippet if snippet else None)
+        CodeElementLink.objects.create(code_reference=reference,
+                code_element=element, index=index, rationale='test',
+                linker_name='test')
+
+    def add_section(self, section_pk, page_pk, element, snippet=False,
+            index=0):
+        self.add_reference(element, 1, self.section_type, section_pk,
+                self.page_type, page_pk, snippet, index)
+
+    def add_message(self, msg_pk, thread_pk, element, snippet=False,
+            index=0, resource_pk=2):
+        self.add_reference(element, resource_pk, self.msg_type, msg_pk,
+                self.thread_type, thread_pk, snippet, index)
+
+    def get_old_links(self, no_snippet, size):
+        params = {
+            'codebase_id': self.codebase.pk,
+            'src_resource_id': 1,
+            'src_type_type': 'local',
+            'src_content_type': self.section_type,
+            'dst_resource_id': 2,
+            'dst_type_type': 'local',
+            'dst_content_type': self.msg_type,
+            'src_snippet_query': 'AND code1.snippet_id is NULL'
+                if no_snippet else '',
+            'dst_snippet_query': 'AND code2.snippet_id is NULL'
+                if no_snippet else '',
+        }
+        cursor = connection.cursor()
+        cursor.execute(OLD_SUB_QUERIES.format(**params) +
+                OLD_MAIN_QUERY.format(size=size))
+        return [(int(line['section_id']), int(line['msg_id']),
+            int(line['code_id']), int(line['size']))
+            for line in dictfetchall(cursor)]
+
+    def get_links(self, level_types, no_snippet, size):
+        (src_type, dst_type, type_type) = level_types
+        return [(line['section_id'], line['msg_id'], line['code_id'],
+            line['size']) for line in ractions.get_high_level_links(
+                self.codebase, 1, src_type, type_type, 2, dst_type,
+                type_type, no_snippet, size)]
+
+    def test_message_level(self):
+        level_types = (self.section_type, self.msg_type, 'local')
+        for no_snippet in (False, True):
+            for size in (0, 1, 2):
+                old = self.get_old_links(no_snippet, size)
+                self.assertEqual(old,
+                        self.get_links(level_types, no_snippet, size))
+
+        (e0, e1, e2, e3) = [element.pk for element in self.elements]
+        self.assertEqual([(100, 200, e0, 3), (100, 200, e1, 3),
+            (100, 200, e2, 3), (101, 200, e0, 1), (100, 201, e0, 1),
+            (101, 201, e0, 2), (101, 201, e3, 2), (100, 202, e1, 1)],
+            self.get_links(level_types, False, 0))
+        self.assertEqual([(100, 200, e0, 2), (100, 200, e1, 2)],
+            self.get_links(level_types, True, 1))
+
+    def test_page_level(self):
+        level_types = (self.page_type, self.thread_type, 'global')
+        (e0, e1, e2, e3) = [element.pk for element in self.elements]
+        self.assertEqual([(10, 20, e0, 4), (10, 20, e1, 4), (10, 20, e2, 4),
+            (10, 20, e3, 4), (10, 21, e1, 1)],
+            self.get_links(level_types, False, 0))
+        self.assertEqual([(10, 20, e0, 2), (10, 20, e1, 2)],
+            self.get_links(level_types, True, 1))
+
+
+def get_old_groups(rec_pks, member_sets):
+    '''Groups the recommendations like the former pairwise scan of
+       compute_super_recommendations.'''
+    processed_recs = set()
+    groups = []
+    rec_groups = {}
+    for (i, rec_pk) in enumerate(rec_pks):
+        if rec_pk in processed_recs:
+            continue
+        processed_recs.add(rec_pk)
+        group_pks = [rec_pk]
+        for temp_pk in rec_pks[i + 1:]:
+            if member_sets[temp_pk] <= member_sets[rec_pk]:
+                group_pks.append(temp_pk)
+                processed_recs.add(temp_pk)
+        for temp_pk in group_pks:
+            rec_groups[temp_pk] = rec_pk
+        groups.append((rec_pk, group_pks))
+    return (groups, rec_groups)
+
+
+def get_random_sets(rand, count):
+    sets = {}
+    for key in xrange(count):
+        size = rand.randint(0, 5)
+        sets[key] = frozenset(rand.sample(xrange(8), size))
+    # Make sure that there are empty and equal sets.
+    sets[count] = frozenset()
+    sets[count + 1] = sets[0]
+    return sets
+
+
+class SuperRecommendationTest(TestCase):
+
+    def test_subset_index(self):
+        rand = random.Random(42)
+        for _ in xrange(20):
+            sets = get_random_sets(rand, 30)
+            index = pcoverage.SubsetIndex(sets)
+            queries = sets.values() + [frozenset(), frozenset(xrange(8))]
+            for query in queries:
+                expected = sorted(key for (key, members) in sets.iteritems()
+                        if members <= query)
+                self.assertEqual(expected, sorted(index.subsets(query)))
+
+    def test_super_groups(self):
+        rand = random.Random(42)
+        for _ in xrange(20):
+            sets = get_random_sets(rand, 30)
+            rec_pks = sorted(sets, key=lambda pk: (-len(sets[pk]), pk))
+            (groups, rec_groups) = pcoverage.get_super_groups(rec_pks, sets)
+            (old_groups, old_rec_groups) = get_old_groups(rec_pks, sets)
+            self.assertEqual([(pk, sorted(group)) for (pk, group) in
+                old_groups], [(pk, sorted(group)) for (pk, group) in groups])
+            self.assertEqual(old_rec_groups, rec_groups)
+
+    def test_last_group(self):
+        sets = {1: frozenset([1, 2, 3]), 2: frozenset([1, 2, 4]),
+                3: frozenset([1, 2]), 4: frozenset([1, 2]), 5: frozenset()}
+        (groups, rec_groups) = pcoverage.get_super_groups([1, 2, 3, 4, 5],
+                sets)
+        self.assertEqual([1, 2], [pk for (pk, _) in groups])
+        self.assertEqual([1, 3, 4, 5], sorted(groups[0][1]))
+        self.assertEqual([2, 3, 4, 5], sorted(groups[1][1]))
+        # A recommendation belongs to the last super recommendation that
+        # includes it.
+        self.assertEqual({1: 1, 2: 2, 3: 2, 4: 2, 5: 2}, rec_groups)
+
+
+def get_old_equivalent(code_element, codebase):
+    '''Former find_equivalent.'''
+    count = 0
+    return_code_element = None
+    exact = False
+    human_string = code_element.human_string()
+    code_elements = codebase.code_elements.filter(fqn=code_element.fqn).\
+            filter(kind=code_element.kind).all()
+
+    for temp in code_elements:
+        count += 1
+        if human_string == temp.human_string():
+            return_code_element = temp
+            exact = True
+            break
+
+    if code_element is None and count > 0:
+        return_code_element = code_elements[0]
+
+    return (return_code_element, exact)
+
+
+def get_element_pk(code_element):
+    if code_element is None:
+        return None
+    else:
+        return code_element.pk
+
+
+def get_old_remove_recs(codebase1, codebase2, source, resource_pk, keep_all):
+    '''Returns the (element from, element to, deprecated element) of the
+       recommendations computed by the former loop of compute_remove_reco.
+    '''
+    recs = set()
+    for code_element in codebase1.code_elements.all():
+        if not ractions.code_element_linked(code_element, source,
+                resource_pk):
+            continue
+
+        (equivalent, exact) = get_old_equivalent(code_element, codebase2)
+        rec = (code_element.pk, get_element_pk(equivalent), None)
+        if equivalent is None:
+            recs.add(rec)
+        elif not exact:
+            deprecated = ractions.find_deprecated(equivalent)
+            if deprecated:
+                rec = rec[:2] + (deprecated.pk,)
+                if keep_all or not ractions.find_deprecated(code_element):
+                    recs.add(rec)
+            else:
+                recs.add(rec)
+        else:
+            deprecated = ractions.find_deprecated(equivalent)
+            if deprecated and (keep_all or
+                    not ractions.find_deprecated(code_element)):
+                recs.add(rec[:2] + (deprecated.pk,))
+    return recs
+
+
+class RemoveRecommendationTest(TestCase):
+
+    def setUp(self):
+        create_code_element_kinds()
+        project = Project.objects.create(name='project1',
+                url='http://www.example.com', dir_name='project1')
+        self.codebase1 = CodeBase.objects.create(name='core',
+                project_release=ProjectRelease.objects.create(
+                    project=project, release='1.0'))
+        self.codebase2 = CodeBase.objects.create(name='core',
+                project_release=ProjectRelease.objects.create(
+                    project=project, release='2.0'))
+        self.elements = {}
+
+        for codebase in (self.codebase1, self.codebase2):
+            self.add(codebase, 'package', 'p1')
+            self.add(codebase, 'class', 'p1.A', 'p1')
+            self.add(codebase, 'method', 'p1.A.foo', 'p1.A', 'p1.A.foo()')
+
+        codebase1 = self.codebase1
+        self.add(codebase1, 'class', 'p1.B', 'p1')
+        self.add(codebase1, 'class', 'p1.C', 'p1', deprecated=True)
+        self.add(codebase1, 'method', 'p1.A.bar', 'p1.A', 'p1.A.bar()')
+        self.add(codebase1, 'method', 'p1.A.gone', 'p1.A', 'p1.A.gone()')
+        self.add(codebase1, 'method', 'p1.A.over', 'p1.A', 'p1.A.over(int)')
+        self.add(codebase1, 'method', 'p1.A.unlinked', 'p1.A',
+                'p1.A.unlinked()')
+        self.add(codebase1, 'method', 'p1.B.baz', 'p1.B', 'p1.B.baz()')
+        self.add(codebase1, 'method', 'p1.C.old', 'p1.C', 'p1.C.old()')
+
+        codebase2 = self.codebase2
+        self.add(codebase2, 'class', 'p1.B', 'p1', deprecated=True)
+        self.add(codebase2, 'class', 'p1.C', 'p1', deprecated=True)
+        self.add(codebase2, 'method', 'p1.A.bar', 'p1.A', 'p1.A.bar()',
+                deprecated=True)
+        self.add(codebase2, 'method', 'p1.A.over', 'p1.A',
+                'p1.A.over(String)')
+        self.add(codebase2, 'method', 'p1.A.unlinked', 'p1.A',
+                'p1.A.unlinked()', deprecated=True)
+        self.add(codebase2, 'method', 'p1.B.baz', 'p1.B', 'p1.B.baz()')
+        self.add(codebase2, 'method', 'p1.C.old', 'p1.C', 'p1.C.old()')
+
+        for ((codebase_pk, fqn), element) in self.elements.iteritems():
+            if codebase_pk != codebase1.pk:
+                continue
+            elif fqn == 'p1.A.unlinked':
+                # Only linked from another resource or as a potential.
+                self.add_link(element, 1, index=1)
+                self.add_link(element, 2)
+            else:
+                self.add_link(element, 1)
+
+    def add(self, codebase, kind, fqn, container=None, signature=None,
+            deprecated=False):
+        element = CodeElement.objects.create(codebase=codebase,
+                kind=get_kinds().get(kind), fqn=fqn,
+                simple_name=fqn.split('.')[-1], deprecated=deprecated,
+                signature=signature if signature is not None else fqn)
+        if container is not None:
+            element.containers.add(self.elements[(codebase.pk, container)])
+        self.elements[(codebase.pk, fqn)] = element
+        return element
+
+    def add_link(self, element, resource_pk, index=0):
+        reference = SingleCodeReference.objects.create(source='d',
+                resource_object_id=resource_pk)
+        CodeElementLink.objects.create(code_reference=reference,
+                code_element=element, index=index, rationale='test',
+                linker_name='test')
+
+    def get_pk(self, codebase, fqn):
+        if fqn is None:
+            return None
+        else:
+            return self.elements[(codebase.pk, fqn)].pk
+
+    def get_recs(self, keep_all):
+        ractions.compute_remove_reco('project1', 'core', '1.0', '2.0', 'd',
+                1, keep_all)
+        query = rmodel.RemoveRecommendation.objects.\
+                filter(codebase_from=self.codebase1).\
+                filter(codebase_to=self.codebase2).\
+                filter(source='d').filter(resource_object_id=1)
+        recs = set(query.values_list('code_element_from_id',
+            'code_element_to_id', 'deprecated_element_id'))
+        query.delete()
+        return recs
+
+    def test_deprecated_finder(self):
+        for codebase in (self.codebase1, self.codebase2):
+            finder = ractions.DeprecatedFinder(codebase)
+            # Twice, to go through the memoized chains.
+            for _ in xrange(2):
+                for code_element in codebase.code_elements.all():
+                    deprecated = ractions.find_deprecated(code_element)
+                    self.assertEqual(get_element_pk(deprecated),
+                            finder.find(code_element.pk))
+
+    def test_remove_recommendations(self):
+        (codebase1, codebase2) = (self.codebase1, self.codebase2)
+        expected = set([(self.get_pk(codebase1, fqn1),
+            self.get_pk(codebase2, fqn2), self.get_pk(codebase2, fqn3))
+            for (fqn1, fqn2, fqn3) in (
+                ('p1.B', 'p1.B', 'p1.B'),
+                ('p1.C', 'p1.C', 'p1.C'),
+                ('p1.A.bar', 'p1.A.bar', 'p1.A.bar'),
+                ('p1.A.gone', None, None),
+                ('p1.A.over', None, None),
+                ('p1.B.baz', 'p1.B.baz', 'p1.B'),
+                ('p1.C.old', 'p1.C.old', 'p1.C'))])
+
+        for keep_all in (True, False):
+            recs = self.get_recs(keep_all)
+            self.assertEqual(get_old_remove_recs(codebase1, codebase2, 'd',
+                1, keep_all), recs)
+            if keep_all:
+                self.assertEqual(expected, recs)
+            else:
+                # p1.C and p1.C.old were already deprecated.
+                already = set([self.get_pk(codebase1, 'p1.C'),
+                    self.get_pk(codebase1, 'p1.C.old')])
+                self.assertEqual(set(rec for rec in expected if rec[0] not
+                    in already), recs)
+
+
+def get_old_members(pattern_coverage):
+    '''Former get_members, with one exists() query per member. Returns the
+       element ids instead of the elements.'''
+    pattern = pattern_coverage.pattern
+    pk = pattern_coverage.resource_object_id
+    source = pattern_coverage.source
+    covered_members = {}
+    uncovered_members = {}
+
+    for member in pattern.extension.all():
+        if CodeElementLink.objects.\
+                filter(code_element=member).\
+                filter(index=0).\
+                filter(code_reference__resource_object_id=pk).\
+                filter(code_reference__source=source).exists():
+            covered_members[member.human_string()] = member.pk
+        else:
+            uncovered_members[member.human_string()] = member.pk
+
+    return (covered_members, uncovered_members)
+
+
+class MemberClassifierTest(TestCase):
+
+    def setUp(self):
+        create_code_element_kinds()
+        project = Project.objects.create(name='project1',
+                url='http://www.example.com', dir_name='project1')
+        codebase = CodeBase.objects.create(name='core',
+                project_release=ProjectRelease.objects.create(
+                    project=project, release='1.0'))
+        method = get_kinds().get('method')
+        self.elements = [CodeElement.objects.create(codebase=codebase,
+            fqn='p1.A.m{0}'.format(i), kind=method,
+            signature='p1.A.m{0}()'.format(i)) for i in xrange(5)]
+        (e0, e1, e2, e3, e4) = self.elements
+
+        self.add_link(e0, 'd', 1)
+        self.add_link(e1, 'd', 1, index=1)
+        self.add_link(e2, 'd', 2)
+        self.add_link(e3, 's', 1)
+        self.add_link(e4, 'd', 1)
+
+        self.coverages = []
+        for extension in ([e0, e1, e2], [e2, e3, e4], []):
+            pattern = rmodel.CodePattern.objects.create(codebase=codebase)
+            pattern.extension.add(*extension)
+            for (source, resource_pk) in (('d', 1), ('d', 2), ('s', 1)):
+                self.coverages.append(
+                        rmodel.CodePatternCoverage.objects.create(
+                            pattern=pattern, source=source,
+                            resource_object_id=resource_pk))
+
+    def add_link(self, element, source, resource_pk, index=0):
+        reference = SingleCodeReference.objects.create(source=source,
+                resource_object_id=resource_pk)
+        CodeElementLink.objects.create(code_reference=reference,
+                code_element=element, index=index, rationale='test',
+                linker_name='test')
 
+    def test_get_members(self):
+        classifier = pcoverage.MemberClassifier(self.coverages)
+        for coverage in self.coverages:
+            old = get_old_members(coverage)
+            self.assertEqual(old, classifier.get_members(coverage))
+            self.assertEqual(old, pcoverage.get_members(coverage))
 
-class SimpleTest(TestCase):
-    def test_basic_addition(self):
-        """
-        Tests that 1 + 1 always equals 2.
-        """
-        self.assertEqual(1 + 1, 2)
+        (e0, e1, e2, e3, e4) = [element.pk for element in self.elements]
+        self.assertEqual(({'p1.A.m0()': e0}, {'p1.A.m1()': e1,
+            'p1.A.m2()': e2}), classifier.get_members(self.coverages[0]))
+        self.assertEqual(({'p1.A.m3()': e3}, {'p1.A.m2()': e2,
+            'p1.A.m4()': e4}), classifier.get_members(self.coverages[5]))
+        self.assertEqual(({}, {}), classifier.get_members(self.coverages[6]))
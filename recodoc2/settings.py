@@ -182,6 +182,22 @@ CUSTOM_LINKERS = {}
 
 CHANNEL_LINE_THRESHOLD = 500
 
+# Number of references the generic linker keeps in memory at once.
+GENERIC_LINKER_BATCH_SIZE = 1000
+
+# queryset_iterator calls the garbage collector every n chunks (0: never).
+QUERYSET_GC_INTERVAL = 1
+
+# Record the calls, activations and time of each linker filter in
+# PROJECT_FS_ROOT/<project>/telemetry-*.jsonl (see the filterstats command).
+FILTER_TELEMETRY = True
+
+# Linker logs are written as JSON lines by a background thread (see the
+# convertlogs command for the text format). Compress them with gzip?
+LINKER_LOG_COMPRESS = False
+# Number of references kept in the DEBUG linker log.
+LINKER_DEBUG_LOG_SIZE = 10000
+
 # Not supported yet
 #SAVE_THREAD_TEXT = False
 # Not supported yet
@@ -190,6 +206,10 @@ CHANNEL_LINE_THRESHOLD = 500
 SAVE_MESSAGE_TEXT = False
 SAVE_SECTION_TEXT = False
 
+# Compression of the downloaded pages ('zlib' or 'lzma'). Pages are stored once
+# per distinct content in PROJECT_FS_ROOT/.pages. None: one plain file per page.
+PAGE_STORE = None
+
 DEVSERVER_MODULES = (
     #'devserver.modules.sql.SQLRealTimeModule',
     #'devserver.modules.sql.SQLSummaryModule',
@@ -0,0 +1,18 @@
+-- Denormalized container and package of the code elements (CodeElement).
+-- Run on databases created before the columns existed, then run
+-- ./manage.py fillcontainers to backfill them.
+BEGIN;
+
+ALTER TABLE "codebase_codeelement"
+    ADD COLUMN "container_id" integer NULL
+    REFERENCES "codebase_codeelement" ("id") DEFERRABLE INITIALLY DEFERRED;
+ALTER TABLE "codebase_codeelement"
+    ADD COLUMN "package_id" integer NULL
+    REFERENCES "codebase_codeelement" ("id") DEFERRABLE INITIALLY DEFERRED;
+
+CREATE INDEX "codebase_codeelement_container_id"
+    ON "codebase_codeelement" ("container_id");
+CREATE INDEX "codebase_codeelement_package_id"
+    ON "codebase_codeelement" ("package_id");
+
+COMMIT;
@@ -0,0 +1,14 @@
+-- Precomputed signature of the code elements (CodeElement.signature).
+-- Run on databases created before the column existed, then run
+-- ./manage.py fillsignatures to backfill it.
+BEGIN;
+
+ALTER TABLE "codebase_codeelement"
+    ADD COLUMN "signature" varchar(2000) NULL;
+
+CREATE INDEX "codebase_codeelement_signature"
+    ON "codebase_codeelement" ("signature");
+CREATE INDEX "codebase_codeelement_signature_like"
+    ON "codebase_codeelement" ("signature" varchar_pattern_ops);
+
+COMMIT;
@@ -0,0 +1,31 @@
+-- Overload index of the code elements (CodeElementOverload). syncdb
+-- creates this table: the script is only needed if syncdb is not run. Run
+-- ./manage.py filloverloads to compute the overloads of existing codebases.
+BEGIN;
+
+CREATE TABLE "codebase_codeelementoverload" (
+    "id" serial NOT NULL PRIMARY KEY,
+    "codebase_id" integer NOT NULL
+        REFERENCES "codebase_codebase" ("id") DEFERRABLE INITIALLY DEFERRED,
+    "fqn" varchar(500),
+    "kind_id" integer
+        REFERENCES "codebase_codeelementkind" ("id")
+        DEFERRABLE INITIALLY DEFERRED,
+    "code_element_id" integer NOT NULL
+        REFERENCES "codebase_codeelement" ("id")
+        DEFERRABLE INITIALLY DEFERRED,
+    "signature" varchar(2000)
+);
+
+CREATE INDEX "codebase_codeelementoverload_codebase_id"
+    ON "codebase_codeelementoverload" ("codebase_id");
+CREATE INDEX "codebase_codeelementoverload_fqn"
+    ON "codebase_codeelementoverload" ("fqn");
+CREATE INDEX "codebase_codeelementoverload_fqn_like"
+    ON "codebase_codeelementoverload" ("fqn" varchar_pattern_ops);
+CREATE INDEX "codebase_codeelementoverload_kind_id"
+    ON "codebase_codeelementoverload" ("kind_id");
+CREATE INDEX "codebase_codeelementoverload_code_element_id"
+    ON "codebase_codeelementoverload" ("code_element_id");
+
+COMMIT;
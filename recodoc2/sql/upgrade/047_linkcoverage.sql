@@ -0,0 +1,21 @@
+-- Persisted link coverage of the resources (LinkCoverage). syncdb creates
+-- this table: the script is only needed if syncdb is not run. The rows are
+-- computed on demand.
+BEGIN;
+
+CREATE TABLE "codebase_linkcoverage" (
+    "id" serial NOT NULL PRIMARY KEY,
+    "codebase_id" integer NOT NULL
+        REFERENCES "codebase_codebase" ("id") DEFERRABLE INITIALLY DEFERRED,
+    "source" varchar(1) NOT NULL,
+    "resource_object_id" integer NOT NULL
+        CHECK ("resource_object_id" >= 0),
+    "element_ids" text NOT NULL,
+    "size" integer NOT NULL,
+    UNIQUE ("codebase_id", "source", "resource_object_id")
+);
+
+CREATE INDEX "codebase_linkcoverage_codebase_id"
+    ON "codebase_linkcoverage" ("codebase_id");
+
+COMMIT;
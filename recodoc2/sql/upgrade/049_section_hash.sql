@@ -0,0 +1,15 @@
+-- Content hash and MinHash signature of the sections (Section.content_hash
+-- and Section.minhash). Run on databases created before the columns
+-- existed. The columns of the sections parsed earlier stay NULL (the doc
+-- differ computes them in memory) until the document is parsed again.
+BEGIN;
+
+ALTER TABLE "doc_section" ADD COLUMN "content_hash" varchar(40) NULL;
+ALTER TABLE "doc_section" ADD COLUMN "minhash" text NULL;
+
+CREATE INDEX "doc_section_content_hash"
+    ON "doc_section" ("content_hash");
+CREATE INDEX "doc_section_content_hash_like"
+    ON "doc_section" ("content_hash" varchar_pattern_ops);
+
+COMMIT;